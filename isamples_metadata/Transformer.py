@@ -3,6 +3,8 @@ import typing
 from typing import Optional
 
 import h3
+import h3.api.basic_int
+import numpy as np
 
 NOT_PROVIDED = "Not Provided"
 
@@ -30,6 +32,9 @@ class Transformer(ABC):
 
     DEFAULT_H3_RESOLUTION = 15
 
+    # The h3 resolutions included in transformed records
+    TRANSFORMED_H3_RESOLUTIONS = range(0, 15)
+
     @staticmethod
     def _transform_key_to_label(
         key: str,
@@ -115,10 +120,10 @@ class Transformer(ABC):
             "authorizedBy": self.authorized_by(),
             "compliesWith": self.complies_with(),
         }
-        for index in range(0, 15):
-            h3_at_resolution = self.h3_function()(self.source_record, index)
-            field_name = f"producedBy_samplingSite_location_h3_{index}"
-            transformed_record[field_name] = h3_at_resolution
+        # Extract the location and index it once at the finest resolution, then derive the coarser cells from that
+        finest_resolution = Transformer.TRANSFORMED_H3_RESOLUTIONS[-1]
+        finest_cell = self.h3_function()(self.source_record, finest_resolution)
+        transformed_record.update(h3_fields(h3_parents(finest_cell, Transformer.TRANSFORMED_H3_RESOLUTIONS)))
         return transformed_record
 
     @abstractmethod
@@ -460,3 +465,109 @@ def geo_to_h3(latitude: typing.Optional[float], longitude: typing.Optional[float
         return h3.latlng_to_cell(latitude, longitude, resolution)
     else:
         return None
+
+
+# The h3 resolutions indexed in solr as producedBy_samplingSite_location_h3_{resolution}
+H3_RESOLUTIONS = range(0, 16)
+
+H3_FIELD_PREFIX = "producedBy_samplingSite_location_h3_"
+
+# Layout of a 64 bit h3 cell index: the resolution sits in bits 52-55, followed by one 3 bit digit per resolution,
+# with resolution 15's in the lowest bits.  Digits finer than the cell's resolution are all 1s.
+_H3_RESOLUTION_SHIFT = np.uint64(52)
+_H3_RESOLUTION_MASK = np.uint64(0xF) << _H3_RESOLUTION_SHIFT
+_H3_MAX_RESOLUTION = 15
+_H3_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+# Every valid h3 index is 15 hex digits long, the top nibble is always 0
+_H3_HEX_SHIFTS = np.arange(14, -1, -1, dtype=np.uint64) * np.uint64(4)
+
+
+def h3_field_name(resolution: int) -> str:
+    return f"{H3_FIELD_PREFIX}{resolution}"
+
+
+def _h3_parent_int(cell: int, resolution: int) -> int:
+    # cell_to_parent without the round trip through the h3 library, see the index layout above
+    finer_digits_mask = (1 << (3 * (_H3_MAX_RESOLUTION - resolution))) - 1
+    return (cell & ~(0xF << 52)) | (resolution << 52) | finer_digits_mask
+
+
+def h3_parents(
+    cell: typing.Optional[str], resolutions: typing.Iterable[int] = H3_RESOLUTIONS
+) -> typing.Dict[int, typing.Optional[str]]:
+    """Returns the cell's ancestors (or the cell itself) at each of resolutions, or None for each if cell is None"""
+    if cell is None:
+        return {resolution: None for resolution in resolutions}
+    cell_resolution = h3.get_resolution(cell)
+    cell_int = int(cell, 16)
+    parents: typing.Dict[int, typing.Optional[str]] = {}
+    for resolution in resolutions:
+        if resolution > cell_resolution:
+            raise ValueError(f"Resolution {resolution} is finer than cell {cell}")
+        parents[resolution] = cell if resolution == cell_resolution else f"{_h3_parent_int(cell_int, resolution):x}"
+    return parents
+
+
+def geo_to_h3_resolutions(
+    latitude: typing.Optional[float],
+    longitude: typing.Optional[float],
+    resolutions: typing.Iterable[int] = H3_RESOLUTIONS,
+) -> typing.Dict[int, typing.Optional[str]]:
+    """
+    The h3 cells containing a location at each of resolutions.  Only the finest resolution is indexed from the
+    coordinates, the rest are its parents, so the cells nest exactly.
+    """
+    resolutions = list(resolutions)
+    return h3_parents(geo_to_h3(latitude, longitude, max(resolutions)), resolutions)
+
+
+def h3_fields(cells_by_resolution: typing.Dict[int, typing.Optional[str]]) -> typing.Dict[str, typing.Optional[str]]:
+    """Maps h3 cells by resolution to the producedBy_samplingSite_location_h3_{resolution} fields"""
+    return {h3_field_name(resolution): cell for resolution, cell in cells_by_resolution.items()}
+
+
+def h3_cell_parents_array(cells: np.ndarray, resolution: int) -> np.ndarray:
+    """
+    Vectorized cell_to_parent: takes a uint64 array of h3 cells at resolution or finer (0 for missing) and returns
+    their parents at resolution, computed with bit operations on the whole array.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    finer_digits_mask = np.uint64((1 << (3 * (_H3_MAX_RESOLUTION - resolution))) - 1)
+    parents = (cells & ~_H3_RESOLUTION_MASK) | (np.uint64(resolution) << _H3_RESOLUTION_SHIFT) | finer_digits_mask
+    return np.where(cells == 0, np.uint64(0), parents)
+
+
+def geo_to_h3_array(
+    latitudes: np.ndarray, longitudes: np.ndarray, resolution: int = Transformer.DEFAULT_H3_RESOLUTION
+) -> np.ndarray:
+    """Indexes arrays of coordinates as a uint64 array of h3 cells, with 0 where a coordinate is missing (NaN)"""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    cells = np.zeros(len(latitudes), dtype=np.uint64)
+    # h3 has no vectorized point indexing, but the int API skips building a string per cell
+    latlng_to_cell = h3.api.basic_int.latlng_to_cell
+    for index in np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes))):
+        cells[index] = latlng_to_cell(latitudes[index], longitudes[index], resolution)
+    return cells
+
+
+def h3_cells_to_strings(cells: np.ndarray) -> np.ndarray:
+    """Formats a uint64 array of h3 cells as an array of h3 strings, with "" where a cell is 0"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    nibbles = (cells[:, np.newaxis] >> _H3_HEX_SHIFTS) & np.uint64(0xF)
+    hex_bytes = np.ascontiguousarray(_H3_HEX_DIGITS[nibbles])
+    strings = hex_bytes.view("S15").reshape(len(cells)).astype(str)
+    return np.where(cells == 0, "", strings)
+
+
+def geo_to_h3_resolutions_array(
+    latitudes: np.ndarray, longitudes: np.ndarray, resolutions: typing.Iterable[int] = H3_RESOLUTIONS
+) -> typing.Dict[int, np.ndarray]:
+    """
+    Batch equivalent of geo_to_h3_resolutions: indexes arrays of coordinates once at the finest resolution and
+    derives the coarser resolutions from those cells.  Returns a uint64 array of cells per resolution, 0 where a
+    coordinate is missing (NaN).  h3_cells_to_strings converts them to h3 strings.
+    """
+    resolutions = list(resolutions)
+    finest_cells = geo_to_h3_array(latitudes, longitudes, max(resolutions))
+    return {resolution: h3_cell_parents_array(finest_cells, resolution) for resolution in resolutions}
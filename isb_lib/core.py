@@ -7,13 +7,19 @@ import hashlib
 import json
 import typing
 import faulthandler
+import collections
+import concurrent.futures
+import functools
+import signal
+import threading
+import time
 from signal import SIGINT
 
 import igsn_lib.time
 
 from isamples_metadata.metadata_exceptions import MetadataException
 from isb_lib.models.thing import Thing
-from isamples_metadata.Transformer import Transformer, geo_to_h3
+from isamples_metadata.Transformer import Transformer, geo_to_h3_resolutions, h3_fields
 import dateparser
 from dateparser.date import DateDataParser
 import re
@@ -22,6 +28,8 @@ import shapely.wkt
 import shapely.geometry
 import heartrate
 
+from isb_lib.utilities.json_streaming import json_array_chunks
+from isb_lib.utilities.pipeline import PipelineStats, PrefetchIterator, ConcurrentBatchSender
 from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import SQLModelDAO
 from typing import Optional
@@ -47,6 +55,8 @@ ELEVATION_PATTERN = re.compile(r"\s*(-?\d+\.?\d*)\s*m?", re.IGNORECASE)
 MEDIA_JSON = "application/json"
 MEDIA_NQUADS = "application/n-quads"
 MEDIA_GEO_JSON = "application/geo+json"
+MEDIA_NDJSON = "application/x-ndjson"
+MEDIA_MVT = "application/vnd.mapbox-vector-tile"
 
 
 def getLogger():
@@ -240,14 +250,7 @@ def lat_lon_to_solr(coreMetadata: typing.Dict, latitude: typing.SupportsFloat, l
     coreMetadata.update(shapely_to_solr(shapely.geometry.Point(longitude, latitude)))
     coreMetadata["producedBy_samplingSite_location_latitude"] = latitude
     coreMetadata["producedBy_samplingSite_location_longitude"] = longitude
-    for index in range(0, 16):
-        h3_at_resolution = geo_to_h3(
-            latitude,
-            longitude,
-            index,
-        )
-        field_name = f"producedBy_samplingSite_location_h3_{index}"
-        coreMetadata[field_name] = h3_at_resolution
+    coreMetadata.update(h3_fields(geo_to_h3_resolutions(latitude, longitude)))
 
 
 def handle_produced_by_fields(coreMetadata: typing.Dict, doc: typing.Dict):  # noqa: C901 -- need to examine computational complexity
@@ -357,7 +360,78 @@ def solr_delete_records(rsession, ids_to_delete: typing.List[str], url):
         L.debug("Successfully posted data %s to url %s", str(data), str(_url))
 
 
-def solrAddRecords(rsession, records, url):
+# Fields solr derives from other fields at index time (copyField destinations and bbox subfields) but still returns.
+# Full document updates have to leave them out and atomic updates have to clear them, otherwise the derived values
+# are added a second time on top of the stored ones.
+SOLR_DERIVED_FIELDS = [
+    "producedBy_samplingSite_location_bb__minY",
+    "producedBy_samplingSite_location_bb__minX",
+    "producedBy_samplingSite_location_bb__maxY",
+    "producedBy_samplingSite_location_bb__maxX",
+    "searchText",
+    "description_text",
+    "producedBy_description_text",
+    "producedBy_samplingSite_description_text",
+    "curation_description_text",
+]
+
+# Solr atomic update operations, see https://solr.apache.org/guide/8_8/updating-parts-of-documents.html
+ATOMIC_SET = "set"
+ATOMIC_ADD = "add"
+ATOMIC_ADD_DISTINCT = "add-distinct"
+ATOMIC_REMOVE = "remove"
+
+
+def _solrPostUpdate(
+    rsession,
+    data_function: typing.Callable[[], typing.Iterator[bytes]],
+    num_records: int,
+    url: str,
+    params: typing.Dict,
+    max_retries: int,
+    retry_backoff: float,
+    commit_within_ms: Optional[int],
+):
+    L = getLogger()
+    headers = {"Content-Type": "application/json"}
+    if commit_within_ms is not None:
+        params["commitWithin"] = str(commit_within_ms)
+    _url = f"{url}update"
+    L.debug("Going to post %d records to url %s", num_records, _url)
+    attempt = 0
+    while True:
+        try:
+            # Serialize lazily into a chunked body so the full payload is never materialized in memory.  A fresh
+            # generator is needed for each attempt since the previous one was consumed.
+            data = data_function()
+            res = rsession.post(_url, headers=headers, data=data, params=params)
+            if res.status_code < 500 or attempt >= max_retries:
+                break
+            L.warning("Solr update returned %s, will retry", res.status_code)
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= max_retries:
+                raise
+            L.warning("Solr update failed with %s, will retry", e)
+        time.sleep(retry_backoff * 2 ** attempt)
+        attempt += 1
+    L.debug("post status: %s", res.status_code)
+    L.debug("Solr update: %s", res.text)
+    if res.status_code != 200:
+        L.error(res.text)
+        # TODO: something more elegant for error handling
+        raise ValueError()
+    else:
+        L.debug("Successfully posted %d records to url %s", num_records, _url)
+
+
+def solrAddRecords(
+    rsession,
+    records,
+    url,
+    max_retries: int = 0,
+    retry_backoff: float = 1.0,
+    commit_within_ms: Optional[int] = None,
+):
     """
     Push records to Solr.
 
@@ -369,6 +443,10 @@ def solrAddRecords(rsession, records, url):
     Args:
         rsession: requests.Session
         relations: list of relations
+        max_retries: Number of times to retry the update after a 5xx response or a connection error
+        retry_backoff: Seconds to wait before the first retry, doubled on each subsequent retry
+        commit_within_ms: If set, asks solr to commit the records within this many milliseconds, which lets bulk
+        updates skip a hard commit per batch
 
     Returns: nothing
 
@@ -377,33 +455,87 @@ def solrAddRecords(rsession, records, url):
     # Need to strip previously generated fields to avoid solr inconsistency errors
     for record in records:
         record.pop("_version_", None)
-        record.pop("producedBy_samplingSite_location_bb__minY", None)
-        record.pop("producedBy_samplingSite_location_bb__minX", None)
-        record.pop("producedBy_samplingSite_location_bb__maxY", None)
-        record.pop("producedBy_samplingSite_location_bb__maxX", None)
-
         # If we don't nuke all the copy fields, they'll end up copying over multiple times
-        record.pop("searchText", None)
-        record.pop("description_text", None)
-        record.pop("producedBy_description_text", None)
-        record.pop("producedBy_samplingSite_description_text", None)
-        record.pop("curation_description_text", None)
+        for field in SOLR_DERIVED_FIELDS:
+            record.pop(field, None)
+
+    _solrPostUpdate(
+        rsession,
+        lambda: json_array_chunks(records),
+        len(records),
+        url,
+        {"overwrite": "true"},
+        max_retries,
+        retry_backoff,
+        commit_within_ms,
+    )
 
-    L = getLogger()
-    headers = {"Content-Type": "application/json"}
-    data = json.dumps(records).encode("utf-8")
-    params = {"overwrite": "true"}
-    _url = f"{url}update"
-    L.debug("Going to post data %s to url %s", str(data), str(_url))
-    res = rsession.post(_url, headers=headers, data=data, params=params)
-    L.debug("post status: %s", res.status_code)
-    L.debug("Solr update: %s", res.text)
-    if res.status_code != 200:
-        L.error(res.text)
-        # TODO: something more elegant for error handling
-        raise ValueError()
-    else:
-        L.debug("Successfully posted data %s to url %s", str(data), str(_url))
+
+def solr_atomic_update_doc(
+    record_id: str,
+    set_fields: Optional[typing.Dict[str, typing.Any]] = None,
+    add_fields: Optional[typing.Dict[str, typing.Any]] = None,
+    must_exist: bool = True,
+) -> typing.Dict:
+    """
+    Builds an atomic update document that only carries the fields that change.
+
+    Args:
+        record_id: The id of the solr document to update
+        set_fields: Fields to replace the value of, a value of None removes the field
+        add_fields: Multivalued fields to append the value (or list of values) to
+        must_exist: Whether to skip the update if the document doesn't exist, rather than create a document holding
+        only these fields
+
+    Returns: The document to pass to solr_atomic_update_records
+    """
+    doc: typing.Dict[str, typing.Any] = {"id": record_id}
+    for field, value in (set_fields or {}).items():
+        doc[field] = {ATOMIC_SET: value}
+    for field, value in (add_fields or {}).items():
+        doc[field] = {ATOMIC_ADD: value}
+    # Clearing the derived fields has solr regenerate them from the merged document instead of duplicating them
+    for field in SOLR_DERIVED_FIELDS:
+        doc[field] = {ATOMIC_SET: None}
+    if must_exist:
+        # Optimistic concurrency: a _version_ of 1 means the document has to exist
+        doc["_version_"] = 1
+    return doc
+
+
+def solr_atomic_update_records(
+    rsession,
+    docs: typing.List[typing.Dict],
+    url,
+    max_retries: int = 0,
+    retry_backoff: float = 1.0,
+    commit_within_ms: Optional[int] = None,
+):
+    """
+    Push atomic updates (see solr_atomic_update_doc) to Solr.  Solr merges them into the stored documents, so only the
+    changed fields go over the wire, rather than whole documents read back from solr.
+
+    Updates to documents that must exist but don't are skipped rather than failing the batch.
+
+    Args:
+        rsession: requests.Session
+        docs: list of atomic update documents
+        max_retries: Number of times to retry the update after a 5xx response or a connection error
+        retry_backoff: Seconds to wait before the first retry, doubled on each subsequent retry
+        commit_within_ms: If set, asks solr to commit the updates within this many milliseconds
+
+    Returns: nothing
+    """
+    _solrPostUpdate(
+        rsession,
+        lambda: json_array_chunks(docs),
+        len(docs),
+        url,
+        {"failOnVersionConflicts": "false"},
+        max_retries,
+        retry_backoff,
+        commit_within_ms,
+    )
 
 
 def solrCommit(rsession, url):
@@ -579,6 +711,19 @@ class CollectionAdaptor:
         return []
 
 
+# Columns of a Thing that the core record functions consult.  Projected iteration selects only these, and only these
+# are shipped to transform worker processes.
+TRANSFORM_THING_FIELDS = [
+    "primary_key",
+    "id",
+    "authority_id",
+    "resolved_content",
+    "tcreated",
+    "tstamp",
+    "h3",
+]
+
+
 class ThingRecordIterator:
     def __init__(
         self,
@@ -626,6 +771,98 @@ class ThingRecordIterator:
             # Grab the next page, by only selecting records with _id > than the last one we fetched
             self._id = max_id_in_page
 
+    def yieldProjectedRecords(self, columns: typing.Optional[typing.List[str]] = None):
+        """
+        Yields rows holding only the requested Thing columns (by default the ones the core record functions use).
+
+        Rather than issuing a query per page, this streams a single keyset-ordered query through a server-side cursor
+        page_size rows at a time.  No ORM objects are created, so memory stays flat regardless of the number of rows.
+        The rows support attribute access, e.g. row.resolved_content, so they can stand in for Things in the
+        core record functions.
+        """
+        rows = sqlmodel_database.stream_thing_columns(
+            self._session,
+            columns or TRANSFORM_THING_FIELDS,
+            self._authority_id,
+            self._status,
+            self._min_time_created,
+            self._id,
+            self._page_size,
+        )
+        for row in rows:
+            if self._limit is not None and 0 < self._limit <= self._total_selected:
+                break
+            self._total_selected += 1
+            yield row
+
+    def yieldJournaledRecords(self, min_sequence: int):
+        """
+        Yields the Things with change journal entries after min_sequence, in journal order, stopping short of any
+        change that may not have been committed yet.
+
+        After iteration, self.max_sequence holds the sequence number every journal entry up to has been read,
+        suitable for saving as the watermark of the next run.
+        """
+        self.max_sequence = min_sequence
+        while True:
+            page_start = self.max_sequence
+            changes, self.max_sequence = sqlmodel_database.settled_thing_changes_since(
+                self._session, page_start, self._authority_id, self._page_size
+            )
+            # A Thing saved repeatedly only needs to be fetched once per page
+            thing_ids = list(dict.fromkeys(change.thing_id for change in changes))
+            for thing in sqlmodel_database.get_things_with_ids(self._session, thing_ids):
+                if thing.resolved_status == self._status:
+                    yield thing
+            if self.max_sequence == page_start:
+                break
+
+
+def _thing_as_transform_payload(thing: Thing) -> typing.Dict:
+    return {field: getattr(thing, field) for field in TRANSFORM_THING_FIELDS}
+
+
+def _transform_thing(
+    core_record_function: typing.Callable, thing: Thing
+) -> typing.List[typing.Dict]:
+    try:
+        return core_record_function(thing)
+    except MetadataException as e:
+        getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{e}\".")
+    except Exception as e:
+        getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
+                          thing.resolved_content, e)
+    return []
+
+
+def _transform_thing_payloads(
+    core_record_function: typing.Callable, payloads: typing.List[typing.Dict]
+) -> typing.List[typing.Tuple[Optional[str], typing.List[typing.Dict]]]:
+    """Worker process entry point -- rebuild detached Things and run the core record function on each of them."""
+    results = []
+    for payload in payloads:
+        thing = Thing(**payload)
+        results.append((payload["h3"], _transform_thing(core_record_function, thing)))
+    return results
+
+
+def _init_transform_worker(worker_initializer: Optional[typing.Callable]):
+    # Leave interrupt handling to the parent process, which owns the pool
+    signal.signal(SIGINT, signal.SIG_IGN)
+    if worker_initializer is not None:
+        worker_initializer()
+
+
+def _chunked(iterable: typing.Iterable, chunk_size: int) -> typing.Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
 
 class CoreSolrImporter:
     def __init__(
@@ -637,28 +874,209 @@ class CoreSolrImporter:
         solr_url: str,
         offset: int = 0,
         min_time_created: Optional[datetime.datetime] = None,
+        limit: int = -1,
+        num_workers: int = 1,
+        ordered_results: bool = True,
+        transform_chunk_size: int = 100,
+        worker_initializer: Optional[typing.Callable] = None,
+        prefetch_size: Optional[int] = None,
+        solr_max_in_flight: int = 2,
+        solr_max_retries: int = 3,
+        stream_columns: bool = False,
+        from_journal: bool = False,
+        refresh_h3_counts: bool = True,
     ):
-        self._db_session = SQLModelDAO(db_url).get_session()
+        """
+        Args:
+            num_workers: Number of processes used to run the core record function.  1 transforms in this process.
+            ordered_results: Whether transformed records are sent to solr in database order.  Unordered results
+            keep the workers busier when individual records are slow to transform.
+            transform_chunk_size: Number of Things shipped to a worker process at once
+            worker_initializer: Optional callable run once in each worker process, e.g. to load the prediction models
+            prefetch_size: Number of Things read ahead of the transform stage on a background thread, which reads
+            them with a database session of its own.  Defaults to db_batch_size, 0 disables prefetching.
+            solr_max_in_flight: Number of concurrent solr update requests
+            solr_max_retries: Number of times a solr update is retried after a 5xx response
+            stream_columns: Whether to stream only the Thing columns the core record functions use over a
+            server-side cursor rather than paging full Thing objects
+            from_journal: Whether to only index Things with change journal entries newer than the watermark left by
+            the previous journaled import, instead of scanning the table.  The watermark is advanced after the final
+            solr commit.
+            refresh_h3_counts: Whether to recompute the precomputed h3 counts served by /h3_counts/ after the final
+            solr commit.  /h3_counts/ falls back to solr while they're out of date.
+        """
+        dao = SQLModelDAO(db_url)
+        self._db_session = dao.get_session()
+        self._prefetch_size = db_batch_size if prefetch_size is None else prefetch_size
+        # Sessions aren't thread-safe, and sqlite connections can only be used by the thread that created them, so the
+        # prefetch thread reads the Things through its own session
+        self._fetch_session = dao.get_session() if self._prefetch_size > 0 else self._db_session
         self._authority_id = authority_id
         self._min_time_created = min_time_created
         self._thing_iterator = ThingRecordIterator(
-            self._db_session,
+            self._fetch_session,
             authority_id=self._authority_id,
             page_size=db_batch_size,
             offset=offset,
+            limit=limit,
             min_time_created=min_time_created,
         )
         self._db_batch_size = db_batch_size
         self._solr_batch_size = solr_batch_size
         self._solr_url = solr_url
+        self._num_workers = num_workers
+        self._ordered_results = ordered_results
+        self._transform_chunk_size = transform_chunk_size
+        self._worker_initializer = worker_initializer
+        self._solr_max_in_flight = solr_max_in_flight
+        self._solr_max_retries = solr_max_retries
+        self._stream_columns = stream_columns
+        self._from_journal = from_journal
+        self._refresh_h3_counts = refresh_h3_counts
+        self._watermark_name = f"solr_{authority_id}"
+        self._thread_local = threading.local()
+        self.stats = PipelineStats()
+
+    def _closing_fetch_session(self, things: typing.Iterator[Thing]) -> typing.Iterator[Thing]:
+        # Closed by the prefetch thread, as its sqlite connection can't be closed from any other thread
+        try:
+            yield from things
+        finally:
+            self._fetch_session.close()
+
+    def _things(self) -> typing.Iterator[Thing]:
+        if self._from_journal:
+            min_sequence = sqlmodel_database.get_change_watermark(self._db_session, self._watermark_name)
+            getLogger().info("Indexing journaled changes after sequence %d", min_sequence)
+            things = self._thing_iterator.yieldJournaledRecords(min_sequence)
+        elif self._stream_columns:
+            things = self._thing_iterator.yieldProjectedRecords()
+        else:
+            things = self._thing_iterator.yieldRecordsByPage()
+        if self._prefetch_size <= 0:
+            yield from things
+            return
+        prefetched = PrefetchIterator(
+            self._closing_fetch_session(things), self._prefetch_size, stage="fetch", stats=self.stats
+        )
+        try:
+            yield from prefetched
+        finally:
+            prefetched.close()
+
+    def transformed_records(
+        self, core_record_function: typing.Callable
+    ) -> typing.Iterator[typing.Tuple[Optional[str], typing.List[typing.Dict]]]:
+        """Yields (thing h3, core records for the thing) tuples for all the Things selected by the thing iterator"""
+        if self._num_workers <= 1:
+            for thing in self._things():
+                yield thing.h3, _transform_thing(core_record_function, thing)
+                self.stats.increment("transform")
+        else:
+            for transformed in self._parallel_transformed_records(core_record_function):
+                yield transformed
+                self.stats.increment("transform")
+
+    def _parallel_transformed_records(
+        self, core_record_function: typing.Callable
+    ) -> typing.Iterator[typing.Tuple[Optional[str], typing.List[typing.Dict]]]:
+        transform = functools.partial(_transform_thing_payloads, core_record_function)
+        payloads = (
+            _thing_as_transform_payload(thing) for thing in self._things()
+        )
+        # Bound the number of chunks in flight so we don't read the whole table into the pool's queue
+        max_pending = self._num_workers * 2
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self._num_workers,
+            initializer=_init_transform_worker,
+            initargs=(self._worker_initializer,),
+        ) as executor:
+            pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+            for chunk in _chunked(payloads, self._transform_chunk_size):
+                pending.append(executor.submit(transform, chunk))
+                while len(pending) >= max_pending:
+                    for future in self._completed_futures(pending):
+                        yield from future.result()
+            while len(pending) > 0:
+                for future in self._completed_futures(pending):
+                    yield from future.result()
+
+    def _completed_futures(
+        self, pending: typing.Deque[concurrent.futures.Future]
+    ) -> typing.List[concurrent.futures.Future]:
+        """Waits for, removes and returns finished futures from pending, preserving submission order if requested"""
+        if self._ordered_results:
+            return [pending.popleft()]
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+        return list(done)
+
+    def _send_solr_batch(self, core_records: typing.List[typing.Dict]):
+        # requests sessions aren't guaranteed to be thread-safe, so give each sender thread its own
+        rsession = getattr(self._thread_local, "rsession", None)
+        if rsession is None:
+            rsession = requests.session()
+            self._thread_local.rsession = rsession
+        solrAddRecords(rsession, core_records, url=self._solr_url, max_retries=self._solr_max_retries)
+
+    def _import_transformed_records(
+        self,
+        core_record_function: typing.Callable,
+        sender: ConcurrentBatchSender,
+        h3_to_height: typing.Dict,
+        allkeys: typing.Set[str],
+    ):
+        core_records = []
+        for thing_h3, core_records_from_thing in self.transformed_records(core_record_function):
+            for core_record in core_records_from_thing:
+                core_record["source"] = self._authority_id
+                # Note that the h3 is precomputed and stored on the Thing itself because we do a
+                # "select distinct h3 from thing" query in order to determine which h3 values we need to compute
+                # Cesium elevation for.  The full order of operations is
+                # (1) compute h3 on things
+                # (2) select distinct h3 to determine points that need to be computed
+                # (3) compute points and insert into Point db cache table using Cesium JS API
+                # (4) at index time, consult Point cache to get elevation for thing, and since we've previously
+                #  computed the h3 just grab it off the Thing
+                # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take great
+                # pain to ensure that we're only querying the absolute minimum
+                core_record["producedBy_samplingSite_location_h3_15"] = thing_h3
+                core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing_h3)
+                core_records.append(core_record)
+                allkeys.add(core_record["id"])
+            if len(core_records) > self._solr_batch_size:
+                # Blocks if the solr senders are already saturated, which keeps the upstream stages from running away
+                sender.submit(core_records)
+                getLogger().info(
+                    "Queued solr records, length of all keys is %d; %s",
+                    len(allkeys),
+                    self.stats.summary(),
+                )
+                core_records = []
+        if len(core_records) > 0:
+            sender.submit(core_records)
+
+    def _refresh_h3_count_cube(self):
+        # Imported here since h3_utilities depends on the web app's solr query module
+        from isb_lib.utilities import h3_utilities
+
+        try:
+            h3_utilities.refresh_h3_count_cube(self._db_session)
+        except Exception as e:
+            # The import itself succeeded, and /h3_counts/ falls back to solr while the counts are out of date
+            getLogger().error("Failed to refresh the h3 count cube: %s", e)
 
     def run_solr_import(
         self, core_record_function: typing.Callable
     ) -> typing.Set[str]:
         getLogger().info(
-            "importing solr records with db batch size: %s, solr batch size: %s",
+            "importing solr records with db batch size: %s, solr batch size: %s, transform workers: %s, "
+            "concurrent solr updates: %s",
             self._db_batch_size,
             self._solr_batch_size,
+            self._num_workers,
+            self._solr_max_in_flight,
         )
         faulthandler.enable()
         faulthandler.register(SIGINT)
@@ -666,54 +1084,19 @@ class CoreSolrImporter:
         rsession = requests.session()
         h3_to_height = sqlmodel_database.h3_to_height(self._db_session)
         try:
-            core_records = []
-            for thing in self._thing_iterator.yieldRecordsByPage():
-                try:
-                    core_records_from_thing = core_record_function(thing)
-                except MetadataException as e:
-                    getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{e}\".")
-                    continue
-                except Exception as e:
-                    getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
-                                      thing.resolved_content, e)
-                    continue
-
-                for core_record in core_records_from_thing:
-                    core_record["source"] = self._authority_id
-                    # Note that the h3 is precomputed and stored on the Thing itself because we do a
-                    # "select distinct h3 from thing" query in order to determine which h3 values we need to compute
-                    # Cesium elevation for.  The full order of operations is
-                    # (1) compute h3 on things
-                    # (2) select distinct h3 to determine points that need to be computed
-                    # (3) compute points and insert into Point db cache table using Cesium JS API
-                    # (4) at index time, consult Point cache to get elevation for thing, and since we've previously
-                    #  computed the h3 just grab it off the Thing
-                    # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take great
-                    # pain to ensure that we're only querying the absolute minimum
-                    core_record["producedBy_samplingSite_location_h3_15"] = thing.h3
-                    core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing.h3)
-                    core_records.append(core_record)
-                for r in core_records:
-                    allkeys.add(r["id"])
-                batch_size = len(core_records)
-                if batch_size > self._solr_batch_size:
-                    solrAddRecords(
-                        rsession,
-                        core_records,
-                        url=self._solr_url,
-                    )
-                    getLogger().info(
-                        "Just added solr records, length of all keys is %d",
-                        len(allkeys),
-                    )
-                    core_records = []
-            if len(core_records) > 0:
-                solrAddRecords(
-                    rsession,
-                    core_records,
-                    url=self._solr_url,
-                )
+            sender = ConcurrentBatchSender(
+                self._send_solr_batch, self._solr_max_in_flight, stage="solr", stats=self.stats
+            )
+            with sender:
+                self._import_transformed_records(core_record_function, sender, h3_to_height, allkeys)
             solrCommit(rsession, url=self._solr_url)
+            if self._from_journal:
+                sqlmodel_database.save_change_watermark(
+                    self._db_session, self._watermark_name, self._thing_iterator.max_sequence
+                )
+            if self._refresh_h3_counts:
+                self._refresh_h3_count_cube()
+            getLogger().info("Finished solr import, %s", self.stats.summary())
             # verify records
             # for verifying that all records were added to solr
             # found = 0
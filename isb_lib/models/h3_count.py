@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Optional
+
+import igsn_lib.time
+from sqlmodel import SQLModel, Field
+
+# The source or category value of H3Count rows that count across all sources or categories
+ALL_VALUES = ""
+
+# The name of the H3CountCube row describing the H3Count rows, there is only the one cube
+H3_COUNT_CUBE_NAME = "h3_counts"
+
+
+class H3Count(SQLModel, table=True):
+    """A materialized count of the solr records in an h3 cell, optionally restricted to one source and category"""
+    resolution: Optional[int] = Field(
+        primary_key=True, default=None, nullable=False, description="The h3 resolution of the cell"
+    )
+    source: Optional[str] = Field(
+        primary_key=True, default=ALL_VALUES, nullable=False, description="The source counted, empty for all"
+    )
+    category: Optional[str] = Field(
+        primary_key=True, default=ALL_VALUES, nullable=False, description="The category counted, empty for all"
+    )
+    h3: Optional[str] = Field(
+        primary_key=True, default=None, nullable=False, description="The h3 cell"
+    )
+    count: int = Field(
+        default=0, nullable=False, description="Number of solr records in the cell"
+    )
+
+
+class H3CountCube(SQLModel, table=True):
+    """Records when the H3Count rows were last refreshed from solr, and which resolutions they cover"""
+    name: Optional[str] = Field(
+        primary_key=True, default=None, nullable=False, description="Name of the count cube"
+    )
+    max_resolution: int = Field(
+        default=0, nullable=False, description="The finest resolution materialized, coarser ones are all included"
+    )
+    category_field: Optional[str] = Field(
+        default=None, nullable=True, description="The solr field the category dimension counts"
+    )
+    index_version: Optional[int] = Field(
+        default=None, nullable=True, description="The solr index version the counts were computed from"
+    )
+    tstamp: datetime = Field(
+        default_factory=igsn_lib.time.dtnow,
+        description="When the count cube was last refreshed",
+    )
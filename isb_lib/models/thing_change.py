@@ -0,0 +1,42 @@
+from datetime import datetime
+from typing import Optional
+
+import igsn_lib.time
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+
+class ThingChange(SQLModel, table=True):
+    """An entry in the change journal, written in the same transaction as every saved Thing"""
+    sequence: Optional[int] = Field(
+        sa_column=sqlalchemy.Column(
+            "sequence",
+            sqlalchemy.Integer,
+            primary_key=True,
+            doc="monotonically increasing change sequence number",
+        ),
+    )
+    thing_id: Optional[str] = Field(
+        default=None, nullable=False, index=True, description="The id of the Thing that changed"
+    )
+    authority_id: Optional[str] = Field(
+        default=None, nullable=True, index=True, description="Authority of the Thing that changed"
+    )
+    tstamp: datetime = Field(
+        default_factory=igsn_lib.time.dtnow,
+        description="When the change was recorded",
+    )
+
+
+class ChangeWatermark(SQLModel, table=True):
+    """The last change journal sequence number a consumer (e.g. a solr index for an authority) has processed"""
+    name: Optional[str] = Field(
+        primary_key=True, default=None, nullable=False, description="Name of the journal consumer"
+    )
+    sequence: int = Field(
+        default=0, nullable=False, description="Sequence number of the last processed change"
+    )
+    tstamp: datetime = Field(
+        default_factory=igsn_lib.time.dtnow,
+        description="When the watermark was last advanced",
+    )
@@ -1,11 +1,15 @@
 """
 
 """
+import asyncio
+import concurrent.futures
 import logging
+import time
 import typing
 import datetime
 from typing import Optional
 
+import aiohttp
 import requests
 import sickle.oaiexceptions
 import sickle.utils
@@ -20,6 +24,7 @@ import dateparser
 from isamples_metadata import SESARTransformer
 from isamples_metadata.SESARTransformer import fullIgsn
 from isb_lib.models.thing import Thing
+from isb_lib.utilities.async_http import HostRateLimiter, AdaptiveConcurrencyLimiter
 
 HTTP_TIMEOUT = 10.0  # seconds
 ##############
@@ -29,6 +34,8 @@ DEFAULT_IGSN_OAI = "https://doidb.wdc-terra.org/igsnoaip/oai"
 
 DEFAULT_SESAR_SITEMAP = "https://app.geosamples.org/sitemaps/sitemap-index.xml"
 MEDIA_JSON_LD = "application/ld+json"
+SESAR_JSONLD_URL = "https://api.geosamples.org/v1/sample/igsn-ev-json-ld/igsn/{igsn}"
+SESAR_JSONLD_HEADERS = {"Accept": "application/ld+json, application/json"}
 
 
 def getLogger():
@@ -59,9 +66,8 @@ def getSESARItem_jsonld(igsn_value: str, verify: bool = True) -> requests.Respon
     Returns:
         response object
     """
-    headers = {"Accept": "application/ld+json, application/json"}
-    url = f"https://api.geosamples.org/v1/sample/igsn-ev-json-ld/igsn/{igsn_value}"
-    res = requests.get(url, headers=headers, verify=verify, timeout=HTTP_TIMEOUT)
+    url = SESAR_JSONLD_URL.format(igsn=igsn_value)
+    res = requests.get(url, headers=SESAR_JSONLD_HEADERS, verify=verify, timeout=HTTP_TIMEOUT)
     return res
 
 
@@ -216,13 +222,26 @@ def loadThing(
     elapsed = igsn_lib.time.datetimeDeltaToSeconds(response.elapsed)
     for h in response.history:
         elapsed = igsn_lib.time.datetimeDeltaToSeconds(h.elapsed)
-    r_url = response.url
-    r_status = response.status_code
     obj = None
     try:
         obj = response.json()
     except Exception as e:
         L.warning(e)
+    return _thingFromResponse(
+        identifier, t_created, existing_thing, obj, response.status_code, response.url, t_resolved, elapsed
+    )
+
+
+def _thingFromResponse(
+        identifier: str,
+        t_created: datetime.datetime,
+        existing_thing: Optional[Thing],
+        obj: typing.Optional[typing.Dict],
+        r_status: int,
+        r_url: str,
+        t_resolved: datetime.datetime,
+        elapsed: float,
+) -> Thing:
     # Try and parse out the creation date from the JSON.  If not present, use the less precise version from
     # the sitemap
     if obj is not None:
@@ -399,3 +418,195 @@ class SESARIdentifiersOAIPMH(isb_lib.core.IdentifierIterator):
             L.debug("Items in page: %s", len(self._cpage))
         except StopIteration:
             self._cpage = None
+
+
+def _retry_after_seconds(retry_after: typing.Optional[str]) -> typing.Optional[float]:
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        # Retry-After may also be an HTTP date, just fall back to our own backoff in that case
+        return None
+
+
+class SESARAsyncHarvester:
+    """
+    Harvests SESAR records over a single pooled aiohttp session.
+
+    Requests to each host are paced by a token bucket at requests_per_second, and the number in flight is adjusted
+    between 1 and max_concurrency based on how the upstream responds: 429 and 5xx responses or timeouts halve it and
+    are retried with backoff (honoring Retry-After), successes slowly grow it again.  Loaded Things are handed to
+    save_things in batches of save_batch_size, e.g. functools.partial(save_or_update_things, session), which checks
+    for existing Things with one query per batch.
+
+    save_things runs on a single thread of its own, so the requests in flight carry on while a batch is written and
+    a (non thread-safe) database session stays on one thread.  If it raises, the whole batch is counted as failed
+    and rollback, e.g. session.rollback, is called so later batches start from a clean transaction.
+    """
+
+    def __init__(
+            self,
+            save_things: typing.Callable[[typing.List[Thing]], typing.Any],
+            requests_per_second: float = 10.0,
+            max_concurrency: int = 20,
+            initial_concurrency: int = 10,
+            save_batch_size: int = 200,
+            max_retries: int = 3,
+            retry_backoff: float = 1.0,
+            url_template: str = SESAR_JSONLD_URL,
+            verify: bool = True,
+            timeout: float = HTTP_TIMEOUT,
+            rollback: Optional[typing.Callable[[], typing.Any]] = None,
+    ):
+        self._save_things = save_things
+        self._requests_per_second = requests_per_second
+        self._max_concurrency = max_concurrency
+        self._initial_concurrency = min(initial_concurrency, max_concurrency)
+        self._save_batch_size = save_batch_size
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._url_template = url_template
+        self._verify = verify
+        self._timeout = timeout
+        self._rollback = rollback
+        self._pending_things: typing.List[Thing] = []
+        self.num_loaded = 0
+        self.num_saved = 0
+        self.num_retries = 0
+        self.num_failed = 0
+
+    async def harvest(self, identifiers: typing.Iterable[typing.Tuple[str, datetime.datetime]]):
+        """Loads and saves the Things for an iterable of (igsn, time created) tuples"""
+        # asyncio primitives are created here so they're bound to the running loop
+        rate_limiter = HostRateLimiter(self._requests_per_second)
+        concurrency_limiter = AdaptiveConcurrencyLimiter(self._initial_concurrency, 1, self._max_concurrency)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._max_concurrency * 2)
+        if self._verify:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+        else:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency, ssl=False)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sesar_save") as save_executor:
+            async with aiohttp.ClientSession(
+                connector=connector,
+                headers=SESAR_JSONLD_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            ) as session:
+                workers = [
+                    asyncio.ensure_future(
+                        self._worker(session, rate_limiter, concurrency_limiter, queue, save_executor)
+                    )
+                    for _ in range(self._max_concurrency)
+                ]
+                try:
+                    for identifier in identifiers:
+                        await queue.put(identifier)
+                    await queue.join()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+            await self._flush(save_executor)
+        getLogger().info(
+            "Harvest done. loaded=%s saved=%s retries=%s failed=%s",
+            self.num_loaded, self.num_saved, self.num_retries, self.num_failed,
+        )
+
+    async def _worker(
+            self,
+            session: aiohttp.ClientSession,
+            rate_limiter: HostRateLimiter,
+            concurrency_limiter: AdaptiveConcurrencyLimiter,
+            queue: asyncio.Queue,
+            save_executor: concurrent.futures.Executor,
+    ):
+        while True:
+            igsn, t_created = await queue.get()
+            try:
+                try:
+                    thing = await self.load_thing(session, rate_limiter, concurrency_limiter, igsn, t_created)
+                except Exception as e:
+                    getLogger().error("Failed to load %s: %s", igsn, e)
+                    self.num_failed += 1
+                    continue
+                if thing is not None:
+                    self._pending_things.append(thing)
+                    if len(self._pending_things) >= self._save_batch_size:
+                        await self._flush(save_executor)
+            finally:
+                queue.task_done()
+
+    async def _flush(self, save_executor: concurrent.futures.Executor):
+        if len(self._pending_things) == 0:
+            return
+        things = self._pending_things
+        self._pending_things = []
+        # The counters are only updated on the loop's thread
+        if await asyncio.get_running_loop().run_in_executor(save_executor, self._save_batch, things):
+            self.num_saved += len(things)
+        else:
+            self.num_failed += len(things)
+
+    def _save_batch(self, things: typing.List[Thing]) -> bool:
+        try:
+            self._save_things(things)
+        except Exception as e:
+            getLogger().error("Failed to save batch of %s things: %s", len(things), e)
+            if self._rollback is not None:
+                self._rollback()
+            return False
+        return True
+
+    async def load_thing(
+            self,
+            session: aiohttp.ClientSession,
+            rate_limiter: HostRateLimiter,
+            concurrency_limiter: AdaptiveConcurrencyLimiter,
+            igsn: str,
+            t_created: datetime.datetime,
+    ) -> Optional[Thing]:
+        """Async equivalent of loadThing, returns None if the record couldn't be retrieved after retrying"""
+        L = getLogger()
+        url = self._url_template.format(igsn=igsn)
+        for attempt in range(self._max_retries + 1):
+            await rate_limiter.acquire(url)
+            await concurrency_limiter.acquire()
+            succeeded = False
+            retry_after = None
+            try:
+                start = time.monotonic()
+                async with session.get(url) as response:
+                    if response.status == 429 or response.status >= 500:
+                        retry_after = _retry_after_seconds(response.headers.get("Retry-After"))
+                        L.info("%s status for %s, concurrency=%s", response.status, igsn, concurrency_limiter.limit)
+                    else:
+                        succeeded = True
+                        obj = None
+                        try:
+                            obj = await response.json(content_type=None)
+                        except ValueError as e:
+                            L.warning(e)
+                        self.num_loaded += 1
+                        return _thingFromResponse(
+                            igsn,
+                            t_created,
+                            None,
+                            obj,
+                            response.status,
+                            str(response.url),
+                            igsn_lib.time.dtnow(),
+                            time.monotonic() - start,
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                L.info("Error fetching %s: %s", igsn, repr(e))
+            finally:
+                await concurrency_limiter.release(succeeded)
+            if attempt < self._max_retries:
+                self.num_retries += 1
+                if retry_after is not None:
+                    await rate_limiter.bucket(url).pause(retry_after)
+                else:
+                    await asyncio.sleep(self._retry_backoff * (2 ** attempt))
+        L.error("Too many retries on %s", igsn)
+        self.num_failed += 1
+        return None
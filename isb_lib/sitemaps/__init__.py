@@ -5,6 +5,8 @@ Chunks of this code based on https://github.com/scrapy/scrapy/blob/master/scrapy
 """
 import asyncio
 import datetime
+import hashlib
+import json
 import types
 import logging
 import re
@@ -22,6 +24,9 @@ from aiofile import AIOFile, Writer
 
 INDEX_XML = "sitemap-index.xml"
 
+# Records what each sitemap file held as of the last incremental build
+MANIFEST_JSON = "sitemap-manifest.json"
+
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -102,9 +107,9 @@ http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">\n"""
 
 
 async def write_sitemap_index_file(
-    base_path: str, host: str, sitemap_index_entries: typing.List[SitemapIndexEntry]
+    base_path: str, host: str, sitemap_index_entries: typing.List[SitemapIndexEntry], filename: str = INDEX_XML
 ):
-    index_file_path = os.path.join(base_path, INDEX_XML)
+    index_file_path = os.path.join(base_path, filename)
     async with AIOFile(index_file_path, "w") as aiodf:
         writer = Writer(aiodf)
         header = """<?xml version="1.0" encoding="utf-8"?>
@@ -128,13 +133,51 @@ https://www.sitemaps.org/schemas/sitemap/0.9/siteindex.xsd">\n"""
         await aiodf.fsync()
 
 
-def build_sitemap(base_path: str, host: str, iterator: typing.Iterator):
+def build_sitemap(base_path: str, host: str, iterator: typing.Iterator, incremental: bool = False):
+    """
+    Writes the sitemap files and sitemap index for the urlsets the iterator lists.
+
+    In incremental mode, a manifest of each file's url count, first and last identifiers and content digest is kept
+    alongside the sitemap, and files whose contents haven't changed since the previous build aren't rewritten.
+    Either way, files are written to a temporary path and renamed into place, so readers never see a partial file.
+    """
     loop = asyncio.get_event_loop()
-    future = asyncio.ensure_future(_build_sitemap(base_path, host, iterator))
+    future = asyncio.ensure_future(_build_sitemap(base_path, host, iterator, incremental))
     loop.run_until_complete(future)
 
 
-async def _build_sitemap(base_path: str, host: str, iterator: typing.Iterator):
+def urlset_manifest_entry(host: str, entries: typing.List[UrlSetEntry]) -> typing.Dict:
+    digest = hashlib.sha1()
+    for entry in entries:
+        digest.update(f"{os.path.join(host, entry.loc_suffix())}\t{entry.last_mod_str}\n".encode("utf-8"))
+    return {
+        "num_urls": len(entries),
+        "first_identifier": entries[0].identifier if len(entries) > 0 else None,
+        "last_identifier": entries[-1].identifier if len(entries) > 0 else None,
+        "last_mod": entries[-1].last_mod_str if len(entries) > 0 else None,
+        "digest": digest.hexdigest(),
+    }
+
+
+def read_manifest(base_path: str) -> typing.Dict[str, typing.Dict]:
+    manifest_path = os.path.join(base_path, MANIFEST_JSON)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _write_manifest(base_path: str, manifest: typing.Dict[str, typing.Dict]):
+    manifest_path = os.path.join(base_path, MANIFEST_JSON)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+async def _build_sitemap(base_path: str, host: str, iterator: typing.Iterator, incremental: bool = False):
+    previous_manifest = read_manifest(base_path) if incremental else {}
+    manifest = {}
     sitemap_index_entries = []
     for urlset_iterator in iterator:
         entries_for_urlset = []
@@ -142,15 +185,35 @@ async def _build_sitemap(base_path: str, host: str, iterator: typing.Iterator):
             entries_for_urlset.append(urlset_entry)
         sitemap_index_entry = urlset_iterator.sitemap_index_entry()
         sitemap_index_entries.append(sitemap_index_entry)
-        urlset_dest_path = os.path.join(base_path, sitemap_index_entry.sitemap_filename)
-        await write_urlset_file(urlset_dest_path, host, entries_for_urlset)
+        sitemap_filename = sitemap_index_entry.sitemap_filename
+        urlset_dest_path = os.path.join(base_path, sitemap_filename)
+        manifest_entry = urlset_manifest_entry(host, entries_for_urlset)
+        manifest[sitemap_filename] = manifest_entry
+        if (
+            incremental
+            and previous_manifest.get(sitemap_filename) == manifest_entry
+            and os.path.exists(urlset_dest_path)
+        ):
+            logging.info(f"{sitemap_filename} is unchanged, leaving it in place")
+            continue
+        temp_dest_path = f"{urlset_dest_path}.tmp"
+        await write_urlset_file(temp_dest_path, host, entries_for_urlset)
+        os.replace(temp_dest_path, urlset_dest_path)
         logging.info(
             "Done with urlset_iterator, wrote "
             + str(urlset_iterator.num_urls)
             + " records to "
-            + sitemap_index_entry.sitemap_filename
+            + sitemap_filename
         )
-    await write_sitemap_index_file(base_path, host, sitemap_index_entries)
+    await write_sitemap_index_file(base_path, host, sitemap_index_entries, f"{INDEX_XML}.tmp")
+    os.replace(os.path.join(base_path, f"{INDEX_XML}.tmp"), os.path.join(base_path, INDEX_XML))
+    if incremental:
+        # Only remove the files the index no longer lists once the new index is in place
+        for sitemap_filename in previous_manifest.keys() - manifest.keys():
+            stale_path = os.path.join(base_path, sitemap_filename)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        _write_manifest(base_path, manifest)
 
 
 @functools.cache
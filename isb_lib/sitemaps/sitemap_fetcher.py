@@ -1,9 +1,16 @@
 from __future__ import annotations
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import random
 import re
+import time
 import urllib.parse
+import zlib
 from abc import ABC
 import datetime
-from typing import Iterator, Optional
+from typing import Callable, Iterator, Optional
 
 import lxml.etree
 import requests
@@ -12,50 +19,213 @@ import logging
 
 import isb_lib.core
 import json
+from isb_lib.utilities.pipeline import PipelineStats
 
 
 IDENTIFIER_REGEX = re.compile(r".*/thing/(.*)")
 
+THING_URL_REGEX = re.compile(r"(.*)/thing/([^?]+)?")
+
 NUM_RETRIES = 5
 
+# Base delay before the first retry, doubled (plus jitter) for every retry after that
+RETRY_BACKOFF_SECONDS = 1.0
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Prefer streamed NDJSON, but older instances only know how to send a JSON array
+THINGS_ACCEPT = f"{isb_lib.core.MEDIA_NDJSON}, {isb_lib.core.MEDIA_JSON};q=0.9"
+
+SITEMAP_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+_SITEMAP_ENTRY_TAGS = [f"{{{SITEMAP_NAMESPACE}}}url", f"{{{SITEMAP_NAMESPACE}}}sitemap"]
+
+_LOC_TAG = f"{{{SITEMAP_NAMESPACE}}}loc"
+
+_LASTMOD_TAG = f"{{{SITEMAP_NAMESPACE}}}lastmod"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+SITEMAP_CHUNK_SIZE = 64 * 1024
+
+
+def request_with_retries(
+    session: requests.Session,
+    method: str,
+    url: str,
+    max_retries: int = NUM_RETRIES,
+    retry_backoff: float = RETRY_BACKOFF_SECONDS,
+    **kwargs,
+) -> Optional[requests.Response]:
+    """
+    Issues the request, retrying connection errors, timeouts and 429/5xx responses with exponential backoff and jitter.
+
+    Returns the last response once the retries are used up (so the caller sees the final status code), and re-raises
+    the last connection error or timeout if there never was one.  Returns None if max_retries allows no attempts.
+    """
+    response = None
+    retry_after = 0.0
+    for attempt in range(max_retries):
+        if attempt > 0:
+            delay = retry_backoff * (2 ** (attempt - 1))
+            delay = max(retry_after, delay + random.uniform(0, delay))
+            logging.info(f"Retrying {url} in {delay:.1f} seconds (attempt {attempt + 1} of {max_retries})")
+            time.sleep(delay)
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries - 1:
+                raise
+            logging.error(f"Error requesting {url}: {e}, will retry")
+            continue
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+        logging.error(f"Got response code {response.status_code} from {url}, will retry")
+        try:
+            retry_after = float(response.headers.get("Retry-After", 0))
+        except ValueError:
+            # Retry-After may also be an HTTP date, fall back to our own backoff then
+            retry_after = 0.0
+    return response
+
+
+def _gunzipped_chunks(chunks: typing.Iterable[bytes]) -> Iterator[bytes]:
+    """Passes the chunks through, gunzipping them if they start with the gzip magic number (a .xml.gz sitemap)"""
+    chunks = iter(chunks)
+    first_chunk = next(chunks, b"")
+    if not first_chunk.startswith(_GZIP_MAGIC):
+        yield first_chunk
+        yield from chunks
+        return
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in itertools.chain([first_chunk], chunks):
+        # Sitemaps compress very well, so cap how much each chunk inflates to at once
+        while len(chunk) > 0:
+            yield decompressor.decompress(chunk, SITEMAP_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _read_sitemap_entries(parser: lxml.etree.XMLPullParser) -> Iterator[typing.Tuple[str, Optional[str]]]:
+    for _, element in parser.read_events():
+        loc = element.findtext(_LOC_TAG)
+        lastmod = element.findtext(_LASTMOD_TAG)
+        # Drop the entry, and the root's references to the entries before it, so the tree never grows
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if loc is not None:
+            yield loc.strip(), lastmod.strip() if lastmod is not None else None
+
+
+def iter_sitemap_entries(chunks: typing.Iterable[bytes]) -> Iterator[typing.Tuple[str, Optional[str]]]:
+    """
+    Incrementally parses a sitemap or sitemap index, plain or gzipped, from an iterable of byte chunks (e.g.
+    response.iter_content()), yielding (loc, lastmod) for each entry as soon as it has been read.
+
+    These entries look like this:
+          <sitemap>
+            <loc>http://mars.cyverse.org/sitemaps/sitemap-5.xml</loc>
+            <lastmod>2006-08-10T12:00:00Z</lastmod>
+          </sitemap>
+          or this:
+            <urlset>
+              <url>
+                <loc>thing/ark:/28722/k2bg30w29?full=false&amp;format=core</loc>
+                <lastmod>2021-07-02T22:49:54Z</lastmod>
+              </url>
+            </urlset>
+    Either way, we can parse them the same way, and memory use stays constant no matter how large the file is.
+    """
+    parser = lxml.etree.XMLPullParser(
+        events=("end",),
+        tag=_SITEMAP_ENTRY_TAGS,
+        recover=True,
+        remove_comments=True,
+        resolve_entities=False,
+    )
+    for chunk in _gunzipped_chunks(chunks):
+        parser.feed(chunk)
+        yield from _read_sitemap_entries(parser)
+    parser.close()
+    yield from _read_sitemap_entries(parser)
+
+
+def _group_from_thing_url_regex(thing_url: str, group: int) -> typing.Optional[str]:
+    match = THING_URL_REGEX.match(thing_url)
+    if match is None:
+        logging.critical(f"Didn't find match in thing URL {thing_url}")
+        return None
+    else:
+        group_str = match.group(group)
+        return group_str
+
+
+def thing_identifier_from_thing_url(thing_url: str) -> typing.Optional[str]:
+    # At this point, we need to massage the URLs a bit, the sitemap publishes them like so:
+    # https://mars.cyverse.org/thing/ark:/21547/DxI2SKS002?full=false&amp;format=core
+    # We need to change full to true to get all the metadata, as well as the original format
+    return _group_from_thing_url_regex(thing_url, 2)
+
+
+def pre_thing_host_url(thing_url: str) -> typing.Optional[str]:
+    # At this point, we need to parse out the the URL a bit, the sitemap publishes them like so:
+    # https://mars.cyverse.org/thing/ark:/21547/DxI2SKS002?full=false&amp;format=core
+    # We need to grab the part of the URL before thing (https://mars.cyverse.org/) and change it to
+    # https://mars.cyverse.org/things to do the bulk fetch
+    return _group_from_thing_url_regex(thing_url, 1)
+
 
 class ThingsFetcher:
     def __init__(
         self,
         url: str,
         sitemap_url: str,
-        identifiers: set[str],
+        identifiers: typing.Iterable[str],
         session: requests.Session = requests.session(),
+        max_retries: int = NUM_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF_SECONDS,
     ):
         self.url = url
         self.sitemap_url = sitemap_url
         self._session = session
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
         self.identifiers = list(identifiers)
         self.json_things: list[dict] = []
         self.primary_keys_fetched: Optional[list[str]] = None
 
     def fetch_things(self) -> ThingsFetcher:
         try:
-            for i in range(NUM_RETRIES):
-                # headers = {"Content-Type": "application/json"}
-                params = {
-                    "identifiers": self.identifiers,
-                }
-                data = json.dumps(params).encode("utf-8")
-                logging.info(f"Going to fetch {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
-                response = self._session.post(self.url, data=data, timeout=90)
-                if response.status_code != 200:
-                    logging.error(f"Got response code {response.status_code} from {self.url}, will retry")
-                    continue
-                else:
-                    self.json_things = response.json()
-                    logging.info(f"Completed fetching {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
-                    self.primary_keys_fetched = [
-                        json_thing["primary_key"] for json_thing in self.json_things
-                    ]
-                    break
-            if len(self.json_things) == 0:
-                raise RuntimeError(f"Didn't receive a valid response from {self.url} after {NUM_RETRIES} attempts.")
+            # headers = {"Content-Type": "application/json"}
+            params = {
+                "identifiers": self.identifiers,
+            }
+            data = json.dumps(params).encode("utf-8")
+            logging.info(f"Going to fetch {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
+            response = request_with_retries(
+                self._session,
+                "POST",
+                self.url,
+                self._max_retries,
+                self._retry_backoff,
+                data=data,
+                timeout=90,
+                headers={"Accept": THINGS_ACCEPT},
+            )
+            if response is None or response.status_code != 200:
+                raise RuntimeError(
+                    f"Didn't receive a valid response from {self.url} after {self._max_retries} attempts, last "
+                    f"response code was {response.status_code if response is not None else None}."
+                )
+            if response.headers.get("Content-Type", "").startswith(isb_lib.core.MEDIA_NDJSON):
+                self.json_things = [json.loads(line) for line in response.iter_lines() if line]
+            else:
+                self.json_things = response.json()
+            logging.info(f"Completed fetching {len(self.identifiers)} things from {self.sitemap_url} at {self.url}")
+            self.primary_keys_fetched = [
+                json_thing["primary_key"] for json_thing in self.json_things
+            ]
         except Exception as e:
             logging.critical(
                 f"Error fetching things from: url: {self.url} exception is {e}"
@@ -112,46 +282,25 @@ class SitemapFetcher(ABC):
         self._session = session
         self.urls_to_fetch: list[str] = []
 
-    def _fetch_file(self):
+    def entry_iterator(self) -> Iterator[typing.Tuple[str, Optional[str]]]:
+        """Streams the sitemap, lazily yielding (loc, lastmod) for the entries modified since last_modified"""
         logging.info(f"Going to fetch sitemap at {self._url}")
-        res = self._session.get(self._url)
-        root = lxml.etree.fromstring(res.content)
-        sitemap_list = root.getchildren()
-        """These sitemap children look like this:
-              <sitemap>
-                <loc>http://mars.cyverse.org/sitemaps/sitemap-5.xml</loc>
-                <lastmod>2006-08-10T12:00:00Z</lastmod>
-              </sitemap>
-              or this:
-                <urlset>
-                  <url>
-                    <loc>thing/ark:/28722/k2bg30w29?full=false&amp;format=core</loc>
-                    <lastmod>2021-07-02T22:49:54Z</lastmod>
-                  </url>
-                </urlset>
-            Either way, we can parse them the same way
-        """
-        for sitemap_child in sitemap_list:
-            loc = (
-                sitemap_child.iterchildren(
-                    "{http://www.sitemaps.org/schemas/sitemap/0.9}loc"
-                )
-                .__next__()
-                .text
-            )
-            lastmod = (
-                sitemap_child.iterchildren(
-                    "{http://www.sitemaps.org/schemas/sitemap/0.9}lastmod"
-                )
-                .__next__()
-                .text
-            )
-            lastmod_date = isb_lib.core.parsed_datetime_from_isamples_format(lastmod)
-            if (
-                self._last_modified is None
-                or lastmod_date.timestamp() >= self._last_modified.timestamp()
-            ):
-                self.urls_to_fetch.append(loc)
+        res = request_with_retries(self._session, "GET", self._url, stream=True)
+        if res is None:
+            raise RuntimeError(f"No attempts were made to fetch sitemap at {self._url}")
+        res.raise_for_status()
+        with contextlib.closing(res):
+            for loc, lastmod in iter_sitemap_entries(res.iter_content(SITEMAP_CHUNK_SIZE)):
+                if (
+                    self._last_modified is None
+                    or lastmod is None
+                    or isb_lib.core.parsed_datetime_from_isamples_format(lastmod).timestamp()
+                    >= self._last_modified.timestamp()
+                ):
+                    yield loc, lastmod
+
+    def _fetch_file(self):
+        self.urls_to_fetch.extend(loc for loc, _ in self.entry_iterator())
 
     def url_iterator(self) -> Iterator:
         return iter(self.urls_to_fetch)
@@ -162,21 +311,69 @@ class SitemapFetcher(ABC):
 
 
 class SitemapFileFetcher(SitemapFetcher):
-    def fetch_sitemap_file(self) -> SitemapFetcher:
-        """Fetches the contents of the particular sitemap file and stores the URLs to fetch"""
-        self._fetch_file()
+    def __init__(
+        self,
+        url: str,
+        authority: str,
+        last_modified: typing.Optional[datetime.datetime],
+        session: requests.Session = requests.session(),
+        streaming: bool = False,
+    ):
+        super().__init__(url, authority, last_modified, session)
+        self._streaming = streaming
+
+    def fetch_sitemap_file(self) -> "SitemapFileFetcher":
+        """
+        Fetches the contents of the particular sitemap file and stores the URLs to fetch.  When streaming, the file
+        isn't fetched until url_iterator is read, and the URLs are never stored.
+        """
+        if not self._streaming:
+            self._fetch_file()
         return self
 
-    def fetch_child_files(self) -> typing.List[ThingFetcher]:
-        """Fetches the actual Things, one per file"""
-        thing_fetchers = []
-        for url in self.urls_to_fetch:
-            thing_fetcher = ThingFetcher(
-                self.prepare_thing_file_url(url), self._session
-            )
-            thing_fetcher.fetch_thing()
-            thing_fetchers.append(thing_fetcher)
-        return thing_fetchers
+    def url_iterator(self) -> Iterator:
+        if self._streaming:
+            return (loc for loc, _ in self.entry_iterator())
+        return super().url_iterator()
+
+    def fetch_child_files(self, max_workers: int = 1) -> typing.List[ThingFetcher]:
+        """Fetches the actual Things, one per file, with up to max_workers requests in flight"""
+        thing_fetchers = [
+            ThingFetcher(self.prepare_thing_file_url(url), self._session)
+            for url in self.urls_to_fetch
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(ThingFetcher.fetch_thing, thing_fetchers))
+
+    def things_fetchers(
+        self, batch_size: int, max_retries: int = NUM_RETRIES, retry_backoff: float = RETRY_BACKOFF_SECONDS
+    ) -> Iterator[ThingsFetcher]:
+        """Lazily groups the thing URLs into unfetched ThingsFetchers of up to batch_size identifiers each"""
+        # a dict rather than a set so the batch keeps sitemap order
+        thing_ids: dict[str, None] = {}
+        things_url = None
+        for url in self.url_iterator():
+            if things_url is None:
+                # parse out the base things url from the first one we grab (they should all be the same)
+                things_url = pre_thing_host_url(url)
+                if things_url is None:
+                    logging.critical(
+                        f"Couldn't parse out things url from url {url} -- unable to construct things."
+                    )
+                    return
+                things_url += "/things"
+            identifier = thing_identifier_from_thing_url(url)
+            if identifier is None:
+                logging.critical(
+                    f"Cannot parse out identifier from url {url} -- will not fetch thing."
+                )
+                continue
+            thing_ids[identifier] = None
+            if len(thing_ids) >= batch_size:
+                yield ThingsFetcher(things_url, self.url, thing_ids, self._session, max_retries, retry_backoff)
+                thing_ids = {}
+        if len(thing_ids) > 0 and things_url is not None:
+            yield ThingsFetcher(things_url, self.url, thing_ids, self._session, max_retries, retry_backoff)
 
     def prepare_thing_file_url(self, file_url: str) -> str:
         """Mainly used as a placeholder for overriding in unit testing"""
@@ -190,26 +387,22 @@ class SitemapIndexFetcher(SitemapFetcher):
         authority: str,
         last_modified: typing.Optional[datetime.datetime],
         session: requests.Session = requests.session(),
+        stream_sitemap_files: bool = False,
     ):
         super().__init__(url, authority, last_modified, session)
+        self._stream_sitemap_files = stream_sitemap_files
 
     def fetch_index_file(self):
-        xmlp = lxml.etree.XMLParser(
-            recover=True,
-            remove_comments=True,
-            resolve_entities=False,
-        )
-        lxml.etree.set_default_parser(xmlp)
         self._fetch_file()
 
-    def fetch_child_files(self) -> typing.List[SitemapFileFetcher]:
-        """Fetches the individual sitemap URLs from the sitemap index, and returns them in a list"""
-        file_fetchers = []
-        for url in self.urls_to_fetch:
-            child_file_fetcher = self.sitemap_file_fetcher(url)
-            child_file_fetcher.fetch_sitemap_file()
-            file_fetchers.append(child_file_fetcher)
-        return file_fetchers
+    def fetch_child_files(self, max_workers: int = 1) -> typing.List[SitemapFileFetcher]:
+        """
+        Fetches the individual sitemap URLs from the sitemap index, with up to max_workers requests in flight, and
+        returns them in index order
+        """
+        file_fetchers = [self.sitemap_file_fetcher(url) for url in self.urls_to_fetch]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(SitemapFileFetcher.fetch_sitemap_file, file_fetchers))
 
     def prepare_sitemap_file_url(self, file_url: str) -> str:
         """Mainly used as a placeholder for overriding in unit testing"""
@@ -221,4 +414,228 @@ class SitemapIndexFetcher(SitemapFetcher):
             self._authority,
             self._last_modified,
             self._session,
+            self._stream_sitemap_files,
         )
+
+
+class ChangeFeedFetcher:
+    """
+    Pages through another iSB instance's /things/changes feed from a change sequence watermark, so that a replica
+    only fetches the Things that changed since it last synced instead of walking the whole sitemap.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        authority: Optional[str],
+        since: int = 0,
+        session: requests.Session = requests.session(),
+        page_size: int = 1000,
+        max_retries: int = NUM_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF_SECONDS,
+    ):
+        self.url = url
+        self._authority = authority
+        self.since = since
+        self._session = session
+        self._page_size = page_size
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self.max_sequence: Optional[int] = None
+
+    @property
+    def things_url(self) -> str:
+        # The feed is served at {things_url}/changes
+        return self.url.rsplit("/changes", 1)[0]
+
+    def fetch_page(self, since: int) -> typing.Tuple[list[dict], int]:
+        """Fetches the changes after since, returning them along with the sequence number to resume from"""
+        params: dict[str, typing.Any] = {"since": since, "limit": self._page_size}
+        if self._authority is not None:
+            params["authority"] = self._authority
+        response = request_with_retries(
+            self._session, "GET", self.url, self._max_retries, self._retry_backoff, params=params, timeout=90
+        )
+        if response is None:
+            raise RuntimeError(f"No attempts were made to fetch changes from {self.url}")
+        response.raise_for_status()
+        page = response.json()
+        self.max_sequence = page["max_sequence"]
+        return page["changes"], page["next"]
+
+    def pages(self) -> Iterator[typing.Tuple[list[dict], int]]:
+        """
+        Yields (changes, next sequence) for each page until the feed stops advancing.  self.since only advances once
+        the caller asks for the following page, so save next as the watermark after processing each page.
+
+        The feed holds next back at changes that may not have been committed yet, so a page may be empty even though
+        next moved on (the changes up to it were to other authorities), or stop short of max_sequence.
+        """
+        while True:
+            changes, next_sequence = self.fetch_page(self.since)
+            if len(changes) == 0 and next_sequence <= self.since:
+                return
+            yield changes, next_sequence
+            self.since = next_sequence
+
+    def things_fetchers(self, changes: list[dict], batch_size: int) -> Iterator[ThingsFetcher]:
+        """Unfetched ThingsFetchers for the changed Things that weren't deleted, up to batch_size ids each"""
+        thing_ids = [change["id"] for change in changes if not change["deleted"]]
+        for start in range(0, len(thing_ids), batch_size):
+            yield ThingsFetcher(
+                self.things_url,
+                self.url,
+                thing_ids[start:start + batch_size],
+                self._session,
+                self._max_retries,
+                self._retry_backoff,
+            )
+
+
+class ConcurrentSitemapConsumer:
+    """
+    Mirrors the things published by another iSB instance's sitemap.  Child sitemap files and /things batches are
+    fetched on bounded thread pools, and each fetched batch is handed to save_things on the calling thread as soon as
+    it's available, so the database writes all happen on one thread (and one session) while the next requests are in
+    flight.
+
+    With ordered=True (the default) batches are saved in sitemap order, which keeps resuming from the last saved
+    timestamp safe; ordered=False saves whichever batch finishes first.  If the index fetcher streams its sitemap
+    files, each file is parsed lazily as its batches are constructed rather than prefetched on the sitemap pool.
+
+    A sitemap file or batch that can't be fetched (after retries) stops the run with a RuntimeError rather than being
+    skipped, so nothing after it is saved and the next run resumes from before it.
+    """
+
+    def __init__(
+        self,
+        index_fetcher: SitemapIndexFetcher,
+        save_things: Callable[[ThingsFetcher], typing.Any],
+        batch_size: int = 20000,
+        max_sitemap_workers: int = 1,
+        max_things_workers: int = 1,
+        max_pending_batches: Optional[int] = None,
+        sitemap_urls: Optional[typing.Iterable[str]] = None,
+        ordered: bool = True,
+        max_retries: int = NUM_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF_SECONDS,
+        progress_interval: float = 30.0,
+    ):
+        self._index_fetcher = index_fetcher
+        self._save_things = save_things
+        self._batch_size = batch_size
+        self._max_sitemap_workers = max_sitemap_workers
+        self._max_things_workers = max_things_workers
+        # By default keep one extra batch per worker fetched ahead, so the workers stay busy while we save
+        self._max_pending_batches = max_pending_batches or 2 * max_things_workers
+        self._sitemap_urls = sitemap_urls
+        self._ordered = ordered
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._progress_interval = progress_interval
+        self._last_progress = time.time()
+        self._pending_batches: collections.deque = collections.deque()
+        self.failed_sitemap_url: Optional[str] = None
+        self.stats = PipelineStats()
+        self.stats.register_queue("pending batches", lambda: len(self._pending_batches))
+
+    def _fetch_sitemap_file(self, url: str) -> Optional[SitemapFileFetcher]:
+        file_fetcher = self._index_fetcher.sitemap_file_fetcher(url)
+        try:
+            file_fetcher.fetch_sitemap_file()
+        except Exception as e:
+            logging.critical(f"Error fetching sitemap file {file_fetcher.url}, exception is {e}")
+            self.stats.increment("failed sitemap files")
+            return None
+        self.stats.increment("sitemap files")
+        return file_fetcher
+
+    def _sitemap_file_fetchers(
+        self, executor: concurrent.futures.ThreadPoolExecutor
+    ) -> Iterator[SitemapFileFetcher]:
+        """Yields the fetched sitemap files in index order, keeping up to max_sitemap_workers fetches ahead.  Stops at
+        the first one that can't be fetched, recording its url in failed_sitemap_url."""
+        urls = iter(self._sitemap_urls if self._sitemap_urls is not None else self._index_fetcher.urls_to_fetch)
+        pending: collections.deque = collections.deque()
+
+        def fill():
+            while len(pending) < self._max_sitemap_workers:
+                url = next(urls, None)
+                if url is None:
+                    return
+                pending.append((url, executor.submit(self._fetch_sitemap_file, url)))
+
+        fill()
+        while len(pending) > 0:
+            url, future = pending.popleft()
+            file_fetcher = future.result()
+            if file_fetcher is None:
+                self.failed_sitemap_url = url
+                for _, pending_future in pending:
+                    pending_future.cancel()
+                return
+            fill()
+            yield file_fetcher
+
+    def _fetch_things(self, things_fetcher: ThingsFetcher) -> ThingsFetcher:
+        things_fetcher.fetch_things()
+        if things_fetcher.primary_keys_fetched is not None:
+            self.stats.increment("things fetched", len(things_fetcher.json_things))
+        return things_fetcher
+
+    def _next_fetched_batch(self) -> ThingsFetcher:
+        if self._ordered:
+            return self._pending_batches.popleft().result()
+        done, _ = concurrent.futures.wait(self._pending_batches, return_when=concurrent.futures.FIRST_COMPLETED)
+        future = done.pop()
+        self._pending_batches.remove(future)
+        return future.result()
+
+    def _save(self, things_fetcher: ThingsFetcher):
+        if things_fetcher.primary_keys_fetched is None:
+            self.stats.increment("failed batches")
+            # Stop rather than skip, since saving later batches would move the resume point past this one's things
+            raise RuntimeError(
+                f"Unable to fetch things for {things_fetcher.sitemap_url} from {things_fetcher.url}, stopping so the "
+                f"things after them aren't saved first.  The next run will resume from the last thing saved."
+            )
+        self._save_things(things_fetcher)
+        self.stats.increment("batches saved")
+        self.stats.increment("things saved", len(things_fetcher.json_things))
+        if time.time() - self._last_progress >= self._progress_interval:
+            self.log_progress()
+
+    def log_progress(self):
+        self._last_progress = time.time()
+        logging.info(f"Sitemap consumer progress: {self.stats.summary()}")
+
+    def run(self) -> PipelineStats:
+        """Fetches and saves everything in the sitemap, returning the counters"""
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._max_sitemap_workers, thread_name_prefix="sitemap"
+        ) as sitemap_executor, concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._max_things_workers, thread_name_prefix="things"
+        ) as things_executor:
+            try:
+                for file_fetcher in self._sitemap_file_fetchers(sitemap_executor):
+                    for things_fetcher in file_fetcher.things_fetchers(
+                        self._batch_size, self._max_retries, self._retry_backoff
+                    ):
+                        self._pending_batches.append(things_executor.submit(self._fetch_things, things_fetcher))
+                        while len(self._pending_batches) >= self._max_pending_batches:
+                            self._save(self._next_fetched_batch())
+                # Batches from the files before a failed one are still safe to save
+                while len(self._pending_batches) > 0:
+                    self._save(self._next_fetched_batch())
+                if self.failed_sitemap_url is not None:
+                    raise RuntimeError(
+                        f"Unable to fetch sitemap file {self.failed_sitemap_url}, stopping so the things after it "
+                        f"aren't saved first.  The next run will resume from the last thing saved."
+                    )
+            finally:
+                # Don't wait on fetches nobody is going to save
+                for future in self._pending_batches:
+                    future.cancel()
+                self._pending_batches.clear()
+                self.log_progress()
+        return self.stats
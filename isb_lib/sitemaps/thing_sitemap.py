@@ -50,7 +50,12 @@ class ThingUrlSetIterator:
 
 
 class ThingSitemapIndexIterator:
-    """Iterator class responsible for listing the individual sitemap files in a sitemap index"""
+    """
+    Iterator class responsible for listing the individual sitemap files in a sitemap index
+
+    Pages through solr with a cursorMark, so that the last sitemap file is as cheap to fetch as the first.  Passing
+    an offset falls back to start/rows paging from that offset.
+    """
 
     def __init__(
         self,
@@ -67,6 +72,8 @@ class ThingSitemapIndexIterator:
         self._offset = offset
         self._last_url_set_iterator: Optional[ThingUrlSetIterator] = None
         self._rsession = requests.session()
+        # None once the cursor has reached the end of the results
+        self._cursor_mark: Optional[str] = isb_solr_query.CURSOR_MARK_START if offset == 0 else None
         self.num_url_sets = 0
 
     def __iter__(self):
@@ -77,9 +84,18 @@ class ThingSitemapIndexIterator:
             # Update our last values with the last ones from the previous iterator
             self._last_timestamp_str = self._last_url_set_iterator.last_tstamp_str
             self._last_primary_key = self._last_url_set_iterator.last_identifier
-        things = isb_solr_query.solr_records_for_sitemap(
-            self._rsession, self._authority, self._offset, self._num_things_per_file
-        )
+        if self._offset > 0:
+            things = isb_solr_query.solr_records_for_sitemap(
+                self._rsession, self._authority, self._offset, self._num_things_per_file
+            )
+        elif self._cursor_mark is not None:
+            things, next_cursor_mark = isb_solr_query.solr_records_for_sitemap_with_cursor(
+                self._rsession, self._authority, self._cursor_mark, self._num_things_per_file
+            )
+            # solr hands back the same cursorMark once there's nothing left
+            self._cursor_mark = next_cursor_mark if next_cursor_mark != self._cursor_mark else None
+        else:
+            things = []
         if len(things) == 0:
             raise StopIteration
         next_url_set_iterator = ThingUrlSetIterator(
@@ -87,5 +103,6 @@ class ThingSitemapIndexIterator:
         )
         self._last_url_set_iterator = next_url_set_iterator
         self.num_url_sets = self.num_url_sets + 1
-        self._offset = self._offset + self._num_things_per_file
+        if self._offset > 0:
+            self._offset = self._offset + self._num_things_per_file
         return next_url_set_iterator
@@ -0,0 +1,218 @@
+import collections
+import concurrent.futures
+import functools
+import json
+import logging
+import os
+import signal
+import threading
+import typing
+from signal import SIGINT
+from typing import Optional
+
+import requests
+
+from isb_lib.core import solrAddRecords, solrCommit, solr_atomic_update_records, _chunked
+from isb_lib.utilities.pipeline import PipelineStats, PrefetchIterator, ConcurrentBatchSender
+from isb_web.isb_solr_query import ISBCoreSolrRecordIterator, SOLR_UNIQUE_KEY
+
+# Solr migrations page by id so that a checkpointed id is a valid place to resume from
+MIGRATION_SORT = f"{SOLR_UNIQUE_KEY} asc"
+
+# Default for how long solr may hold updates before making them visible, rather than hard committing every batch
+DEFAULT_COMMIT_WITHIN_MS = 60000
+
+
+def _mutate_records(
+    mutate_record: typing.Callable, batch_mutate: bool, records: typing.List[typing.Dict]
+) -> typing.List[typing.Dict]:
+    """Worker process entry point -- run the migration's mutate_record on a chunk of records"""
+    if batch_mutate:
+        return mutate_record(records)
+    mutated_records = []
+    for record in records:
+        mutated_record = mutate_record(record)
+        if mutated_record is not None:
+            mutated_records.append(mutated_record)
+    return mutated_records
+
+
+def _init_mutate_worker(worker_initializer: Optional[typing.Callable]):
+    # Leave interrupt handling to the parent process, which owns the pool
+    signal.signal(SIGINT, signal.SIG_IGN)
+    if worker_initializer is not None:
+        worker_initializer()
+
+
+def _escape_range_term(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def read_checkpoint(checkpoint_path: Optional[str]) -> Optional[typing.Dict]:
+    """Returns the checkpoint left by an unfinished migration run, or None if there isn't one"""
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def _write_checkpoint(checkpoint_path: str, checkpoint: typing.Dict):
+    # Write and rename so a crash mid-write never leaves a truncated checkpoint behind
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, checkpoint_path)
+
+
+class SolrMigrationRunner:
+    """
+    Runs a solr migration: iterates the records matching a query, runs mutate_record on each and saves the records
+    it returns (None leaves a record alone).
+
+    The next batch is fetched from solr on a background thread while the current one is mutated, mutate_record
+    optionally runs in a pool of processes, and updates are uploaded on a background thread.  Instead of a hard
+    commit per batch, updates are sent with commitWithin and hard committed once at the end.  Progress is
+    checkpointed to a file after each saved batch, so a failed run picks up where it left off when re-run.
+    """
+
+    def __init__(
+        self,
+        solr_url: str,
+        mutate_record: typing.Callable,
+        query: Optional[str] = None,
+        batch_size: int = 50000,
+        num_workers: int = 1,
+        mutate_chunk_size: int = 1000,
+        worker_initializer: Optional[typing.Callable] = None,
+        commit_within_ms: Optional[int] = DEFAULT_COMMIT_WITHIN_MS,
+        checkpoint_path: Optional[str] = None,
+        fields: Optional[str] = None,
+        solr_max_retries: int = 3,
+        rsession: Optional[requests.Session] = None,
+        atomic_updates: bool = False,
+        batch_mutate: bool = False,
+    ):
+        """
+        Args:
+            solr_url: The solr collection url, ending with a slash
+            mutate_record: Function returning the updated record, or None if there's nothing to change.  Must be
+            picklable (e.g. a module level function) when num_workers > 1.
+            query: The solr query selecting records to migrate, defaults to all
+            batch_size: Number of records fetched from solr, and number of mutated records sent, at a time
+            num_workers: Number of processes used to run mutate_record.  1 mutates in this process.
+            mutate_chunk_size: Number of records shipped to a worker process at once
+            worker_initializer: Optional callable run once in each worker process
+            commit_within_ms: commitWithin sent with each update, None to leave commits to solr's autoCommit
+            checkpoint_path: File recording the last saved record, read on start to resume and removed on success
+            fields: The solr fl parameter to fetch records with, defaults to all stored fields
+            solr_max_retries: Number of times a solr update is retried after a 5xx response
+            rsession: The requests.session to send solr requests with
+            atomic_updates: Whether mutate_record returns atomic update documents (see
+            isb_lib.core.solr_atomic_update_doc) carrying only the changed fields, rather than whole records.  Pair
+            it with fields so that only the fields mutate_record needs are fetched, too.
+            batch_mutate: Whether mutate_record takes a list of (up to mutate_chunk_size) records and returns the
+            list of mutated ones, for migrations that vectorize their work
+        """
+        self._solr_url = solr_url
+        self._mutate_record = mutate_record
+        self._query = query
+        self._batch_size = batch_size
+        self._num_workers = num_workers
+        self._mutate_chunk_size = mutate_chunk_size
+        self._worker_initializer = worker_initializer
+        self._commit_within_ms = commit_within_ms
+        self._checkpoint_path = checkpoint_path
+        self._fields = fields
+        self._solr_max_retries = solr_max_retries
+        # The fetch and update threads each get their own session unless one was passed in
+        self._rsession = rsession if rsession is not None else requests.session()
+        self._update_rsession = rsession if rsession is not None else requests.session()
+        self._update_function = solr_atomic_update_records if atomic_updates else solrAddRecords
+        self._batch_mutate = batch_mutate
+        self._num_saved = 0
+        self._lock = threading.Lock()
+        self.stats = PipelineStats()
+
+    def _resume_query(self, checkpoint: Optional[typing.Dict]) -> str:
+        query = self._query if self._query is not None else "*:*"
+        if checkpoint is None:
+            return query
+        # Records are visited in id order, so everything up to and including the checkpointed id is done
+        return f"({query}) AND {SOLR_UNIQUE_KEY}:{{{_escape_range_term(checkpoint['last_id'])} TO *]"
+
+    def _records(self, query: str) -> typing.Iterator[typing.Dict]:
+        iterator = ISBCoreSolrRecordIterator(
+            self._rsession, query, self._batch_size, 0, MIGRATION_SORT, fields=self._fields
+        )
+        # Buffering a whole batch lets the background thread fetch the next one while this one is mutated
+        prefetched = PrefetchIterator(iterator, self._batch_size, stage="fetch", stats=self.stats)
+        try:
+            yield from prefetched
+        finally:
+            prefetched.close()
+
+    def mutated_records(self, records: typing.Iterable[typing.Dict]) -> typing.Iterator[typing.Dict]:
+        """Yields the mutated records, in the same order as the records they came from"""
+        mutate = functools.partial(_mutate_records, self._mutate_record, self._batch_mutate)
+        if self._num_workers <= 1:
+            for chunk in _chunked(records, self._mutate_chunk_size):
+                yield from mutate(chunk)
+                self.stats.increment("mutate", len(chunk))
+            return
+        # Bound the number of chunks in flight so we don't read the whole index into the pool's queue
+        max_pending = self._num_workers * 2
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self._num_workers,
+            initializer=_init_mutate_worker,
+            initargs=(self._worker_initializer,),
+        ) as executor:
+            pending: typing.Deque[typing.Tuple[concurrent.futures.Future, int]] = collections.deque()
+            for chunk in _chunked(records, self._mutate_chunk_size):
+                pending.append((executor.submit(mutate, chunk), len(chunk)))
+                while len(pending) >= max_pending:
+                    future, chunk_size = pending.popleft()
+                    yield from future.result()
+                    self.stats.increment("mutate", chunk_size)
+            while len(pending) > 0:
+                future, chunk_size = pending.popleft()
+                yield from future.result()
+                self.stats.increment("mutate", chunk_size)
+
+    def _save_batch(self, records: typing.List[typing.Dict]):
+        # The checkpoint has to be taken before solrAddRecords, which strips fields from the records in place
+        last_id = records[-1][SOLR_UNIQUE_KEY]
+        self._update_function(
+            self._update_rsession,
+            records,
+            self._solr_url,
+            max_retries=self._solr_max_retries,
+            commit_within_ms=self._commit_within_ms,
+        )
+        with self._lock:
+            self._num_saved += len(records)
+            if self._checkpoint_path is not None:
+                _write_checkpoint(self._checkpoint_path, {"last_id": last_id, "num_saved": self._num_saved})
+        logging.info("Saved %d migrated records through %s; %s", self._num_saved, last_id, self.stats.summary())
+
+    def run(self) -> PipelineStats:
+        checkpoint = read_checkpoint(self._checkpoint_path)
+        if checkpoint is not None:
+            logging.info("Resuming migration after record %s", checkpoint["last_id"])
+            self._num_saved = checkpoint.get("num_saved", 0)
+        # A single sender thread saves batches in order, so the checkpoint never runs ahead of an unsaved batch
+        sender = ConcurrentBatchSender(self._save_batch, 1, stage="solr", stats=self.stats)
+        with sender:
+            batch = []
+            for mutated_record in self.mutated_records(self._records(self._resume_query(checkpoint))):
+                batch.append(mutated_record)
+                if len(batch) >= self._batch_size:
+                    sender.submit(batch)
+                    batch = []
+            if len(batch) > 0:
+                sender.submit(batch)
+        solrCommit(self._update_rsession, self._solr_url)
+        if self._checkpoint_path is not None and os.path.exists(self._checkpoint_path):
+            os.remove(self._checkpoint_path)
+        logging.info("Finished migration, saved %d records; %s", self._num_saved, self.stats.summary())
+        return self.stats
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import typing
+import urllib.parse
+
+
+class TokenBucket:
+    """Async token bucket allowing rate requests per second on average, with bursts of up to capacity requests"""
+
+    def __init__(self, rate: float, capacity: typing.Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        # Holding the lock while sleeping hands out tokens in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def pause(self, seconds: float):
+        """Drains the bucket and waits, e.g. when the host has told us to back off via Retry-After"""
+        async with self._lock:
+            await asyncio.sleep(seconds)
+            self._tokens = 0
+            self._last_refill = time.monotonic()
+
+
+class HostRateLimiter:
+    """Keeps a separate TokenBucket for each host that requests are issued against"""
+
+    def __init__(self, rate: float, capacity: typing.Optional[float] = None):
+        self._rate = rate
+        self._capacity = capacity
+        self._buckets: typing.Dict[str, TokenBucket] = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urllib.parse.urlparse(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self._rate, self._capacity)
+            self._buckets[host] = bucket
+        return bucket
+
+    async def acquire(self, url: str):
+        await self.bucket(url).acquire()
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of requests in flight, adjusting the limit with AIMD (additive increase, multiplicative
+    decrease): every success grows the limit by 1/limit (about one per round of requests), every failure such as a
+    429, 5xx or timeout halves it.
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int = 1, max_limit: typing.Optional[int] = None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit if max_limit is not None else initial_limit
+        self._limit = float(max(min_limit, min(initial_limit, self.max_limit)))
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self, success: bool):
+        async with self._condition:
+            self._in_flight -= 1
+            if success:
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            else:
+                self._limit = max(float(self.min_limit), self._limit / 2)
+            self._condition.notify_all()
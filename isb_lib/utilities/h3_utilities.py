@@ -1,16 +1,37 @@
-from typing import Any
+from typing import Any, Optional
 
 from .antimeridian_splitter import split_polygon
+import logging
 import math
+import re
+import threading
+import time
 import typing
 import geojson
 import h3
-from isb_web.isb_solr_query import clip_float, solr_records_forh3_counts
+from sqlmodel import Session
+
+from isb_lib.models.h3_count import ALL_VALUES
+from isb_web import sqlmodel_database
+from isb_web.isb_solr_query import clip_float, solr_records_forh3_counts, solr_bucket_counts, solr_index_version
 
 # Mainly adapted from https://github.com/datadavev/seeh3/blob/main/app/seeh3.py
 
 BB_REGEX = r"^([+-]?[0-9]+(\.[0-9]+)?,?){4}$"
 
+# The solr field the count cube's category dimension counts, alongside source
+H3_COUNT_CUBE_CATEGORY_FIELD = "hasMaterialCategory"
+
+# Finest resolution materialized by default.  Finer (zoomed in) requests come with a bounding box, which the cube
+# can't answer anyway.
+H3_COUNT_CUBE_MAX_RESOLUTION = 6
+
+# Seconds the solr index version is remembered for before checking whether the count cube is still current
+H3_COUNT_CUBE_INDEX_CHECK_INTERVAL = 10.0
+
+# A single field:value or field:"value" term, optionally parenthesized
+_QUERY_TERM_REGEX = re.compile(r'^\(?\s*(\w+):(?:"([^"\\*?]*)"|([^\s"()\\*?:]+))\s*\)?$')
+
 # These are H3 cells from resolutions 0-16 that overlap the north or south poles
 POLES = {
     "8af2939520c7fff",
@@ -118,29 +139,138 @@ def get_h3_solr_query_from_bb(bb: str, resolution: str, q: str) -> H3SolrQueryPa
     return H3SolrQueryParams(q, resolution)
 
 
-def get_record_counts(
-    query: str = "*:*", resolution: int = 1, exclude_poles: bool = True
-) -> dict[Any, dict[str, Any]]:
+def count_cube_key(
+    query: Optional[str], category_field: str = H3_COUNT_CUBE_CATEGORY_FIELD
+) -> Optional[typing.Tuple[str, str]]:
     """
-    Facet records matching query on resolution, returning dict with keys being h3.
+    The (source, category) the count cube holds the counts for query under, with ALL_VALUES for an unrestricted
+    dimension.  None if the query is anything more than *:* and at most one source and one category term ANDed together.
     """
+    source = ALL_VALUES
+    category = ALL_VALUES
+    if query is None or query.strip() in ("", "*:*"):
+        return source, category
+    for term in re.split(r"\s+AND\s+", query.strip()):
+        term = term.strip()
+        if term == "*:*":
+            continue
+        match = _QUERY_TERM_REGEX.match(term)
+        if match is None:
+            return None
+        field = match.group(1)
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        if field == "source" and source == ALL_VALUES:
+            source = value
+        elif field == category_field and category == ALL_VALUES:
+            category = value
+        else:
+            return None
+    return source, category
+
+
+def compute_h3_count_cube(
+    max_resolution: int = H3_COUNT_CUBE_MAX_RESOLUTION, category_field: str = H3_COUNT_CUBE_CATEGORY_FIELD
+) -> dict[typing.Tuple[int, str, str], dict[str, int]]:
+    """
+    Counts all the solr records per h3 cell at each resolution up to max_resolution, overall, per source, per
+    category and per source and category.  Keys are (resolution, source, category), with ALL_VALUES for the
+    dimensions that aren't broken down.
+    """
+    counts: dict[typing.Tuple[int, str, str], dict[str, int]] = {}
+    for resolution in range(0, max_resolution + 1):
+        field_name = f"producedBy_samplingSite_location_h3_{resolution}"
+        for dimensions in [[], ["source"], [category_field], ["source", category_field]]:
+            for entry in solr_bucket_counts("*:*", dimensions + [field_name]):
+                cell = entry.get(field_name)
+                if cell is None:
+                    continue
+                source = entry.get("source", ALL_VALUES) if "source" in dimensions else ALL_VALUES
+                category = entry.get(category_field, ALL_VALUES) if category_field in dimensions else ALL_VALUES
+                counts.setdefault((resolution, source, category), {})[cell] = entry["count(*)"]
+    return counts
+
+
+def refresh_h3_count_cube(
+    session: Session,
+    max_resolution: int = H3_COUNT_CUBE_MAX_RESOLUTION,
+    category_field: str = H3_COUNT_CUBE_CATEGORY_FIELD,
+):
+    """Recomputes the materialized h3 counts from solr, to be run after the index changes (e.g. after an import)"""
+    # Read first, so that counts computed while the index changes are never taken to be current
+    index_version = solr_index_version()
+    counts = compute_h3_count_cube(max_resolution, category_field)
+    sqlmodel_database.save_h3_count_cube(session, counts, max_resolution, category_field, index_version)
+    logging.info(
+        "Refreshed the h3 count cube with %d cells", sum(len(cell_counts) for cell_counts in counts.values())
+    )
+
+
+_index_version_lock = threading.Lock()
+_index_version: Optional[int] = None
+_index_version_checked = 0.0
+
+
+def current_solr_index_version() -> Optional[int]:
+    """solr's index version, checked at most every H3_COUNT_CUBE_INDEX_CHECK_INTERVAL seconds"""
+    global _index_version, _index_version_checked
+    with _index_version_lock:
+        if time.monotonic() - _index_version_checked >= H3_COUNT_CUBE_INDEX_CHECK_INTERVAL:
+            _index_version = solr_index_version()
+            _index_version_checked = time.monotonic()
+        return _index_version
+
+
+def count_cube_counts(session: Session, query: Optional[str], resolution: int) -> Optional[dict[str, int]]:
+    """
+    The materialized counts per h3 cell for query at resolution, or None if the count cube can't answer it.  The
+    cube can only answer for the solr index version it was computed from, any commit since makes it out of date.
+    """
+    cube = sqlmodel_database.get_h3_count_cube(session)
+    if cube is None or resolution is None or int(resolution) > cube.max_resolution:
+        return None
+    if cube.index_version is None or cube.index_version != current_solr_index_version():
+        return None
+    # Cubes saved before the category field was recorded counted the default one
+    key = count_cube_key(query, cube.category_field or H3_COUNT_CUBE_CATEGORY_FIELD)
+    if key is None:
+        return None
+    return sqlmodel_database.h3_counts(session, int(resolution), key[0], key[1])
+
+
+def _solr_cell_counts(query: str, resolution: int) -> dict[str, int]:
     field_name = f"producedBy_samplingSite_location_h3_{resolution}"
     response = solr_records_forh3_counts(query, field_name)
-    counts = {}
-    total = 0
+    cell_counts = {}
     for entry in response.get("result-set", {}).get("docs", []):
         try:
-            h = entry[field_name]
-            if h not in POLES or not exclude_poles:
-                n = entry["count(*)"]
-                total += n
-                counts[h] = {
-                    "n": n,
-                    "rn": 0,
-                    "ln": 0,
-                }
+            cell_counts[entry[field_name]] = entry["count(*)"]
         except KeyError:
             pass
+    return cell_counts
+
+
+def get_record_counts(
+    query: str = "*:*", resolution: int = 1, exclude_poles: bool = True, session: Optional[Session] = None
+) -> dict[Any, dict[str, Any]]:
+    """
+    Facet records matching query on resolution, returning dict with keys being h3.
+
+    If a database session is provided, queries the materialized count cube answers are served from it rather than
+    solr.
+    """
+    cell_counts = count_cube_counts(session, query, resolution) if session is not None else None
+    if cell_counts is None:
+        cell_counts = _solr_cell_counts(query, resolution)
+    counts: dict[Any, dict[str, Any]] = {}
+    total = 0
+    for h, n in cell_counts.items():
+        if h not in POLES or not exclude_poles:
+            total += n
+            counts[h] = {
+                "n": n,
+                "rn": 0,
+                "ln": 0,
+            }
     if total == 0:
         log_total: float = 0
     else:
@@ -0,0 +1,118 @@
+import hashlib
+import typing
+
+import numpy as np
+
+# Rows are accumulated in chunks of this many entries while loading, so the loader never holds Python objects for
+# more than one chunk at a time
+DEFAULT_LOAD_CHUNK_SIZE = 100_000
+
+
+def hash_identifier(identifier: str) -> int:
+    """Stable (across processes, unlike hash()) signed 64 bit hash of an identifier"""
+    return int.from_bytes(
+        hashlib.blake2b(identifier.encode("utf-8"), digest_size=8).digest(), "little", signed=True
+    )
+
+
+class CompactIdentifierMap(typing.Mapping[str, int]):
+    """
+    Read-only identifier to Thing primary key map, held as two parallel int64 NumPy arrays sorted by identifier hash.
+
+    Takes 16 bytes per identifier, versus the hundreds a dict of str -> int costs, and lookups are a binary search.
+    The identifier strings themselves aren't stored, so the map can't be iterated by identifier, and two identifiers
+    with the same 64 bit hash (vanishingly unlikely, about n^2 / 2^65) would share an entry.  Callers that can't
+    tolerate that should confirm matches against the database.
+    """
+
+    def __init__(self, hashes: np.ndarray, primary_keys: np.ndarray):
+        # Expects hashes to already be sorted and unique, use one of the from_ classmethods to build a new map
+        self._hashes = hashes
+        self._primary_keys = primary_keys
+
+    @classmethod
+    def from_pairs(
+        cls, pairs: typing.Iterable[typing.Tuple[str, int]], chunk_size: int = DEFAULT_LOAD_CHUNK_SIZE
+    ) -> "CompactIdentifierMap":
+        """Builds a map from a (possibly streamed) iterable of (identifier, primary key).  Later duplicates win."""
+        hash_chunks = []
+        primary_key_chunks = []
+        chunk_hashes: typing.List[int] = []
+        chunk_primary_keys: typing.List[int] = []
+        for identifier, primary_key in pairs:
+            chunk_hashes.append(hash_identifier(identifier))
+            chunk_primary_keys.append(primary_key)
+            if len(chunk_hashes) >= chunk_size:
+                hash_chunks.append(np.array(chunk_hashes, dtype=np.int64))
+                primary_key_chunks.append(np.array(chunk_primary_keys, dtype=np.int64))
+                chunk_hashes = []
+                chunk_primary_keys = []
+        hash_chunks.append(np.array(chunk_hashes, dtype=np.int64))
+        primary_key_chunks.append(np.array(chunk_primary_keys, dtype=np.int64))
+        hashes = np.concatenate(hash_chunks)
+        primary_keys = np.concatenate(primary_key_chunks)
+        # A stable sort keeps duplicates in load order, so keeping the last of each run lets later entries win
+        order = np.argsort(hashes, kind="stable")
+        hashes = hashes[order]
+        primary_keys = primary_keys[order]
+        last_of_run = np.ones(len(hashes), dtype=bool)
+        last_of_run[:-1] = hashes[:-1] != hashes[1:]
+        return cls(hashes[last_of_run], primary_keys[last_of_run])
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompactIdentifierMap":
+        """Loads a map written by save, memory mapped by default so only the pages that are searched get read"""
+        table = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(table[0], table[1])
+
+    def save(self, path: str):
+        np.save(path, np.stack([self._hashes, self._primary_keys]))
+
+    def _index(self, identifier: str) -> int:
+        identifier_hash = hash_identifier(identifier)
+        index = int(np.searchsorted(self._hashes, identifier_hash))
+        if index < len(self._hashes) and self._hashes[index] == identifier_hash:
+            return index
+        return -1
+
+    def __getitem__(self, identifier: str) -> int:
+        index = self._index(identifier)
+        if index < 0:
+            raise KeyError(identifier)
+        return int(self._primary_keys[index])
+
+    def __contains__(self, identifier: object) -> bool:
+        return isinstance(identifier, str) and self._index(identifier) >= 0
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __iter__(self):
+        raise TypeError("CompactIdentifierMap doesn't store identifiers and can't be iterated")
+
+    def get_many(self, identifiers: typing.Iterable[str]) -> typing.Dict[str, int]:
+        """Vectorized lookup of a batch of identifiers, returns a dict of the identifiers that are present"""
+        identifiers = list(identifiers)
+        if len(identifiers) == 0 or len(self._hashes) == 0:
+            return {}
+        identifier_hashes = np.fromiter(
+            (hash_identifier(identifier) for identifier in identifiers), dtype=np.int64, count=len(identifiers)
+        )
+        indexes = np.minimum(np.searchsorted(self._hashes, identifier_hashes), len(self._hashes) - 1)
+        found = self._hashes[indexes] == identifier_hashes
+        return {
+            identifier: int(primary_key)
+            for identifier, primary_key, is_found in zip(identifiers, self._primary_keys[indexes], found)
+            if is_found
+        }
+
+    @property
+    def max_primary_key(self) -> int:
+        """The largest primary key in the map, 0 if it's empty.  Things saved after it was built have larger ones."""
+        if len(self._primary_keys) == 0:
+            return 0
+        return int(self._primary_keys.max())
+
+    @property
+    def nbytes(self) -> int:
+        return self._hashes.nbytes + self._primary_keys.nbytes
@@ -0,0 +1,225 @@
+import codecs
+import datetime
+import gzip
+import json
+import re
+import typing
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore[assignment]
+
+ENCODING_GZIP = "gzip"
+ENCODING_ZSTD = "zstd"
+
+# Size of the chunks handed to the HTTP client, large enough to avoid a flood of tiny writes
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def _json_default(obj: typing.Any) -> typing.Any:
+    # orjson writes datetimes as isoformat natively, do the same when falling back to json
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: typing.Any) -> bytes:
+    """Serializes obj to UTF-8 encoded JSON, using orjson if it is installed.  Datetimes are written as isoformat."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson is stricter than json (e.g. non-str keys, > 64 bit ints), so fall back rather than fail
+            pass
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+
+def json_array_chunks(
+    records: typing.Iterable[typing.Any], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> typing.Iterator[bytes]:
+    """
+    Lazily serializes records as a JSON array, one record at a time.
+
+    Suitable for passing as the data of a requests post, which then sends a chunked body without ever holding the
+    whole serialized payload in memory.
+    """
+    buffer = bytearray(b"[")
+    first = True
+    for record in records:
+        if not first:
+            buffer += b","
+        first = False
+        buffer += dumps_bytes(record)
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+
+def ndjson_chunks(
+    records: typing.Iterable[typing.Any], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> typing.Iterator[bytes]:
+    """Lazily serializes records as newline delimited JSON, one record per line."""
+    buffer = bytearray()
+    for record in records:
+        buffer += dumps_bytes(record)
+        buffer += b"\n"
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if len(buffer) > 0:
+        yield bytes(buffer)
+
+
+def available_encodings() -> typing.List[str]:
+    """Content encodings compressed_chunks supports, in order of preference"""
+    encodings = [ENCODING_GZIP]
+    if zstandard is not None:
+        encodings.insert(0, ENCODING_ZSTD)
+    return encodings
+
+
+def best_encoding(accept_encoding: typing.Optional[str]) -> typing.Optional[str]:
+    """Picks the preferred available encoding that an Accept-Encoding header allows, or None to send uncompressed"""
+    if accept_encoding is None:
+        return None
+    accepted = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _gzip_chunks(chunks: typing.Iterable[bytes], level: int) -> typing.Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
+def _zstd_chunks(chunks: typing.Iterable[bytes], level: int) -> typing.Iterator[bytes]:
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
+def compressed_chunks(
+    chunks: typing.Iterable[bytes], encoding: str, level: typing.Optional[int] = None
+) -> typing.Iterator[bytes]:
+    """
+    Lazily compresses a stream of chunks with the given content encoding (one of available_encodings()).
+
+    Defaults to a fast compression level, since these are meant for responses that are compressed as they're sent.
+    """
+    if encoding == ENCODING_GZIP:
+        return _gzip_chunks(chunks, level if level is not None else 5)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return _zstd_chunks(chunks, level if level is not None else 3)
+    raise ValueError(f"Unsupported content encoding {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Inverse of compressed_chunks, for clients that don't decode the encoding themselves"""
+    if encoding == ENCODING_GZIP:
+        return gzip.decompress(data)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported content encoding {encoding}")
+
+
+_JSON_WHITESPACE = " \t\r\n"
+
+
+class _JsonArrayItemReader:
+    """Decodes the items of a JSON array from a stream of UTF-8 chunks, reading only as many chunks as it needs to"""
+
+    def __init__(self, chunks: typing.Iterable[bytes], key: str):
+        self._key = key
+        self._array_start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._decoder = json.JSONDecoder()
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._position = -1
+        self._exhausted = False
+
+    def _read_more(self) -> bool:
+        """Appends the next chunk to the buffer, returning False if there are no more"""
+        if self._exhausted:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            self._buffer += self._utf8_decoder.decode(b"", final=True)
+            return True
+        # Drop what has already been decoded so the buffer only ever holds about one item plus one chunk
+        if self._position > 0:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        self._buffer += self._utf8_decoder.decode(chunk)
+        return True
+
+    def _find_array(self):
+        while self._position < 0:
+            match = self._array_start.search(self._buffer)
+            if match is not None:
+                self._position = match.end()
+            elif not self._read_more():
+                raise ValueError(f"No {self._key} array found in the JSON document")
+
+    def _next_token(self) -> str:
+        """Skips whitespace and commas, returning the first character after them"""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _JSON_WHITESPACE + ",":
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read_more():
+                raise ValueError(f"Unterminated {self._key} array in the JSON document")
+
+    def _decode_item(self) -> typing.Any:
+        while True:
+            try:
+                item, self._position = self._decoder.raw_decode(self._buffer, self._position)
+                return item
+            except json.JSONDecodeError:
+                # Most likely an item split across chunks, unless there is nothing more to read
+                if not self._read_more():
+                    raise
+
+    def items(self) -> typing.Iterator[typing.Any]:
+        self._find_array()
+        while self._next_token() != "]":
+            yield self._decode_item()
+
+
+def iter_json_array_items(chunks: typing.Iterable[bytes], key: str) -> typing.Iterator[typing.Any]:
+    """
+    Incrementally decodes the items of the first array under key in a UTF-8 JSON document, e.g. the docs of a solr
+    response, without holding the whole response in memory.  Items are expected to be objects or arrays, and anything
+    after the array is ignored.
+    """
+    return _JsonArrayItemReader(chunks, key).items()
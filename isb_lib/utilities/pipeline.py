@@ -0,0 +1,192 @@
+import collections
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+import typing
+
+# Marks the end of a prefetched stream
+_END_OF_STREAM = object()
+
+
+class PipelineStats:
+    """Thread-safe item counters and queue depths for the stages of a pipeline, used to spot the bottleneck stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._counts: typing.Dict[str, int] = collections.OrderedDict()
+        self._queue_depths: typing.Dict[str, typing.Callable[[], int]] = {}
+
+    def increment(self, stage: str, num_items: int = 1):
+        with self._lock:
+            self._counts[stage] = self._counts.get(stage, 0) + num_items
+
+    def register_queue(self, stage: str, depth_function: typing.Callable[[], int]):
+        with self._lock:
+            self._counts.setdefault(stage, 0)
+            self._queue_depths[stage] = depth_function
+
+    def count(self, stage: str) -> int:
+        with self._lock:
+            return self._counts.get(stage, 0)
+
+    def rate(self, stage: str) -> float:
+        elapsed = time.time() - self._start
+        return self.count(stage) / elapsed if elapsed > 0 else 0.0
+
+    def queue_depth(self, stage: str) -> typing.Optional[int]:
+        depth_function = self._queue_depths.get(stage)
+        return depth_function() if depth_function is not None else None
+
+    def summary(self) -> str:
+        with self._lock:
+            stages = list(self._counts.keys())
+        stage_summaries = []
+        for stage in stages:
+            stage_summary = f"{stage}: {self.count(stage)} ({self.rate(stage):.1f}/sec"
+            depth = self.queue_depth(stage)
+            if depth is not None:
+                stage_summary += f", queue depth {depth}"
+            stage_summaries.append(stage_summary + ")")
+        return ", ".join(stage_summaries)
+
+
+class PrefetchIterator:
+    """
+    Iterates a source iterable on a background thread, keeping at most max_size items buffered ahead of the consumer.
+
+    Exceptions raised by the source are re-raised in the consuming thread.  Call close() if the consumer stops early
+    so the background thread doesn't stay blocked on a full queue.  Sources with a close method, like generators, are
+    closed on the background thread once it's done with them.
+    """
+
+    def __init__(
+        self,
+        iterable: typing.Iterable,
+        max_size: int,
+        stage: str = "prefetch",
+        stats: typing.Optional[PipelineStats] = None,
+    ):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._stage = stage
+        self._stats = stats
+        if stats is not None:
+            stats.register_queue(stage, self._queue.qsize)
+        self._thread = threading.Thread(target=self._produce, args=(iterable,), name=stage, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, iterable: typing.Iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    return
+                if self._stats is not None:
+                    self._stats.increment(self._stage)
+            self._put(_END_OF_STREAM)
+        except Exception as e:
+            self._put(e)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if item is _END_OF_STREAM:
+            self._queue.put(_END_OF_STREAM)
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class ConcurrentBatchSender:
+    """
+    Sends batches with send_function on a pool of threads, with at most max_in_flight concurrent sends.
+
+    submit() blocks once max_queued batches are waiting or in flight, which applies backpressure to the producer.
+    The first failed send is re-raised from the next call to submit() or close().
+    """
+
+    def __init__(
+        self,
+        send_function: typing.Callable[[list], typing.Any],
+        max_in_flight: int,
+        max_queued: typing.Optional[int] = None,
+        stage: str = "send",
+        stats: typing.Optional[PipelineStats] = None,
+    ):
+        self._send_function = send_function
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=stage)
+        self._slots = threading.BoundedSemaphore(max_queued or max_in_flight * 2)
+        self._futures: typing.Set[concurrent.futures.Future] = set()
+        self._lock = threading.Lock()
+        self._stage = stage
+        self._stats = stats
+        if stats is not None:
+            stats.register_queue(stage, self.pending)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._futures)
+
+    def _raise_failures(self):
+        with self._lock:
+            done = [future for future in self._futures if future.done()]
+        for future in done:
+            with self._lock:
+                self._futures.discard(future)
+            future.result()
+
+    def _on_done(self, future: concurrent.futures.Future, batch_size: int):
+        self._slots.release()
+        if self._stats is not None and future.exception() is None:
+            self._stats.increment(self._stage, batch_size)
+
+    def submit(self, batch: list):
+        self._raise_failures()
+        self._slots.acquire()
+        future = self._executor.submit(self._send_function, batch)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._on_done(f, len(batch)))
+
+    def close(self):
+        """Waits for all outstanding sends to complete and re-raises the first failure, if any."""
+        try:
+            with self._lock:
+                futures = list(self._futures)
+            concurrent.futures.wait(futures)
+            self._raise_failures()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Already failing, so just let in-flight sends finish without masking the original exception
+            self._executor.shutdown(wait=True)
+            logging.debug("Shut down %s sender after error %s", self._stage, exc_val)
@@ -1,3 +1,4 @@
+import datetime
 from typing import Optional
 
 from pydantic import BaseModel
@@ -13,6 +14,23 @@ class ThingsSitemapParams(BaseModel):
     identifiers: list[str]
 
 
+class ThingChangeEntry(BaseModel):
+    # The sequence number of the Thing's latest change, usable as its version
+    sequence: int
+    id: str
+    authority_id: Optional[str]
+    tstamp: datetime.datetime
+    deleted: bool
+
+
+class ThingChangeFeed(BaseModel):
+    since: int
+    # Pass as since to fetch the next page
+    next: int
+    max_sequence: int
+    changes: list[ThingChangeEntry] = []
+
+
 class ReliqueryResponse(BaseModel):
     timestamp: str
     url: str
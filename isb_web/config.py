@@ -18,6 +18,36 @@ class Settings(BaseSettings):
     # e.g. http://localhost:8983/solr/isb_core_records/
     solr_url: str = "UNSET"
 
+    # Seconds the web app waits to connect to solr, and for solr to send more of a response
+    solr_connect_timeout: float = 5.0
+    solr_read_timeout: float = 60.0
+
+    # Size of the web app's solr connection pool, and how many seconds idle connections are kept alive
+    solr_max_connections: int = 100
+    solr_keepalive_timeout: float = 30.0
+
+    # Number of solr heatmaps the web app caches, and for how many seconds
+    heatmap_cache_max_entries: int = 256
+    heatmap_cache_ttl: float = 3600.0
+
+    # Seconds between checks of the solr index version, cached heatmaps are dropped when it changes
+    heatmap_cache_index_check_interval: float = 10.0
+
+    # Optional directory for a heatmap cache shared by all the web app processes
+    heatmap_cache_directory: str = "UNSET"
+
+    # Vector tiles from this zoom have the Things themselves as points, unless there are more than tile_max_points in
+    # the tile.  Below it they have the counts of Things per cell.
+    tile_point_min_zoom: int = 12
+    tile_max_points: int = 10000
+
+    # Number of vector tiles the web app caches, and for how many seconds
+    tile_cache_max_entries: int = 4096
+    tile_cache_ttl: float = 3600.0
+
+    # Seconds clients may cache vector tiles for
+    tile_max_age: int = 300
+
     thing_url_path: str = "thing"
 
     stac_item_url_path: str = "stac_item"
@@ -2,6 +2,8 @@ import requests
 import logging
 from typing import Optional
 
+from isb_web.solr_client import AsyncSolrClient
+
 
 def getLogger():
     return logging.getLogger("isb_web")
@@ -35,8 +37,7 @@ def escapeSolrQueryTerm(term):
     return term
 
 
-def getRelationsSolr(
-    rsession: requests.Session,
+def _relationsSolrParams(
     s: Optional[str] = None,
     p: Optional[str] = None,
     o: Optional[str] = None,
@@ -44,8 +45,7 @@ def getRelationsSolr(
     name: Optional[str] = None,
     offset: int = 0,
     limit: int = 1000,
-    url: str = "http://localhost:8983/solr/isb_rel/",
-):
+) -> dict:
     q = []
     if s is not None:
         q.append(f"s:{escapeSolrQueryTerm(s)}")
@@ -59,25 +59,68 @@ def getRelationsSolr(
         q.append(f"name:{escapeSolrQueryTerm(name)}")
     if len(q) == 0:
         q.append("*:*")
-    headers = {"Accept": "application/json"}
-    params: dict = {
+    return {
         "q": " AND ".join(q),
         "wt": "json",
         "rows": limit,
         "start": offset,
     }
+
+
+def getRelationsSolr(
+    rsession: requests.Session,
+    s: Optional[str] = None,
+    p: Optional[str] = None,
+    o: Optional[str] = None,
+    source: Optional[str] = None,
+    name: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 1000,
+    url: str = "http://localhost:8983/solr/isb_rel/",
+):
+    headers = {"Accept": "application/json"}
+    params = _relationsSolrParams(s, p, o, source, name, offset, limit)
     _url = f"{url}select"
     res = rsession.get(_url, headers=headers, params=params).json()
     return res.get("response", {}).get("docs", [])
 
 
+async def getRelationsSolrAsync(
+    client: AsyncSolrClient,
+    s: Optional[str] = None,
+    p: Optional[str] = None,
+    o: Optional[str] = None,
+    source: Optional[str] = None,
+    name: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 1000,
+    url: str = "http://localhost:8983/solr/isb_rel/",
+):
+    params = _relationsSolrParams(s, p, o, source, name, offset, limit)
+    _, res = await client.get_json(f"{url}select", params=params)
+    return (res or {}).get("response", {}).get("docs", [])
+
+
+_PREDICATE_COUNTS_PARAMS = {"q": "*:*", "rows": "0", "facet": "true", "facet.field": "p"}
+
+
 def getPredicateCountsSolr(
     rsession: requests.Session, url="http://localhost:8983/solr/isb_rel/"
 ):
-    params = {"q": "*:*", "rows": "0", "facet": "true", "facet.field": "p"}
     headers = {"Accept": "application/json"}
     _url = f"{url}select"
-    res = rsession.get(_url, headers=headers, params=params).json()
+    res = rsession.get(_url, headers=headers, params=_PREDICATE_COUNTS_PARAMS).json()
+    return _predicateCounts(res)
+
+
+async def getPredicateCountsSolrAsync(
+    client: AsyncSolrClient, url="http://localhost:8983/solr/isb_rel/"
+):
+    _, res = await client.get_json(f"{url}select", params=_PREDICATE_COUNTS_PARAMS)
+    return _predicateCounts(res or {})
+
+
+def _predicateCounts(res: dict) -> list:
     fc = res.get("facet_counts", {}).get("facet_fields", {}).get("p", [])
     result = []
     for i in range(0, len(fc), 2):
@@ -9,6 +9,7 @@ from isamples_metadata.GEOMETransformer import GEOMETransformer
 from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
 
 from isamples_metadata.metadata_exceptions import MetadataException
+from isb_web import isb_solr_query, vector_tiles
 from isb_web.api_types import DebugTransformParams
 from isb_web.isb_enums import ISBAuthority, ISBReturnField
 
@@ -54,3 +55,15 @@ def debug_transform(params: DebugTransformParams) -> Any:
         }
     else:
         return transformed
+
+
+@debug_api.get("/heatmap_cache")
+def heatmap_cache_stats() -> Any:
+    """Hit, miss and coalesced request counts of the heatmap cache, and the number of heatmaps it holds"""
+    return isb_solr_query.get_heatmap_cache().stats()
+
+
+@debug_api.get("/tile_cache")
+def tile_cache_stats() -> Any:
+    """Hit, miss and coalesced request counts of the vector tile cache, and the number of tiles it holds"""
+    return vector_tiles.get_tile_cache().stats()
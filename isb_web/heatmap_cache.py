@@ -0,0 +1,272 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+from typing import Optional
+
+L = logging.getLogger("ISB_HEATMAP_CACHE")
+
+# The sentinel index version used when solr's can't be determined
+UNKNOWN_INDEX_VERSION = "unknown"
+
+T = typing.TypeVar("T")
+
+# Directory cache entries are named for the hash of their key
+_ENTRY_SUFFIX = ".entry"
+
+
+def heatmap_cache_key(params: typing.Mapping, index_version: typing.Any = UNKNOWN_INDEX_VERSION) -> str:
+    """
+    The cache key for a set of solr request parameters (e.g. for a heatmap).  Parameter order and surrounding
+    whitespace don't matter, and empty parameters are the same as missing ones.
+    """
+    normalized = {}
+    for key, value in params.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        normalized[key] = value
+    return json.dumps([str(index_version), normalized], sort_keys=True, default=str)
+
+
+def _retrieve_exception(task: asyncio.Future):
+    # Every waiter may have gone away, in which case nobody else would
+    if not task.cancelled():
+        task.exception()
+
+
+def _json_dumps(value: typing.Any) -> bytes:
+    return json.dumps(value).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> typing.Any:
+    return json.loads(data)
+
+
+class ResponseCache(typing.Generic[T]):
+    """
+    A bounded LRU cache of responses computed from solr (e.g. heatmap facets or vector tiles), keyed on the
+    normalized request parameters.
+
+    Entries expire after ttl seconds, and all of them are dropped when solr's index version changes (i.e. after a
+    commit), which is checked at most every index_check_interval seconds.  Concurrent requests for the same response
+    wait for a single fetch rather than each sending their own.  Optionally, entries are also written to a directory
+    that several web app processes can share, serialized with dumps and read back with loads.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        directory: Optional[str] = None,
+        index_version: Optional[typing.Callable[[], typing.Awaitable[typing.Any]]] = None,
+        index_check_interval: float = 10.0,
+        dumps: Optional[typing.Callable[[T], bytes]] = None,
+        loads: Optional[typing.Callable[[bytes], T]] = None,
+    ):
+        """
+        Args:
+            max_entries: Number of responses held in memory, the least recently used are evicted past it
+            ttl: Seconds a response is served from the cache
+            directory: Optional directory for a cache shared between processes, which needs dumps and loads
+            index_version: Coroutine function returning solr's current index version, None to rely on ttl alone
+            index_check_interval: Seconds between index version checks
+            dumps: Serializes a response for the directory
+            loads: Deserializes a response from the directory
+        """
+        if directory is not None and (dumps is None or loads is None):
+            raise ValueError("A directory cache needs dumps and loads to serialize the responses")
+        self._dumps = dumps
+        self._loads = loads
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._directory = directory
+        self._index_version = index_version
+        self._index_check_interval = index_check_interval
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._in_flight: typing.Dict[str, "asyncio.Future[T]"] = {}
+        self._current_index_version: typing.Any = UNKNOWN_INDEX_VERSION
+        self._next_index_check = 0.0
+        self._index_check: Optional[asyncio.Future] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "index_version": self._current_index_version,
+        }
+
+    def clear(self):
+        """Drops all the cached responses, in memory and on disk"""
+        self._entries.clear()
+        if self._directory is not None:
+            for filename in os.listdir(self._directory):
+                if filename.endswith(_ENTRY_SUFFIX):
+                    os.remove(os.path.join(self._directory, filename))
+
+    async def get(self, params: typing.Mapping, fetch: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        """
+        Returns the cached response for params, or the one fetch returns, caching it.  The returned response is
+        shared with other callers, so it must not be modified.
+        """
+        await self._check_index_version()
+        key = heatmap_cache_key(params, self._current_index_version)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, response = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._entries[key]
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # A task of its own rather than part of this call, so that this caller going away (e.g. the client
+            # disconnecting) doesn't cancel the request for the others waiting on it
+            task = asyncio.ensure_future(self._load(key, fetch))
+            task.add_done_callback(_retrieve_exception)
+            self._in_flight[key] = task
+        # Shielded so one waiter going away doesn't cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, fetch: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        try:
+            response = await self._read_disk(key)
+            if response is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                response = await fetch()
+                await self._write_disk(key, response)
+            self._put(key, response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    def _put(self, key: str, response: T):
+        self._entries[key] = (time.monotonic() + self._ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def _check_index_version(self):
+        if self._index_version is None:
+            return
+        # Requests arriving during a check wait for it, so they don't go on to use the old version's keys
+        if self._index_check is None:
+            if time.monotonic() < self._next_index_check:
+                return
+            self._next_index_check = time.monotonic() + self._index_check_interval
+            self._index_check = asyncio.ensure_future(self._update_index_version())
+        index_check = self._index_check
+        try:
+            await asyncio.shield(index_check)
+        finally:
+            if index_check.done() and self._index_check is index_check:
+                self._index_check = None
+
+    async def _update_index_version(self):
+        try:
+            index_version = await self._index_version()
+        except Exception as e:
+            L.warning("Unable to check the solr index version, keeping cached responses: %s", e)
+            return
+        if index_version is None or index_version == self._current_index_version:
+            return
+        if self._current_index_version != UNKNOWN_INDEX_VERSION:
+            L.info("Solr index version changed to %s, dropping cached responses", index_version)
+            self.invalidations += 1
+        # Disk entries are keyed on the version so they won't be read again, just tidy up the expired ones
+        self._entries.clear()
+        self._current_index_version = index_version
+        if self._directory is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._prune_disk, self._directory)
+
+    @staticmethod
+    def _path(directory: str, key: str) -> str:
+        return os.path.join(directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}{_ENTRY_SUFFIX}")
+
+    async def _read_disk(self, key: str) -> Optional[T]:
+        if self._directory is None or self._loads is None:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._read_file, self._directory, self._loads, key
+        )
+
+    def _read_file(self, directory: str, loads: typing.Callable[[bytes], T], key: str) -> Optional[T]:
+        path = self._path(directory, key)
+        try:
+            with open(path, "rb") as cache_file:
+                # A line of JSON with the entry's key and expiry, then the serialized response
+                header = json.loads(cache_file.readline())
+                if header.get("key") != key or header.get("expires", 0) <= time.time():
+                    return None
+                return loads(cache_file.read())
+        except (OSError, ValueError):
+            return None
+
+    def _prune_disk(self, directory: str):
+        oldest = time.time() - self._ttl
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            except OSError:
+                # Another process got to it first
+                pass
+
+    async def _write_disk(self, key: str, response: T):
+        if self._directory is None or self._dumps is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._write_file, self._directory, self._dumps, key, response
+        )
+
+    def _write_file(self, directory: str, dumps: typing.Callable[[T], bytes], key: str, response: T):
+        path = self._path(directory, key)
+        # Write and rename so other processes never read a partially written entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as cache_file:
+                cache_file.write(json.dumps({"key": key, "expires": time.time() + self._ttl}).encode("utf-8"))
+                cache_file.write(b"\n")
+                cache_file.write(dumps(response))
+            os.replace(temp_path, path)
+        except OSError as e:
+            L.warning("Unable to write response cache entry %s: %s", path, e)
+
+
+class HeatmapCache(ResponseCache[typing.Dict]):
+    """A ResponseCache of solr heatmap facets, written to the directory (if any) as JSON"""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        directory: Optional[str] = None,
+        index_version: Optional[typing.Callable[[], typing.Awaitable[typing.Any]]] = None,
+        index_check_interval: float = 10.0,
+    ):
+        super().__init__(
+            max_entries, ttl, directory, index_version, index_check_interval, dumps=_json_dumps, loads=_json_loads
+        )
@@ -36,3 +36,10 @@ class ISBReturnField(_NoValue):
 
     def dictionary_key(self) -> str:
         return f"has{self.value.capitalize()}Category"
+
+
+class ISBTileAggregation(_NoValue):
+    """How vector tiles aggregate Things at zooms too low for points"""
+
+    H3 = "h3"
+    HEATMAP = "heatmap"
@@ -1,3 +1,5 @@
+import asyncio
+import math
 import typing
 from typing import Optional, Tuple, Mapping
 
@@ -7,11 +9,14 @@ import fastapi
 import logging
 import urllib.parse
 import isb_web.config
+from isb_lib.utilities import json_streaming
+from isb_web import heatmap_cache, heatmap_grid, solr_client
 
 BASE_URL = isb_web.config.Settings().solr_url
 _RPT_FIELD = "producedBy_samplingSite_location_rpt"
 LONGITUDE_FIELD = "producedBy_samplingSite_location_longitude"
 LATITUDE_FIELD = "producedBy_samplingSite_location_latitude"
+LOCATION_FIELD = "producedBy_samplingSite_location_ll"
 
 DEFAULT_COLLECTION_NAME = "isb_core_records"
 
@@ -86,54 +91,214 @@ def get_solr_url(path_component: str):
     return urllib.parse.urljoin(BASE_URL, path_component)
 
 
-def _get_heatmap(
+_BB_DECIMALS = 6
+
+
+def heatmap_longitude_ranges(min_lon: float, max_lon: float) -> Tuple[typing.List[Tuple[float, float]], float]:
+    """
+    The longitude ranges within -180 to 180 that cover min_lon east to max_lon, and the multiple of 360 to add to
+    them to get back to the requested longitudes.
+
+    Maps panned across the antimeridian ask for e.g. 170 to 190, or 170 to -170 once wrapped, which is the two ranges
+    170 to 180 and -180 to -170.
+    """
+    span = max_lon - min_lon
+    if span < 0:
+        span += 360.0
+    if span >= 360.0:
+        return [(-180.0, 180.0)], 0.0
+    west = (min_lon + 180.0) % 360.0 - 180.0
+    east = west + span
+    offset = round((min_lon - west) / 360.0) * 360.0
+    if east <= 180.0:
+        return [(west, east)], offset
+    return [(west, 180.0), (-180.0, east - 360.0)], offset
+
+
+def _distance_degrees(lon_1: float, lat_1: float, lon_2: float, lat_2: float) -> float:
+    # Great circle distance in degrees, like solr's geo distance calculator
+    lat_1, lat_2 = math.radians(lat_1), math.radians(lat_2)
+    d_lon = math.radians(lon_2 - lon_1)
+    h = math.sin((lat_2 - lat_1) / 2.0) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin(d_lon / 2.0) ** 2
+    return math.degrees(2.0 * math.asin(min(1.0, math.sqrt(h))))
+
+
+def _heatmap_dist_err(west: float, east: float, min_lat: float, max_lat: float, dist_err_pct: float) -> float:
+    """
+    The facet.heatmap.distErr solr would derive from dist_err_pct for the whole of the region, east may be past 180.
+    Solr takes dist_err_pct of the distance from the centre to the nearest eastern corner.
+    """
+    centre_lon = (west + east) / 2.0
+    centre_lat = (min_lat + max_lat) / 2.0
+    corner_lat = max_lat if centre_lat >= 0 else min_lat
+    return _distance_degrees(centre_lon, centre_lat, east, corner_lat) * dist_err_pct
+
+
+def _heatmap_params(
     q: str,
-    bb: typing.Dict,
-    dist_err_pct: float,
+    geom: str,
     fq: str = "",
     grid_level=None,
+    dist_err_pct: Optional[float] = None,
+    dist_err: Optional[float] = None,
 ) -> typing.Dict:
-    # TODO: dealing with the antimeridian ("dateline") in the Solr request.
-    # Should probably do this by computing two requests when the request BB
-    # straddles the antimeridian.
-    if bb is None or len(bb) < 2:
-        bb = {MIN_LAT: -90.0, MAX_LAT: 90.0, MIN_LON: -180.0, MAX_LON: 180.0}
-    bb[MIN_LAT] = clip_float(bb[MIN_LAT], -90.0, 90.0)
-    bb[MAX_LAT] = clip_float(bb[MAX_LAT], -90.0, 90.0)
-    bb[MIN_LON] = clip_float(bb[MIN_LON], -180.0, 180.0)
-    bb[MAX_LON] = clip_float(bb[MAX_LON], -180.0, 180.0)
-    # logging.warning(bb)
-    headers = {"Accept": "application/json"}
     params: dict = {
         "q": q,
         "rows": 0,
         "wt": "json",
         "facet": "true",
         "facet.heatmap": _RPT_FIELD,
-        "facet.heatmap.distErrPct": dist_err_pct,
-        # "facet.heatmap.gridLevel": grid_level,
-        "facet.heatmap.geom": (
-            f"[{bb[MIN_LON]} {bb[MIN_LAT]}" f"TO {bb[MAX_LON]} {bb[MAX_LAT]}]"
-        ),
+        "facet.heatmap.geom": geom,
     }
+    if dist_err is not None:
+        params["facet.heatmap.distErr"] = dist_err
+    else:
+        params["facet.heatmap.distErrPct"] = dist_err_pct
     if fq is not None:
         params["fq"] = fq
     # if grid level is None, then Solr calculates an "appropriate" grid scale
     # based on the bounding box and distErrPct. Seems a bit off...
     if grid_level is not None:
         params["facet.heatmap.gridLevel"] = grid_level
-    # Get the solr heatmap for the provided bounds
-    url = get_solr_url("select")
-    response = requests.get(url, headers=headers, params=params)
+    return params
+
+
+def _heatmap_requests(
+    q: str,
+    bb: typing.Dict,
+    dist_err_pct: float,
+    fq: str = "",
+    grid_level=None,
+) -> Tuple[typing.List[typing.Dict], float]:
+    """
+    The params of the solr heatmap requests covering bb, and the longitude offset of their heatmaps, as returned by
+    heatmap_longitude_ranges.  Bounds crossing the antimeridian are split in two, at the same grid level so their
+    heatmaps can be joined.
+    """
+    if bb is None or len(bb) < 2:
+        bb = {MIN_LAT: -90.0, MAX_LAT: 90.0, MIN_LON: -180.0, MAX_LON: 180.0}
+    # Rounded to about 10cm, so that requests for practically the same bounds share cached heatmaps
+    bb[MIN_LAT] = round(clip_float(bb[MIN_LAT], -90.0, 90.0), _BB_DECIMALS)
+    bb[MAX_LAT] = round(clip_float(bb[MAX_LAT], -90.0, 90.0), _BB_DECIMALS)
+    bb[MIN_LON] = round(bb[MIN_LON], _BB_DECIMALS)
+    bb[MAX_LON] = round(bb[MAX_LON], _BB_DECIMALS)
+    # logging.warning(bb)
+    ranges, offset = heatmap_longitude_ranges(bb[MIN_LON], bb[MAX_LON])
+    ranges = [(round(west, _BB_DECIMALS), round(east, _BB_DECIMALS)) for west, east in ranges]
+    dist_err = None
+    if len(ranges) > 1:
+        # Left to itself, solr would pick a finer grid for the smaller of the two
+        west, east = ranges[0][0], ranges[-1][1] + 360.0
+        dist_err = round(_heatmap_dist_err(west, east, bb[MIN_LAT], bb[MAX_LAT], dist_err_pct), _BB_DECIMALS)
+    requests_params = [
+        _heatmap_params(
+            q,
+            f"[{west} {bb[MIN_LAT]} TO {east} {bb[MAX_LAT]}]",
+            fq=fq,
+            grid_level=grid_level,
+            dist_err_pct=dist_err_pct,
+            dist_err=dist_err,
+        )
+        for west, east in ranges
+    ]
+    return requests_params, offset
 
-    # logging.debug("Got: %s", response.url)
-    res = response.json()
+
+def _heatmap_from_response(res: typing.Dict) -> typing.Dict:
     total_matching = res.get("response", {}).get("numFound", 0)
     hm = res.get("facet_counts", {}).get("facet_heatmaps", {}).get(_RPT_FIELD, {})
     hm["numDocs"] = total_matching
     return hm
 
 
+def _get_heatmap(
+    q: str,
+    bb: typing.Dict,
+    dist_err_pct: float,
+    fq: str = "",
+    grid_level=None,
+) -> typing.Dict:
+    requests_params, offset = _heatmap_requests(q, bb, dist_err_pct, fq, grid_level)
+    # Get the solr heatmap for the provided bounds
+    url = get_solr_url("select")
+    headers = {"Accept": "application/json"}
+    heatmaps = []
+    for params in requests_params:
+        response = requests.get(url, headers=headers, params=params)
+        # logging.debug("Got: %s", response.url)
+        heatmaps.append(_heatmap_from_response(response.json()))
+    return heatmap_grid.join_heatmaps(heatmaps, offset)
+
+
+async def _async_get_heatmap(
+    q: str,
+    bb: typing.Dict,
+    dist_err_pct: float,
+    fq: str = "",
+    grid_level=None,
+) -> typing.Dict:
+    requests_params, offset = _heatmap_requests(q, bb, dist_err_pct, fq, grid_level)
+    # Either side of the antimeridian are requested at the same time
+    heatmaps = await asyncio.gather(*[_async_get_cached_heatmap(params) for params in requests_params])
+    return heatmap_grid.join_heatmaps(heatmaps, offset)
+
+
+async def _async_get_cached_heatmap(params: typing.Dict) -> typing.Dict:
+    async def fetch() -> typing.Dict:
+        client = solr_client.get_async_solr_client()
+        status, res = await client.get_json(get_solr_url("select"), params=params)
+        if status != 200 or res is None:
+            # Don't cache a failed request as an empty heatmap
+            raise fastapi.HTTPException(status_code=status, detail="Unable to retrieve solr heatmap")
+        return _heatmap_from_response(res)
+
+    # Shared with other requests, which is fine as the heatmap functions only read it
+    return await get_heatmap_cache().get(params, fetch)
+
+
+_INDEX_VERSION_PARAMS: typing.Dict[str, typing.Any] = {"show": "index", "numTerms": 0, "wt": "json"}
+
+
+async def async_solr_index_version() -> typing.Optional[int]:
+    """The version of the solr index, which changes with every commit"""
+    client = solr_client.get_async_solr_client()
+    _, res = await client.get_json(get_solr_url("admin/luke"), params=_INDEX_VERSION_PARAMS)
+    if res is None:
+        return None
+    return res.get("index", {}).get("version")
+
+
+def solr_index_version() -> typing.Optional[int]:
+    """The version of the solr index, see async_solr_index_version.  None if solr doesn't say."""
+    headers = {"Accept": "application/json"}
+    try:
+        response = requests.get(get_solr_url("admin/luke"), headers=headers, params=_INDEX_VERSION_PARAMS)
+        response.raise_for_status()
+        return response.json().get("index", {}).get("version")
+    except (requests.RequestException, ValueError) as e:
+        L.warning("Unable to retrieve the solr index version: %s", e)
+        return None
+
+
+_heatmap_cache: Optional[heatmap_cache.HeatmapCache] = None
+
+
+def get_heatmap_cache() -> heatmap_cache.HeatmapCache:
+    """The web app's heatmap cache, created from the settings on first use"""
+    global _heatmap_cache
+    if _heatmap_cache is None:
+        settings = isb_web.config.Settings()
+        directory = settings.heatmap_cache_directory
+        _heatmap_cache = heatmap_cache.HeatmapCache(
+            max_entries=settings.heatmap_cache_max_entries,
+            ttl=settings.heatmap_cache_ttl,
+            directory=None if directory == "UNSET" else directory,
+            index_version=async_solr_index_version,
+            index_check_interval=settings.heatmap_cache_index_check_interval,
+        )
+    return _heatmap_cache
+
+
 ##
 # Create a GeoJSON rendering of the Solr Heatmap response.
 # Generates a GeoJSON polygon (rectangle) feature for each Solr heatmap cell
@@ -144,19 +309,27 @@ def solr_geojson_heatmap(
     q, bb, fq=None, grid_level=None, show_bounds=False, show_solr_bounds=False
 ):
     hm = _get_heatmap(q, bb, _GEOJSON_ERR_PCT, fq=fq, grid_level=grid_level)
-    # print(hm)
-    gl = hm.get("gridLevel", -1)
-    # logging.warning(hm)
-    d_lat = hm["maxY"] - hm["minY"]
-    dd_lat = d_lat / (hm["rows"])
-    d_lon = hm["maxX"] - hm["minX"]
-    dd_lon = d_lon / (hm["columns"])
-    lat_0 = hm["maxY"]  # - dd_lat
-    lon_0 = hm["minX"]  # + dd_lon
-    _max_value = 0
+    return _geojson_heatmap(hm, bb, show_bounds, show_solr_bounds)
+
+
+async def async_solr_geojson_heatmap(
+    q, bb, fq=None, grid_level=None, show_bounds=False, show_solr_bounds=False
+):
+    hm = await _async_get_heatmap(q, bb, _GEOJSON_ERR_PCT, fq=fq, grid_level=grid_level)
+    return _geojson_heatmap(hm, bb, show_bounds, show_solr_bounds)
+
+
+async def async_solr_geojson_heatmap_bytes(
+    q, bb, fq=None, grid_level=None, show_bounds=False, show_solr_bounds=False
+) -> bytes:
+    """The same as async_solr_geojson_heatmap, already serialized, which is much quicker for large grids"""
+    hm = await _async_get_heatmap(q, bb, _GEOJSON_ERR_PCT, fq=fq, grid_level=grid_level)
+    return _geojson_heatmap_bytes(hm, bb, show_bounds, show_solr_bounds)
 
+
+def _geojson_bounds_features(hm, bb, show_bounds, show_solr_bounds) -> list:
     # Container for the generated geojson features
-    grid = []
+    features = []
     if show_bounds:
         bbox = geojson.Feature(
             geometry=geojson.Polygon(
@@ -187,7 +360,7 @@ def solr_geojson_heatmap(
             ),
             properties={"count": LEAFLET_BOUNDS},
         )
-        grid.append(bbox)
+        features.append(bbox)
     if show_solr_bounds:
         bbox = geojson.Feature(
             geometry=geojson.Polygon(
@@ -218,58 +391,20 @@ def solr_geojson_heatmap(
             ),
             properties={"count": SOLR_BOUNDS},
         )
-        grid.append(bbox)
-
-    # Process the Solr heatmap response. Draw a box for each cell
-    # that has a count > 0 and set the "count" property of the
-    # feature to that value.
-    _total = 0
-    _count_matrix = hm.get("counts_ints2D", None)
-    if _count_matrix is not None:
-        for i_row in range(0, hm["rows"]):
-            for i_col in range(0, hm["columns"]):
-                if _count_matrix[i_row] is not None:
-                    v = _count_matrix[i_row][i_col]
-                    if v > 0:
-                        _total = _total + v
-                        if v > _max_value:
-                            _max_value = v
-                        p0lat = lat_0 - dd_lat * i_row
-                        p0lon = lon_0 + dd_lon * i_col
-                        pts = geojson.Polygon(
-                            [
-                                [
-                                    (
-                                        p0lon,
-                                        p0lat,
-                                    ),
-                                    (
-                                        p0lon + dd_lon,
-                                        p0lat,
-                                    ),
-                                    (
-                                        p0lon + dd_lon,
-                                        p0lat - dd_lat,
-                                    ),
-                                    (
-                                        p0lon,
-                                        p0lat - dd_lat,
-                                    ),
-                                    (
-                                        p0lon,
-                                        p0lat,
-                                    ),
-                                ]
-                            ]
-                        )
-                        feature = geojson.Feature(geometry=pts, properties={"count": v})
-                        grid.append(feature)
-    geodata = geojson.FeatureCollection(grid)
-    geodata["max_count"] = _max_value
-    geodata["grid_level"] = gl
-    geodata["total"] = _total
-    geodata["num_docs"] = hm.get("numDocs", 0)
-    return geodata
+        features.append(bbox)
+
+    return features
+
+
+def _geojson_heatmap(hm, bb, show_bounds, show_solr_bounds):
+    # Draws a box for each cell that has a count > 0, with the "count" property of the feature set to that value.
+    grid = heatmap_grid.HeatmapGrid(hm)
+    return grid.geojson(_geojson_bounds_features(hm, bb, show_bounds, show_solr_bounds))
+
+
+def _geojson_heatmap_bytes(hm, bb, show_bounds, show_solr_bounds) -> bytes:
+    grid = heatmap_grid.HeatmapGrid(hm)
+    return grid.geojson_bytes(_geojson_bounds_features(hm, bb, show_bounds, show_solr_bounds))
 
 
 # Generate a list of [latitude, longitude, value] from
@@ -279,51 +414,90 @@ def solr_geojson_heatmap(
 # Suitable for consumption by leaflet: https://leafletjs.com
 def solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
     hm = _get_heatmap(q, bb, _LEAFLET_ERR_PCT, fq=fq, grid_level=grid_level)
-    # logging.warning(hm)
-    d_lat = hm["maxY"] - hm["minY"]
-    dd_lat = d_lat / (hm["rows"])
-    d_lon = hm["maxX"] - hm["minX"]
-    dd_lon = d_lon / (hm["columns"])
-    lat_0 = hm["maxY"] - dd_lat / 2.0
-    lon_0 = hm["minX"] + dd_lon / 2.0
-    data = []
-    max_value = 0
-    _total = 0
-    for i_row in range(0, hm["rows"]):
-        for i_col in range(0, hm["columns"]):
-            if hm["counts_ints2D"][i_row] is not None:
-                v = hm["counts_ints2D"][i_row][i_col]
-                if v > 0:
-                    _total = _total + v
-                    lt = lat_0 - dd_lat * i_row
-                    lg = lon_0 + dd_lon * i_col
-                    data.append([lt, lg, v])
-                    if v > max_value:
-                        max_value = v
+    return _leaflet_heatmap(hm)
+
+
+async def async_solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
+    hm = await _async_get_heatmap(q, bb, _LEAFLET_ERR_PCT, fq=fq, grid_level=grid_level)
+    return _leaflet_heatmap(hm)
+
+
+def _leaflet_heatmap(hm):
     # return list of [lat, lon, count] and maximum count value
-    return {
-        "data": data,
-        "max_value": max_value,
-        "total": _total,
-        "num_docs": hm.get("numDocs", 0),
-    }
+    return heatmap_grid.HeatmapGrid(hm).leaflet()
 
 
-def solr_query(params, query=None):
-    """
-    Issue a request against the solr select endpoint.
+async def async_solr_heatmap_grid(
+    q, bb, fq=None, grid_level=None, dist_err_pct=_GEOJSON_ERR_PCT
+) -> heatmap_grid.HeatmapGrid:
+    hm = await _async_get_heatmap(q, bb, dist_err_pct, fq=fq, grid_level=grid_level)
+    return heatmap_grid.HeatmapGrid(hm)
 
-    Params is a list of [k, v] to support duplicate keys, which solr
-    uses a lot of.
 
-    Args:
-        params: list of list, see https://solr.apache.org/guide/8_9/common-query-parameters.html
+def bounds_filter_query(bounds: Tuple[float, float, float, float]) -> str:
+    """
+    A filter query for the records located within bounds, (west, south, east, north).  As with the heatmaps, bounds
+    may cross the antimeridian.
+    """
+    west, south, east, north = bounds
+    south = round(clip_float(south, -90.0, 90.0), _BB_DECIMALS)
+    north = round(clip_float(north, -90.0, 90.0), _BB_DECIMALS)
+    ranges, _ = heatmap_longitude_ranges(west, east)
+    return " OR ".join(
+        f"{LOCATION_FIELD}:[{south},{round(min_lon, _BB_DECIMALS)} TO {north},{round(max_lon, _BB_DECIMALS)}]"
+        for min_lon, max_lon in ranges
+    )
 
-    Returns:
-        Iterator for the solr response.
+
+async def async_solr_facet_counts(
+    q: str, field: str, bounds: Tuple[float, float, float, float], fq: Optional[str] = None
+) -> typing.Dict[str, int]:
+    """The number of records matching q and fq, located within bounds, with each value of field"""
+    params = [
+        ("q", q),
+        ("fq", bounds_filter_query(bounds)),
+        ("rows", 0),
+        ("wt", "json"),
+        ("facet", "true"),
+        ("facet.field", field),
+        ("facet.limit", -1),
+        ("facet.mincount", 1),
+        ("json.nl", "map"),
+    ]
+    if fq:
+        params.append(("fq", fq))
+    client = solr_client.get_async_solr_client()
+    status, res = await client.get_json(get_solr_url("select"), params=params)
+    if status != 200 or res is None:
+        raise fastapi.HTTPException(status_code=status, detail="Unable to retrieve solr facet counts")
+    return res.get("facet_counts", {}).get("facet_fields", {}).get(field, {})
+
+
+async def async_solr_points(
+    q: str, bounds: Tuple[float, float, float, float], fq: Optional[str] = None, rows: int = 10000
+) -> Tuple[int, typing.List[typing.Dict]]:
     """
-    url = get_solr_url("select")
-    headers = {"Accept": "application/json"}
+    The number of records matching q and fq located within bounds, and up to rows of them with their id, source, and
+    location as x and y.
+    """
+    params = [
+        ("q", q),
+        ("fq", bounds_filter_query(bounds)),
+        ("fl", f"id,source,x:{LONGITUDE_FIELD},y:{LATITUDE_FIELD}"),
+        ("rows", rows),
+        ("wt", "json"),
+    ]
+    if fq:
+        params.append(("fq", fq))
+    client = solr_client.get_async_solr_client()
+    status, res = await client.get_json(get_solr_url("select"), params=params)
+    if status != 200 or res is None:
+        raise fastapi.HTTPException(status_code=status, detail="Unable to retrieve solr records")
+    response = res.get("response", {})
+    return response.get("numFound", 0), response.get("docs", [])
+
+
+def _select_content_type(params) -> str:
     content_type = "application/json"
     wt_map = {
         "csv": "text/plain",
@@ -335,7 +509,25 @@ def solr_query(params, query=None):
     for k, v in params:
         if k == "wt":
             content_type = wt_map.get(v.lower(), "json")
+    return content_type
+
+
+def solr_query(params, query=None):
+    """
+    Issue a request against the solr select endpoint.
+
+    Params is a list of [k, v] to support duplicate keys, which solr
+    uses a lot of.
 
+    Args:
+        params: list of list, see https://solr.apache.org/guide/8_9/common-query-parameters.html
+
+    Returns:
+        Iterator for the solr response.
+    """
+    url = get_solr_url("select")
+    headers = {"Accept": "application/json"}
+    content_type = _select_content_type(params)
     if query is None:
         response = requests.get(url, headers=headers, params=params, stream=True)
     else:
@@ -347,6 +539,30 @@ def solr_query(params, query=None):
     )
 
 
+async def async_solr_query(params, query=None):
+    """
+    Issue a request against the solr select endpoint without blocking the event loop, see solr_query.
+
+    Returns:
+        StreamingResponse passing the solr response through as it arrives.
+    """
+    url = get_solr_url("select")
+    content_type = _select_content_type(params)
+    client = solr_client.get_async_solr_client()
+    if query is None:
+        return await client.stream("GET", url, content_type, params=params, chunk_size=2048)
+    return await client.stream("POST", url, content_type, params=params, json=query, chunk_size=2048)
+
+
+def _reliquery_params(query: str) -> Mapping:
+    return {
+        "q": query,
+        "rows": MAX_RELIQUERY_ROWS,
+        "wt": "json",
+        "fl": "id"
+    }
+
+
 def reliquery_solr_query(query: str) -> dict:
     """
     Returns the solr response from making the reliquery query
@@ -357,14 +573,31 @@ def reliquery_solr_query(query: str) -> dict:
     """
     url = get_solr_url("select")
     headers = {"Accept": "application/json"}
-    params: Mapping = {
-        "q": query,
-        "rows": MAX_RELIQUERY_ROWS,
+    response = requests.get(url, headers=headers, params=_reliquery_params(query))
+    return response.json()
+
+
+async def async_reliquery_solr_query(query: str) -> dict:
+    """The solr response from executing the reliquery query, see reliquery_solr_query"""
+    client = solr_client.get_async_solr_client()
+    _, res = await client.get_json(get_solr_url("select"), params=_reliquery_params(query))
+    return res or {}
+
+
+def _get_record_params(identifier) -> dict:
+    return {
         "wt": "json",
-        "fl": "id"
+        "q": f"id:{escape_solr_query_term(identifier)}",
+        "fl": "*",
+        "rows": 1,
+        "start": 0,
     }
-    response = requests.get(url, headers=headers, params=params)
-    return response.json()
+
+
+def _record_from_response(docs: dict):
+    if docs["response"]["numFound"] == 0:
+        return 404, None
+    return 200, docs["response"]["docs"][0]
 
 
 def solr_get_record(identifier):
@@ -379,25 +612,28 @@ def solr_get_record(identifier):
 
     Returns: status_code, object
     """
-    params = {
-        "wt": "json",
-        "q": f"id:{escape_solr_query_term(identifier)}",
-        "fl": "*",
-        "rows": 1,
-        "start": 0,
-    }
     url = get_solr_url("select")
     headers = {"Accept": "application/json"}
-    response = requests.get(url, headers=headers, params=params)
+    response = requests.get(url, headers=headers, params=_get_record_params(identifier))
     if response.status_code != 200:
         return response.status_code, None
-    docs = response.json()
-    if docs["response"]["numFound"] == 0:
-        return 404, None
-    return 200, docs["response"]["docs"][0]
+    return _record_from_response(response.json())
 
 
-def solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):  # noqa: C901
+async def async_solr_get_record(identifier):
+    """
+    Retrieve the solr document for the specified identifier without blocking the event loop, see solr_get_record.
+
+    Returns: status_code, object
+    """
+    client = solr_client.get_async_solr_client()
+    status, docs = await client.get_json(get_solr_url("select"), params=_get_record_params(identifier))
+    if status != 200:
+        return status, None
+    return _record_from_response(docs)
+
+
+def solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):
     """
     Requests a streaming search response from solr.
 
@@ -446,13 +682,39 @@ def solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):  # noqa: C901
     Returns:
         Stream of records from solr
     """
+    url = get_solr_url("stream")
+    headers = {"Accept": "application/json"}
+    # Post the request to solr
+    # The response is an open stream that is read in chunks to
+    # be passed on to the client as they are received
+    response = requests.post(
+        url, headers=headers, params={}, data=_search_stream_request(params, collection), stream=True
+    )
+    logging.info("Returning response")
+    return fastapi.responses.StreamingResponse(
+        response.iter_content(chunk_size=4096), media_type="application/json"
+    )
+
+
+async def async_solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):
+    """
+    Requests a streaming search response from solr without blocking the event loop, see solr_searchStream.
+
+    Returns:
+        Stream of records from solr
+    """
+    client = solr_client.get_async_solr_client()
+    return await client.stream(
+        "POST", get_solr_url("stream"), "application/json", data=_search_stream_request(params, collection)
+    )
+
+
+def _search_stream_request(params, collection) -> dict:  # noqa: C901
+    """The form posted to solr's stream handler for solr_searchStream"""
     # TODO: Test coverage, need to mock solr?
     # TODO: C901 -- need to examine computational complexity
 
     point_rollup = False
-    qparams = {}
-    url = get_solr_url("stream")
-    headers = {"Accept": "application/json"}
     selection_method = "search"
     _params = []
     for kv in params:
@@ -481,7 +743,6 @@ def solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):  # noqa: C901
         else:
             _params.append(f'{kv[0]}="{kv[1]}"')
     L.debug("_params = %s", _params)
-    content_type = "application/json"
     request = {
         "expr": f'{selection_method}({collection},{",".join(_params)},qt="/select")'
     }
@@ -493,16 +754,7 @@ def solr_searchStream(params, collection=DEFAULT_COLLECTION_NAME):  # noqa: C901
             )
         }
     L.info("Expression = %s", request["expr"])
-    # Post the request to solr
-    # The response is an open stream that is read in chunks to
-    # be passed on to the client as they are received
-    response = requests.post(
-        url, headers=headers, params=qparams, data=request, stream=True
-    )
-    logging.info("Returning response")
-    return fastapi.responses.StreamingResponse(
-        response.iter_content(chunk_size=4096), media_type=content_type
-    )
+    return request
 
 
 def solr_luke():
@@ -522,6 +774,24 @@ def solr_luke():
     )
 
 
+async def async_solr_luke():
+    """Information about the solr isb_core_records schema without blocking the event loop, see solr_luke"""
+    client = solr_client.get_async_solr_client()
+    return await client.stream(
+        "GET", get_solr_url("admin/luke"), "application/json", params={"show": "schema", "wt": "json"}, chunk_size=2048
+    )
+
+
+def _solr_records_query(authority_id: typing.Optional[str], additional_query: typing.Optional[str]) -> str:
+    if additional_query is not None:
+        if authority_id is not None:
+            return f"{additional_query} AND source:{authority_id}"
+        return additional_query
+    elif authority_id is None:
+        return "*:*"
+    return f"source:{authority_id}"
+
+
 def _fetch_solr_records(
     rsession=requests.session(),
     authority_id: typing.Optional[str] = None,
@@ -532,15 +802,7 @@ def _fetch_solr_records(
     additional_query: typing.Optional[str] = None,
 ):
     headers = {"Content-Type": "application/json"}
-    if additional_query is not None:
-        if authority_id is not None:
-            query = f"{additional_query} AND source:{authority_id}"
-        else:
-            query = additional_query
-    elif authority_id is None:
-        query = "*:*"
-    else:
-        query = f"source:{authority_id}"
+    query = _solr_records_query(authority_id, additional_query)
     params = {
         "q": query,
         "rows": batch_size,
@@ -559,6 +821,84 @@ def _fetch_solr_records(
     return docs, has_next
 
 
+# Solr's uniqueKey, which a cursorMark sort has to end with so that every document has a distinct position
+SOLR_UNIQUE_KEY = "id"
+
+# The cursorMark that starts from the beginning of a sorted result set
+CURSOR_MARK_START = "*"
+
+
+def sort_with_unique_key(sort: typing.Optional[str]) -> str:
+    """Appends the uniqueKey tie-breaker that cursorMark paging requires, unless the sort already ends with it"""
+    if sort is None or len(sort.strip()) == 0:
+        return f"{SOLR_UNIQUE_KEY} asc"
+    last_clause = sort.split(",")[-1].split()
+    if len(last_clause) > 0 and last_clause[0] == SOLR_UNIQUE_KEY:
+        return sort
+    return f"{sort}, {SOLR_UNIQUE_KEY} asc"
+
+
+def _fetch_solr_records_with_cursor(
+    rsession=requests.session(),
+    authority_id: typing.Optional[str] = None,
+    cursor_mark: str = CURSOR_MARK_START,
+    batch_size: int = 50000,
+    field: typing.Optional[str] = None,
+    sort: typing.Optional[str] = None,
+    additional_query: typing.Optional[str] = None,
+) -> Tuple[list[dict], str]:
+    """
+    Keyset (cursorMark) equivalent of _fetch_solr_records.  Unlike start, a cursor costs the same no matter how deep
+    into the results it is.
+
+    Returns the docs and the cursorMark to pass for the next batch, which is equal to cursor_mark once the results
+    are exhausted.
+    """
+    headers = {"Content-Type": "application/json"}
+    params = {
+        "q": _solr_records_query(authority_id, additional_query),
+        "rows": batch_size,
+        "sort": sort_with_unique_key(sort),
+        "cursorMark": cursor_mark,
+    }
+    if field is not None:
+        params["fl"] = field
+    _url = get_solr_url("select")
+    res = rsession.get(_url, headers=headers, params=params)
+    res.raise_for_status()
+    json = res.json()
+    return json["response"]["docs"], json["nextCursorMark"]
+
+
+# Size of the chunks read from a streamed /export response
+_EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _export_solr_records(
+    rsession=requests.session(),
+    field: str = SOLR_UNIQUE_KEY,
+    sort: typing.Optional[str] = None,
+    query: typing.Optional[str] = None,
+) -> typing.Iterator[dict]:
+    """
+    Streams every record matching query through solr's /export handler in a single request, decoding docs as they
+    arrive.  /export only returns docValues fields, so field (and every field in sort) must have docValues enabled.
+    """
+    params = {
+        "q": query if query is not None else "*:*",
+        "fl": field,
+        "sort": sort_with_unique_key(sort),
+    }
+    _url = get_solr_url("export")
+    with rsession.get(_url, params=params, stream=True) as res:
+        res.raise_for_status()
+        for doc in json_streaming.iter_json_array_items(res.iter_content(_EXPORT_CHUNK_SIZE), "docs"):
+            # /export has already sent a 200 by the time it fails, and reports the failure as a doc instead
+            if "EXCEPTION" in doc:
+                raise ValueError(f"Solr /export failed: {doc['EXCEPTION']}")
+            yield doc
+
+
 def solr_records_for_sitemap(
     rsession=requests.session(),
     authority_id: typing.Optional[str] = None,
@@ -586,6 +926,34 @@ def solr_records_for_sitemap(
     )[0]
 
 
+def solr_records_for_sitemap_with_cursor(
+    rsession=requests.session(),
+    authority_id: typing.Optional[str] = None,
+    cursor_mark: str = CURSOR_MARK_START,
+    batch_size: int = 50000,
+) -> Tuple[list[dict], str]:
+    """
+    Cursor paged equivalent of solr_records_for_sitemap
+
+    Args:
+        rsession: The requests.session object to use for sending the solr request
+        authority_id: The authority_id to use when querying SOLR, defaults to all
+        cursor_mark: The cursorMark returned with the previous batch, or CURSOR_MARK_START
+        batch_size: Number of documents for this particular sitemap document
+
+    Returns:
+        A tuple of the dictionaries of solr documents with id and sourceUpdatedTime fields, and the next cursorMark
+    """
+    return _fetch_solr_records_with_cursor(
+        rsession,
+        authority_id,
+        cursor_mark,
+        batch_size,
+        "id,sourceUpdatedTime",
+        "sourceUpdatedTime asc",
+    )
+
+
 def solr_records_for_stac_collection(
     authority_id: typing.Optional[str] = None,
     start_index: int = 0,
@@ -628,6 +996,36 @@ def solr_records_forh3_counts(
     return response.json()
 
 
+def solr_bucket_counts(
+    query: str, bucket_fields: typing.List[str], max_rows: int = -1
+) -> typing.List[dict]:
+    """
+    Counts the records matching query in every combination of values of bucket_fields, using a streaming facet.
+
+    Returns:
+        A list of dictionaries with a key per bucket field and the count under "count(*)"
+    """
+    url = get_solr_url("stream")
+    headers = {"Accept": "application/json"}
+    dlm = ",\n"
+    facet = (f'facet({DEFAULT_COLLECTION_NAME}{dlm}'
+             f'q="{query}"{dlm}'
+             f'buckets="{",".join(bucket_fields)}"{dlm}count(*),rows={max_rows})')
+    response = requests.post(
+        url, headers=headers, data={"expr": facet}, stream=True
+    )
+    response.raise_for_status()
+    return [doc for doc in response.json().get("result-set", {}).get("docs", []) if "EOF" not in doc]
+
+
+# start/rows paging, where each batch costs more than the last since solr has to collect every record before start
+PAGING_OFFSET = "offset"
+# cursorMark paging, where every batch costs the same however deep into the results it is
+PAGING_CURSOR = "cursor"
+# The /export handler, which streams everything in one request but can only return docValues fields
+PAGING_EXPORT = "export"
+
+
 class ISBCoreSolrRecordIterator:
     """
     Iterator class for looping over all the Solr records in the ISB core Solr schema
@@ -640,47 +1038,80 @@ class ISBCoreSolrRecordIterator:
         batch_size: int = 50000,
         offset: int = 0,
         sort: Optional[str] = None,
+        paging: str = PAGING_CURSOR,
+        fields: Optional[str] = None,
     ):
         """
 
         Args:
             rsession: The requests.session object to use for sending the solr request
-            authority_id: The authority_id to use when querying SOLR, defaults to all
+            query: The solr query to select records with, defaults to all
             batch_size: Number of documents to fetch at a time
-            offset: The offset into the records to begin iterating
-            sort: The solr sort parameter to use
+            offset: The offset into the records to begin iterating, only supported with PAGING_OFFSET
+            sort: The solr sort parameter to use, with cursor and export paging the id tie-breaker is appended to it
+            paging: One of PAGING_CURSOR, PAGING_OFFSET or PAGING_EXPORT
+            fields: The solr fl parameter to use, defaults to all stored fields but is required for PAGING_EXPORT
         """
+        if paging not in (PAGING_OFFSET, PAGING_CURSOR, PAGING_EXPORT):
+            raise ValueError(f"Unknown paging {paging}")
+        if offset > 0 and paging == PAGING_CURSOR:
+            # A cursor can't start part way through, so callers resuming at an offset page by offset like before
+            paging = PAGING_OFFSET
+        if paging == PAGING_EXPORT and (fields is None or offset > 0):
+            raise ValueError("Export paging requires fields and doesn't support an offset")
         self.rsession = rsession
         self.query = query
         self.batch_size = batch_size
         self.offset = offset
         self.sort = sort
+        self.paging = paging
+        self.fields = fields
+        self._cursor_mark: Optional[str] = CURSOR_MARK_START
+        self._export_iterator: Optional[typing.Iterator[dict]] = None
         self._current_batch: list[dict] = []
         self._current_batch_index = -1
 
     def __iter__(self):
         return self
 
+    def _fetch_batch(self) -> list[dict]:
+        if self.paging == PAGING_CURSOR:
+            if self._cursor_mark is None:
+                return []
+            docs, next_cursor_mark = _fetch_solr_records_with_cursor(
+                self.rsession, None, self._cursor_mark, self.batch_size, self.fields, self.sort, self.query
+            )
+            # solr hands back the same cursorMark once it has run out of results
+            self._cursor_mark = next_cursor_mark if next_cursor_mark != self._cursor_mark else None
+            return docs
+        return _fetch_solr_records(
+            self.rsession,
+            None,
+            self.offset,
+            self.batch_size,
+            self.fields,
+            self.sort,
+            self.query
+        )[0]
+
     def __next__(self) -> typing.Dict:
+        if self.paging == PAGING_EXPORT:
+            if self._export_iterator is None:
+                # Checked in __init__, export paging can't be used without fields
+                assert self.fields is not None
+                self._export_iterator = _export_solr_records(self.rsession, self.fields, self.sort, self.query)
+            return next(self._export_iterator)
         if len(self._current_batch) == 0 or self._current_batch_index == len(
             self._current_batch
         ):
-            self._current_batch = _fetch_solr_records(
-                self.rsession,
-                None,
-                self.offset,
-                self.batch_size,
-                None,
-                self.sort,
-                self.query
-            )[0]
+            self._current_batch = self._fetch_batch()
             if len(self._current_batch) == 0:
                 # reached the end of the records
                 raise StopIteration
             logging.info(
                 f"Just fetched {len(self._current_batch)} ISB Core solr records at offset {self.offset}"
             )
-            self.offset += self.batch_size
+            self.offset += len(self._current_batch)
             self._current_batch_index = 0
         # return the next one in the list and increment our index
         next_record = self._current_batch[self._current_batch_index]
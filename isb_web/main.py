@@ -4,7 +4,6 @@ from typing import Optional
 
 import uvicorn
 import typing
-import requests
 import fastapi
 from fastapi.logger import logger as fastapi_logger
 import fastapi.staticfiles
@@ -19,9 +18,9 @@ import geojson
 
 import isb_web
 import isamples_metadata.GEOMETransformer
-from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_NQUADS, SOLR_TIME_FORMAT
+from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_MVT, MEDIA_NDJSON, MEDIA_NQUADS, SOLR_TIME_FORMAT
 from isb_lib.models.thing import Thing
-from isb_lib.utilities import h3_utilities
+from isb_lib.utilities import h3_utilities, json_streaming
 from isb_web import sqlmodel_database, analytics, manage, debug
 from isb_web.analytics import AnalyticsEvent
 from isb_web import schemas
@@ -29,14 +28,16 @@ from isb_web import crud
 from isb_web import config
 from isb_web import isb_enums
 from isb_web import isb_solr_query
+from isb_web import solr_client
 from isb_web import profiles
+from isb_web import vector_tiles
 from isamples_metadata.SESARTransformer import SESARTransformer
 from isamples_metadata.OpenContextTransformer import OpenContextTransformer
 from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
 
 import logging
 
-from isb_web.api_types import ThingsSitemapParams, ReliqueryResponse, ReliqueryParams
+from isb_web.api_types import ThingsSitemapParams, ReliqueryResponse, ReliqueryParams, ThingChangeFeed, ThingChangeEntry
 from isb_web.schemas import ThingPage
 from isb_web.sqlmodel_database import SQLModelDAO
 import isb_lib.stac
@@ -62,6 +63,9 @@ tags_metadata = [
 THING_URL_PATH = config.Settings().thing_url_path
 STAC_ITEM_URL_PATH = config.Settings().stac_item_url_path
 STAC_COLLECTION_URL_PATH = config.Settings().stac_collection_url_path
+TILE_POINT_MIN_ZOOM = config.Settings().tile_point_min_zoom
+TILE_MAX_POINTS = config.Settings().tile_max_points
+TILE_MAX_AGE = config.Settings().tile_max_age
 
 app = fastapi.FastAPI(openapi_tags=tags_metadata)
 dao = SQLModelDAO(None)
@@ -113,6 +117,11 @@ def on_startup():
     manage.allowed_orcid_ids = orcid_ids
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await solr_client.close_async_solr_client()
+
+
 def get_session():
     with dao.get_session() as session:
         yield session
@@ -267,11 +276,11 @@ async def get_solr_select(request: fastapi.Request):
     # for the streaming response as otherwise the iterator is consumed
     # before returning here, hence defeating the purpose of the streaming
     # response.
-    return isb_solr_query.solr_query(params)
+    return await isb_solr_query.async_solr_query(params)
 
 
 @app.post(f"/{THING_URL_PATH}/reliquery", response_model=ReliqueryResponse)
-def get_reliquery(request: fastapi.Request, params: ReliqueryParams) -> ReliqueryResponse:
+async def get_reliquery(request: fastapi.Request, params: ReliqueryParams) -> ReliqueryResponse:
     timestamp_str = datetime.datetime.now().strftime(SOLR_TIME_FORMAT)
     if params.previous_response is not None:
         query = params.previous_response.query
@@ -279,7 +288,7 @@ def get_reliquery(request: fastapi.Request, params: ReliqueryParams) -> Reliquer
     else:
         query = params.query
         description = params.description
-    solr_response_dict = isb_solr_query.reliquery_solr_query(query)
+    solr_response_dict = await isb_solr_query.async_reliquery_solr_query(query)
     json_response = solr_response_dict.get("response")
     docs = json_response.get("docs")
     identifiers = []
@@ -305,7 +314,7 @@ async def get_solr_query(
     request: fastapi.Request, query: typing.Any = fastapi.Body(...)
 ):
     # logging.warning(query)
-    return isb_solr_query.solr_query(request.query_params, query=query)
+    return await isb_solr_query.async_solr_query(request.query_params.multi_items(), query=query)
 
 
 @app.get(f"/{THING_URL_PATH}/stream", response_model=typing.Any)
@@ -357,7 +366,7 @@ async def get_solr_stream(request: fastapi.Request):
     params = set_default_params(params, defparams)
     # L.debug("Params: %s", params)
     analytics.record_analytics_event(AnalyticsEvent.THING_SOLR_STREAM, request, properties)
-    return isb_solr_query.solr_searchStream(params)
+    return await isb_solr_query.async_solr_searchStream(params)
 
 
 @app.get(f"/{THING_URL_PATH}/select/info", response_model=typing.Any)
@@ -367,7 +376,7 @@ async def get_solr_luke_info(request: fastapi.Request):
     Returns: JSON
     """
     analytics.record_analytics_event(AnalyticsEvent.THING_SOLR_LUKE_INFO, request)
-    return isb_solr_query.solr_luke()
+    return await isb_solr_query.async_solr_luke()
 
 
 resolution_q = fastapi.Query(
@@ -402,28 +411,68 @@ def get_h3_grid(
         exclude_poles: bool = exclude_poles_q,
         bb: typing.Optional[str] = bb_q,
         q: str = None,
+        session: Session = Depends(get_session),
 ) -> geojson.FeatureCollection:
     solr_query_params = h3_utilities.get_h3_solr_query_from_bb(bb, resolution, q)
     record_counts = h3_utilities.get_record_counts(
-        query=solr_query_params.q, resolution=solr_query_params.resolution, exclude_poles=exclude_poles
+        query=solr_query_params.q,
+        resolution=solr_query_params.resolution,
+        exclude_poles=exclude_poles,
+        session=session,
     )
     return h3_utilities.h3s_to_feature_collection(
         set(record_counts.keys()), cell_props=record_counts
     )
 
 
-@app.post("/things", response_model=typing.Any)
+def things_ndjson_response(
+    session: Session, identifiers: typing.List[str], accept_encoding: typing.Optional[str]
+) -> fastapi.responses.StreamingResponse:
+    # dumps_bytes writes datetimes as isoformat, the same as FastAPI's encoder does for the JSON array response
+    chunks = json_streaming.ndjson_chunks(sqlmodel_database.stream_things_with_ids(session, identifiers))
+    headers = {}
+    encoding = json_streaming.best_encoding(accept_encoding)
+    if encoding is not None:
+        chunks = json_streaming.compressed_chunks(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return fastapi.responses.StreamingResponse(chunks, media_type=MEDIA_NDJSON, headers=headers)
+
+
+@app.post(
+    "/things",
+    response_model=typing.Any,
+    responses={
+        200: {
+            "content": {
+                MEDIA_NDJSON: {
+                    "example": '{"primary_key": 1, "id": "IGSN:123456", ...}\n'
+                    '{"primary_key": 2, "id": "IGSN:123457", ...}\n'
+                }
+            }
+        }
+    },
+)
 async def get_things_for_sitemap(
     request: fastapi.Request,
     params: ThingsSitemapParams,
     session: Session = Depends(get_session),
+    accept: typing.Optional[str] = fastapi.Header(MEDIA_JSON),
+    accept_encoding: typing.Optional[str] = fastapi.Header(None),
 ):
     """Returns batched things suitable for sitemap ingestion
+
+    By default this is a JSON array.  Clients that accept application/x-ndjson get one thing per line instead,
+    streamed from a database cursor and compressed with zstd or gzip if the Accept-Encoding header allows.
     Args:
         request: The fastapi request
         params: Class that contains the identifier list, JSON-encoded in the request body
         session: The database session to use to fetch things
+        accept: The Accept header, used to choose between JSON and NDJSON
+        accept_encoding: The Accept-Encoding header, used to compress NDJSON responses
     """
+    return_type = accept_types.get_best_match(accept, [MEDIA_JSON, MEDIA_NDJSON])
+    if return_type == MEDIA_NDJSON:
+        return things_ndjson_response(session, params.identifiers, accept_encoding)
     content = sqlmodel_database.get_things_with_ids(session, params.identifiers)
     # things
     # for identifier in params.identifiers:
@@ -435,6 +484,45 @@ async def get_things_for_sitemap(
     return content
 
 
+MAX_CHANGE_FEED_PAGE_SIZE = 50000
+
+
+@app.get("/things/changes", response_model=ThingChangeFeed)
+def get_thing_changes(
+    since: int = fastapi.Query(
+        default=0, ge=0, description="Return changes after this change sequence number (the previous page's next)"
+    ),
+    since_time: typing.Optional[datetime.datetime] = fastapi.Query(
+        default=None, description="Return changes recorded at or after this time, if later than since"
+    ),
+    authority: typing.Optional[str] = None,
+    limit: int = fastapi.Query(default=1000, gt=0, le=MAX_CHANGE_FEED_PAGE_SIZE),
+    session: Session = Depends(get_session),
+):
+    """Returns a page of the change journal, for replicating Things between iSB instances
+
+    Each entry is the latest change to a Thing in the page, flagged as deleted if the Thing is no longer published.
+    Fetch the changed Things that aren't deleted with POST /things, then request the next page with since=next
+    until next stops advancing.  next never moves past a change that may not have been committed yet, so it can
+    trail max_sequence for a while.
+    Args:
+        since: The change sequence number to resume from
+        since_time: Alternatively, a timestamp to resume from
+        authority: Only return changes to Things from this authority
+        limit: The maximum number of journal entries to read for the page
+        session: The database session to use to read the journal
+    """
+    if since_time is not None:
+        since = max(since, sqlmodel_database.thing_change_sequence_before(session, since_time, authority))
+    changes, next_sequence = sqlmodel_database.thing_change_feed(session, since, authority, limit)
+    return ThingChangeFeed(
+        since=since,
+        next=next_sequence,
+        max_sequence=sqlmodel_database.max_thing_change_sequence(session, authority),
+        changes=[ThingChangeEntry(**change) for change in changes],
+    )
+
+
 def all_profiles_json_response(request_url: str):
     query_string_index = request_url.find("?")
     if query_string_index != -1:
@@ -445,11 +533,11 @@ def all_profiles_json_response(request_url: str):
     )
 
 
-def solr_thing_response(identifier: str):
+async def solr_thing_response(identifier: str):
     # Return solr representation of the record
     # Get the solr response, and return the doc portion or
     # and appropriate error condition
-    status, doc = isb_solr_query.solr_get_record(identifier)
+    status, doc = await isb_solr_query.async_solr_get_record(identifier)
     if status == 200:
         return fastapi.responses.JSONResponse(
             content=doc, media_type="application/json"
@@ -476,7 +564,7 @@ async def get_thing(
     analytics.record_analytics_event(AnalyticsEvent.THING_BY_IDENTIFIER, request, properties)
     """Record for the specified identifier"""
     if format == isb_enums.ISBFormat.SOLR:
-        return solr_thing_response(identifier)
+        return await solr_thing_response(identifier)
 
     if _profile == profiles.ALL_PROFILES_QSA_VALUE or _profile == profiles.ALT_PROFILES_QSA_VALUE \
             or request.method == "HEAD":
@@ -566,7 +654,7 @@ async def get_stac_item(
     # stac wants things to have filenames, so let these requests work, too.
     if identifier.endswith(".json"):
         identifier = identifier.removesuffix(".json")
-    status, doc = isb_solr_query.solr_get_record(identifier)
+    status, doc = await isb_solr_query.async_solr_get_record(identifier)
     if status == 200:
         stac_item = isb_lib.stac.stac_item_from_solr_dict(
             doc, "http://isamples.org/stac/", "http://isamples.org/thing/"
@@ -640,7 +728,8 @@ async def get_things_geojson_heatmap(
     """
     Returns a GeoJSON heatmap of all Things matching the specified Solr query in the bounding box described by the
     latitude and longitude parameters.  The format of the response is a GeoJSON Feature Collection:
-    https://datatracker.ietf.org/doc/html/rfc7946#section-3.3
+    https://datatracker.ietf.org/doc/html/rfc7946#section-3.3  A bounding box crossing the antimeridian may be given
+    with min_lon > max_lon, or with longitudes past +/-180, and the heatmap comes back in the requested longitudes.
     """
     bounds = {
         isb_solr_query.MIN_LAT: min_lat,
@@ -648,10 +737,10 @@ async def get_things_geojson_heatmap(
         isb_solr_query.MIN_LON: min_lon,
         isb_solr_query.MAX_LON: max_lon,
     }
-    results = isb_solr_query.solr_geojson_heatmap(
+    content = await isb_solr_query.async_solr_geojson_heatmap_bytes(
         query, bounds, fq=fq, grid_level=None, show_bounds=False, show_solr_bounds=False
     )
-    return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_GEO_JSON)
+    return fastapi.responses.Response(content=content, media_type=MEDIA_GEO_JSON)
 
 
 @app.get(
@@ -689,7 +778,8 @@ async def get_things_leaflet_heatmap(
     """
     Returns a Leaflet heatmap of all Things matching the specified Solr query in the bounding box described by the
     latitude and longitude parameters.  The format of the response is suitable for consumption by the Leaflet JavaScript
-    library https://leafletjs.com
+    library https://leafletjs.com.  A bounding box crossing the antimeridian may be given with min_lon > max_lon, or
+    with longitudes past +/-180, and the heatmap comes back in the requested longitudes.
     """
     bounds = {
         isb_solr_query.MIN_LAT: min_lat,
@@ -697,8 +787,54 @@ async def get_things_leaflet_heatmap(
         isb_solr_query.MIN_LON: min_lon,
         isb_solr_query.MAX_LON: max_lon,
     }
-    results = isb_solr_query.solr_leaflet_heatmap(query, bounds, fq=fq, grid_level=None)
-    return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_JSON)
+    results = await isb_solr_query.async_solr_leaflet_heatmap(query, bounds, fq=fq, grid_level=None)
+    return fastapi.responses.Response(content=json_streaming.dumps_bytes(results), media_type=MEDIA_JSON)
+
+
+@app.get(
+    "/tiles/{z}/{x}/{y}.mvt",
+    response_class=fastapi.responses.Response,
+    summary="Gets a Mapbox Vector Tile of Things",
+    tags=["heatmaps"],
+)
+async def get_things_tile(
+    z: int,
+    x: int,
+    y: int,
+    query: str = Query(
+        default="*:*",
+        description="Solr query to use for selecting Things. Details at https://solr.apache.org/guide/8_9/the-standard-query-parser.html#the-standard-query-parser",
+    ),
+    fq: str = Query(
+        default="",
+        description="Filter query to use for selecting Things. Details at https://solr.apache.org/guide/8_9/the-standard-query-parser.html#the-standard-query-parser",
+    ),
+    aggregation: isb_enums.ISBTileAggregation = Query(
+        default=isb_enums.ISBTileAggregation.H3,
+        description="Whether Things are counted per h3 cell or per Solr heatmap cell at zooms too low for points",
+    ),
+):
+    """
+    Returns a Mapbox Vector Tile (https://github.com/mapbox/vector-tile-spec) of all Things matching the specified Solr
+    query in the web mercator tile x, y at zoom z.  At low zooms, the tile's "h3" (or "heatmap") layer has a polygon
+    per cell with the count of Things in it.  At high zooms, its "things" layer has a point per Thing with its id and
+    source, unless there are too many Things in the tile to show them individually.
+    """
+    if not vector_tiles.valid_tile(z, x, y):
+        raise fastapi.HTTPException(status_code=404, detail=f"No tile {z}/{x}/{y}")
+    content = await vector_tiles.cached_things_tile(
+        z,
+        x,
+        y,
+        query,
+        fq,
+        aggregation.value,
+        point_min_zoom=TILE_POINT_MIN_ZOOM,
+        max_points=TILE_MAX_POINTS,
+    )
+    return fastapi.responses.Response(
+        content=content, media_type=MEDIA_MVT, headers={"Cache-Control": f"public, max-age={TILE_MAX_AGE}"}
+    )
 
 
 @app.get(
@@ -710,8 +846,7 @@ async def relation_metadata(request: fastapi.Request):
     """List of predicates with counts"""
     # return crud.getPredicateCounts(db)
     analytics.record_analytics_event(AnalyticsEvent.RELATION_METADATA, request)
-    session = requests.session()
-    return crud.getPredicateCountsSolr(session)
+    return await crud.getPredicateCountsSolrAsync(solr_client.get_async_solr_client())
 
 
 '''
@@ -794,8 +929,7 @@ async def get_related_solr(
     """
     analytics.record_analytics_event(AnalyticsEvent.RELATED_SOLR, request)
     return_type = accept_types.get_best_match(accept, [MEDIA_JSON, MEDIA_NQUADS])
-    rsession = requests.Session()
-    res = crud.getRelationsSolr(rsession, s, p, o, source, name, offset, limit)
+    res = await crud.getRelationsSolrAsync(solr_client.get_async_solr_client(), s, p, o, source, name, offset, limit)
     if return_type == MEDIA_NQUADS:
         rows = []
         for row in res:
@@ -0,0 +1,157 @@
+import asyncio
+import typing
+from typing import Optional
+
+import aiohttp
+import fastapi
+import starlette.background
+
+import isb_web.config
+
+# Size of the chunks passed on to the client when streaming a solr response through
+STREAM_CHUNK_SIZE = 4096
+
+_HEADERS = {"Accept": "application/json"}
+
+
+class AsyncSolrClient:
+    """
+    A non-blocking solr client for the web app, sharing a pool of keep-alive connections across requests.
+
+    Every request has a connect and a read timeout (the longest solr may go without sending anything), defaulting to
+    the ones in the settings.  Pass read_timeout to an individual call to override it, e.g. for slow facets.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 100,
+        keepalive_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            connect_timeout: Seconds to wait for a connection to solr, including waiting for one from the pool
+            read_timeout: Seconds to wait for solr between bytes of the response
+            max_connections: Maximum number of concurrent connections to solr, further requests wait for one
+            keepalive_timeout: Seconds an idle connection is kept open for reuse
+        """
+        # aiohttp binds the session to the running loop, so this has to be constructed inside it
+        self._connect_timeout = connect_timeout
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=keepalive_timeout),
+            headers=_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout),
+        )
+
+    async def get_json(
+        self, url: str, params=None, read_timeout: Optional[float] = None
+    ) -> typing.Tuple[int, typing.Optional[dict]]:
+        """Returns the status code of a GET request for url, and the decoded JSON body if it succeeded"""
+        return await self._json("GET", url, params=params, read_timeout=read_timeout)
+
+    async def post_json(
+        self, url: str, params=None, data=None, json=None, read_timeout: Optional[float] = None
+    ) -> typing.Tuple[int, typing.Optional[dict]]:
+        """Returns the status code of a POST request for url, and the decoded JSON body if it succeeded"""
+        return await self._json("POST", url, params=params, data=data, json=json, read_timeout=read_timeout)
+
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        media_type: str,
+        params=None,
+        data=None,
+        json=None,
+        read_timeout: Optional[float] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> fastapi.responses.StreamingResponse:
+        """
+        Sends a request to solr and passes its response body through to the client as it arrives.
+
+        Only the response headers are awaited here, the body is read from solr while it's written to the client and
+        the connection goes back to the pool once it's done (or the client goes away).  The release is also the
+        response's background task, so the connection isn't held if the body is never iterated.
+        """
+        response = await self._session.request(
+            method, url, params=_query_params(params), data=data, json=json, **self._timeout(read_timeout)
+        )
+
+        async def body() -> typing.AsyncIterator[bytes]:
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+            finally:
+                response.release()
+
+        # A coroutine function, as a plain one would be run on a worker thread, away from the session's loop
+        async def release():
+            response.release()
+
+        return fastapi.responses.StreamingResponse(
+            body(),
+            status_code=response.status,
+            media_type=media_type,
+            background=starlette.background.BackgroundTask(release),
+        )
+
+    async def close(self):
+        await self._session.close()
+
+    async def _json(self, method: str, url: str, params=None, read_timeout=None, **kwargs):
+        async with self._session.request(
+            method, url, params=_query_params(params), **kwargs, **self._timeout(read_timeout)
+        ) as response:
+            if response.status != 200:
+                return response.status, None
+            # Don't insist on the content type, solr sends text/plain for some wt=json responses
+            return response.status, await response.json(content_type=None)
+
+    def _timeout(self, read_timeout: Optional[float]) -> dict:
+        if read_timeout is None:
+            return {}
+        return {"timeout": aiohttp.ClientTimeout(total=None, connect=self._connect_timeout, sock_read=read_timeout)}
+
+
+def _query_params(params) -> typing.Optional[typing.List[typing.Tuple[str, str]]]:
+    """
+    Solr params as aiohttp accepts them, which is only strings.  Like requests, a mapping or a list of [key, value]
+    (keys may repeat) is accepted.
+    """
+    if params is None:
+        return None
+    items = params.items() if isinstance(params, typing.Mapping) else params
+    return [(str(key), str(value)) for key, value in items]
+
+
+_async_solr_client: Optional[AsyncSolrClient] = None
+_async_solr_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_solr_client() -> AsyncSolrClient:
+    """
+    The shared solr client, created on first use.  Must be called from within the event loop the client is used on,
+    since pooled connections can't move between loops.
+    """
+    global _async_solr_client, _async_solr_client_loop
+    loop = asyncio.get_running_loop()
+    # A client left behind by a loop that's gone (e.g. between test runs) can't be closed from this one, drop it
+    if _async_solr_client is None or _async_solr_client_loop is not loop:
+        settings = isb_web.config.Settings()
+        _async_solr_client = AsyncSolrClient(
+            connect_timeout=settings.solr_connect_timeout,
+            read_timeout=settings.solr_read_timeout,
+            max_connections=settings.solr_max_connections,
+            keepalive_timeout=settings.solr_keepalive_timeout,
+        )
+        _async_solr_client_loop = loop
+    return _async_solr_client
+
+
+async def close_async_solr_client():
+    global _async_solr_client, _async_solr_client_loop
+    if _async_solr_client is not None:
+        await _async_solr_client.close()
+    _async_solr_client = None
+    _async_solr_client_loop = None
@@ -1,4 +1,5 @@
 import datetime
+import json
 import typing
 
 import igsn_lib.time
@@ -9,13 +10,18 @@ from typing import Optional, List
 from isb_lib.identifiers.noidy.n2tminter import N2TMinter
 from isb_lib.models.namespace import Namespace
 from sqlalchemy import Index, update
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, ProgrammingError, OperationalError
 from sqlmodel import SQLModel, create_engine, Session, select
 from sqlmodel.sql.expression import SelectOfScalar
 
 import isb_lib
 from isb_lib.models.person import Person
 from isb_lib.models.thing import Thing, ThingIdentifier, Point
+from isb_lib.models.thing_change import ThingChange, ChangeWatermark
+from isb_lib.models.h3_count import H3Count, H3CountCube, ALL_VALUES, H3_COUNT_CUBE_NAME
+from isb_lib.utilities.identifier_map import CompactIdentifierMap
 from isb_web.schemas import ThingPage
 
 
@@ -23,6 +29,15 @@ DRAFT_RESOLVED_URL = "DRAFT"
 DRAFT_AUTHORITY_ID = "DRAFT"
 DRAFT_RESOLVED_STATUS = -1
 
+# How long a gap in the change journal's sequence numbers is waited on before it's taken to be a transaction that
+# rolled back, rather than one that hasn't committed yet.  Longer than any transaction saving Things should take.
+CHANGE_JOURNAL_SETTLE_TIME = datetime.timedelta(minutes=10)
+
+# Watermarks tracking the copy of identifiers saved before the ThingIdentifier table was maintained, from the
+# Thing.identifiers column into it: the last primary key copied, and whether the copy has finished
+THING_IDENTIFIERS_BACKFILL_WATERMARK = "thing_identifiers_backfill"
+THING_IDENTIFIERS_BACKFILLED_WATERMARK = "thing_identifiers_backfilled"
+
 
 class SQLModelDAO:
     def __init__(self, db_url: Optional[str], echo: bool = False):
@@ -34,12 +49,22 @@ class SQLModelDAO:
         else:
             self.engine = None
 
-    # Utility method to attempt to create an index but catch an exception if it already exists
+    def _index_exists(self, index: Index) -> bool:
+        indexes = sqlalchemy.inspect(self.engine).get_indexes(index.table.name)
+        return any(existing["name"] == index.name for existing in indexes)
+
+    # Utility method to create an index if it doesn't already exist
     def _create_index(self, index: Index):
         try:
-            index.create(self.engine)
-        except ProgrammingError:
-            pass
+            index.create(self.engine, checkfirst=True)
+        except (ProgrammingError, OperationalError):
+            # Another process may have created it between the check and the create, anything else is a real failure
+            if not self._index_exists(index):
+                raise
+        finally:
+            # Constructing the Index attaches it to the table, so detach it to avoid accumulating duplicates in the
+            # shared metadata when connecting more than once in a process
+            index.table.indexes.discard(index)
 
     def connect_sqlmodel(self, db_url: str, echo: bool = False):
         self.engine = create_engine(db_url, echo=echo)
@@ -51,7 +76,6 @@ class SQLModelDAO:
             Thing.resolved_status,
             Thing.authority_id,
         )
-        # These index creations will throw if they already exist -- there's nothing to do in that case
         self._create_index(id_resolved_status_authority_id_idx)
 
         authority_id_tcreated_idx = Index(
@@ -71,10 +95,32 @@ class SQLModelDAO:
         )
         self._create_index(resolved_status_authority_id_idx)
 
-        # guid_thing_id_idx = Index(
-        #     "guid_thing_id_idx", ThingIdentifier.guid, ThingIdentifier.thing_id
-        # )
-        # self._create_index(guid_thing_id_idx)
+        # Covering index for resolving alternate identifiers to Thing primary keys
+        guid_thing_id_idx = Index(
+            "guid_thing_id_idx", ThingIdentifier.guid, ThingIdentifier.thing_id
+        )
+        self._create_index(guid_thing_id_idx)
+
+        self._mark_empty_database_backfilled()
+
+    def _mark_empty_database_backfilled(self):
+        # A new database has no identifiers that only live in the Thing.identifiers column, so there's nothing to
+        # backfill and no reason to fall back to searching the column
+        with Session(self.engine) as session:
+            if thing_identifiers_backfilled(session):
+                return
+            if session.exec(select(Thing.primary_key).limit(1)).first() is not None:
+                logging.warning(
+                    "Thing identifiers haven't been backfilled into the ThingIdentifier table, identifier lookups will "
+                    "also search the Thing.identifiers column until scripts/migrations/backfill_thing_identifiers.py "
+                    "has been run"
+                )
+                return
+            try:
+                save_change_watermark(session, THING_IDENTIFIERS_BACKFILLED_WATERMARK, 1)
+            except IntegrityError:
+                # Another process connecting at the same time got there first
+                session.rollback()
 
     def get_session(self) -> Session:
         return Session(self.engine)
@@ -117,13 +163,29 @@ def read_things_summary(
     return overall_count, overall_pages, things_results.all()
 
 
+# Keep IN clauses comfortably below database bound parameter limits
+_MAX_IN_CLAUSE_SIZE = 1000
+# Rows per INSERT ... ON CONFLICT statement, keeping their parameters well under the databases' limits
+_UPSERT_BATCH_SIZE = 500
+# Identifiers searched for per query in the Thing.identifiers column, each is a LIKE over every row
+_IDENTIFIERS_COLUMN_SEARCH_SIZE = 100
+
+
 def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
     statement = (
         select(Thing).filter(Thing.id == identifier).order_by(Thing.primary_key.asc())
     )
     result = session.exec(statement).first()
     if result is None:
-        # Fall back to querying the Identifiers table
+        # Fall back to querying the indexed alternate identifiers table
+        identifiers_statement = (
+            select(Thing)
+            .join(ThingIdentifier, ThingIdentifier.thing_id == Thing.primary_key)
+            .where(ThingIdentifier.guid == identifier)
+        )
+        result = session.exec(identifiers_statement).first()
+    if result is None and not thing_identifiers_backfilled(session):
+        # Identifiers saved before the table was maintained may only be in the Thing.identifiers column
         identifiers_statement = select(Thing).where(
             Thing.identifiers.like(f"%{identifier}%")
         )
@@ -131,12 +193,82 @@ def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
     return result
 
 
+def thing_identifiers_backfilled(session: Session) -> bool:
+    """Whether the ThingIdentifier table holds the identifiers of every Thing, including ones saved before it was
+    maintained (see backfill_thing_identifiers).  Until then, identifier lookups also search the Thing.identifiers
+    column."""
+    return get_change_watermark(session, THING_IDENTIFIERS_BACKFILLED_WATERMARK) > 0
+
+
+def _search_identifiers_column(
+    session: Session, identifiers: list[str], column: typing.Any
+) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    """Yields (identifier, column value) for the Things with identifiers in their Thing.identifiers column"""
+    for start in range(0, len(identifiers), _IDENTIFIERS_COLUMN_SEARCH_SIZE):
+        chunk = identifiers[start:start + _IDENTIFIERS_COLUMN_SEARCH_SIZE]
+        # The column holds a JSON list, so look for each quoted identifier, then confirm it's an exact match
+        statement = select(Thing.identifiers, column).where(
+            sqlalchemy.or_(*[Thing.identifiers.like(f"%{json.dumps(identifier)}%") for identifier in chunk])
+        ).order_by(Thing.primary_key.asc())
+        for thing_identifiers, value in session.execute(statement):
+            for identifier in chunk:
+                if identifier in (thing_identifiers or []):
+                    yield identifier, value
+
+
 def get_things_with_ids(session: Session, identifiers: list[str]) -> list[Thing]:
     statement = select(Thing).where(Thing.id.in_(identifiers))
     things = session.exec(statement).all()
     return things
 
 
+def stream_things_with_ids(
+    session: Session, identifiers: list[str], yield_per: int = 1000
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """Streaming equivalent of get_things_with_ids, yields plain dicts of Thing attribute name to column value.
+
+    Rows come straight off a server-side cursor without constructing (and validating) Thing objects, so only
+    yield_per rows are held in memory at a time.
+    """
+    thing_columns = [getattr(Thing, column).label(column) for column in Thing.__fields__]
+    for start in range(0, len(identifiers), _MAX_IN_CLAUSE_SIZE):
+        chunk = identifiers[start:start + _MAX_IN_CLAUSE_SIZE]
+        statement = select(*thing_columns).where(Thing.id.in_(chunk)).execution_options(stream_results=True)
+        for row in session.execute(statement).mappings().yield_per(yield_per):
+            yield dict(row)
+
+
+def get_things_by_ids(session: Session, identifiers: list[str]) -> typing.Dict[str, Thing]:
+    """Bulk equivalent of get_thing_with_id, returns a dict of identifier to Thing for the identifiers that exist.
+
+    Identifiers are matched against Thing.id first, and any that don't match are then resolved as alternate
+    identifiers via the indexed ThingIdentifier table, so a page of identifiers costs at most two queries per
+    _MAX_IN_CLAUSE_SIZE identifiers.
+    """
+    things_by_id: typing.Dict[str, Thing] = {}
+    unique_identifiers = list(dict.fromkeys(identifiers))
+    for start in range(0, len(unique_identifiers), _MAX_IN_CLAUSE_SIZE):
+        chunk = unique_identifiers[start:start + _MAX_IN_CLAUSE_SIZE]
+        # Order by primary key so that, as in get_thing_with_id, the oldest row wins if an id is duplicated
+        statement = select(Thing).where(Thing.id.in_(chunk)).order_by(Thing.primary_key.asc())
+        for thing in session.exec(statement):
+            things_by_id.setdefault(thing.id, thing)
+        unresolved = [identifier for identifier in chunk if identifier not in things_by_id]
+        if len(unresolved) > 0:
+            alternate_statement = (
+                select(ThingIdentifier.guid, Thing)
+                .join(Thing, Thing.primary_key == ThingIdentifier.thing_id)
+                .where(ThingIdentifier.guid.in_(unresolved))
+            )
+            for guid, thing in session.exec(alternate_statement):
+                things_by_id.setdefault(guid, thing)
+    unresolved = [identifier for identifier in unique_identifiers if identifier not in things_by_id]
+    if len(unresolved) > 0 and not thing_identifiers_backfilled(session):
+        for identifier, thing in _search_identifiers_column(session, unresolved, Thing):
+            things_by_id.setdefault(identifier, thing)
+    return things_by_id
+
+
 def get_thing_identifiers_for_thing(session: Session, thing_id: int) -> list[str]:
     statement = select(Thing.identifiers).where(Thing.primary_key == thing_id)
     session_exec = session.exec(statement)
@@ -203,6 +335,32 @@ def paged_things_with_ids(
     return session.exec(thing_select).all()
 
 
+def stream_thing_columns(
+    session: Session,
+    columns: list[str],
+    authority: Optional[str] = None,
+    status: int = 200,
+    min_time_created: Optional[datetime.datetime] = None,
+    min_id: int = 0,
+    yield_per: int = 5000,
+) -> typing.Iterator[sqlalchemy.engine.Row]:
+    """Streams the named Thing columns as lightweight rows in primary key order, using a server-side cursor.
+
+    Rows support attribute access by column name (e.g. row.resolved_content), and since no ORM objects are
+    created the session's identity map stays empty no matter how many rows are read.
+    """
+    thing_columns = [getattr(Thing, column).label(column) for column in columns]
+    thing_select = select(*thing_columns).filter(Thing.resolved_status == status)
+    if authority is not None:
+        thing_select = thing_select.filter(Thing.authority_id == authority)
+    if min_time_created is not None:
+        thing_select = thing_select.filter(Thing.tcreated >= min_time_created)
+    if min_id > 0:
+        thing_select = thing_select.filter(Thing.primary_key > min_id)
+    thing_select = thing_select.order_by(Thing.primary_key.asc()).execution_options(stream_results=True)
+    return session.execute(thing_select).yield_per(yield_per)
+
+
 def things_for_sitemap(
     session: Session,
     authority: Optional[str] = None,
@@ -293,7 +451,9 @@ def _standard_identifier(thing: Thing) -> str:
     return thing.id
 
 
-def thing_identifiers_from_resolved_content(authority_id: str, resolved_content: typing.Dict) -> list[str]:
+def thing_identifiers_from_resolved_content(
+    authority_id: Optional[str], resolved_content: typing.Dict
+) -> list[str]:
     identifiers = []
     if authority_id == "GEOME":
         identifiers += geome_identifiers_from_resolved_content(resolved_content)
@@ -309,10 +469,19 @@ def insert_identifiers(thing: Thing):
         thing.insert_thing_identifier_if_not_present(identifier)
 
 
+def _journal_thing_change(session: Session, thing_id: str, authority_id: Optional[str]):
+    # Added to the same transaction as the Thing itself, so a change is journaled if and only if it is committed
+    session.add(ThingChange(thing_id=thing_id, authority_id=authority_id))
+
+
 def save_thing(session: Session, thing: Thing):
     insert_identifiers(thing)
     logging.debug("Going to add thing to session")
     session.add(thing)
+    # Flush so that the primary key is available for the identifiers table
+    session.flush()
+    save_thing_identifiers(session, {thing.primary_key: thing.identifiers})
+    _journal_thing_change(session, thing.id, thing.authority_id)
     logging.debug("Added thing to session")
     session.commit()
     logging.debug("committed session")
@@ -358,6 +527,251 @@ def save_or_update_thing(session: Session, thing: Thing):
                 )
 
 
+# The fields save_or_update_thing copies onto an existing Thing (see Thing.take_values_from_other_thing)
+THING_UPDATE_FIELDS = [
+    "id",
+    "resolved_content",
+    "resolved_url",
+    "resolved_status",
+    "tresolved",
+    "resolve_elapsed",
+    "tcreated",
+    "tstamp",
+    "identifiers",
+]
+
+
+def primary_keys_for_thing_ids(session: Session, thing_ids: list[str]) -> typing.Dict[str, int]:
+    """Returns a dict of Thing id to primary key for the ids that exist in the database"""
+    primary_keys = {}
+    for start in range(0, len(thing_ids), _MAX_IN_CLAUSE_SIZE):
+        pk_select = select(Thing.id, Thing.primary_key).where(
+            Thing.id.in_(thing_ids[start:start + _MAX_IN_CLAUSE_SIZE])
+        )
+        for row in session.execute(pk_select):
+            primary_keys[row[0]] = row[1]
+    return primary_keys
+
+
+def thing_ids_for_primary_keys(session: Session, primary_keys: list[int]) -> typing.Dict[int, str]:
+    """Returns a dict of primary key to Thing id for the primary keys that exist in the database"""
+    thing_ids = {}
+    for start in range(0, len(primary_keys), _MAX_IN_CLAUSE_SIZE):
+        id_select = select(Thing.primary_key, Thing.id).where(
+            Thing.primary_key.in_(primary_keys[start:start + _MAX_IN_CLAUSE_SIZE])
+        )
+        for row in session.execute(id_select):
+            thing_ids[row[0]] = row[1]
+    return thing_ids
+
+
+def primary_keys_for_identifiers(session: Session, identifiers: list[str]) -> typing.Dict[str, int]:
+    """Returns a dict of identifier to Thing primary key, resolving both Thing ids and alternate identifiers"""
+    primary_keys = primary_keys_for_thing_ids(session, identifiers)
+    unresolved = [identifier for identifier in identifiers if identifier not in primary_keys]
+    for start in range(0, len(unresolved), _MAX_IN_CLAUSE_SIZE):
+        guid_select = select(ThingIdentifier.guid, ThingIdentifier.thing_id).where(
+            ThingIdentifier.guid.in_(unresolved[start:start + _MAX_IN_CLAUSE_SIZE])
+        )
+        for row in session.execute(guid_select):
+            primary_keys[row[0]] = row[1]
+    unresolved = [identifier for identifier in unresolved if identifier not in primary_keys]
+    if len(unresolved) > 0 and not thing_identifiers_backfilled(session):
+        for identifier, primary_key in _search_identifiers_column(session, unresolved, Thing.primary_key):
+            primary_keys.setdefault(identifier, primary_key)
+    return primary_keys
+
+
+def _upsert(
+    session: Session,
+    table: sqlalchemy.Table,
+    rows: list[typing.Dict],
+    key_column: str,
+    update_columns: typing.Iterable[str],
+    changed_columns: Optional[list[str]] = None,
+):
+    """
+    INSERT ... ON CONFLICT DO UPDATE of rows, keyed on column names, into table.  Rows conflicting on key_column with
+    ones already there (including ones a concurrent writer has just inserted) overwrite their update_columns instead,
+    or if changed_columns is specified, only when one of those differs.
+
+    Databases without ON CONFLICT (anything but postgresql and sqlite) get the same result with a select and then
+    separate inserts and updates, without the protection from concurrent writers.
+    """
+    dialect_name = session.get_bind().dialect.name
+    update_columns = list(update_columns)
+    # A multi-row VALUES needs the same columns in every row
+    rows_by_columns: typing.Dict[typing.Tuple[str, ...], list[typing.Dict]] = {}
+    for row in rows:
+        rows_by_columns.setdefault(tuple(sorted(row.keys())), []).append(row)
+    for columns, column_rows in rows_by_columns.items():
+        set_columns = [column for column in update_columns if column in columns]
+        for start in range(0, len(column_rows), _UPSERT_BATCH_SIZE):
+            batch = column_rows[start:start + _UPSERT_BATCH_SIZE]
+            if dialect_name == "postgresql":
+                _insert_on_conflict(session, postgresql.insert, table, batch, key_column, set_columns, changed_columns)
+            elif dialect_name == "sqlite":
+                _insert_on_conflict(session, sqlite.insert, table, batch, key_column, set_columns, changed_columns)
+            else:
+                _select_then_write(session, table, batch, key_column, set_columns, changed_columns)
+
+
+def _insert_on_conflict(
+    session: Session,
+    insert: typing.Callable,
+    table: sqlalchemy.Table,
+    rows: list[typing.Dict],
+    key_column: str,
+    set_columns: list[str],
+    changed_columns: Optional[list[str]],
+):
+    statement = insert(table).values(rows)
+    where = None
+    if changed_columns is not None:
+        where = sqlalchemy.or_(
+            *[table.c[column].is_distinct_from(statement.excluded[column]) for column in changed_columns]
+        )
+    statement = statement.on_conflict_do_update(
+        index_elements=[key_column],
+        set_={column: statement.excluded[column] for column in set_columns},
+        where=where,
+    )
+    session.execute(statement)
+
+
+def _select_then_write(
+    session: Session,
+    table: sqlalchemy.Table,
+    rows: list[typing.Dict],
+    key_column: str,
+    set_columns: list[str],
+    changed_columns: Optional[list[str]],
+):
+    keys = [row[key_column] for row in rows]
+    existing_rows = {}
+    for existing_row in session.execute(sqlalchemy.select(table).where(table.c[key_column].in_(keys))).mappings():
+        existing_rows[existing_row[key_column]] = existing_row
+    new_rows = [row for row in rows if row[key_column] not in existing_rows]
+    changed_rows = [
+        row for row in rows
+        if row[key_column] in existing_rows and (
+            changed_columns is None
+            or any(existing_rows[row[key_column]][column] != row[column] for column in changed_columns)
+        )
+    ]
+    if len(new_rows) > 0:
+        session.execute(table.insert(), new_rows)
+    if len(changed_rows) > 0 and len(set_columns) > 0:
+        # Bound parameters can't share the names of the columns being set
+        statement = table.update().where(table.c[key_column] == sqlalchemy.bindparam("_key")).values(
+            {column: sqlalchemy.bindparam(f"_{column}") for column in set_columns}
+        )
+        session.execute(
+            statement,
+            [
+                dict({f"_{column}": row[column] for column in set_columns}, _key=row[key_column])
+                for row in changed_rows
+            ],
+        )
+
+
+def save_thing_identifiers(session: Session, identifiers_by_primary_key: typing.Mapping[int, typing.Optional[list[str]]]):
+    """Records the identifiers of Things in the ThingIdentifier table, so they can be resolved with an index lookup.
+
+    An identifier that already points at another Thing is moved to the Thing being saved.  Doesn't commit, so this is
+    written in the same transaction as the Things themselves.
+    """
+    primary_keys_by_guid = {}
+    for primary_key, identifiers in identifiers_by_primary_key.items():
+        for identifier in identifiers or []:
+            primary_keys_by_guid[identifier] = primary_key
+    now = igsn_lib.time.dtnow()
+    rows = [
+        {"guid": guid, "thing_id": primary_key, "tstamp": now} for guid, primary_key in primary_keys_by_guid.items()
+    ]
+    # Identifiers still pointing at the same Thing are left alone, so their tstamp is when they were first recorded
+    _upsert(session, ThingIdentifier.__table__, rows, "guid", ["thing_id", "tstamp"], changed_columns=["thing_id"])
+
+
+def _mapping_identifiers(mapping: typing.Dict) -> list[str]:
+    identifiers = mapping.get("identifiers")
+    if identifiers is None:
+        return [mapping["id"]]
+    if isinstance(identifiers, str):
+        # Callers may hand us the already serialized StringListType value
+        identifiers = json.loads(identifiers)
+    return identifiers
+
+
+def save_or_update_thing_mappings(
+    session: Session,
+    thing_mappings: list[typing.Dict],
+    primary_keys_by_id: Optional[typing.Mapping[str, int]] = None,
+    update_fields: Optional[list[str]] = None,
+) -> tuple[int, int]:
+    """Inserts or updates a batch of Things, given as dicts of Thing attribute values, with a single commit.
+
+    Existing Things are matched on id or alternate identifier, either via primary_keys_by_id or with indexed queries
+    for the whole batch.  The identifiers of every Thing are recorded in the ThingIdentifier table.
+    If a batch contains the same id more than once, the last mapping wins.  If update_fields is specified, only those
+    fields are written to existing Things.
+
+    Unlike the ThingIdentifier rows, which are upserted on their guid, new Things are plain inserts: Thing ids have no
+    unique constraint to detect a conflict with (existing tables hold the same id under different authorities).  Ids
+    primary_keys_by_id doesn't know about are looked up again in this transaction, so a stale snapshot (e.g. a preloaded
+    identifier map) doesn't insert a second copy of a Thing saved since.  A concurrent writer inserting the same id
+    after that can still leave two rows, in which case the identifiers resolve to whichever was saved last.
+
+    Returns: a tuple of (number of inserted Things, number of updated Things)
+    """
+    mappings_by_id = {mapping["id"]: mapping for mapping in thing_mappings}
+    if primary_keys_by_id is None:
+        primary_keys_by_id = {}
+    unknown_ids = [thing_id for thing_id in mappings_by_id.keys() if thing_id not in primary_keys_by_id]
+    looked_up_primary_keys = primary_keys_for_identifiers(session, unknown_ids)
+    new_mappings = []
+    existing_mappings = []
+    identifiers_by_primary_key = {}
+    for thing_id, mapping in mappings_by_id.items():
+        primary_key = primary_keys_by_id.get(thing_id, looked_up_primary_keys.get(thing_id))
+        if primary_key is None:
+            new_mapping = dict(mapping)
+            new_mapping.pop("primary_key", None)
+            new_mappings.append(new_mapping)
+        else:
+            if update_fields is not None:
+                existing_mapping = {field: mapping[field] for field in update_fields if field in mapping}
+            else:
+                existing_mapping = dict(mapping)
+            existing_mapping["primary_key"] = primary_key
+            existing_mappings.append(existing_mapping)
+            identifiers_by_primary_key[primary_key] = _mapping_identifiers(mapping)
+    now = igsn_lib.time.dtnow()
+    change_mappings = [
+        {"thing_id": thing_id, "authority_id": mapping.get("authority_id"), "tstamp": now}
+        for thing_id, mapping in mappings_by_id.items()
+    ]
+    session.bulk_insert_mappings(mapper=Thing, mappings=new_mappings, return_defaults=False)
+    session.bulk_update_mappings(mapper=Thing, mappings=existing_mappings)
+    # bulk inserts don't return the generated keys, so look up the new rows in the same transaction
+    new_primary_keys = primary_keys_for_thing_ids(session, [mapping["id"] for mapping in new_mappings])
+    for mapping in new_mappings:
+        identifiers_by_primary_key[new_primary_keys[mapping["id"]]] = _mapping_identifiers(mapping)
+    save_thing_identifiers(session, identifiers_by_primary_key)
+    session.bulk_insert_mappings(mapper=ThingChange, mappings=change_mappings, return_defaults=False)
+    session.commit()
+    return len(new_mappings), len(existing_mappings)
+
+
+def save_or_update_things(session: Session, things: list[Thing]) -> tuple[int, int]:
+    """Batched equivalent of save_or_update_thing, committing once for the whole list of Things"""
+    thing_mappings = []
+    for thing in things:
+        insert_identifiers(thing)
+        thing_mappings.append({field: getattr(thing, field) for field in Thing.__fields__.keys()})
+    return save_or_update_thing_mappings(session, thing_mappings, update_fields=THING_UPDATE_FIELDS)
+
+
 def all_thing_identifier_objects(
     session: Session, min_id: int, batch_size: int
 ) -> list[ThingIdentifier]:
@@ -390,6 +804,71 @@ def all_thing_identifiers(session: Session, authority: typing.Optional[str] = No
     return thing_identifiers_dict
 
 
+def stream_thing_identifiers(
+    session: Session,
+    authority: typing.Optional[str] = None,
+    yield_per: int = 10000,
+    min_primary_key: int = 0,
+) -> typing.Iterator[typing.Tuple[str, int]]:
+    """Streams (identifier, primary key) for every identifier of every Thing with a primary key greater than
+    min_primary_key, in primary key order, over a server-side cursor.
+
+    Unlike all_thing_identifiers, only yield_per rows are held in memory at a time.
+    """
+    thing_identifiers_select = select(Thing.primary_key, Thing.id, Thing.identifiers)
+    if authority is not None:
+        thing_identifiers_select = thing_identifiers_select.where(Thing.authority_id == authority)
+    if min_primary_key > 0:
+        thing_identifiers_select = thing_identifiers_select.where(Thing.primary_key > min_primary_key)
+    thing_identifiers_select = thing_identifiers_select.order_by(Thing.primary_key.asc()).execution_options(
+        stream_results=True
+    )
+    for primary_key, thing_id, identifiers in session.execute(thing_identifiers_select).yield_per(yield_per):
+        for identifier in identifiers or [thing_id]:
+            yield identifier, primary_key
+
+
+def backfill_thing_identifiers(read_session: Session, write_session: Session, chunk_size: int = 10000) -> int:
+    """Copies the Thing.identifiers column of every Thing into the ThingIdentifier table, for databases with Things
+    saved before it was maintained, then marks the backfill done so lookups stop searching the column.
+
+    Identifiers are streamed from read_session and upserted with write_session, committing every chunk_size
+    identifiers along with the last primary key copied, so an interrupted backfill resumes where it left off.
+
+    Returns: the number of identifiers copied
+    """
+    min_primary_key = get_change_watermark(write_session, THING_IDENTIFIERS_BACKFILL_WATERMARK)
+    identifiers_by_primary_key: typing.Dict[int, list[str]] = {}
+    num_identifiers = 0
+    num_pending = 0
+
+    def save_chunk():
+        last_primary_key = max(identifiers_by_primary_key)
+        save_thing_identifiers(write_session, identifiers_by_primary_key)
+        # Commits the identifiers along with the watermark
+        save_change_watermark(write_session, THING_IDENTIFIERS_BACKFILL_WATERMARK, last_primary_key)
+        identifiers_by_primary_key.clear()
+        logging.info(f"Backfilled {num_identifiers} identifiers, through primary key {last_primary_key}")
+
+    for identifier, primary_key in stream_thing_identifiers(read_session, min_primary_key=min_primary_key):
+        # Only save between Things, so the watermark never passes one that's partially copied
+        if num_pending >= chunk_size and primary_key not in identifiers_by_primary_key:
+            save_chunk()
+            num_pending = 0
+        identifiers_by_primary_key.setdefault(primary_key, []).append(identifier)
+        num_identifiers += 1
+        num_pending += 1
+    if len(identifiers_by_primary_key) > 0:
+        save_chunk()
+    save_change_watermark(write_session, THING_IDENTIFIERS_BACKFILLED_WATERMARK, 1)
+    return num_identifiers
+
+
+def thing_identifier_map(session: Session, authority: typing.Optional[str] = None) -> CompactIdentifierMap:
+    """Memory-compact equivalent of all_thing_identifiers"""
+    return CompactIdentifierMap.from_pairs(stream_thing_identifiers(session, authority))
+
+
 def all_thing_primary_keys(session: Session, authority: typing.Optional[str] = None) -> typing.Dict[str, int]:
     thing_pk_select = select(Thing.primary_key, Thing.id)
     if authority is not None:
@@ -433,6 +912,200 @@ def mark_thing_not_found(session: Session, thing_id: str, resolved_url: str):
             .values(resolved_status=404)
             .values(resolved_url=resolved_url)
         )
+        _journal_thing_change(session, thing_id, existing_thing.authority_id)
+
+
+def thing_changes_since(
+    session: Session,
+    min_sequence: int,
+    authority: Optional[str] = None,
+    limit: int = 1000,
+) -> list[ThingChange]:
+    """Returns up to limit change journal entries with sequence > min_sequence, in sequence order"""
+    changes_select = select(ThingChange).filter(ThingChange.sequence > min_sequence)
+    if authority is not None:
+        changes_select = changes_select.filter(ThingChange.authority_id == authority)
+    changes_select = changes_select.order_by(ThingChange.sequence.asc()).limit(limit)
+    return session.exec(changes_select).all()
+
+
+def settled_change_sequence(
+    session: Session,
+    min_sequence: int,
+    max_sequence: int,
+    settle_time: datetime.timedelta = CHANGE_JOURNAL_SETTLE_TIME,
+) -> int:
+    """
+    The highest sequence number from min_sequence up to max_sequence that every change up to has been committed.
+
+    Sequence numbers are handed out as changes are written, not as their transactions commit, so a gap is usually
+    a transaction that is still running.  A consumer advancing its watermark past one would never see that change.
+    Gaps are only skipped once the change after them is older than settle_time, at which point the transaction
+    is taken to have rolled back.  Gaps are looked for across all authorities, as any of them may be the one missing.
+    """
+    previous = aliased(ThingChange)
+    after_gap_select = (
+        select(sqlalchemy.func.min(ThingChange.sequence))
+        .filter(ThingChange.sequence > min_sequence + 1, ThingChange.sequence <= max_sequence)
+        .filter(ThingChange.tstamp > igsn_lib.time.dtnow() - settle_time)
+        .filter(~sqlalchemy.exists().where(previous.sequence == ThingChange.sequence - 1))
+    )
+    after_gap = session.exec(after_gap_select).first()
+    if after_gap is None:
+        return max_sequence
+    before_gap_select = select(sqlalchemy.func.max(ThingChange.sequence)).filter(
+        ThingChange.sequence > min_sequence, ThingChange.sequence < after_gap
+    )
+    return session.exec(before_gap_select).first() or min_sequence
+
+
+def settled_thing_changes_since(
+    session: Session,
+    min_sequence: int,
+    authority: Optional[str] = None,
+    limit: int = 1000,
+) -> typing.Tuple[list[ThingChange], int]:
+    """
+    Like thing_changes_since, but stops short of any changes that may still be committed before them (see
+    settled_change_sequence).  Returns the changes along with the sequence number to resume from, which is safe to
+    save as a watermark.
+    """
+    changes = thing_changes_since(session, min_sequence, authority, limit)
+    if len(changes) == 0:
+        return [], min_sequence
+    next_sequence = settled_change_sequence(session, min_sequence, changes[-1].sequence)
+    return [change for change in changes if change.sequence <= next_sequence], next_sequence
+
+
+def thing_change_feed(
+    session: Session,
+    min_sequence: int,
+    authority: Optional[str] = None,
+    limit: int = 1000,
+) -> typing.Tuple[list[typing.Dict], int]:
+    """Returns a page of the change journal after min_sequence for replicas, and the sequence to resume from.
+
+    Repeated changes to a Thing within the page are collapsed into its latest one, whose sequence number serves as
+    the Thing's version.  Things that are no longer published with a 200 status (e.g. marked not found) are flagged
+    as deleted, so a replica only needs to fetch the rest.  The page ends before any change that may not have been
+    committed yet, so the next page can't miss it.
+    """
+    changes, next_sequence = settled_thing_changes_since(session, min_sequence, authority, limit)
+    if len(changes) == 0:
+        return [], next_sequence
+    latest_changes: typing.Dict[str, ThingChange] = {}
+    for change in changes:
+        # Re-insert so the dict stays ordered by each Thing's latest change
+        latest_changes.pop(change.thing_id, None)
+        latest_changes[change.thing_id] = change
+    thing_ids = list(latest_changes.keys())
+    published_ids = set()
+    for start in range(0, len(thing_ids), _MAX_IN_CLAUSE_SIZE):
+        chunk = thing_ids[start:start + _MAX_IN_CLAUSE_SIZE]
+        published_select = select(Thing.id).where(Thing.id.in_(chunk)).where(Thing.resolved_status == 200)
+        published_ids.update(session.exec(published_select).all())
+    entries = [
+        {
+            "sequence": change.sequence,
+            "id": change.thing_id,
+            "authority_id": change.authority_id,
+            "tstamp": change.tstamp,
+            "deleted": change.thing_id not in published_ids,
+        }
+        for change in latest_changes.values()
+    ]
+    return entries, next_sequence
+
+
+def thing_change_sequence_before(
+    session: Session, tstamp: datetime.datetime, authority: Optional[str] = None
+) -> int:
+    """The last change sequence number recorded before tstamp, for converting a timestamp watermark to a sequence"""
+    sequence_select = select(sqlalchemy.func.max(ThingChange.sequence)).filter(ThingChange.tstamp < tstamp)
+    if authority is not None:
+        sequence_select = sequence_select.filter(ThingChange.authority_id == authority)
+    return session.exec(sequence_select).first() or 0
+
+
+def max_thing_primary_key(session: Session, authority: Optional[str] = None) -> int:
+    primary_key_select = select(sqlalchemy.func.max(Thing.primary_key))
+    if authority is not None:
+        primary_key_select = primary_key_select.filter(Thing.authority_id == authority)
+    return session.exec(primary_key_select).first() or 0
+
+
+def max_thing_change_sequence(session: Session, authority: Optional[str] = None) -> int:
+    sequence_select = select(sqlalchemy.func.max(ThingChange.sequence))
+    if authority is not None:
+        sequence_select = sequence_select.filter(ThingChange.authority_id == authority)
+    return session.exec(sequence_select).first() or 0
+
+
+def get_change_watermark(session: Session, name: str) -> int:
+    """Returns the last change sequence number processed by the named consumer, 0 if it has never run"""
+    watermark = session.get(ChangeWatermark, name)
+    return watermark.sequence if watermark is not None else 0
+
+
+def save_change_watermark(session: Session, name: str, sequence: int):
+    watermark = session.get(ChangeWatermark, name)
+    if watermark is None:
+        watermark = ChangeWatermark(name=name)
+    watermark.sequence = sequence
+    watermark.tstamp = igsn_lib.time.dtnow()
+    session.add(watermark)
+    session.commit()
+
+
+def save_h3_count_cube(
+    session: Session,
+    counts: typing.Dict[typing.Tuple[int, str, str], typing.Dict[str, int]],
+    max_resolution: int,
+    category_field: str,
+    index_version: Optional[int] = None,
+):
+    """
+    Replaces the materialized h3 counts with counts, keyed by (resolution, source, category) with ALL_VALUES for the
+    source or category to count across all of them, computed from the solr index at index_version.  Readers keep
+    seeing the previous counts until the commit.
+    """
+    session.execute(sqlalchemy.delete(H3Count))
+    mappings = (
+        {"resolution": resolution, "source": source, "category": category, "h3": cell, "count": count}
+        for (resolution, source, category), cell_counts in counts.items()
+        for cell, count in cell_counts.items()
+    )
+    batch = []
+    for mapping in mappings:
+        batch.append(mapping)
+        if len(batch) >= 10000:
+            session.bulk_insert_mappings(mapper=H3Count, mappings=batch, return_defaults=False)
+            batch = []
+    if len(batch) > 0:
+        session.bulk_insert_mappings(mapper=H3Count, mappings=batch, return_defaults=False)
+    cube = session.get(H3CountCube, H3_COUNT_CUBE_NAME)
+    if cube is None:
+        cube = H3CountCube(name=H3_COUNT_CUBE_NAME)
+    cube.max_resolution = max_resolution
+    cube.category_field = category_field
+    cube.index_version = index_version
+    cube.tstamp = igsn_lib.time.dtnow()
+    session.add(cube)
+    session.commit()
+
+
+def get_h3_count_cube(session: Session) -> Optional[H3CountCube]:
+    return session.get(H3CountCube, H3_COUNT_CUBE_NAME)
+
+
+def h3_counts(
+    session: Session, resolution: int, source: str = ALL_VALUES, category: str = ALL_VALUES
+) -> typing.Dict[str, int]:
+    """The materialized count of records per h3 cell at resolution, for source and category"""
+    count_select = select(H3Count.h3, H3Count.count).filter(
+        H3Count.resolution == resolution, H3Count.source == source, H3Count.category == category
+    )
+    return {row[0]: row[1] for row in session.execute(count_select)}
 
 
 def save_person_with_orcid_id(session: Session, orcid_id: str) -> Person:
@@ -0,0 +1,343 @@
+import math
+import struct
+import typing
+from typing import Optional
+
+import h3
+import numpy as np
+
+import isb_web.config
+from isamples_metadata.Transformer import H3_FIELD_PREFIX, H3_RESOLUTIONS
+from isb_lib.utilities import h3_utilities
+from isb_web import heatmap_cache, isb_solr_query
+
+# Mapbox Vector Tiles, https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+MVT_VERSION = 2
+GEOM_POINT = 1
+GEOM_POLYGON = 3
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+# Tile coordinates run from 0 to the extent along each axis, y pointing down
+DEFAULT_EXTENT = 4096
+# Tile coordinates outside the extent that geometry is kept to, so renderers don't draw seams along tile edges
+DEFAULT_BUFFER = 64
+
+MAX_ZOOM = 24
+# Web mercator stops short of the poles
+MAX_MERCATOR_LATITUDE = 85.0511287798066
+
+# The tile layers
+H3_LAYER = "h3"
+HEATMAP_LAYER = "heatmap"
+THINGS_LAYER = "things"
+
+# Roughly how many h3 cells span a tile, whatever the zoom
+H3_CELLS_PER_TILE = 12
+# Fraction of a tile around it that records are counted in as well, enough to take in the whole of any h3 cell
+# overlapping the tile, so cells along tile edges have the same count in each tile
+_H3_TILE_MARGIN = 0.125
+# The heatmap cells are finer than the heatmap endpoints', a tile being a small part of a map
+_TILE_HEATMAP_ERR_PCT = 0.05
+
+_EARTH_CIRCUMFERENCE_KM = 40075.017
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field_varint(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value)
+
+
+def _field_bytes(field: int, value: bytes) -> bytes:
+    return _varint((field << 3) | 2) + _varint(len(value)) + value
+
+
+def _field_packed(field: int, values: typing.Iterable[int]) -> bytes:
+    return _field_bytes(field, b"".join(_varint(value) for value in values))
+
+
+def _value(value: typing.Any) -> bytes:
+    if isinstance(value, bool):
+        return _field_varint(7, int(value))
+    if isinstance(value, int):
+        return _field_varint(5, value) if value >= 0 else _field_varint(6, _zigzag(value))
+    if isinstance(value, float):
+        return _varint((3 << 3) | 1) + struct.pack("<d", value)
+    return _field_bytes(1, str(value).encode("utf-8"))
+
+
+def _command(command: int, count: int) -> int:
+    return (command & 0x7) | (count << 3)
+
+
+class Layer:
+    """A vector tile layer, with features added in tile coordinates"""
+
+    def __init__(self, name: str, extent: int = DEFAULT_EXTENT):
+        self.name = name
+        self.extent = extent
+        self._features: typing.List[bytes] = []
+        self._keys: typing.Dict[str, int] = {}
+        # Keyed on the type too, so that 1, 1.0 and True are different values
+        self._values: typing.Dict[typing.Tuple[type, typing.Any], int] = {}
+
+    def __len__(self):
+        return len(self._features)
+
+    def _tags(self, properties: typing.Dict[str, typing.Any]) -> typing.List[int]:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self._keys.setdefault(key, len(self._keys)))
+            tags.append(self._values.setdefault((type(value), value), len(self._values)))
+        return tags
+
+    def _add(self, geometry_type: int, geometry: typing.List[int], properties: typing.Dict[str, typing.Any]):
+        self._features.append(
+            _field_packed(2, self._tags(properties)) + _field_varint(3, geometry_type) + _field_packed(4, geometry)
+        )
+
+    def add_point(self, x: float, y: float, properties: typing.Dict[str, typing.Any]):
+        self._add(GEOM_POINT, [_command(_MOVE_TO, 1), _zigzag(round(x)), _zigzag(round(y))], properties)
+
+    def add_polygon(
+        self, ring: typing.Iterable[typing.Tuple[float, float]], properties: typing.Dict[str, typing.Any]
+    ) -> bool:
+        """
+        Adds a polygon with the ring as its exterior, in either winding order.  Returns False if the polygon is too
+        small to draw at the tile's resolution, and so wasn't added.
+        """
+        points: typing.List[typing.Tuple[int, int]] = []
+        for x, y in ring:
+            point = (round(x), round(y))
+            if len(points) == 0 or point != points[-1]:
+                points.append(point)
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        if len(points) < 3:
+            return False
+        area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]))
+        if area == 0:
+            return False
+        if area < 0:
+            # Exterior rings have a positive area, which is clockwise with y pointing down
+            points.reverse()
+        geometry = [_command(_MOVE_TO, 1)]
+        cursor_x, cursor_y = 0, 0
+        for i, (x, y) in enumerate(points):
+            if i == 1:
+                geometry.append(_command(_LINE_TO, len(points) - 1))
+            geometry.append(_zigzag(x - cursor_x))
+            geometry.append(_zigzag(y - cursor_y))
+            cursor_x, cursor_y = x, y
+        geometry.append(_command(_CLOSE_PATH, 1))
+        self._add(GEOM_POLYGON, geometry, properties)
+        return True
+
+    def encode(self) -> bytes:
+        encoded = [_field_varint(15, MVT_VERSION), _field_bytes(1, self.name.encode("utf-8"))]
+        encoded.extend(_field_bytes(2, feature) for feature in self._features)
+        encoded.extend(_field_bytes(3, key.encode("utf-8")) for key in self._keys)
+        encoded.extend(_field_bytes(4, _value(value)) for _, value in self._values)
+        encoded.append(_field_varint(5, self.extent))
+        return b"".join(encoded)
+
+
+def encode_tile(layers: typing.Iterable[Layer]) -> bytes:
+    """The Mapbox Vector Tile of layers, leaving out the empty ones"""
+    return b"".join(_field_bytes(3, layer.encode()) for layer in layers if len(layer) > 0)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _tile_latitude(y: float, z: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / 2 ** z))))
+
+
+def tile_bounds(z: int, x: int, y: int, margin: float = 0.0) -> typing.Tuple[float, float, float, float]:
+    """(west, south, east, north) of the web mercator tile, grown by margin (a fraction of the tile) on every side"""
+    n = 2 ** z
+    return (
+        (x - margin) / n * 360.0 - 180.0,
+        max(-90.0, _tile_latitude(y + 1 + margin, z)),
+        (x + 1 + margin) / n * 360.0 - 180.0,
+        min(90.0, _tile_latitude(y - margin, z)),
+    )
+
+
+def tile_x(longitudes: np.ndarray, z: int, x: int, extent: int = DEFAULT_EXTENT) -> np.ndarray:
+    """Tile coordinates of longitudes in tile x at zoom z, which are on the same side of the antimeridian as it"""
+    return ((np.asarray(longitudes, dtype=float) + 180.0) / 360.0 * 2 ** z - x) * extent
+
+
+def tile_y(latitudes: np.ndarray, z: int, y: int, extent: int = DEFAULT_EXTENT) -> np.ndarray:
+    latitudes = np.radians(np.clip(np.asarray(latitudes, dtype=float), -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE))
+    mercator = np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes))
+    return ((1.0 - mercator / math.pi) / 2.0 * 2 ** z - y) * extent
+
+
+def _unwrap(longitudes: np.ndarray, centre: float) -> np.ndarray:
+    # Moves longitudes across the antimeridian, if need be, to the side centre is on
+    return longitudes + 360.0 * np.round((centre - longitudes) / 360.0)
+
+
+def tile_h3_resolution(z: int, y: int) -> int:
+    """The h3 resolution whose cells are about 1/H3_CELLS_PER_TILE of the width of tile row y at zoom z"""
+    _, south, _, north = tile_bounds(z, 0, y)
+    tile_km = _EARTH_CIRCUMFERENCE_KM * math.cos(math.radians((south + north) / 2.0)) / 2 ** z
+    for resolution in H3_RESOLUTIONS:
+        if 2.0 * h3.average_hexagon_edge_length(resolution, unit="km") <= tile_km / H3_CELLS_PER_TILE:
+            return resolution
+    return H3_RESOLUTIONS[-1]
+
+
+def _overlaps(xs: np.ndarray, ys: np.ndarray, extent: int) -> bool:
+    return xs.max() >= 0 and xs.min() <= extent and ys.max() >= 0 and ys.min() <= extent
+
+
+async def _h3_layer(z: int, x: int, y: int, q: str, fq: Optional[str], extent: int) -> Layer:
+    resolution = tile_h3_resolution(z, y)
+    counts = await isb_solr_query.async_solr_facet_counts(
+        q, f"{H3_FIELD_PREFIX}{resolution}", tile_bounds(z, x, y, _H3_TILE_MARGIN), fq=fq
+    )
+    west, _, east, _ = tile_bounds(z, x, y)
+    layer = Layer(H3_LAYER, extent)
+    for cell, count in counts.items():
+        if cell in h3_utilities.POLES:
+            # Spread across every longitude, they don't have a sensible shape in web mercator
+            continue
+        latitudes, longitudes = np.array(h3.cell_to_boundary(cell)).T
+        xs = tile_x(_unwrap(longitudes, (west + east) / 2.0), z, x, extent)
+        ys = tile_y(latitudes, z, y, extent)
+        if _overlaps(xs, ys, extent):
+            layer.add_polygon(zip(xs.tolist(), ys.tolist()), {"h3": cell, "count": count})
+    return layer
+
+
+async def _heatmap_layer(z: int, x: int, y: int, q: str, fq: Optional[str], extent: int, buffer: int) -> Layer:
+    west, south, east, north = tile_bounds(z, x, y, buffer / extent)
+    bounds = {
+        isb_solr_query.MIN_LAT: south,
+        isb_solr_query.MAX_LAT: north,
+        isb_solr_query.MIN_LON: west,
+        isb_solr_query.MAX_LON: east,
+    }
+    grid = await isb_solr_query.async_solr_heatmap_grid(q, bounds, fq=fq, dist_err_pct=_TILE_HEATMAP_ERR_PCT)
+    # Heatmap cells are rectangles, so clipping the coordinates clips the cells
+    lefts = np.clip(tile_x(grid.lefts, z, x, extent), -buffer, extent + buffer).tolist()
+    rights = np.clip(tile_x(grid.rights, z, x, extent), -buffer, extent + buffer).tolist()
+    tops = np.clip(tile_y(grid.tops, z, y, extent), -buffer, extent + buffer).tolist()
+    bottoms = np.clip(tile_y(grid.bottoms, z, y, extent), -buffer, extent + buffer).tolist()
+    layer = Layer(HEATMAP_LAYER, extent)
+    for row, column, count in zip(grid.rows.tolist(), grid.columns.tolist(), grid.values.tolist()):
+        left, right, top, bottom = lefts[column], rights[column], tops[row], bottoms[row]
+        layer.add_polygon([(left, top), (right, top), (right, bottom), (left, bottom)], {"count": count})
+    return layer
+
+
+async def _things_layer(
+    z: int, x: int, y: int, q: str, fq: Optional[str], extent: int, buffer: int, max_points: int
+) -> Optional[Layer]:
+    """The things in the tile as points, or None if there are more than max_points of them"""
+    num_found, docs = await isb_solr_query.async_solr_points(
+        q, tile_bounds(z, x, y, buffer / extent), fq=fq, rows=max_points
+    )
+    if num_found > max_points:
+        return None
+    west, _, east, _ = tile_bounds(z, x, y)
+    xs = tile_x(_unwrap(np.array([doc["x"] for doc in docs], dtype=float), (west + east) / 2.0), z, x, extent)
+    ys = tile_y(np.array([doc["y"] for doc in docs], dtype=float), z, y, extent)
+    layer = Layer(THINGS_LAYER, extent)
+    for doc, point_x, point_y in zip(docs, xs.tolist(), ys.tolist()):
+        layer.add_point(point_x, point_y, {"id": doc["id"], "source": doc.get("source")})
+    return layer
+
+
+async def things_tile(
+    z: int,
+    x: int,
+    y: int,
+    q: str = "*:*",
+    fq: Optional[str] = None,
+    aggregation: str = H3_LAYER,
+    point_min_zoom: int = 12,
+    max_points: int = 10000,
+    extent: int = DEFAULT_EXTENT,
+    buffer: int = DEFAULT_BUFFER,
+) -> bytes:
+    """
+    The Mapbox Vector Tile of the things matching q and fq in web mercator tile x, y at zoom z.
+
+    From point_min_zoom, the tile has a "things" layer with a point per thing, with its id and source.  Below it, or
+    if there are more than max_points things in the tile, there's a polygon per cell with the count of things in it
+    instead: an "h3" layer of h3 cells (at a resolution to suit the zoom) or, if aggregation is "heatmap", a "heatmap"
+    layer of solr heatmap cells.
+    """
+    if z >= point_min_zoom:
+        layer = await _things_layer(z, x, y, q, fq, extent, buffer, max_points)
+        if layer is not None:
+            return encode_tile([layer])
+    if aggregation == HEATMAP_LAYER:
+        return encode_tile([await _heatmap_layer(z, x, y, q, fq, extent, buffer)])
+    return encode_tile([await _h3_layer(z, x, y, q, fq, extent)])
+
+
+_tile_cache: Optional[heatmap_cache.ResponseCache[bytes]] = None
+
+
+def get_tile_cache() -> heatmap_cache.ResponseCache[bytes]:
+    """The web app's in memory cache of encoded vector tiles, created from the settings on first use"""
+    global _tile_cache
+    if _tile_cache is None:
+        settings = isb_web.config.Settings()
+        _tile_cache = heatmap_cache.ResponseCache[bytes](
+            max_entries=settings.tile_cache_max_entries,
+            ttl=settings.tile_cache_ttl,
+            index_version=isb_solr_query.async_solr_index_version,
+            index_check_interval=settings.heatmap_cache_index_check_interval,
+        )
+    return _tile_cache
+
+
+async def cached_things_tile(
+    z: int,
+    x: int,
+    y: int,
+    q: str = "*:*",
+    fq: Optional[str] = None,
+    aggregation: str = H3_LAYER,
+    point_min_zoom: int = 12,
+    max_points: int = 10000,
+) -> bytes:
+    """things_tile, from the tile cache"""
+    params = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "q": q,
+        "fq": fq,
+        "aggregation": aggregation,
+        "point_min_zoom": point_min_zoom,
+        "max_points": max_points,
+    }
+
+    async def render() -> bytes:
+        return await things_tile(z, x, y, q, fq, aggregation, point_min_zoom=point_min_zoom, max_points=max_points)
+
+    return await get_tile_cache().get(params, render)
@@ -0,0 +1,63 @@
+import logging
+import time
+
+import click
+import numpy as np
+
+from isamples_metadata.Transformer import (
+    H3_RESOLUTIONS,
+    geo_to_h3,
+    geo_to_h3_resolutions,
+    geo_to_h3_resolutions_array,
+    h3_cells_to_strings,
+)
+
+
+def _per_resolution(latitudes: np.ndarray, longitudes: np.ndarray) -> int:
+    # What Transformer.transform and lat_lon_to_solr used to do: index the coordinates from scratch at each resolution
+    num_cells = 0
+    for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist()):
+        for resolution in H3_RESOLUTIONS:
+            if geo_to_h3(latitude, longitude, resolution) is not None:
+                num_cells += 1
+    return num_cells
+
+
+def _single_pass(latitudes: np.ndarray, longitudes: np.ndarray) -> int:
+    num_cells = 0
+    for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist()):
+        num_cells += len(geo_to_h3_resolutions(latitude, longitude))
+    return num_cells
+
+
+def _batch(latitudes: np.ndarray, longitudes: np.ndarray) -> int:
+    cells_by_resolution = geo_to_h3_resolutions_array(latitudes, longitudes)
+    # Include formatting the cells as strings, since that's what ends up in the solr documents
+    return sum(len(h3_cells_to_strings(cells).tolist()) for cells in cells_by_resolution.values())
+
+
+@click.command()
+@click.option(
+    "-n", "--num_records", type=int, default=100000, show_default=True, help="Number of random coordinates to index"
+)
+def main(num_records):
+    """Compares per-record time to compute the h3 cells at every resolution one at a time, in one pass, and batched."""
+    logging.basicConfig(level=logging.INFO)
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(-90, 90, num_records)
+    longitudes = rng.uniform(-180, 180, num_records)
+    for label, compute in [("per resolution", _per_resolution), ("single pass", _single_pass), ("batch", _batch)]:
+        start = time.time()
+        num_cells = compute(latitudes, longitudes)
+        elapsed = time.time() - start
+        logging.info(
+            "%s: %d cells for %d records in %.2fs, %.2f µs/record",
+            label, num_cells, num_records, elapsed, elapsed / num_records * 1e6
+        )
+
+
+"""
+Benchmarks computing the producedBy_samplingSite_location_h3_* values for all resolutions
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import logging
+import time
+import typing
+
+import click
+import geojson
+import numpy as np
+
+from isb_web import heatmap_grid
+
+
+def _cell_by_cell(hm: typing.Dict) -> bytes:
+    # What _geojson_heatmap used to do: a geojson.Polygon per cell from nested loops, then encode the lot
+    dd_lat = (hm["maxY"] - hm["minY"]) / hm["rows"]
+    dd_lon = (hm["maxX"] - hm["minX"]) / hm["columns"]
+    grid = []
+    total = 0
+    max_value = 0
+    for i_row in range(0, hm["rows"]):
+        for i_col in range(0, hm["columns"]):
+            if hm["counts_ints2D"][i_row] is not None:
+                v = hm["counts_ints2D"][i_row][i_col]
+                if v > 0:
+                    total = total + v
+                    max_value = max(max_value, v)
+                    p0lat = hm["maxY"] - dd_lat * i_row
+                    p0lon = hm["minX"] + dd_lon * i_col
+                    pts = geojson.Polygon(
+                        [[
+                            (p0lon, p0lat),
+                            (p0lon + dd_lon, p0lat),
+                            (p0lon + dd_lon, p0lat - dd_lat),
+                            (p0lon, p0lat - dd_lat),
+                            (p0lon, p0lat),
+                        ]]
+                    )
+                    grid.append(geojson.Feature(geometry=pts, properties={"count": v}))
+    geodata = geojson.FeatureCollection(grid)
+    geodata["max_count"] = max_value
+    geodata["total"] = total
+    return json.dumps(geodata).encode("utf-8")
+
+
+def _vectorized(hm: typing.Dict) -> bytes:
+    return json.dumps(heatmap_grid.HeatmapGrid(hm).geojson()).encode("utf-8")
+
+
+def _serialized(hm: typing.Dict) -> bytes:
+    return heatmap_grid.HeatmapGrid(hm).geojson_bytes()
+
+
+def _leaflet(hm: typing.Dict) -> bytes:
+    return json.dumps(heatmap_grid.HeatmapGrid(hm).leaflet()).encode("utf-8")
+
+
+@click.command()
+@click.option("-r", "--rows", type=int, default=1000, show_default=True, help="Number of rows in the heatmap")
+@click.option("-c", "--columns", type=int, default=1000, show_default=True, help="Number of columns in the heatmap")
+@click.option(
+    "-d", "--density", type=float, default=0.5, show_default=True, help="Fraction of the cells with a count"
+)
+def main(rows, columns, density):
+    """Compares the time to render a synthetic solr heatmap as GeoJSON cell by cell, vectorized, and serialized."""
+    logging.basicConfig(level=logging.INFO)
+    rng = np.random.default_rng(0)
+    counts = rng.integers(1, 1000, (rows, columns)) * (rng.random((rows, columns)) < density)
+    hm = {
+        "gridLevel": 7,
+        "rows": rows,
+        "columns": columns,
+        "minX": -180.0,
+        "maxX": 180.0,
+        "minY": -90.0,
+        "maxY": 90.0,
+        "counts_ints2D": counts.tolist(),
+    }
+    num_cells = int(np.count_nonzero(counts))
+    for label, render in [
+        ("cell by cell", _cell_by_cell),
+        ("vectorized", _vectorized),
+        ("serialized", _serialized),
+        ("leaflet", _leaflet),
+    ]:
+        start = time.time()
+        content = render(hm)
+        elapsed = time.time() - start
+        logging.info(
+            "%s: %d cells in %.2fs, %.2f µs/cell, %.1f MB", label, num_cells, elapsed, elapsed / num_cells * 1e6,
+            len(content) / 1e6
+        )
+
+
+"""
+Benchmarks rendering solr heatmap facets as the GeoJSON and Leaflet heatmap responses
+"""
+if __name__ == "__main__":
+    main()
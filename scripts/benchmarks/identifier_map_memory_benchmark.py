@@ -0,0 +1,52 @@
+import logging
+import time
+import tracemalloc
+
+import click
+
+from isb_lib.utilities.identifier_map import CompactIdentifierMap
+
+
+def _pairs(num_identifiers: int):
+    for i in range(num_identifiers):
+        yield f"IGSN:XYZ{i:09d}", i
+
+
+def _measure(label: str, build_function, num_identifiers: int):
+    tracemalloc.start()
+    start = time.time()
+    identifier_map = build_function()
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    identifiers = [identifier for identifier, _ in _pairs(min(num_identifiers, 100000))]
+    lookup_start = time.time()
+    for identifier in identifiers:
+        identifier_map.get(identifier)
+    lookup_elapsed = time.time() - lookup_start
+    logging.info(
+        "%s: built in %.2fs, retained %.1f MB (peak %.1f MB), 100k single lookups in %.2fs",
+        label, elapsed, current / 1e6, peak / 1e6, lookup_elapsed
+    )
+    if isinstance(identifier_map, CompactIdentifierMap):
+        lookup_start = time.time()
+        identifier_map.get_many(identifiers)
+        logging.info("%s: 100k batched lookups in %.2fs", label, time.time() - lookup_start)
+
+
+@click.command()
+@click.option(
+    "-n", "--num_identifiers", type=int, default=2_000_000, show_default=True, help="Number of synthetic identifiers"
+)
+def main(num_identifiers):
+    """Compares the memory used by a dict of identifier -> primary key against a CompactIdentifierMap."""
+    logging.basicConfig(level=logging.INFO)
+    _measure("dict", lambda: dict(_pairs(num_identifiers)), num_identifiers)
+    _measure("CompactIdentifierMap", lambda: CompactIdentifierMap.from_pairs(_pairs(num_identifiers)), num_identifiers)
+
+
+"""
+Benchmarks the memory used by identifier to primary key maps, as used when consuming sitemaps
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import concurrent.futures
+import gzip
+import logging
+import os
+import resource
+import tempfile
+import time
+
+import click
+import lxml.etree
+
+from isb_lib.sitemaps.sitemap_fetcher import SITEMAP_CHUNK_SIZE, SITEMAP_NAMESPACE, iter_sitemap_entries
+
+
+def _write_sitemap(path: str, num_entries: int, gzipped: bool):
+    open_function = gzip.open if gzipped else open
+    with open_function(path, "wt") as sitemap_file:
+        sitemap_file.write(f'<?xml version="1.0" encoding="utf-8"?>\n<urlset xmlns="{SITEMAP_NAMESPACE}">\n')
+        for i in range(num_entries):
+            sitemap_file.write(
+                f"  <url>\n    <loc>https://mars.cyverse.org/thing/ark:/21547/BENCH{i:08d}?full=false&amp;"
+                f"format=core</loc>\n    <lastmod>2021-07-02T22:49:54Z</lastmod>\n  </url>\n"
+            )
+        sitemap_file.write("</urlset>\n")
+
+
+def _parse_fromstring(path: str) -> int:
+    # What _fetch_file used to do: hold the whole body and tree, then collect every loc
+    with open(path, "rb") as sitemap_file:
+        content = sitemap_file.read()
+    if path.endswith(".gz"):
+        content = gzip.decompress(content)
+    root = lxml.etree.fromstring(content)
+    urls = [child.findtext(f"{{{SITEMAP_NAMESPACE}}}loc") for child in root.getchildren()]
+    return len(urls)
+
+
+def _parse_streaming(path: str) -> int:
+    with open(path, "rb") as sitemap_file:
+        chunks = iter(lambda: sitemap_file.read(SITEMAP_CHUNK_SIZE), b"")
+        return sum(1 for _ in iter_sitemap_entries(chunks))
+
+
+def _run(parse_function, path: str):
+    start = time.time()
+    num_entries = parse_function(path)
+    elapsed = time.time() - start
+    # libxml2 allocations aren't visible to tracemalloc, so use the peak RSS of this (fresh) worker process
+    return num_entries, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@click.command()
+@click.option(
+    "-n", "--num_entries", type=int, default=50000, show_default=True, help="Number of entries in the synthetic sitemap"
+)
+@click.option("-g", "--gzipped", is_flag=True, help="Benchmark a gzipped (.xml.gz) sitemap")
+def main(num_entries, gzipped):
+    """Compares parsing a large sitemap with lxml.etree.fromstring against streaming it through iter_sitemap_entries."""
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "sitemap.xml.gz" if gzipped else "sitemap.xml")
+        _write_sitemap(path, num_entries, gzipped)
+        logging.info("Synthetic sitemap is %.1f MB", os.path.getsize(path) / 1e6)
+        for label, parse_function in [("fromstring", _parse_fromstring), ("iter_sitemap_entries", _parse_streaming)]:
+            # Each run gets its own process so the peak RSS of one doesn't hide the other's
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                baseline_rss = executor.submit(_run, len, "").result()[2]
+                num_parsed, elapsed, peak_rss = executor.submit(_run, parse_function, path).result()
+            logging.info(
+                "%s: %d entries in %.2fs, peak RSS %.1f MB above a %.1f MB baseline",
+                label, num_parsed, elapsed, peak_rss - baseline_rss, baseline_rss
+            )
+
+
+"""
+Benchmarks memory and time to parse a large (e.g. 50k URL) sitemap file, as consumed by consume_sitemaps.py
+"""
+if __name__ == "__main__":
+    main()
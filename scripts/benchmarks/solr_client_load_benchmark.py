@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import socket
+import statistics
+import threading
+import time
+import typing
+
+import aiohttp
+import click
+import fastapi
+import uvicorn
+
+from isb_web import isb_solr_query
+
+SOLR_PATH = "/solr/isb_core_records/"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def solr_stand_in_app(latency: float) -> fastapi.FastAPI:
+    """A solr stand-in whose /select takes latency seconds to answer, like a query doing real work"""
+    app = fastapi.FastAPI()
+
+    @app.get(f"{SOLR_PATH}select")
+    async def select(q: str, rows: int = 10):
+        await asyncio.sleep(latency)
+        identifier = q[len("id:"):].replace("\\", "")
+        docs = [{"id": identifier, "source": "SESAR"}] + [{"id": f"IGSN:BENCH{i:08d}"} for i in range(rows - 1)]
+        return {"response": {"numFound": rows, "docs": docs}}
+
+    return app
+
+
+def web_app() -> fastapi.FastAPI:
+    """The thing lookup and select passthrough endpoints, as they were wired before and after the async solr client"""
+    app = fastapi.FastAPI()
+
+    @app.get("/before/thing/{identifier:path}")
+    async def before_thing(identifier: str):
+        status, doc = isb_solr_query.solr_get_record(identifier)
+        return fastapi.responses.JSONResponse(content=doc, status_code=status)
+
+    @app.get("/after/thing/{identifier:path}")
+    async def after_thing(identifier: str):
+        status, doc = await isb_solr_query.async_solr_get_record(identifier)
+        return fastapi.responses.JSONResponse(content=doc, status_code=status)
+
+    @app.get("/before/select")
+    async def before_select(request: fastapi.Request):
+        return isb_solr_query.solr_query(request.query_params.multi_items())
+
+    @app.get("/after/select")
+    async def after_select(request: fastapi.Request):
+        return await isb_solr_query.async_solr_query(request.query_params.multi_items())
+
+    return app
+
+
+def _serve(app: fastapi.FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+async def _load(url: str, num_requests: int, concurrency: int) -> typing.Tuple[float, typing.List[float]]:
+    latencies: typing.List[float] = []
+    remaining = iter(range(num_requests))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+
+        async def _worker():
+            for index in remaining:
+                start = time.perf_counter()
+                async with session.get(url.format(index=index)) as response:
+                    response.raise_for_status()
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[_worker() for _ in range(concurrency)])
+        return time.perf_counter() - start, latencies
+
+
+@click.command()
+@click.option(
+    "-n", "--num_requests", type=int, default=1000, show_default=True, help="Number of requests per endpoint"
+)
+@click.option(
+    "-c", "--concurrency", type=int, default=50, show_default=True, help="Number of concurrent client requests"
+)
+@click.option(
+    "-l", "--latency", type=float, default=0.02, show_default=True, help="Seconds the solr stand-in takes per query"
+)
+def main(num_requests, concurrency, latency):
+    """Compares requests/sec the solr backed endpoints serve with blocking requests calls and the async client."""
+    logging.basicConfig(level=logging.INFO)
+    solr_port = _free_port()
+    isb_solr_query.BASE_URL = f"http://127.0.0.1:{solr_port}{SOLR_PATH}"
+    solr_server = _serve(solr_stand_in_app(latency), solr_port)
+    web_port = _free_port()
+    web_server = _serve(web_app(), web_port)
+    try:
+        for endpoint in ["thing/IGSN:BENCH{index:08d}", "select?q=*:*&rows=100"]:
+            for wiring in ["before", "after"]:
+                url = f"http://127.0.0.1:{web_port}/{wiring}/{endpoint}"
+                elapsed, latencies = asyncio.run(_load(url, num_requests, concurrency))
+                latencies.sort()
+                logging.info(
+                    "%s %s: %d requests in %.2fs, %.0f requests/sec, median %.1fms, p99 %.1fms",
+                    wiring,
+                    endpoint.split("?")[0].split("/")[0],
+                    num_requests,
+                    elapsed,
+                    num_requests / elapsed,
+                    statistics.median(latencies) * 1000,
+                    latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                )
+    finally:
+        web_server.should_exit = True
+        solr_server.should_exit = True
+
+
+"""
+Load tests the solr backed endpoints of the web app against a local solr stand-in with fixed query latency, with many
+concurrent clients
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import logging
+import time
+
+import click
+
+import isb_lib.core
+import isb_lib.geome_adapter
+import isb_lib.opencontext_adapter
+import isb_lib.sesar_adapter
+import isb_lib.smithsonian_adapter
+
+CORE_RECORD_FUNCTIONS = {
+    isb_lib.sesar_adapter.SESARItem.AUTHORITY_ID: isb_lib.sesar_adapter.reparseAsCoreRecord,
+    isb_lib.opencontext_adapter.OpenContextItem.AUTHORITY_ID: isb_lib.opencontext_adapter.reparse_as_core_record,
+    isb_lib.geome_adapter.GEOMEItem.AUTHORITY_ID: isb_lib.geome_adapter.reparseAsCoreRecord,
+    isb_lib.smithsonian_adapter.SmithsonianItem.AUTHORITY_ID: isb_lib.smithsonian_adapter.reparse_as_core_record,
+}
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-a", "--authority", type=click.Choice(list(CORE_RECORD_FUNCTIONS.keys())), default="SESAR", show_default=True
+)
+@click.option(
+    "-w", "--num_workers", type=int, multiple=True, default=[1, 4, 16], show_default=True,
+    help="Worker counts to compare, may be specified multiple times"
+)
+@click.option(
+    "-m", "--max_records", type=int, default=100000, show_default=True, help="Number of Things to transform per run"
+)
+@click.option(
+    "-u", "--unordered", is_flag=True, help="Let workers return results out of database order"
+)
+def main(db_url, authority, num_workers, max_records, unordered):
+    """Measures throughput of the CoreSolrImporter transform stage (no solr requests are made) by worker count."""
+    isb_lib.core.initialize_logging("INFO")
+    core_record_function = CORE_RECORD_FUNCTIONS[authority]
+    for workers in num_workers:
+        importer = isb_lib.core.CoreSolrImporter(
+            db_url=db_url,
+            authority_id=authority,
+            db_batch_size=1000,
+            solr_batch_size=1000,
+            solr_url="",
+            limit=max_records,
+            num_workers=workers,
+            ordered_results=not unordered,
+        )
+        num_things = 0
+        num_docs = 0
+        start = time.time()
+        for _, core_records in importer.transformed_records(core_record_function):
+            num_things += 1
+            num_docs += len(core_records)
+        elapsed = time.time() - start
+        logging.info(
+            "workers: %d things: %d docs: %d elapsed: %.2fs things/sec: %.1f",
+            workers,
+            num_things,
+            num_docs,
+            elapsed,
+            num_things / elapsed if elapsed > 0 else 0,
+        )
+
+
+"""
+Compares transform throughput of the solr importer for different worker process counts
+"""
+if __name__ == "__main__":
+    main()
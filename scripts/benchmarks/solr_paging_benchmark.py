@@ -0,0 +1,116 @@
+import heapq
+import logging
+import time
+import typing
+import urllib.parse
+
+import click
+import fastapi
+import numpy as np
+from fastapi.testclient import TestClient
+
+from isb_lib.utilities import json_streaming
+from isb_web import isb_solr_query
+from isb_web.isb_solr_query import (
+    ISBCoreSolrRecordIterator,
+    PAGING_CURSOR,
+    PAGING_EXPORT,
+    PAGING_OFFSET,
+    CURSOR_MARK_START,
+)
+
+# Where the stand-in pretends solr lives, only the path matters to the TestClient
+STAND_IN_SOLR_URL = "http://localhost:8983/solr/isb_core_records/"
+
+
+def _doc(key: int) -> dict:
+    return {"id": f"IGSN:BENCH{key:08d}", "sourceUpdatedTime": "2021-07-02T22:49:54Z"}
+
+
+def solr_stand_in_app(num_docs: int) -> fastapi.FastAPI:
+    """
+    A local solr stand-in over num_docs documents sorted by id, modelling what solr's collectors do for each kind of
+    request: start/rows has to keep the top start + rows documents of the whole index, a cursorMark only the top rows
+    after the mark, and /export sorts once and streams everything.
+    """
+    app = fastapi.FastAPI()
+    # Documents sit in the index in insertion order, not sort order
+    sort_keys = np.random.default_rng(0).permutation(num_docs).tolist()
+
+    def path(handler: str) -> str:
+        return urllib.parse.urlparse(urllib.parse.urljoin(STAND_IN_SOLR_URL, handler)).path
+
+    @app.get(path("select"))
+    def select(q: str, rows: int, start: int = 0, cursorMark: typing.Optional[str] = None):
+        # Like solr's TopFieldCollector, visit every matching document keeping a priority queue of the best ones
+        if cursorMark is not None:
+            after = sort_keys
+            if cursorMark != CURSOR_MARK_START:
+                after = (key for key in sort_keys if key > int(cursorMark))
+            collected = heapq.nsmallest(rows, after)
+            next_cursor_mark = str(collected[-1]) if len(collected) > 0 else cursorMark
+            return {
+                "response": {"numFound": num_docs, "docs": [_doc(key) for key in collected]},
+                "nextCursorMark": next_cursor_mark,
+            }
+        collected = heapq.nsmallest(start + rows, sort_keys)[start:]
+        return {"response": {"numFound": num_docs, "docs": [_doc(key) for key in collected]}}
+
+    @app.get(path("export"))
+    def export(q: str, fl: str, sort: str):
+        def body() -> typing.Iterator[bytes]:
+            yield b'{"responseHeader":{"status":0},"response":{"numFound":%d,"docs":' % num_docs
+            yield from json_streaming.json_array_chunks(_doc(key) for key in sorted(sort_keys))
+            yield b"}}"
+
+        return fastapi.responses.StreamingResponse(body(), media_type="application/json")
+
+    return app
+
+
+@click.command()
+@click.option(
+    "-n", "--num_docs", type=int, default=1000000, show_default=True, help="Number of documents in the stand-in"
+)
+@click.option(
+    "-b", "--batch_size", type=int, default=50000, show_default=True, help="Number of documents per select request"
+)
+@click.option(
+    "-p",
+    "--paging",
+    type=click.Choice([PAGING_OFFSET, PAGING_CURSOR, PAGING_EXPORT]),
+    multiple=True,
+    help="Paging mode(s) to benchmark, defaults to all of them",
+)
+def main(num_docs, batch_size, paging):
+    """Compares the time to iterate a whole solr index with ISBCoreSolrRecordIterator in each paging mode."""
+    logging.basicConfig(level=logging.INFO)
+    isb_solr_query.BASE_URL = STAND_IN_SOLR_URL
+    client = TestClient(solr_stand_in_app(num_docs))
+    for mode in paging or [PAGING_OFFSET, PAGING_CURSOR, PAGING_EXPORT]:
+        iterator = ISBCoreSolrRecordIterator(
+            client, "*:*", batch_size, 0, "id asc", mode, "id,sourceUpdatedTime"
+        )
+        batch_times = []
+        num_records = 0
+        start = time.time()
+        batch_start = start
+        for _ in iterator:
+            num_records += 1
+            if num_records % batch_size == 0:
+                now = time.time()
+                batch_times.append(now - batch_start)
+                batch_start = now
+        elapsed = time.time() - start
+        logging.info(
+            "%s: %d records in %.2fs (%.0f records/sec), slowest batch %.2fs",
+            mode, num_records, elapsed, num_records / elapsed, max(batch_times)
+        )
+
+
+"""
+Benchmarks iterating a 1M document solr index page by page with start/rows, cursorMark and the /export handler,
+against a local solr stand-in
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import json
+import logging
+import time
+import tracemalloc
+
+import click
+
+from isb_lib.utilities import json_streaming
+
+
+def _synthetic_solr_doc(index: int) -> dict:
+    return {
+        "id": f"IGSN:BENCH{index:08d}",
+        "isb_core_id": f"https://data.isamples.org/IGSN:BENCH{index:08d}",
+        "source": "SESAR",
+        "label": f"Sample {index}",
+        "description": "Synthetic benchmark sample " * 8,
+        "hasMaterialCategory": ["Rock"],
+        "hasMaterialCategoryConfidence": [0.93],
+        "keywords": ["benchmark", "synthetic", "sample"],
+        "producedBy_samplingSite_location_latitude": (index % 180) - 90.0,
+        "producedBy_samplingSite_location_longitude": (index % 360) - 180.0,
+        "producedBy_samplingSite_location_rpt": f"POINT ({(index % 360) - 180.0} {(index % 180) - 90.0})",
+    }
+
+
+def _measure(label: str, serialize) -> None:
+    tracemalloc.start()
+    start = time.time()
+    num_bytes = serialize()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logging.info("%s: %d bytes in %.2fs, peak memory above baseline %.1f MB", label, num_bytes, elapsed, peak / 1e6)
+
+
+@click.command()
+@click.option(
+    "-n", "--num_docs", type=int, default=100000, show_default=True, help="Number of synthetic solr docs in the batch"
+)
+def main(num_docs):
+    """Compares peak memory of the old single-string solr update payload against the streamed chunked body."""
+    logging.basicConfig(level=logging.INFO)
+    docs = [_synthetic_solr_doc(index) for index in range(num_docs)]
+    logging.info("orjson available: %s", json_streaming.orjson is not None)
+
+    def materialized() -> int:
+        data = json.dumps(docs).encode("utf-8")
+        # The old debug line formatted the payload even with debug logging off
+        debug_str = str(data)
+        return len(data) + 0 * len(debug_str)
+
+    def streamed() -> int:
+        return sum(len(chunk) for chunk in json_streaming.json_array_chunks(docs))
+
+    _measure("json.dumps payload", materialized)
+    _measure("streamed payload", streamed)
+
+
+"""
+Measures memory used to serialize a large solr update batch
+"""
+if __name__ == "__main__":
+    main()
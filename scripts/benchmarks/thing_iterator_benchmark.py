@@ -0,0 +1,87 @@
+import datetime
+import logging
+import time
+import tracemalloc
+
+import click
+
+import isb_lib.core
+from isb_lib.models.thing import Thing
+from isb_web.sqlmodel_database import SQLModelDAO
+
+
+def _populate_things(session, authority: str, num_things: int):
+    resolved_content = {"description": "Synthetic benchmark sample " * 50, "values": list(range(100))}
+    for i in range(num_things):
+        session.add(
+            Thing(
+                id=f"benchmark:{i}",
+                authority_id=authority,
+                resolved_url="http://example.org",
+                resolved_status=200,
+                resolved_content=resolved_content,
+                tcreated=datetime.datetime.now(),
+            )
+        )
+        if i % 10000 == 0:
+            session.commit()
+    session.commit()
+
+
+def _iterate(label: str, records) -> None:
+    tracemalloc.start()
+    start = time.time()
+    num_records = 0
+    for record in records:
+        # Touch the content like a transformer would
+        num_records += record.resolved_content is not None
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logging.info(
+        "%s: %d records in %.2fs (%.0f/sec), peak memory %.1f MB",
+        label, num_records, elapsed, num_records / elapsed if elapsed > 0 else 0, peak / 1e6
+    )
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default="sqlite:///thing_iterator_benchmark.db", show_default=True,
+    help="SQLAlchemy database URL, SQLite or Postgres"
+)
+@click.option(
+    "-a", "--authority", default="BENCHMARK", show_default=True, help="Authority of the Things to iterate"
+)
+@click.option(
+    "-p", "--populate", type=int, default=0, help="Number of synthetic Things to insert before measuring"
+)
+@click.option(
+    "-s", "--page_size", type=int, default=5000, show_default=True
+)
+def main(db_url, authority, populate, page_size):
+    """Compares offset/keyset paging of full Things against streaming projected columns."""
+    logging.basicConfig(level=logging.INFO)
+    dao = SQLModelDAO(db_url)
+    if populate > 0:
+        session = dao.get_session()
+        _populate_things(session, authority, populate)
+        session.close()
+
+    session = dao.get_session()
+    iterator = isb_lib.core.ThingRecordIterator(session, authority, page_size=page_size)
+    _iterate("paged Things", iterator.yieldRecordsByPage())
+    logging.info("identity map size after paging: %d", len(session.identity_map))
+    session.close()
+
+    session = dao.get_session()
+    iterator = isb_lib.core.ThingRecordIterator(session, authority, page_size=page_size)
+    _iterate("streamed columns", iterator.yieldProjectedRecords())
+    logging.info("identity map size after streaming: %d", len(session.identity_map))
+    session.close()
+
+
+"""
+Benchmarks the ThingRecordIterator modes
+"""
+if __name__ == "__main__":
+    main()
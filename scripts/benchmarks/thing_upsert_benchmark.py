@@ -0,0 +1,65 @@
+import logging
+import time
+
+import click
+
+from isb_lib.models.thing import Thing
+from isb_web.sqlmodel_database import SQLModelDAO, save_or_update_thing, save_or_update_things
+
+
+def _things(prefix: str, num_things: int) -> list[Thing]:
+    return [
+        Thing(
+            id=f"{prefix}:{i}",
+            authority_id="BENCHMARK",
+            resolved_url="http://example.org",
+            resolved_status=200,
+            resolved_content={"description": "Synthetic benchmark sample", "values": list(range(20))},
+        )
+        for i in range(num_things)
+    ]
+
+
+def _report(label: str, num_things: int, elapsed: float):
+    logging.info("%s: %d things in %.2fs (%.0f rows/sec)", label, num_things, elapsed, num_things / elapsed)
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default="sqlite:///thing_upsert_benchmark.db", show_default=True,
+    help="SQLAlchemy database URL, SQLite or Postgres"
+)
+@click.option(
+    "-n", "--num_things", type=int, default=5000, show_default=True, help="Number of Things to save per run"
+)
+@click.option(
+    "-b", "--batch_size", type=int, default=1000, show_default=True, help="Things per batched upsert"
+)
+def main(db_url, num_things, batch_size):
+    """Compares per-Thing save_or_update_thing against batched save_or_update_things, for inserts and updates."""
+    logging.basicConfig(level=logging.INFO)
+    dao = SQLModelDAO(db_url)
+    run_id = int(time.time())
+    for label, prefix in [("insert", f"single_{run_id}"), ("update", f"single_{run_id}")]:
+        session = dao.get_session()
+        start = time.time()
+        for thing in _things(prefix, num_things):
+            save_or_update_thing(session, thing)
+        _report(f"save_or_update_thing {label}", num_things, time.time() - start)
+        session.close()
+
+    for label, prefix in [("insert", f"batched_{run_id}"), ("update", f"batched_{run_id}")]:
+        session = dao.get_session()
+        things = _things(prefix, num_things)
+        start = time.time()
+        for i in range(0, num_things, batch_size):
+            save_or_update_things(session, things[i:i + batch_size])
+        _report(f"save_or_update_things {label}", num_things, time.time() - start)
+        session.close()
+
+
+"""
+Benchmarks batched Thing upserts against the per-Thing save path used by the ingest scripts
+"""
+if __name__ == "__main__":
+    main()
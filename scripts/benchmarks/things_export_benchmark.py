@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import click
+from fastapi.encoders import jsonable_encoder
+
+from isb_lib.models.thing import Thing
+from isb_lib.utilities import json_streaming
+from isb_web.sqlmodel_database import SQLModelDAO, get_things_with_ids, stream_things_with_ids
+
+
+def _synthetic_thing(index: int) -> Thing:
+    return Thing(
+        id=f"IGSN:BENCH{index:08d}",
+        authority_id="BENCHMARK",
+        resolved_url=f"https://app.geosamples.org/sample/igsn/BENCH{index:08d}",
+        resolved_status=200,
+        resolved_media_type="application/ld+json",
+        identifiers=[f"IGSN:BENCH{index:08d}"],
+        resolved_content={
+            "description": "Synthetic benchmark sample " * 20,
+            "keywords": ["benchmark", "synthetic", "sample"],
+            "location": {"latitude": (index % 180) - 90.0, "longitude": (index % 360) - 180.0},
+            "values": list(range(50)),
+        },
+    )
+
+
+def _measure(label: str, num_things: int, serialize):
+    tracemalloc.start()
+    start = time.time()
+    num_bytes = serialize()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Compressed output is small, so report things/sec as well as the bytes/sec actually sent
+    logging.info(
+        "%s: %d things in %.2fs (%.0f things/sec), %.1f MB sent (%.2f MB/sec), peak memory %.1f MB",
+        label, num_things, elapsed, num_things / elapsed, num_bytes / 1e6, num_bytes / 1e6 / elapsed, peak / 1e6
+    )
+
+
+@click.command()
+@click.option(
+    "-n", "--num_things", type=int, default=20000, show_default=True, help="Number of Things in the exported batch"
+)
+def main(num_things):
+    """Compares the JSON array /things response against streamed NDJSON, uncompressed and compressed."""
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dao = SQLModelDAO(f"sqlite:///{os.path.join(temp_dir, 'things_export_benchmark.db')}")
+        session = dao.get_session()
+        session.add_all(_synthetic_thing(index) for index in range(num_things))
+        session.commit()
+        identifiers = [f"IGSN:BENCH{index:08d}" for index in range(num_things)]
+
+        def json_array() -> int:
+            # What FastAPI does with the list of Things the endpoint returns by default
+            session.expunge_all()
+            things = get_things_with_ids(session, identifiers)
+            return len(json.dumps(jsonable_encoder(things)).encode("utf-8"))
+
+        def ndjson(encoding=None):
+            def serialize() -> int:
+                chunks = json_streaming.ndjson_chunks(stream_things_with_ids(session, identifiers))
+                if encoding is not None:
+                    chunks = json_streaming.compressed_chunks(chunks, encoding)
+                return sum(len(chunk) for chunk in chunks)
+            return serialize
+
+        _measure("JSON array", num_things, json_array)
+        _measure("NDJSON", num_things, ndjson())
+        for encoding in json_streaming.available_encodings():
+            _measure(f"NDJSON {encoding}", num_things, ndjson(encoding))
+        session.close()
+
+
+"""
+Benchmarks bytes/sec and peak memory of a /things batch export, as pulled by peers consuming the sitemap
+"""
+if __name__ == "__main__":
+    main()
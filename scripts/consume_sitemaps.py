@@ -1,10 +1,9 @@
-import concurrent.futures
 import datetime
+import functools
 import json
+import os.path
 import typing
 import urllib.parse
-from concurrent.futures import ThreadPoolExecutor
-from typing import Iterator
 
 import click
 import requests
@@ -14,21 +13,29 @@ import isb_lib.core
 import isb_web
 import isb_web.config
 import logging
-import re
 
-from isb_lib.models.thing import Thing
 from isb_lib.sitemaps.sitemap_fetcher import (
+    ChangeFeedFetcher,
+    ConcurrentSitemapConsumer,
     SitemapIndexFetcher,
-    SitemapFileFetcher,
     ThingFetcher,
     ThingsFetcher,
 )
 from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import (
     SQLModelDAO,
-    all_thing_identifiers,
     thing_identifiers_from_resolved_content,
+    save_or_update_thing_mappings,
+    primary_keys_for_identifiers,
+    thing_identifier_map,
+    get_change_watermark,
+    save_change_watermark,
+    primary_keys_for_thing_ids,
+    mark_thing_not_found,
+    thing_ids_for_primary_keys,
+    max_thing_primary_key,
 )
+from isb_lib.utilities.identifier_map import CompactIdentifierMap
 
 __NUM_THINGS_FETCHED = 0
 
@@ -73,10 +80,61 @@ __NUM_THINGS_FETCHED = 0
     default=-1,
     help="If specified, the start index of the sitemap files to ingest",
 )
-def main(ctx, url: str, authority: str, ignore_last_modified: bool, batch_size: int, file: str, start: int):
+@click.option(
+    "-p",
+    "--preload_identifiers",
+    is_flag=True,
+    help="Preload a compact map of the authority's identifiers to primary keys, so that existing things are matched "
+    "without querying the database for every batch",
+)
+@click.option(
+    "-m",
+    "--identifier_map_file",
+    default=None,
+    help="With --preload_identifiers, a .npy file to memory map the identifier map from (it's written if it doesn't "
+    "exist yet, and rewritten if things were saved since)",
+)
+@click.option(
+    "--sitemap_workers",
+    default=1,
+    help="The number of sitemap files to fetch concurrently",
+)
+@click.option(
+    "--things_workers",
+    default=1,
+    help="The number of /things batches to fetch concurrently",
+)
+@click.option(
+    "--stream_sitemaps",
+    is_flag=True,
+    help="Parse each sitemap file incrementally as it downloads instead of loading all of its URLs up front",
+)
+@click.option(
+    "-c",
+    "--change_feed_url",
+    default=None,
+    help="If specified, the /things/changes URL of the source instance.  Only the things changed since the last "
+    "sync are fetched, instead of walking the sitemap index",
+)
+def main(
+    ctx,
+    url: str,
+    authority: str,
+    ignore_last_modified: bool,
+    batch_size: int,
+    file: str,
+    start: int,
+    preload_identifiers: bool,
+    identifier_map_file: typing.Optional[str],
+    sitemap_workers: int,
+    things_workers: int,
+    stream_sitemaps: bool,
+    change_feed_url: typing.Optional[str],
+):
     solr_url = isb_web.config.Settings().solr_url
     rsession = requests.session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=5, pool_maxsize=5)
+    pool_size = max(5, sitemap_workers + things_workers)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=5, pool_maxsize=pool_size)
     rsession.mount("http://", adapter)
     rsession.mount("https://", adapter)
     db_url = isb_web.config.Settings().database_url
@@ -84,6 +142,15 @@ def main(ctx, url: str, authority: str, ignore_last_modified: bool, batch_size:
     if authority is not None:
         authority = authority.upper()
     isb_lib.core.things_main(ctx, db_url, solr_url, "INFO", False)
+    if change_feed_url is not None:
+        identifier_map = None
+        if preload_identifiers:
+            identifier_map = load_identifier_map(db_session, authority, identifier_map_file)
+        consume_change_feed(
+            authority, change_feed_url, ignore_last_modified, identifier_map, rsession, db_session, batch_size
+        )
+        logging.info(f"Completed.  Fetched {__NUM_THINGS_FETCHED} things total.")
+        return
     if ignore_last_modified:
         last_updated_date = None
     else:
@@ -94,24 +161,69 @@ def main(ctx, url: str, authority: str, ignore_last_modified: bool, batch_size:
         last_updated_date = sqlmodel_database.last_time_thing_created(
             db_session, authority
         )
-    thing_ids_to_pks = all_thing_identifiers(db_session, authority)
+    identifier_map = None
+    if preload_identifiers:
+        identifier_map = load_identifier_map(db_session, authority, identifier_map_file)
     logging.info(
         f"Going to fetch records for authority {authority} with updated date > {last_updated_date}"
     )
     fetch_sitemap_files(
         authority,
         last_updated_date,
-        thing_ids_to_pks,
+        identifier_map,
         rsession,
         url,
         db_session,
         batch_size,
         file,
-        start
+        start,
+        sitemap_workers,
+        things_workers,
+        stream_sitemaps,
     )
     logging.info(f"Completed.  Fetched {__NUM_THINGS_FETCHED} things total.")
 
 
+def load_identifier_map(
+    db_session, authority: typing.Optional[str], identifier_map_file: typing.Optional[str]
+) -> CompactIdentifierMap:
+    identifier_map = None
+    if identifier_map_file is not None and os.path.exists(identifier_map_file):
+        identifier_map = CompactIdentifierMap.load(identifier_map_file)
+        # Primary keys only grow, so a map missing the newest thing is from before things were saved since
+        if identifier_map.max_primary_key < max_thing_primary_key(db_session, authority):
+            logging.info(f"Identifier map {identifier_map_file} is out of date, rebuilding it")
+            identifier_map = None
+    if identifier_map is None:
+        identifier_map = thing_identifier_map(db_session, authority)
+        if identifier_map_file is not None:
+            identifier_map.save(identifier_map_file)
+    logging.info(f"Loaded {len(identifier_map)} identifiers using {identifier_map.nbytes / 1e6:.1f} MB")
+    return identifier_map
+
+
+def primary_keys_for_things(
+    db_session, json_things: list, identifier_map: typing.Optional[CompactIdentifierMap]
+) -> typing.Optional[typing.Dict[str, int]]:
+    if identifier_map is None:
+        # Let the save look existing things up in the database
+        return None
+    thing_ids = [json_thing["id"] for json_thing in json_things]
+    mapped_primary_keys = identifier_map.get_many(thing_ids)
+    # The map only stores identifier hashes, so confirm its hits are the same things before updating those rows
+    mapped_thing_ids = thing_ids_for_primary_keys(db_session, list(set(mapped_primary_keys.values())))
+    primary_keys = {
+        thing_id: primary_key
+        for thing_id, primary_key in mapped_primary_keys.items()
+        if mapped_thing_ids.get(primary_key) == thing_id
+    }
+    # The map is a snapshot from startup, so anything it doesn't know about may have been inserted since.  Hits that
+    # weren't confirmed (a hash collision, or a match on an alternate identifier) are looked up properly too.
+    missing_ids = [thing_id for thing_id in thing_ids if thing_id not in primary_keys]
+    primary_keys.update(primary_keys_for_identifiers(db_session, missing_ids))
+    return primary_keys
+
+
 def thing_fetcher_for_url(thing_url: str, rsession) -> ThingFetcher:
     # At this point, we need to massage the URLs a bit, the sitemap publishes them like so:
     # https://mars.cyverse.org/thing/ark:/21547/DxI2SKS002?full=false&amp;format=core
@@ -123,166 +235,122 @@ def thing_fetcher_for_url(thing_url: str, rsession) -> ThingFetcher:
     return thing_fetcher
 
 
-THING_URL_REGEX = re.compile(r"(.*)/thing/([^?]+)?")
-
-
-def _group_from_thing_url_regex(thing_url: str, group: int) -> typing.Optional[str]:
-    match = THING_URL_REGEX.match(thing_url)
-    if match is None:
-        logging.critical(f"Didn't find match in thing URL {thing_url}")
-        return None
-    else:
-        group_str = match.group(group)
-        return group_str
-
-
-def thing_identifier_from_thing_url(thing_url: str) -> typing.Optional[str]:
-    # At this point, we need to massage the URLs a bit, the sitemap publishes them like so:
-    # https://mars.cyverse.org/thing/ark:/21547/DxI2SKS002?full=false&amp;format=core
-    # We need to change full to true to get all the metadata, as well as the original format
-    return _group_from_thing_url_regex(thing_url, 2)
-
-
-def pre_thing_host_url(thing_url: str) -> typing.Optional[str]:
-    # At this point, we need to parse out the the URL a bit, the sitemap publishes them like so:
-    # https://mars.cyverse.org/thing/ark:/21547/DxI2SKS002?full=false&amp;format=core
-    # We need to grab the part of the URL before thing (https://mars.cyverse.org/) and change it to
-    # https://mars.cyverse.org/things to do the bulk fetch
-    return _group_from_thing_url_regex(thing_url, 1)
+def sitemap_urls_to_consume(urls_to_fetch: typing.List[str], file: str, start: int) -> typing.List[str]:
+    sitemap_urls = []
+    for num_files, url in enumerate(urls_to_fetch, start=1):
+        if file is not None and file not in url:
+            # there's a specific sitemap file specified, and this file isn't it, so continue on our way
+            # we expect file to be something like "sitemap-81.xml"
+            continue
+        if num_files < start:
+            # we've specified a start file (e.g. 81) and we are less than the start (e.g. sitemap-1.xml), so continue
+            continue
+        sitemap_urls.append(url)
+    return sitemap_urls
 
 
-def construct_thing_futures(
-    thing_futures: list,
-    sitemap_file_iterator: Iterator,
-    sitemap_file_url: str,
-    rsession: requests.Session,
-    thing_executor: ThreadPoolExecutor,
-    batch_size: int,
-) -> bool:
-    constructed_all_futures_for_sitemap_file = False
-    while not constructed_all_futures_for_sitemap_file:
-        thing_ids: set = set()
-        things_url = None
-        while len(thing_ids) < batch_size:
-            try:
-                url = next(sitemap_file_iterator)
-                if things_url is None:
-                    # parse out the base things url from the first one we grab (they should all be the same)
-                    things_url = pre_thing_host_url(url)
-                    if things_url is not None:
-                        things_url += "/things"
-                    else:
-                        logging.critical(
-                            f"Couldn't parse out things url from url {url} -- unable to construct things."
-                        )
-                identifier = thing_identifier_from_thing_url(url)
-                if identifier is not None:
-                    thing_ids.add(identifier)
-                else:
-                    logging.critical(
-                        f"Cannot parse out identifier from url {url} -- will not fetch thing."
-                    )
-            except StopIteration:
-                constructed_all_futures_for_sitemap_file = True
-                break
-        if len(thing_ids) > 0 and things_url is not None:
-            things_fetcher = ThingsFetcher(
-                things_url, sitemap_file_url, thing_ids, rsession
-            )
-            things_future = thing_executor.submit(things_fetcher.fetch_things)
-            thing_futures.append(things_future)
-    return constructed_all_futures_for_sitemap_file
+def save_fetched_things(
+    db_session,
+    authority: typing.Optional[str],
+    identifier_map: typing.Optional[CompactIdentifierMap],
+    things_fetcher: ThingsFetcher,
+):
+    global __NUM_THINGS_FETCHED
+    __NUM_THINGS_FETCHED += len(things_fetcher.json_things)
+    logging.info(
+        f"About to process {len(things_fetcher.json_things)} things"
+    )
+    for json_thing in things_fetcher.json_things:
+        json_thing["tstamp"] = datetime.datetime.now()
+        # Without an authority (e.g. a change feed of every authority), go by the thing's own
+        identifiers = thing_identifiers_from_resolved_content(
+            authority or json_thing.get("authority_id"), json_thing["resolved_content"]
+        )
+        identifiers.append(json_thing["id"])
+        json_thing["identifiers"] = json.dumps(identifiers)
+        # remove the pk as that isn't guaranteed to be the same, existing rows are matched on
+        # id or alternate identifier via the indexed identifiers table
+        del json_thing["primary_key"]
+    save_or_update_thing_mappings(
+        db_session,
+        things_fetcher.json_things,
+        primary_keys_for_things(db_session, things_fetcher.json_things, identifier_map),
+    )
+    logging.info(
+        f"Just processed {len(things_fetcher.json_things)} things"
+    )
 
 
 def fetch_sitemap_files(
     authority,
     last_updated_date,
-    thing_ids: typing.Dict[str, int],
+    identifier_map: typing.Optional[CompactIdentifierMap],
     rsession,
     url,
     db_session,
     batch_size: int,
     file: str,
-    start: int
+    start: int,
+    sitemap_workers: int = 1,
+    things_workers: int = 1,
+    stream_sitemaps: bool = False,
 ):
     sitemap_index_fetcher = SitemapIndexFetcher(
-        url, authority, last_updated_date, rsession
+        url, authority, last_updated_date, rsession, stream_sitemaps
     )
-    # fetch the index file, and iterate over the individual sitemap files serially so we preserve order
     sitemap_index_fetcher.fetch_index_file()
-    num_files = 0
-    for url in sitemap_index_fetcher.urls_to_fetch:
-        num_files += 1
-        if file is not None and file not in url:
-            # there's a specific sitemap file specified, and this file isn't it, so continue on our way
-            # we expect file to be something like "sitemap-81.xml"
-            continue
-        if num_files < start:
-            # we've specified a start file (e.g. 81) and we are less than the start (e.g. sitemap-1.xml), so continue
-            continue
-        sitemap_file_fetcher = SitemapFileFetcher(
-            url, authority, last_updated_date, rsession
-        )
-        sitemap_file_fetcher.fetch_sitemap_file()
-        sitemap_file_iterator = sitemap_file_fetcher.url_iterator()
-        thing_futures: list = []
-        # max_workers is 1 so that we may execute one request at a time in order to avoid overwhelming the server
-        # We still gain benefits as the next things request executes while the local processing is occurring
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as thing_executor:
-            construct_thing_futures(
-                thing_futures,
-                sitemap_file_iterator,
-                sitemap_file_fetcher.url,
-                rsession,
-                thing_executor,
-                batch_size,
-            )
-            # Then read out results and save to the database after the queue is filled to capacity.
-            # Provided there are more urls in the iterator, return to the top of the loop to fill the queue again
-            for thing_fut in concurrent.futures.as_completed(thing_futures):
-                things_fetcher = thing_fut.result()
-                if (
-                    things_fetcher is not None
-                    and things_fetcher.json_things is not None
-                ):
-                    global __NUM_THINGS_FETCHED
-                    __NUM_THINGS_FETCHED += len(things_fetcher.json_things)
-                    logging.info(
-                        f"About to process {len(things_fetcher.json_things)} things"
-                    )
-                    current_existing_things_batch = []
-                    current_new_things_batch = []
+    # Batches are saved in sitemap order even when several are fetched at once, and the consumer stops at the first
+    # one it can't fetch, so resuming from the last created time stays safe.  Keep the worker counts low to avoid
+    # overwhelming the source server.
+    consumer = ConcurrentSitemapConsumer(
+        sitemap_index_fetcher,
+        functools.partial(save_fetched_things, db_session, authority, identifier_map),
+        batch_size=batch_size,
+        max_sitemap_workers=sitemap_workers,
+        max_things_workers=things_workers,
+        sitemap_urls=sitemap_urls_to_consume(sitemap_index_fetcher.urls_to_fetch, file, start),
+    )
+    consumer.run()
 
-                    for json_thing in things_fetcher.json_things:
-                        json_thing["tstamp"] = datetime.datetime.now()
-                        identifiers = thing_identifiers_from_resolved_content(
-                            authority, json_thing["resolved_content"]
-                        )
-                        identifiers.append(json_thing["id"])
-                        json_thing["identifiers"] = json.dumps(identifiers)
-                        # remove the pk as that isn't guaranteed to be the same
-                        del json_thing["primary_key"]
-                        if thing_ids.__contains__(json_thing["id"]):
-                            # existing row in the db, for the update to work we need to insert the pk into the dict
-                            json_thing["primary_key"] = thing_ids[json_thing["id"]]
-                            current_existing_things_batch.append(json_thing)
-                        else:
-                            current_new_things_batch.append(json_thing)
-                    db_session.bulk_insert_mappings(
-                        mapper=Thing,
-                        mappings=current_new_things_batch,
-                        return_defaults=False,
-                    )
-                    db_session.bulk_update_mappings(
-                        mapper=Thing, mappings=current_existing_things_batch
-                    )
-                    db_session.commit()
-                    logging.info(
-                        f"Just processed {len(things_fetcher.json_things)} things"
-                    )
-                else:
-                    logging.error(f"Error fetching thing for {things_fetcher.url}")
-                thing_futures.remove(thing_fut)
+
+def change_feed_watermark_name(change_feed_url: str, authority: typing.Optional[str]) -> str:
+    return f"change_feed:{change_feed_url}:{authority}"
+
+
+def consume_change_feed(
+    authority: typing.Optional[str],
+    change_feed_url: str,
+    ignore_watermark: bool,
+    identifier_map: typing.Optional[CompactIdentifierMap],
+    rsession,
+    db_session,
+    batch_size: int,
+):
+    """Pulls only the things that changed on the source instance since the last sync, then advances the watermark"""
+    watermark_name = change_feed_watermark_name(change_feed_url, authority)
+    since = 0 if ignore_watermark else get_change_watermark(db_session, watermark_name)
+    logging.info(f"Going to fetch changes for authority {authority} after sequence {since} from {change_feed_url}")
+    change_feed_fetcher = ChangeFeedFetcher(change_feed_url, authority, since, rsession, page_size=batch_size)
+    for changes, next_sequence in change_feed_fetcher.pages():
+        for things_fetcher in change_feed_fetcher.things_fetchers(changes, batch_size):
+            things_fetcher.fetch_things()
+            if things_fetcher.primary_keys_fetched is None:
+                # Stop rather than skip, so the watermark isn't advanced past changes we never saved
+                raise RuntimeError(
+                    f"Unable to fetch changed things from {things_fetcher.url}, will resume from sequence "
+                    f"{change_feed_fetcher.since} next time."
+                )
+            save_fetched_things(db_session, authority, identifier_map, things_fetcher)
+        deleted_ids = [change["id"] for change in changes if change["deleted"]]
+        # Only mark the deleted things we actually have, there's no point in recording ones we never saw
+        for thing_id in primary_keys_for_thing_ids(db_session, deleted_ids):
+            mark_thing_not_found(db_session, thing_id, change_feed_fetcher.things_url)
+        db_session.commit()
+        save_change_watermark(db_session, watermark_name, next_sequence)
+        logging.info(
+            f"Processed {len(changes)} changes ({len(deleted_ids)} deleted), at sequence {next_sequence} of "
+            f"{change_feed_fetcher.max_sequence}"
+        )
 
 
 if __name__ == "__main__":
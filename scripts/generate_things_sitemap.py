@@ -23,12 +23,18 @@ from isb_lib.sitemaps.thing_sitemap import (
     default=None,
     help="The hostname to include in the sitemap file",
 )
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    help="Only rewrite the sitemap files whose contents changed since the previous incremental run",
+)
 @click.pass_context
-def main(ctx, path: str, host: str):
+def main(ctx, path: str, host: str, incremental: bool):
     isb_lib.core.things_main(
         ctx, None, isb_web.config.Settings().solr_url, "INFO", False
     )
-    build_sitemap(path, host, ThingSitemapIndexIterator())
+    build_sitemap(path, host, ThingSitemapIndexIterator(), incremental)
 
 
 if __name__ == "__main__":
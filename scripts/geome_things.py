@@ -13,7 +13,7 @@ import click
 import click_config_file
 from isb_lib.models.thing import Thing
 from isb_web import sqlmodel_database
-from isb_web.sqlmodel_database import SQLModelDAO, get_thing_with_id, save_thing
+from isb_web.sqlmodel_database import SQLModelDAO, get_things_by_ids, save_thing
 from typing import Optional
 
 CONCURRENT_DOWNLOADS = 10
@@ -65,28 +65,28 @@ async def _loadGEOMEEntries(session, max_count, start_from=None):  # noqa: C901
         while more_work:
             # populate the futures list with work until the list is full
             # or there is no more work to get.
+            new_ids = []
             while (
-                len(futures) < BACKLOG_SIZE
-                and total_requested < max_count
+                len(futures) + len(new_ids) < BACKLOG_SIZE
+                and total_requested + len(new_ids) < max_count
                 and num_prepared > 0
             ):
                 try:
-                    _id = next(ids)
-                    identifier = _id[0]
-                    existing_thing = get_thing_with_id(session, identifier)
-                    if existing_thing is not None:
-                        logging.debug("Already have %s at %s", identifier, _id[1])
-                        future = executor.submit(wrapLoadThing, identifier, _id[1], existing_thing)
-                    else:
-                        future = executor.submit(wrapLoadThing, identifier, _id[1])
-                    futures.append(future)
-                    working[identifier] = 0
-                    total_requested += 1
+                    new_ids.append(next(ids))
                 except StopIteration:
                     L.info("Reached end of identifier iteration.")
                     num_prepared = 0
-                if total_requested >= max_count:
-                    num_prepared = 0
+            # Look up all the things we already have in one query rather than one per identifier
+            existing_things = get_things_by_ids(session, [_id[0] for _id in new_ids])
+            for identifier, tc in new_ids:
+                existing_thing = existing_things.get(identifier)
+                if existing_thing is not None:
+                    logging.debug("Already have %s at %s", identifier, tc)
+                futures.append(executor.submit(wrapLoadThing, identifier, tc, existing_thing))
+                working[identifier] = 0
+                total_requested += 1
+            if total_requested >= max_count:
+                num_prepared = 0
             L.debug("%s", working)
             try:
                 for fut in concurrent.futures.as_completed(futures, timeout=1):
@@ -97,7 +97,7 @@ async def _loadGEOMEEntries(session, max_count, start_from=None):  # noqa: C901
                             save_thing(session, _thing)
                         except sqlalchemy.exc.IntegrityError:
                             session.rollback()
-                            logging.error("Item already exists: %s", _id[0])
+                            logging.error("Item already exists: %s", identifier)
                         # for _rel in _related:
                         #    try:
                         #        session.add(_rel)
@@ -315,8 +315,30 @@ def reloadRecords(ctx, status_code):
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--num_workers", type=int, default=1, help="Number of processes to use when transforming records", show_default=True
+)
+@click.option(
+    "--stream_columns", is_flag=True, help="Stream only the columns needed for indexing instead of paging full Things"
+)
+@click.option(
+    "--journal", "from_journal", is_flag=True, help="Only index Things saved since the last journaled import"
+)
+@click.option(
+    "--refresh_h3_counts/--no_refresh_h3_counts",
+    default=True,
+    help="Whether to recompute the precomputed h3 counts served by /h3_counts/ afterwards",
+    show_default=True,
+)
 @click.pass_context
-def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
+def populateIsbCoreSolr(
+    ctx,
+    ignore_last_modified: bool,
+    num_workers: int,
+    stream_columns: bool,
+    from_journal: bool,
+    refresh_h3_counts: bool,
+):
     logger = getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -334,7 +356,11 @@ def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
-        min_time_created=max_solr_updated_date
+        min_time_created=max_solr_updated_date,
+        num_workers=num_workers,
+        stream_columns=stream_columns,
+        from_journal=from_journal,
+        refresh_h3_counts=refresh_h3_counts,
     )
     allkeys = solr_importer.run_solr_import(isb_lib.geome_adapter.reparseAsCoreRecord)
     logger.info(f"Total keys= {len(allkeys)}")
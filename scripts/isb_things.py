@@ -141,8 +141,29 @@ def reparse_as_core_record(thing: isb_lib.models.thing.Thing) -> list[dict]:
 
 
 @main.command("populate_isb_core_solr")
+@click.option(
+    "-w", "--num_workers", type=int, default=1, help="Number of processes to use when transforming records", show_default=True
+)
+@click.option(
+    "--stream_columns", is_flag=True, help="Stream only the columns needed for indexing instead of paging full Things"
+)
+@click.option(
+    "--journal", "from_journal", is_flag=True, help="Only index Things saved since the last journaled import"
+)
+@click.option(
+    "--refresh_h3_counts/--no_refresh_h3_counts",
+    default=True,
+    help="Whether to recompute the precomputed h3 counts served by /h3_counts/ afterwards",
+    show_default=True,
+)
 @click.pass_context
-def populate_isb_core_solr(ctx):
+def populate_isb_core_solr(
+    ctx,
+    num_workers: int,
+    stream_columns: bool,
+    from_journal: bool,
+    refresh_h3_counts: bool,
+):
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
     solr_importer = isb_lib.core.CoreSolrImporter(
@@ -150,7 +171,11 @@ def populate_isb_core_solr(ctx):
         authority_id=config.Settings().authority_id,
         db_batch_size=1000,
         solr_batch_size=1000,
-        solr_url=solr_url
+        solr_url=solr_url,
+        num_workers=num_workers,
+        stream_columns=stream_columns,
+        from_journal=from_journal,
+        refresh_h3_counts=refresh_h3_counts,
     )
     allkeys = solr_importer.run_solr_import(
         reparse_as_core_record
@@ -0,0 +1,41 @@
+import logging
+
+import click
+
+import isb_lib.core
+from isb_web.sqlmodel_database import SQLModelDAO, backfill_thing_identifiers
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-v",
+    "--verbosity",
+    default="INFO",
+    help="Specify logging level",
+    show_default=True,
+)
+@click.option(
+    "-c",
+    "--chunk_size",
+    default=10000,
+    help="The number of identifiers to commit at a time",
+)
+@click.pass_context
+def main(ctx, db_url, verbosity, chunk_size):
+    isb_lib.core.things_main(ctx, db_url, None, verbosity)
+    dao = SQLModelDAO(ctx.obj["db_url"])
+    # Separate sessions, so committing each chunk doesn't close the cursor the identifiers are streamed over
+    with dao.get_session() as read_session, dao.get_session() as write_session:
+        num_identifiers = backfill_thing_identifiers(read_session, write_session, chunk_size)
+    logging.info(f"Done.  Backfilled {num_identifiers} identifiers")
+
+
+"""
+Copies the identifiers of Things saved before the ThingIdentifier table was maintained from the Thing.identifiers
+column into it.  Safe to rerun, and resumes where it left off if interrupted.
+"""
+if __name__ == "__main__":
+    main()
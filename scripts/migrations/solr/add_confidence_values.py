@@ -1,49 +1,40 @@
-import logging
 from typing import Optional
 
 import click
-import requests
 
 import isb_lib.core
 import isb_web.config
 import isb_lib.sesar_adapter
 from isamples_metadata.Transformer import Transformer
-from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
+from isb_lib.solr_migration import SolrMigrationRunner
 
 
 @click.command()
+@click.option("-w", "--num_workers", type=int, default=1, help="Number of processes used to mutate records")
+@click.option(
+    "-c",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to checkpoint progress in, an interrupted run resumes from it when re-run",
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, num_workers, checkpoint):
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url)
-    add_confidence_values(solr_url)
+    add_confidence_values(solr_url, num_workers, checkpoint)
 
 
-def add_confidence_values(solr_url: str):
-    total_records = 0
-    batch_size = 10000
-    current_mutated_batch = []
-    rsession = requests.session()
-    iterator = ISBCoreSolrRecordIterator(rsession, "*:*", batch_size, 0, "id asc")
-    for record in iterator:
-        mutated_record = mutate_record(record)
-        if mutated_record is not None:
-            current_mutated_batch.append(mutated_record)
-        if len(current_mutated_batch) == batch_size:
-            save_mutated_batch(current_mutated_batch, rsession, solr_url)
-            current_mutated_batch = []
-        total_records += 1
-    if len(current_mutated_batch) > 0:
-        # handle the remainder
-        save_mutated_batch(current_mutated_batch, rsession, solr_url)
-    logging.info(f"Finished iterating, visited {total_records} records")
-
-
-def save_mutated_batch(current_mutated_batch, rsession, solr_url):
-    logging.info(f"Going to save {len(current_mutated_batch)} records")
-    isb_lib.core.solrAddRecords(rsession, current_mutated_batch, solr_url)
-    isb_lib.core.solrCommit(rsession, solr_url)
-    logging.info(f"Just saved {len(current_mutated_batch)} records")
+def add_confidence_values(solr_url: str, num_workers: int = 1, checkpoint: Optional[str] = None):
+    runner = SolrMigrationRunner(
+        solr_url,
+        mutate_record,
+        "*:*",
+        10000,
+        num_workers=num_workers,
+        checkpoint_path=checkpoint,
+    )
+    runner.run()
 
 
 def _insert_confidence_values(record: dict, category_str: str, confidence_str: str) -> bool:
@@ -1,51 +1,106 @@
-import logging
 from typing import Optional
 
 import click
-import requests
+import numpy as np
 
 import isb_lib.core
 import isb_web.config
 import isb_lib.sesar_adapter
-from isamples_metadata.Transformer import geo_to_h3
-from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
+from isamples_metadata.Transformer import (
+    geo_to_h3_resolutions,
+    geo_to_h3_resolutions_array,
+    h3_cells_to_strings,
+    h3_field_name,
+    h3_fields,
+)
+from isb_lib.solr_migration import SolrMigrationRunner
 
 
 @click.command()
+@click.option("-w", "--num_workers", type=int, default=1, help="Number of processes used to mutate records")
+@click.option(
+    "-c",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to checkpoint progress in, an interrupted run resumes from it when re-run",
+)
+@click.option(
+    "--full_records",
+    is_flag=True,
+    help="Re-send whole records rather than atomic updates of the h3 fields",
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, num_workers, checkpoint, full_records):
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url)
-    add_h3_values(solr_url)
+    add_h3_values(solr_url, num_workers, checkpoint, full_records)
 
 
-def add_h3_values(solr_url: str):
-    total_records = 0
-    batch_size = 50000
-    current_mutated_batch = []
-    rsession = requests.session()
-    iterator = ISBCoreSolrRecordIterator(
-        rsession, "-(_nest_path_:*) AND producedBy_samplingSite_location_latitude:*", batch_size, 0, "id asc"
+# The fields atomic_updates_for_records reads, and the old ones it removes
+ATOMIC_UPDATE_SOURCE_FIELDS = [
+    "id",
+    "producedBy_samplingSite_location_latitude",
+    "producedBy_samplingSite_location_longitude",
+    "producedBy_samplingSite_location_h3_0",
+    "producedBy_samplingSite_location_h3",
+    "producedBy_samplingSite_location_cesium_height",
+]
+
+
+def add_h3_values(
+    solr_url: str, num_workers: int = 1, checkpoint: Optional[str] = None, full_records: bool = False
+):
+    runner = SolrMigrationRunner(
+        solr_url,
+        mutate_record if full_records else atomic_updates_for_records,
+        "-(_nest_path_:*) AND producedBy_samplingSite_location_latitude:*",
+        50000,
+        num_workers=num_workers,
+        checkpoint_path=checkpoint,
+        fields=None if full_records else ",".join(ATOMIC_UPDATE_SOURCE_FIELDS),
+        atomic_updates=not full_records,
+        batch_mutate=not full_records,
+    )
+    runner.run()
+
+
+def _h3_fields(record: dict) -> dict:
+    return h3_fields(
+        geo_to_h3_resolutions(
+            record.get("producedBy_samplingSite_location_latitude"),
+            record.get("producedBy_samplingSite_location_longitude"),
+        )
     )
-    for record in iterator:
-        mutated_record = mutate_record(record)
-        if mutated_record is not None:
-            current_mutated_batch.append(mutated_record)
-        if len(current_mutated_batch) == batch_size:
-            save_mutated_batch(current_mutated_batch, rsession, solr_url)
-            current_mutated_batch = []
-        total_records += 1
-    if len(current_mutated_batch) > 0:
-        # handle the remainder
-        save_mutated_batch(current_mutated_batch, rsession, solr_url)
-    logging.info(f"Finished iterating, visited {total_records} records")
-
-
-def save_mutated_batch(current_mutated_batch, rsession, solr_url):
-    logging.info(f"Going to save {len(current_mutated_batch)} records")
-    isb_lib.core.solrAddRecords(rsession, current_mutated_batch, solr_url)
-    isb_lib.core.solrCommit(rsession, solr_url)
-    logging.info(f"Just saved {len(current_mutated_batch)} records")
+
+
+def _coordinate_array(records: list[dict], field_name: str) -> np.ndarray:
+    coordinates = [record.get(field_name) for record in records]
+    return np.array([np.nan if coordinate is None else coordinate for coordinate in coordinates], dtype=np.float64)
+
+
+def atomic_updates_for_records(records: list[dict]) -> list[dict]:
+    records = [record for record in records if record.get("producedBy_samplingSite_location_h3_0") is None]
+    if len(records) == 0:
+        return []
+    # Index the whole chunk at once rather than a record and a resolution at a time
+    cells_by_resolution = geo_to_h3_resolutions_array(
+        _coordinate_array(records, "producedBy_samplingSite_location_latitude"),
+        _coordinate_array(records, "producedBy_samplingSite_location_longitude"),
+    )
+    h3_columns = {
+        h3_field_name(resolution): h3_cells_to_strings(cells).tolist()
+        for resolution, cells in cells_by_resolution.items()
+    }
+    updates = []
+    for index, record in enumerate(records):
+        set_fields = {field_name: column[index] or None for field_name, column in h3_columns.items()}
+        # Remove old problematic fields
+        for field_name in ["producedBy_samplingSite_location_h3", "producedBy_samplingSite_location_cesium_height"]:
+            if field_name in record:
+                set_fields[field_name] = None
+        updates.append(isb_lib.core.solr_atomic_update_doc(record["id"], set_fields))
+    return updates
 
 
 def mutate_record(record: dict) -> Optional[dict]:
@@ -56,14 +111,7 @@ def mutate_record(record: dict) -> Optional[dict]:
     # Remove old problematic fields
     record.pop("producedBy_samplingSite_location_h3")
     record_copy.pop("producedBy_samplingSite_location_cesium_height")
-    for index in range(0, 16):
-        h3_at_resolution = geo_to_h3(
-            record.get("producedBy_samplingSite_location_latitude"),
-            record.get("producedBy_samplingSite_location_longitude"),
-            index,
-        )
-        field_name = f"producedBy_samplingSite_location_h3_{index}"
-        record_copy[field_name] = h3_at_resolution
+    record_copy.update(_h3_fields(record))
     return record_copy
 
 
@@ -12,6 +12,7 @@ import sqlalchemy.exc
 from isb_lib import opencontext_adapter
 from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import SQLModelDAO, save_thing
+from isamples_metadata.taxonomy.metadata_models import MetadataModelLoader
 
 BACKLOG_SIZE = 40
 
@@ -127,12 +128,39 @@ def load_records(ctx, max_records):
     load_open_context_entries(session, max_records, max_created)
 
 
+def _load_opencontext_models():
+    MetadataModelLoader.get_oc_material_model()
+    MetadataModelLoader.get_oc_sample_model()
+
+
 @main.command("populate_isb_core_solr")
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--num_workers", type=int, default=1, help="Number of processes to use when transforming records", show_default=True
+)
+@click.option(
+    "--stream_columns", is_flag=True, help="Stream only the columns needed for indexing instead of paging full Things"
+)
+@click.option(
+    "--journal", "from_journal", is_flag=True, help="Only index Things saved since the last journaled import"
+)
+@click.option(
+    "--refresh_h3_counts/--no_refresh_h3_counts",
+    default=True,
+    help="Whether to recompute the precomputed h3 counts served by /h3_counts/ afterwards",
+    show_default=True,
+)
 @click.pass_context
-def populate_isb_core_solr(ctx, ignore_last_modified: bool):
+def populate_isb_core_solr(
+    ctx,
+    ignore_last_modified: bool,
+    num_workers: int,
+    stream_columns: bool,
+    from_journal: bool,
+    refresh_h3_counts: bool,
+):
     L = get_logger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -151,6 +179,11 @@ def populate_isb_core_solr(ctx, ignore_last_modified: bool):
         solr_batch_size=1000,
         solr_url=solr_url,
         min_time_created=max_solr_updated_date,
+        num_workers=num_workers,
+        stream_columns=stream_columns,
+        from_journal=from_journal,
+        refresh_h3_counts=refresh_h3_counts,
+        worker_initializer=_load_opencontext_models,
     )
     allkeys = solr_importer.run_solr_import(
         isb_lib.opencontext_adapter.reparse_as_core_record
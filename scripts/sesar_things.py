@@ -10,18 +10,23 @@ import isb_lib.sesar_adapter
 import igsn_lib.time
 import asyncio
 import concurrent.futures
+import functools
+import itertools
 import click
 import click_config_file
 import typing
 
 from isb_lib.models.thing import Thing
 from isb_web import sqlmodel_database
-from isb_web.sqlmodel_database import SQLModelDAO, save_thing
+from isb_web.sqlmodel_database import SQLModelDAO, save_or_update_things
 from isamples_metadata.SESARTransformer import fullIgsn
+from isamples_metadata.taxonomy.metadata_models import MetadataModelLoader
 from typing import Optional
 
 CONCURRENT_DOWNLOADS = 10
 BACKLOG_SIZE = 40
+# Number of loaded things to accumulate before writing them to the database in one transaction
+SAVE_BATCH_SIZE = 200
 
 
 def getLogger():
@@ -37,6 +42,24 @@ def wrapLoadThing(igsn, tc, existing_thing: Optional[Thing] = None):
     return igsn, tc, None
 
 
+def _saveThings(session, things: typing.List[Thing]):
+    if len(things) == 0:
+        return
+    try:
+        save_or_update_things(session, things)
+    except sqlalchemy.exc.IntegrityError as e:
+        session.rollback()
+        # Don't lose the whole batch to one conflicting Thing, save them one at a time to find it
+        logging.warning("Failed to save batch of %s things, saving them one at a time: %s", len(things), e)
+        for thing in things:
+            try:
+                sqlmodel_database.save_or_update_thing(session, thing)
+            except sqlalchemy.exc.SQLAlchemyError as thing_error:
+                session.rollback()
+                logging.error("Failed to save %s: %s", thing.id, thing_error)
+    things.clear()
+
+
 def countThings(session):
     """Return number of things already collected in database"""
     cnt = session.query(Thing).count()
@@ -47,6 +70,7 @@ async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Opt
     L = getLogger()
     futures: list = []
     working = {}
+    loaded_things: typing.List[Thing] = []
     if manual_ids is not None:
         ids = iter(manual_ids)
     else:
@@ -63,39 +87,40 @@ async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Opt
         while more_work:
             # populate the futures list with work until the list is full
             # or there is no more work to get.
+            new_ids = []
             while (
-                len(futures) < BACKLOG_SIZE
-                and total_requested < max_count
+                len(futures) + len(new_ids) < BACKLOG_SIZE
+                and total_requested + len(new_ids) < max_count
                 and num_prepared > 0
             ):
                 try:
                     _id = next(ids)
-                    igsn = igsn_lib.normalize(_id[0])
-                    existing_thing = sqlmodel_database.get_thing_with_id(session, fullIgsn(igsn))
-                    if existing_thing is not None:
-                        logging.info("Already have %s at %s", igsn, existing_thing)
-                        future = executor.submit(wrapLoadThing, igsn, _id[1], existing_thing)
-                    else:
-                        future = executor.submit(wrapLoadThing, igsn, _id[1])
-                    futures.append(future)
-                    working[igsn] = 0
-                    total_requested += 1
+                    new_ids.append((igsn_lib.normalize(_id[0]), _id[1]))
                 except StopIteration:
                     L.info("Reached end of identifier iteration.")
                     num_prepared = 0
-                if total_requested >= max_count:
-                    num_prepared = 0
+            # Look up all the things we already have in one query rather than one per identifier
+            existing_things = sqlmodel_database.get_things_by_ids(
+                session, [fullIgsn(igsn) for igsn, _ in new_ids]
+            )
+            for igsn, tc in new_ids:
+                existing_thing = existing_things.get(fullIgsn(igsn))
+                if existing_thing is not None:
+                    logging.info("Already have %s at %s", igsn, existing_thing)
+                futures.append(executor.submit(wrapLoadThing, igsn, tc, existing_thing))
+                working[igsn] = 0
+                total_requested += 1
+            if total_requested >= max_count:
+                num_prepared = 0
             L.debug("%s", working)
             try:
                 for fut in concurrent.futures.as_completed(futures, timeout=1):
                     igsn, tc, _thing = fut.result()
                     futures.remove(fut)
                     if _thing is not None:
-                        try:
-                            save_thing(session, _thing)
-                        except sqlalchemy.exc.IntegrityError:
-                            session.rollback()
-                            logging.error("Item already exists: %s", _id[0])
+                        loaded_things.append(_thing)
+                        if len(loaded_things) >= SAVE_BATCH_SIZE:
+                            _saveThings(session, loaded_things)
                         # for _rel in _related:
                         #    try:
                         #        session.add(_rel)
@@ -131,6 +156,7 @@ async def _loadSesarEntries(session, max_count, start_from=None, manual_ids: Opt
                 total_completed,
                 len(futures),
             )
+    _saveThings(session, loaded_things)
 
 
 def loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[typing.List[typing.List[str]]] = None):
@@ -141,6 +167,31 @@ def loadSesarEntries(session, max_count, start_from=None, manual_ids: Optional[t
     loop.run_until_complete(future)
 
 
+def loadSesarEntriesAsync(
+    session,
+    max_count,
+    start_from=None,
+    manual_ids: Optional[typing.List[typing.List[str]]] = None,
+    requests_per_second: float = 10.0,
+    max_concurrency: int = 20,
+):
+    if manual_ids is not None:
+        ids = iter(manual_ids)
+    else:
+        ids = isb_lib.sesar_adapter.SESARIdentifiersSitemap(
+            max_entries=countThings(session) + max_count, date_start=start_from
+        )
+    harvester = isb_lib.sesar_adapter.SESARAsyncHarvester(
+        functools.partial(_saveThings, session),
+        requests_per_second=requests_per_second,
+        max_concurrency=max_concurrency,
+        save_batch_size=SAVE_BATCH_SIZE,
+        rollback=session.rollback,
+    )
+    identifiers = ((igsn_lib.normalize(_id[0]), _id[1]) for _id in itertools.islice(ids, max_count))
+    asyncio.run(harvester.harvest(identifiers))
+
+
 @click.group()
 @click.option(
     "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
@@ -168,8 +219,30 @@ def main(ctx, db_url, solr_url, verbosity, heart_rate):
     default=1000,
     help="Maximum records to load, -1 for all",
 )
+@click.option(
+    "-a",
+    "--async_harvest",
+    is_flag=True,
+    help="Harvest with the asyncio HTTP client, pacing requests to the upstream's allowed rate",
+)
+@click.option(
+    "-r",
+    "--requests_per_second",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="Maximum requests per second to the SESAR API when using --async_harvest",
+)
+@click.option(
+    "-c",
+    "--max_concurrency",
+    type=int,
+    default=20,
+    show_default=True,
+    help="Maximum requests in flight when using --async_harvest",
+)
 @click.pass_context
-def loadRecords(ctx, max_records):
+def loadRecords(ctx, max_records, async_harvest, requests_per_second, max_concurrency):
     L = getLogger()
     L.info("loadRecords, max = %s", max_records)
     if max_records == -1:
@@ -181,7 +254,16 @@ def loadRecords(ctx, max_records):
         )
         logging.info("Oldest = %s", oldest_record)
         time.sleep(1)
-        loadSesarEntries(session, max_records, start_from=oldest_record)
+        if async_harvest:
+            loadSesarEntriesAsync(
+                session,
+                max_records,
+                start_from=oldest_record,
+                requests_per_second=requests_per_second,
+                max_concurrency=max_concurrency,
+            )
+        else:
+            loadSesarEntries(session, max_records, start_from=oldest_record)
     finally:
         session.close()
 
@@ -328,8 +410,30 @@ def reloadRecords(ctx, status_code):
 @click.option(
     "-I", "--ignore_last_modified", is_flag=True, help="Whether to ignore the last modified date and do a full rebuild"
 )
+@click.option(
+    "-w", "--num_workers", type=int, default=1, help="Number of processes to use when transforming records", show_default=True
+)
+@click.option(
+    "--stream_columns", is_flag=True, help="Stream only the columns needed for indexing instead of paging full Things"
+)
+@click.option(
+    "--journal", "from_journal", is_flag=True, help="Only index Things saved since the last journaled import"
+)
+@click.option(
+    "--refresh_h3_counts/--no_refresh_h3_counts",
+    default=True,
+    help="Whether to recompute the precomputed h3 counts served by /h3_counts/ afterwards",
+    show_default=True,
+)
 @click.pass_context
-def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
+def populateIsbCoreSolr(
+    ctx,
+    ignore_last_modified: bool,
+    num_workers: int,
+    stream_columns: bool,
+    from_journal: bool,
+    refresh_h3_counts: bool,
+):
     L = getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -347,7 +451,12 @@ def populateIsbCoreSolr(ctx, ignore_last_modified: bool):
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
-        min_time_created=max_solr_updated_date
+        min_time_created=max_solr_updated_date,
+        num_workers=num_workers,
+        stream_columns=stream_columns,
+        from_journal=from_journal,
+        refresh_h3_counts=refresh_h3_counts,
+        worker_initializer=MetadataModelLoader.get_sesar_material_model,
     )
     allkeys = solr_importer.run_solr_import(isb_lib.sesar_adapter.reparseAsCoreRecord)
     L.info(f"Total keys= {len(allkeys)}")
@@ -11,15 +11,13 @@ import datetime
 
 from isamples_metadata import SmithsonianTransformer
 from isb_lib import smithsonian_adapter
-from isb_lib.models.thing import Thing
 from isb_lib.smithsonian_adapter import SmithsonianItem
-from isb_web.sqlmodel_database import SQLModelDAO, all_thing_primary_keys
+from isb_web.sqlmodel_database import SQLModelDAO, all_thing_primary_keys, save_or_update_thing_mappings
 
 BATCH_SIZE = 10000
 num_inserts = 0
 num_updates = 0
-current_existing_things_batch = []
-current_new_things_batch = []
+current_things_batch = []
 all_ids = set()
 
 
@@ -31,21 +29,19 @@ def load_smithsonian_entries(db_session, file_path, start_from=None):
         column_headers = next(csvreader)
         for i, current_values in enumerate(csvreader):
             if i > 0 and i % BATCH_SIZE == 0:
-                save_to_db(db_session, i, num_newer)
+                save_to_db(db_session, i, num_newer, primary_keys_by_id)
             # Otherwise iterate over the keys and make source JSON
             current_record = {}
             newer_than_start_from, thing_id = process_keys(column_headers, current_record, current_values, start_from)
             if newer_than_start_from:
                 num_newer += 1
-                thing_dict = thing_dict_for_db(current_record, file_path, thing_id, primary_keys_by_id)
-                if thing_id in primary_keys_by_id:
-                    current_existing_things_batch.append(thing_dict)
-                else:
-                    current_new_things_batch.append(thing_dict)
+                current_things_batch.append(
+                    thing_dict_for_db(current_record, file_path, thing_id, primary_keys_by_id)
+                )
             all_ids.add(thing_id)
 
         # get the remainder
-        save_to_db(db_session, i, num_newer)
+        save_to_db(db_session, i, num_newer, primary_keys_by_id)
         print(f"Done.  Num inserts={num_inserts}, num updates={num_updates}, num_unique_ids={len(all_ids)}")
 
 
@@ -109,23 +105,16 @@ def thing_dict_for_db(resolved_content: typing.Dict, file_path: str, thing_id: s
     return thing_dict
 
 
-def save_to_db(db_session, i, num_newer):
-    global num_inserts, num_updates, current_new_things_batch, current_existing_things_batch
-    num_inserts += len(current_new_things_batch)
-    num_updates += len(current_existing_things_batch)
+def save_to_db(db_session, i, num_newer, primary_keys_by_id):
+    global num_inserts, num_updates, current_things_batch
     print(f"\n\nNum records={i}")
     print(f"Num newer={num_newer}\n\n")
-    db_session.bulk_insert_mappings(
-        mapper=Thing,
-        mappings=current_new_things_batch,
-        return_defaults=False,
+    batch_inserts, batch_updates = save_or_update_thing_mappings(
+        db_session, current_things_batch, primary_keys_by_id
     )
-    db_session.bulk_update_mappings(
-        mapper=Thing, mappings=current_existing_things_batch
-    )
-    db_session.commit()
-    current_new_things_batch = []
-    current_existing_things_batch = []
+    num_inserts += batch_inserts
+    num_updates += batch_updates
+    current_things_batch = []
 
 
 @click.group()
@@ -180,8 +169,29 @@ def load_records(ctx, max_records, file, modification_date):
 
 
 @main.command("populate_isb_core_solr")
+@click.option(
+    "-w", "--num_workers", type=int, default=1, help="Number of processes to use when transforming records", show_default=True
+)
+@click.option(
+    "--stream_columns", is_flag=True, help="Stream only the columns needed for indexing instead of paging full Things"
+)
+@click.option(
+    "--journal", "from_journal", is_flag=True, help="Only index Things saved since the last journaled import"
+)
+@click.option(
+    "--refresh_h3_counts/--no_refresh_h3_counts",
+    default=True,
+    help="Whether to recompute the precomputed h3 counts served by /h3_counts/ afterwards",
+    show_default=True,
+)
 @click.pass_context
-def populate_isb_core_solr(ctx):
+def populate_isb_core_solr(
+    ctx,
+    num_workers: int,
+    stream_columns: bool,
+    from_journal: bool,
+    refresh_h3_counts: bool,
+):
     logger = isb_lib.core.getLogger()
     db_url = ctx.obj["db_url"]
     solr_url = ctx.obj["solr_url"]
@@ -191,6 +201,10 @@ def populate_isb_core_solr(ctx):
         db_batch_size=1000,
         solr_batch_size=1000,
         solr_url=solr_url,
+        num_workers=num_workers,
+        stream_columns=stream_columns,
+        from_journal=from_journal,
+        refresh_h3_counts=refresh_h3_counts,
     )
     allkeys = solr_importer.run_solr_import(
         isb_lib.smithsonian_adapter.reparse_as_core_record
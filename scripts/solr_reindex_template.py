@@ -1,12 +1,10 @@
 import typing
 
 import click
-import requests
-import logging
 
 import isb_lib.core
 import isb_web
-from isb_web.isb_solr_query import ISBCoreSolrRecordIterator
+from isb_lib.solr_migration import SolrMigrationRunner
 
 
 def mutate_record(record: typing.Dict) -> typing.Optional[typing.Dict]:
@@ -17,37 +15,24 @@ def mutate_record(record: typing.Dict) -> typing.Optional[typing.Dict]:
 
 
 @click.command()
+@click.option("-w", "--num_workers", type=int, default=1, help="Number of processes used to mutate records")
+@click.option(
+    "-c",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="File to checkpoint progress in, an interrupted run resumes from it when re-run",
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, num_workers, checkpoint):
     """Starting point template for reindexing the iSB Core Solr schema.  Solr URL is contained in a file called
     isb_web_config.env that should be located in the same directory as this file."""
     solr_url = isb_web.config.Settings().solr_url
     isb_lib.core.things_main(ctx, None, solr_url, "INFO", False)
-    total_records = 0
-    batch_size = 50000
-    current_mutated_batch = []
-    rsession = requests.session()
-    iterator = ISBCoreSolrRecordIterator(rsession, None, batch_size, 0, "id asc")
-    for record in iterator:
-        mutated_record = mutate_record(record)
-        if mutated_record is not None:
-            current_mutated_batch.append(mutated_record)
-        if len(current_mutated_batch) == batch_size:
-            save_mutated_batch(current_mutated_batch, rsession, solr_url)
-            current_mutated_batch = []
-        total_records += 1
-    if len(current_mutated_batch) > 0:
-        # handle the remainder
-        save_mutated_batch(current_mutated_batch, rsession, solr_url)
-
-    logging.info(f"Finished iterating, visited {total_records} records")
-
-
-def save_mutated_batch(current_mutated_batch, rsession, solr_url):
-    logging.info(f"Going to save {len(current_mutated_batch)} records")
-    isb_lib.core.solrAddRecords(rsession, current_mutated_batch, solr_url)
-    isb_lib.core.solrCommit(rsession, solr_url)
-    logging.info(f"Just saved {len(current_mutated_batch)} records")
+    runner = SolrMigrationRunner(
+        solr_url, mutate_record, None, 50000, num_workers=num_workers, checkpoint_path=checkpoint
+    )
+    runner.run()
 
 
 if __name__ == "__main__":
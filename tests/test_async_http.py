@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from isb_lib.utilities.async_http import TokenBucket, HostRateLimiter, AdaptiveConcurrencyLimiter
+
+
+def test_token_bucket_rate():
+    async def _acquire_all():
+        bucket = TokenBucket(100, 1)
+        start = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # The first token is available immediately, the next 10 at 100/sec
+    assert asyncio.run(_acquire_all()) >= 0.09
+
+
+def test_host_rate_limiter_buckets():
+    async def _buckets():
+        limiter = HostRateLimiter(10)
+        return (
+            limiter.bucket("http://foo.bar/a"),
+            limiter.bucket("http://foo.bar/b"),
+            limiter.bucket("http://baz.bar/a"),
+        )
+
+    first, second, third = asyncio.run(_buckets())
+    assert first is second
+    assert first is not third
+
+
+def test_adaptive_concurrency_limiter():
+    async def _adjust():
+        limiter = AdaptiveConcurrencyLimiter(8, 1, 16)
+        await limiter.acquire()
+        await limiter.release(False)
+        assert 4 == limiter.limit
+        for _ in range(20):
+            await limiter.acquire()
+            await limiter.release(True)
+        assert limiter.limit > 4
+        for _ in range(10):
+            await limiter.acquire()
+            await limiter.release(False)
+        assert 1 == limiter.limit
+
+    asyncio.run(_adjust())
+
+
+def test_adaptive_concurrency_limiter_blocks():
+    async def _max_in_flight():
+        limiter = AdaptiveConcurrencyLimiter(2)
+        max_in_flight = 0
+
+        async def _request():
+            nonlocal max_in_flight
+            await limiter.acquire()
+            max_in_flight = max(max_in_flight, limiter.in_flight)
+            await asyncio.sleep(0.01)
+            await limiter.release(True)
+
+        await asyncio.gather(*[_request() for _ in range(10)])
+        return max_in_flight
+
+    assert 2 == asyncio.run(_max_in_flight())
@@ -5,6 +5,10 @@ import json
 import requests
 
 from isb_lib.core import things_main
+from isb_lib.utilities import h3_utilities
+from isb_lib.models.thing import Thing
+from isb_web.sqlmodel_database import SQLModelDAO, get_change_watermark, save_thing
+from test_utils import _add_some_things
 
 TEST_LIVE_SERVER = 0
 
@@ -197,3 +201,132 @@ def test_isamples_date_with_ms():
 
 def test_things_main():
     things_main(click.core.Context(click.core.Command("test")), None, None)
+
+
+def _core_records_for_thing(thing):
+    return [{"id": thing.id, "authority": thing.authority_id}]
+
+
+@pytest.mark.parametrize("num_workers,ordered_results", [(1, True), (2, True), (2, False)])
+def test_core_solr_importer_transformed_records(tmp_path, num_workers, ordered_results):
+    db_url = f"sqlite:///{tmp_path}/things.db"
+    session = SQLModelDAO(db_url).get_session()
+    _add_some_things(session, 25, "test")
+    session.close()
+    importer = isb_lib.core.CoreSolrImporter(
+        db_url=db_url,
+        authority_id="test",
+        db_batch_size=10,
+        solr_batch_size=10,
+        solr_url="",
+        num_workers=num_workers,
+        ordered_results=ordered_results,
+        transform_chunk_size=3,
+    )
+    transformed = list(importer.transformed_records(_core_records_for_thing))
+    ids = [core_records[0]["id"] for _, core_records in transformed]
+    assert 25 == len(ids)
+    if ordered_results:
+        assert [str(i) for i in range(25)] == ids
+    else:
+        assert set([str(i) for i in range(25)]) == set(ids)
+
+
+@pytest.mark.parametrize(
+    "importer_options",
+    [{}, {"prefetch_size": 0}, {"stream_columns": True}, {"from_journal": True}, {"num_workers": 2}],
+)
+def test_core_solr_importer_run_solr_import(tmp_path, monkeypatch, importer_options):
+    db_url = f"sqlite:///{tmp_path}/things.db"
+    session = SQLModelDAO(db_url).get_session()
+    for i in range(25):
+        thing = Thing(
+            id=str(i),
+            authority_id="test",
+            resolved_url="http://foo.bar",
+            resolved_status=200,
+            resolved_content={"foo": "bar"},
+        )
+        # Journaled, unlike _add_some_things
+        save_thing(session, thing)
+    session.close()
+    sent = []
+    monkeypatch.setattr(isb_lib.core, "solrAddRecords", lambda rsession, records, url, max_retries: sent.extend(records))
+    monkeypatch.setattr(isb_lib.core, "solrCommit", lambda rsession, url: None)
+    refreshed = []
+    monkeypatch.setattr(h3_utilities, "refresh_h3_count_cube", lambda session: refreshed.append(session))
+    importer = isb_lib.core.CoreSolrImporter(
+        db_url=db_url,
+        authority_id="test",
+        db_batch_size=10,
+        solr_batch_size=10,
+        solr_url="",
+        **importer_options,
+    )
+    allkeys = importer.run_solr_import(_core_records_for_thing)
+    assert set([str(i) for i in range(25)]) == allkeys
+    assert allkeys == set([record["id"] for record in sent])
+    assert all("test" == record["source"] for record in sent)
+    # The h3 count cube is refreshed once everything is committed
+    assert 1 == len(refreshed)
+    if importer_options.get("from_journal"):
+        session = SQLModelDAO(db_url).get_session()
+        assert 25 == get_change_watermark(session, "solr_test")
+        session.close()
+
+
+class _FlakySolrSession:
+    def __init__(self, status_codes):
+        self.status_codes = status_codes
+        self.num_posts = 0
+
+    def post(self, url, headers=None, data=None, params=None):
+        response = requests.Response()
+        response.status_code = self.status_codes[self.num_posts]
+        response._content = b"{}"
+        self.num_posts += 1
+        return response
+
+
+def test_solr_add_records_retries_server_errors():
+    rsession = _FlakySolrSession([503, 502, 200])
+    isb_lib.core.solrAddRecords(rsession, [{"id": "1"}], "http://localhost:8983/solr/test/", max_retries=3, retry_backoff=0)
+    assert 3 == rsession.num_posts
+
+
+def test_solr_add_records_gives_up():
+    rsession = _FlakySolrSession([503, 503])
+    with pytest.raises(ValueError):
+        isb_lib.core.solrAddRecords(rsession, [{"id": "1"}], "http://localhost:8983/solr/test/", max_retries=1, retry_backoff=0)
+    assert 2 == rsession.num_posts
+
+
+def test_solr_atomic_update_doc():
+    doc = isb_lib.core.solr_atomic_update_doc(
+        "IGSN:123", {"producedBy_samplingSite_location_h3_0": "8029fffffffffff", "old_field": None}, {"keywords": "new"}
+    )
+    assert "IGSN:123" == doc["id"]
+    assert {"set": "8029fffffffffff"} == doc["producedBy_samplingSite_location_h3_0"]
+    assert {"set": None} == doc["old_field"]
+    assert {"add": "new"} == doc["keywords"]
+    # Derived fields are cleared so solr regenerates them, and the document has to already exist
+    assert all({"set": None} == doc[field] for field in isb_lib.core.SOLR_DERIVED_FIELDS)
+    assert 1 == doc["_version_"]
+    assert "_version_" not in isb_lib.core.solr_atomic_update_doc("IGSN:123", {"label": "x"}, must_exist=False)
+
+
+def test_solr_atomic_update_records():
+    posted = []
+
+    class _RecordingSolrSession(_FlakySolrSession):
+        def post(self, url, headers=None, data=None, params=None):
+            posted.append((url, b"".join(data), params))
+            return super().post(url, headers, data, params)
+
+    docs = [isb_lib.core.solr_atomic_update_doc("1", {"label": "one"})]
+    rsession = _RecordingSolrSession([200])
+    isb_lib.core.solr_atomic_update_records(rsession, docs, "http://localhost:8983/solr/test/", commit_within_ms=1000)
+    url, data, params = posted[0]
+    assert "http://localhost:8983/solr/test/update" == url
+    assert docs == json.loads(data)
+    assert {"failOnVersionConflicts": "false", "commitWithin": "1000"} == params
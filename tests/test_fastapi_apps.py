@@ -1,11 +1,17 @@
+import asyncio
+
 import pytest
 import json
 
+from aiohttp.test_utils import TestServer
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
+from isb_lib.core import MEDIA_MVT
 from isb_lib.models import thing
+from isb_web import sqlmodel_database, isb_solr_query, solr_client
 from isb_web.main import get_session, app, manage_app
+from test_isb_solr_query import aiohttp_solr_stand_in_app, STAND_IN_SOLR_PATH
 
 
 def _test_model():
@@ -206,6 +212,54 @@ def test_non_existent_thing_page(client: TestClient, session: Session):
     assert response.status_code == 404
 
 
+@pytest.fixture(name="solr_docs")
+def solr_docs_fixture(monkeypatch):
+    docs = [{"id": f"IGSN:{i:04d}", "source": "SESAR"} for i in range(5)]
+    # Serve the solr stand-in on the event loop the TestClient runs the app on
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    server = TestServer(aiohttp_solr_stand_in_app(docs, []))
+    loop.run_until_complete(server.start_server())
+    monkeypatch.setattr(isb_solr_query, "BASE_URL", str(server.make_url(STAND_IN_SOLR_PATH)))
+    yield docs
+    loop.run_until_complete(solr_client.close_async_solr_client())
+    loop.run_until_complete(server.close())
+
+
+def test_solr_select(client: TestClient, solr_docs: list):
+    response = client.get("/thing/select?q=*:*&rows=2")
+    assert response.status_code == 200
+    assert solr_docs[:2] == response.json()["response"]["docs"]
+
+
+def test_get_thing_solr_format(client: TestClient, solr_docs: list):
+    response = client.get(f"/thing/{solr_docs[1]['id']}?format=solr")
+    assert response.status_code == 200
+    assert solr_docs[1] == response.json()
+    response = client.get("/thing/IGSN:missing?format=solr")
+    assert response.status_code == 404
+
+
+def test_things_leaflet_heatmap(client: TestClient, solr_docs: list):
+    response = client.get("/things_leaflet_heatmap")
+    assert response.status_code == 200
+    assert len(solr_docs) == response.json()["num_docs"]
+
+
+def test_things_tile(client: TestClient, solr_docs: list):
+    # The stand-in's docs don't have locations, so the tile is empty
+    response = client.get("/tiles/0/0/0.mvt")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MEDIA_MVT
+    assert "max-age" in response.headers["cache-control"]
+    assert b"" == response.content
+    response = client.get("/tiles/1/2/0.mvt")
+    assert response.status_code == 404
+
+
 def test_get_thing_core_format(client: TestClient, session: Session):
     response = client.get(f"/thing/{TEST_IGSN}?format=core")
     assert response.status_code == 200
@@ -242,6 +296,41 @@ def test_get_things_for_sitemap(client: TestClient, session: Session):
     assert response_data[0]["id"] == TEST_IGSN
 
 
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip"])
+def test_get_things_for_sitemap_ndjson(client: TestClient, session: Session, accept_encoding: str):
+    post_data = json.dumps({"identifiers": [TEST_IGSN, "IGSN:nope"]}).encode("utf-8")
+    json_response = client.post("/things", data=post_data)
+    response = client.post(
+        "/things",
+        data=post_data,
+        headers={"Accept": "application/x-ndjson", "Accept-Encoding": accept_encoding},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    if accept_encoding == "gzip":
+        assert "gzip" == response.headers["content-encoding"]
+    else:
+        assert "content-encoding" not in response.headers
+    # requests transparently decodes the gzip encoding
+    response_data = [json.loads(line) for line in response.iter_lines() if line]
+    assert json_response.json() == response_data
+
+
+def test_get_thing_changes(client: TestClient, session: Session):
+    sqlmodel_database.save_thing(session, _test_model())
+    response = client.get("/things/changes", params={"since": 0, "authority": TEST_AUTHORITY_ID})
+    assert response.status_code == 200
+    data = response.json()
+    assert 1 == data["next"]
+    assert 1 == data["max_sequence"]
+    assert [TEST_IGSN] == [change["id"] for change in data["changes"]]
+    assert not data["changes"][0]["deleted"]
+    response = client.get("/things/changes", params={"since": data["next"]})
+    assert [] == response.json()["changes"]
+    response = client.get("/things/changes", params={"since_time": "2000-01-01T00:00:00"})
+    assert 1 == len(response.json()["changes"])
+
+
 def test_manage_logout(manage_client: TestClient, session: Session):
     headers = {
         "authorization": "Bearer 123456"
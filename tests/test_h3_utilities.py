@@ -0,0 +1,150 @@
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from isb_lib.models.h3_count import ALL_VALUES
+from isb_lib.utilities import h3_utilities
+from isb_web.sqlmodel_database import save_h3_count_cube, get_h3_count_cube
+
+CELL_1 = "8099fffffffffff"
+CELL_2 = "80d7fffffffffff"
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+INDEX_VERSION = 1234
+
+
+@pytest.fixture(name="index_version")
+def index_version_fixture(monkeypatch):
+    """The solr index version seen by h3_utilities, which tests can change by appending to the list"""
+    versions = [INDEX_VERSION]
+    monkeypatch.setattr(h3_utilities, "solr_index_version", lambda: versions[-1])
+    monkeypatch.setattr(h3_utilities, "H3_COUNT_CUBE_INDEX_CHECK_INTERVAL", 0.0)
+    return versions
+
+
+@pytest.fixture(name="solr_counts")
+def solr_counts_fixture(monkeypatch, index_version):
+    queries = []
+
+    def solr_records_forh3_counts(query, field_name):
+        queries.append(query)
+        return {"result-set": {"docs": [{field_name: CELL_1, "count(*)": 2}, {"EOF": True}]}}
+
+    monkeypatch.setattr(h3_utilities, "solr_records_forh3_counts", solr_records_forh3_counts)
+    return queries
+
+
+def _save_cube(session: Session):
+    counts = {
+        (0, ALL_VALUES, ALL_VALUES): {CELL_1: 30, CELL_2: 10},
+        (0, "SESAR", ALL_VALUES): {CELL_1: 20},
+        (0, "SESAR", "Rock"): {CELL_1: 5},
+        (0, ALL_VALUES, "Rock"): {CELL_1: 5, CELL_2: 5},
+    }
+    save_h3_count_cube(session, counts, 0, "hasMaterialCategory", INDEX_VERSION)
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        (None, (ALL_VALUES, ALL_VALUES)),
+        ("*:*", (ALL_VALUES, ALL_VALUES)),
+        ("source:SESAR", ("SESAR", ALL_VALUES)),
+        ('hasMaterialCategory:"Rock"', (ALL_VALUES, "Rock")),
+        ('source:SESAR AND hasMaterialCategory:"Mixed soil"', ("SESAR", "Mixed soil")),
+        ("(source:SESAR) AND *:*", ("SESAR", ALL_VALUES)),
+        ("source:SES*", None),
+        ("source:SESAR OR source:GEOME", None),
+        ("source:SESAR AND source:GEOME", None),
+        ("producedBy_samplingSite_location_ll:[0,0 TO 10,10]", None),
+        ("searchText:rock", None),
+    ],
+)
+def test_count_cube_key(query, expected):
+    assert expected == h3_utilities.count_cube_key(query)
+
+
+def test_get_record_counts_from_cube(session: Session, solr_counts):
+    _save_cube(session)
+    counts = h3_utilities.get_record_counts("*:*", 0, session=session)
+    assert [] == solr_counts
+    assert 30 == counts[CELL_1]["n"]
+    assert 0.75 == counts[CELL_1]["rn"]
+    counts = h3_utilities.get_record_counts('source:SESAR AND hasMaterialCategory:"Rock"', 0, session=session)
+    assert {CELL_1: {"n": 5, "rn": 1.0, "ln": 1.0}} == counts
+    assert [] == solr_counts
+
+
+def test_get_record_counts_falls_back_to_solr(session: Session, solr_counts):
+    # No cube yet
+    h3_utilities.get_record_counts("*:*", 0, session=session)
+    _save_cube(session)
+    # Finer than the cube's resolutions, and a query the cube can't answer
+    h3_utilities.get_record_counts("*:*", 1, session=session)
+    h3_utilities.get_record_counts("searchText:rock", 0, session=session)
+    assert ["*:*", "*:*", "searchText:rock"] == solr_counts
+    h3_utilities.get_record_counts("*:*", 0, session=session)
+    assert 3 == len(solr_counts)
+
+
+def test_get_record_counts_index_changed(session: Session, solr_counts, index_version):
+    _save_cube(session)
+    # Committed to since the counts were computed
+    index_version.append(INDEX_VERSION + 1)
+    assert 2 == h3_utilities.get_record_counts("*:*", 0, session=session)[CELL_1]["n"]
+    assert ["*:*"] == solr_counts
+    # Or solr can't say
+    index_version.append(None)
+    h3_utilities.get_record_counts("*:*", 0, session=session)
+    assert 2 == len(solr_counts)
+    index_version.append(INDEX_VERSION)
+    assert 30 == h3_utilities.get_record_counts("*:*", 0, session=session)[CELL_1]["n"]
+    assert 2 == len(solr_counts)
+
+
+def test_count_cube_counts_without_category_field(session: Session, index_version):
+    _save_cube(session)
+    cube = get_h3_count_cube(session)
+    assert cube is not None
+    # As saved before the category field was recorded
+    cube.category_field = None
+    session.add(cube)
+    session.commit()
+    assert {CELL_1: 5} == h3_utilities.count_cube_counts(session, 'source:SESAR AND hasMaterialCategory:"Rock"', 0)
+
+
+def test_refresh_h3_count_cube(session: Session, monkeypatch, index_version):
+    monkeypatch.setattr(
+        h3_utilities, "compute_h3_count_cube", lambda max_resolution, category_field: {(0, ALL_VALUES, ALL_VALUES): {CELL_1: 3}}
+    )
+    h3_utilities.refresh_h3_count_cube(session, 0)
+    cube = get_h3_count_cube(session)
+    assert cube is not None
+    assert INDEX_VERSION == cube.index_version
+    assert {CELL_1: 3} == h3_utilities.count_cube_counts(session, "*:*", 0)
+
+
+def test_compute_h3_count_cube(monkeypatch):
+    def solr_bucket_counts(query, bucket_fields):
+        doc = {"count(*)": 2}
+        for field in bucket_fields:
+            doc[field] = CELL_1 if field.startswith("producedBy") else f"{field}_value"
+        return [doc]
+
+    monkeypatch.setattr(h3_utilities, "solr_bucket_counts", solr_bucket_counts)
+    counts = h3_utilities.compute_h3_count_cube(1, "hasMaterialCategory")
+    assert 8 == len(counts)
+    assert {CELL_1: 2} == counts[(1, ALL_VALUES, ALL_VALUES)]
+    assert {CELL_1: 2} == counts[(0, "source_value", ALL_VALUES)]
+    assert {CELL_1: 2} == counts[(0, ALL_VALUES, "hasMaterialCategory_value")]
+    assert {CELL_1: 2} == counts[(1, "source_value", "hasMaterialCategory_value")]
@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import pytest
+
+from isb_web.heatmap_cache import HeatmapCache, ResponseCache, heatmap_cache_key
+
+
+def _fetcher(fetched: list, delay: float = 0.0):
+    def fetch_for(params: dict):
+        async def fetch():
+            fetched.append(params["q"])
+            await asyncio.sleep(delay)
+            return {"q": params["q"], "counts_ints2D": [[1]]}
+
+        return fetch
+
+    return fetch_for
+
+
+def test_heatmap_cache_key():
+    assert heatmap_cache_key({"q": "*:*", "fq": "", "rows": 0}) == heatmap_cache_key({"rows": 0, "q": " *:* "})
+    assert heatmap_cache_key({"q": "*:*"}) != heatmap_cache_key({"q": "source:SESAR"})
+    assert heatmap_cache_key({"q": "*:*"}, 1) != heatmap_cache_key({"q": "*:*"}, 2)
+
+
+def test_heatmap_cache_lru():
+    fetched: list = []
+    fetch_for = _fetcher(fetched)
+
+    async def _get():
+        cache = HeatmapCache(max_entries=2)
+        for q in ["a", "b", "a", "c", "a", "b"]:
+            await cache.get({"q": q}, fetch_for({"q": q}))
+        return cache
+
+    cache = asyncio.run(_get())
+    # b was the least recently used when c came along
+    assert ["a", "b", "c", "b"] == fetched
+    assert 2 == cache.hits
+    assert 4 == cache.misses
+
+
+def test_heatmap_cache_ttl():
+    fetched: list = []
+    fetch_for = _fetcher(fetched)
+
+    async def _get():
+        cache = HeatmapCache(ttl=0.05)
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+        time.sleep(0.1)
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+
+    asyncio.run(_get())
+    assert ["a", "a"] == fetched
+
+
+def test_heatmap_cache_coalesces_requests():
+    fetched: list = []
+    fetch_for = _fetcher(fetched, 0.05)
+
+    async def _get():
+        cache = HeatmapCache()
+        heatmaps = await asyncio.gather(*[cache.get({"q": "a"}, fetch_for({"q": "a"})) for _ in range(10)])
+        return cache, heatmaps
+
+    cache, heatmaps = asyncio.run(_get())
+    assert ["a"] == fetched
+    assert all(heatmap is heatmaps[0] for heatmap in heatmaps)
+    assert 1 == cache.misses
+    assert 9 == cache.coalesced
+
+
+def test_heatmap_cache_owner_cancelled():
+    fetched: list = []
+    fetch_for = _fetcher(fetched, 0.05)
+
+    async def _get():
+        cache = HeatmapCache()
+        # The first request, which started the fetch, goes away while a second is waiting on it
+        owner = asyncio.ensure_future(cache.get({"q": "a"}, fetch_for({"q": "a"})))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(cache.get({"q": "a"}, fetch_for({"q": "a"})))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        heatmap = await waiter
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return cache, heatmap
+
+    cache, heatmap = asyncio.run(_get())
+    assert "a" == heatmap["q"]
+    assert ["a"] == fetched
+    assert 1 == cache.coalesced
+    # Cached all the same
+    assert 1 == len(cache._entries)
+
+
+def test_heatmap_cache_failures_not_cached():
+    num_fetches = 0
+
+    async def fail():
+        nonlocal num_fetches
+        num_fetches += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("solr is down")
+
+    async def _get():
+        cache = HeatmapCache()
+        results = await asyncio.gather(*[cache.get({"q": "a"}, fail) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        with pytest.raises(ValueError):
+            await cache.get({"q": "a"}, fail)
+
+    asyncio.run(_get())
+    assert 2 == num_fetches
+
+
+def test_heatmap_cache_index_version():
+    fetched: list = []
+    fetch_for = _fetcher(fetched)
+    index_version = [1]
+
+    async def current_index_version():
+        return index_version[0]
+
+    async def _get():
+        cache = HeatmapCache(index_version=current_index_version, index_check_interval=0)
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+        index_version[0] = 2
+        await cache.get({"q": "a"}, fetch_for({"q": "a"}))
+        return cache
+
+    cache = asyncio.run(_get())
+    assert ["a", "a"] == fetched
+    assert 1 == cache.invalidations
+    assert 2 == cache.stats()["index_version"]
+
+
+def test_heatmap_cache_directory(tmp_path):
+    fetched: list = []
+    fetch_for = _fetcher(fetched)
+
+    async def _get():
+        # As if in two different web app processes
+        first = HeatmapCache(directory=str(tmp_path))
+        second = HeatmapCache(directory=str(tmp_path))
+        first_heatmap = await first.get({"q": "a"}, fetch_for({"q": "a"}))
+        second_heatmap = await second.get({"q": "a"}, fetch_for({"q": "a"}))
+        assert first_heatmap == second_heatmap
+        assert 1 == second.disk_hits
+        second.clear()
+        await first.get({"q": "b"}, fetch_for({"q": "b"}))
+        await HeatmapCache(directory=str(tmp_path)).get({"q": "a"}, fetch_for({"q": "a"}))
+
+    asyncio.run(_get())
+    assert ["a", "b", "a"] == fetched
+
+
+def test_response_cache_bytes_directory(tmp_path):
+    fetched: list = []
+
+    async def fetch():
+        fetched.append(True)
+        return b"\x1a\x00tile\n"
+
+    async def _get():
+        first = ResponseCache[bytes](directory=str(tmp_path), dumps=bytes, loads=bytes)
+        second = ResponseCache[bytes](directory=str(tmp_path), dumps=bytes, loads=bytes)
+        assert b"\x1a\x00tile\n" == await first.get({"z": 1}, fetch)
+        assert b"\x1a\x00tile\n" == await second.get({"z": 1}, fetch)
+        assert 1 == second.disk_hits
+
+    asyncio.run(_get())
+    assert [True] == fetched
+    with pytest.raises(ValueError):
+        ResponseCache[bytes](directory=str(tmp_path))
@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import pytest
+
+from isb_web.heatmap_grid import HeatmapGrid, counts_array, join_heatmaps
+
+HEATMAP = {
+    "gridLevel": 2,
+    "rows": 2,
+    "columns": 3,
+    "minX": -180.0,
+    "maxX": 180.0,
+    "minY": -90.0,
+    "maxY": 90.0,
+    "counts_ints2D": [None, [0, 3, 1]],
+    "numDocs": 4,
+}
+
+
+def test_counts_array():
+    assert [[0, 0, 0], [0, 3, 1]] == counts_array(HEATMAP).tolist()
+    assert (2, 3) == counts_array(dict(HEATMAP, counts_ints2D=None)).shape
+
+
+def test_heatmap_grid_leaflet():
+    leaflet = HeatmapGrid(HEATMAP).leaflet()
+    assert [[-45.0, 0.0, 3], [-45.0, 120.0, 1]] == leaflet["data"]
+    assert 3 == leaflet["max_value"]
+    assert 4 == leaflet["total"]
+    assert 4 == leaflet["num_docs"]
+
+
+def test_heatmap_grid_geojson():
+    geojson = HeatmapGrid(HEATMAP).geojson()
+    assert 2 == len(geojson["features"])
+    assert [[[-60.0, 0.0], [60.0, 0.0], [60.0, -90.0], [-60.0, -90.0], [-60.0, 0.0]]] == geojson["features"][0][
+        "geometry"
+    ]["coordinates"]
+    assert 3 == geojson["features"][0]["properties"]["count"]
+    assert 3 == geojson["max_count"]
+    assert 2 == geojson["grid_level"]
+    assert 4 == geojson["total"]
+
+
+def test_heatmap_grid_geojson_bytes():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 3, (7, 9)).tolist()
+    counts[2] = None
+    hm = {
+        "rows": 7,
+        "columns": 9,
+        "minX": -123.4567891,
+        "maxX": 50.1,
+        "minY": -33.3,
+        "maxY": 71.77777,
+        "counts_ints2D": counts,
+    }
+    bounds = {"type": "Feature", "properties": {"count": -1}}
+    grid = HeatmapGrid(hm)
+    assert json.loads(json.dumps(grid.geojson([bounds]))) == json.loads(grid.geojson_bytes([bounds]))
+
+
+def test_heatmap_grid_empty():
+    grid = HeatmapGrid(dict(HEATMAP, counts_ints2D=None))
+    assert 0 == len(grid)
+    geojson = json.loads(grid.geojson_bytes())
+    assert [] == geojson["features"]
+    assert 0 == geojson["max_count"]
+    assert 0 == geojson["total"]
+
+
+def test_join_heatmaps():
+    west = dict(HEATMAP, columns=1, minX=0.0, maxX=180.0, counts_ints2D=[[3], None])
+    east = dict(HEATMAP, columns=2, minX=-180.0, maxX=180.0, counts_ints2D=[None, [1, 2]])
+    joined = join_heatmaps([west, east])
+    assert 3 == joined["columns"]
+    assert 0.0 == joined["minX"]
+    assert 540.0 == joined["maxX"]
+    assert [[3, 0, 0], [0, 1, 2]] == counts_array(joined).tolist()
+    assert [[-45.0, 270.0, 1], [-45.0, 450.0, 2]] == HeatmapGrid(joined).leaflet()["data"][1:]
+    assert -360.0 == join_heatmaps([west], -360.0)["minX"]
+    # The originals, which may be cached, aren't modified
+    assert 0.0 == west["minX"] and [[3], None] == west["counts_ints2D"]
+    assert west is join_heatmaps([west])
+    with pytest.raises(ValueError):
+        join_heatmaps([west, dict(east, gridLevel=3)])
@@ -0,0 +1,50 @@
+import pytest
+
+from isb_lib.utilities.identifier_map import CompactIdentifierMap, hash_identifier
+
+
+def _pairs(num_pairs: int):
+    return [(f"IGSN:{i:08d}", i) for i in range(num_pairs)]
+
+
+def test_hash_identifier_is_stable():
+    assert hash_identifier("IGSN:123") == hash_identifier("IGSN:123")
+    assert hash_identifier("IGSN:123") != hash_identifier("IGSN:124")
+
+
+def test_compact_identifier_map():
+    identifier_map = CompactIdentifierMap.from_pairs(_pairs(1000), chunk_size=64)
+    assert 1000 == len(identifier_map)
+    assert 16000 == identifier_map.nbytes
+    assert 5 == identifier_map["IGSN:00000005"]
+    assert "IGSN:00000999" in identifier_map
+    assert "IGSN:00001000" not in identifier_map
+    assert identifier_map.get("nope") is None
+    with pytest.raises(KeyError):
+        identifier_map["nope"]
+    assert {"IGSN:00000001": 1, "IGSN:00000500": 500} == identifier_map.get_many(
+        ["IGSN:00000001", "nope", "IGSN:00000500"]
+    )
+
+
+def test_compact_identifier_map_later_duplicates_win():
+    identifier_map = CompactIdentifierMap.from_pairs([("ark:/1", 1), ("ark:/2", 2), ("ark:/1", 3)])
+    assert 2 == len(identifier_map)
+    assert 3 == identifier_map["ark:/1"]
+
+
+def test_compact_identifier_map_empty():
+    identifier_map = CompactIdentifierMap.from_pairs([])
+    assert 0 == len(identifier_map)
+    assert "ark:/1" not in identifier_map
+    assert {} == identifier_map.get_many(["ark:/1"])
+    assert 0 == identifier_map.max_primary_key
+
+
+def test_compact_identifier_map_save_load(tmp_path):
+    path = str(tmp_path / "identifiers.npy")
+    CompactIdentifierMap.from_pairs(_pairs(100)).save(path)
+    identifier_map = CompactIdentifierMap.load(path)
+    assert 100 == len(identifier_map)
+    assert 42 == identifier_map["IGSN:00000042"]
+    assert 99 == identifier_map.max_primary_key
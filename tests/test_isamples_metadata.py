@@ -3,6 +3,8 @@ import json
 import csv
 from typing import Optional
 
+import h3
+import numpy
 import pytest
 import typing
 import re
@@ -287,3 +289,31 @@ def test_geome_geo_to_h3():
         source_record = json.load(source_file)
         h3 = GEOMETransformer.geo_to_h3(source_record)
         assert "8f65534b37a2c0d" == h3
+
+
+def test_geo_to_h3_resolutions():
+    cells = Transformer.geo_to_h3_resolutions(32.253460, -110.911789)
+    assert list(Transformer.H3_RESOLUTIONS) == list(cells.keys())
+    assert Transformer.geo_to_h3(32.253460, -110.911789) == cells[15]
+    # Coarser cells are derived from the finest one, so they nest exactly
+    for resolution in range(0, 15):
+        assert h3.cell_to_parent(cells[resolution + 1], resolution) == cells[resolution]
+    assert all(cell is None for cell in Transformer.geo_to_h3_resolutions(None, None).values())
+
+
+def test_geo_to_h3_resolutions_array():
+    rng = numpy.random.default_rng(0)
+    latitudes = rng.uniform(-90, 90, 500)
+    longitudes = rng.uniform(-180, 180, 500)
+    latitudes[7] = numpy.nan
+    cells_by_resolution = Transformer.geo_to_h3_resolutions_array(latitudes, longitudes)
+    strings_by_resolution = {
+        resolution: Transformer.h3_cells_to_strings(cells) for resolution, cells in cells_by_resolution.items()
+    }
+    for index in range(len(latitudes)):
+        expected = Transformer.geo_to_h3_resolutions(
+            None if index == 7 else latitudes[index], longitudes[index]
+        )
+        for resolution, strings in strings_by_resolution.items():
+            assert (expected[resolution] or "") == strings[index]
+    assert 0 == cells_by_resolution[3][7]
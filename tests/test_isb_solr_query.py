@@ -0,0 +1,370 @@
+import asyncio
+import collections
+import json
+import math
+import re
+import typing
+import urllib.parse
+
+import fastapi
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from fastapi.testclient import TestClient
+
+from isb_web import isb_solr_query, solr_client
+from isb_web.isb_solr_query import (
+    ISBCoreSolrRecordIterator,
+    PAGING_CURSOR,
+    PAGING_EXPORT,
+    PAGING_OFFSET,
+    CURSOR_MARK_START,
+)
+
+NUM_DOCS = 25
+
+STAND_IN_SOLR_PATH = "/solr/isb_core_records/"
+
+
+def _solr_path(handler: str) -> str:
+    return urllib.parse.urlparse(isb_solr_query.get_solr_url(handler)).path
+
+
+def solr_stand_in_app(docs: list[dict]) -> fastapi.FastAPI:
+    """Just enough of solr's /select and /export, over docs sorted by id, to page through them"""
+    app = fastapi.FastAPI()
+    requests_seen: list[dict] = []
+    app.state.requests_seen = requests_seen
+
+    @app.get(_solr_path("select"))
+    def select(
+        q: str, rows: int, start: int = 0, sort: typing.Optional[str] = None, cursorMark: typing.Optional[str] = None
+    ):
+        requests_seen.append({"handler": "select", "start": start, "sort": sort, "cursorMark": cursorMark})
+        if cursorMark is not None:
+            assert sort is not None and sort.endswith("id asc")
+            after = [doc for doc in docs if cursorMark == CURSOR_MARK_START or doc["id"] > cursorMark]
+            page = after[:rows]
+            next_cursor_mark = page[-1]["id"] if len(page) > 0 else cursorMark
+            return {"response": {"numFound": len(docs), "docs": page}, "nextCursorMark": next_cursor_mark}
+        return {"response": {"numFound": len(docs), "docs": docs[start:start + rows]}}
+
+    @app.get(_solr_path("export"))
+    def export(q: str, fl: str, sort: str):
+        requests_seen.append({"handler": "export", "fl": fl, "sort": sort})
+        fields = fl.split(",")
+        exported = [{field: doc[field] for field in fields if field in doc} for doc in docs]
+        if "fail" in fields:
+            exported.append({"EXCEPTION": "fail must have docValues to use this feature."})
+        body = json.dumps({"responseHeader": {"status": 0}, "response": {"numFound": len(docs), "docs": exported}})
+        # Small chunks, so docs are split across them
+        return fastapi.responses.StreamingResponse(
+            (body[i:i + 7].encode("utf-8") for i in range(0, len(body), 7)), media_type="application/json"
+        )
+
+    return app
+
+
+HEATMAP: dict[str, typing.Any] = {
+    "gridLevel": 2,
+    "columns": 2,
+    "rows": 2,
+    "minX": -180.0,
+    "maxX": 180.0,
+    "minY": -90.0,
+    "maxY": 90.0,
+    "counts_ints2D": [[0, 3], None],
+}
+
+
+def _heatmap_for(geom: str) -> dict:
+    """The columns of HEATMAP, which has 180 degree wide cells, covering the longitudes of geom"""
+    min_x, _, _, max_x, _ = geom.strip("[]").split()
+    first = int((float(min_x) + 180.0) // 180.0)
+    last = max(first + 1, int(math.ceil((float(max_x) + 180.0) / 180.0)))
+    return dict(
+        HEATMAP,
+        columns=last - first,
+        minX=-180.0 + first * 180.0,
+        maxX=-180.0 + last * 180.0,
+        counts_ints2D=[None if row is None else row[first:last] for row in HEATMAP["counts_ints2D"]],
+    )
+
+
+def _located_within(doc: dict, fqs: list[str]) -> bool:
+    """Whether doc, with its location as x and y, is within the location filter queries among fqs"""
+    for fq in fqs:
+        ranges = [[float(v) for v in r] for r in re.findall(r"_ll:\[(\S+),(\S+) TO (\S+),(\S+)\]", fq)]
+        if len(ranges) == 0:
+            continue
+        if "x" not in doc or not any(s <= doc["y"] <= n and w <= doc["x"] <= e for s, w, n, e in ranges):
+            return False
+    return True
+
+
+def aiohttp_solr_stand_in_app(
+    docs: list[dict], requests_seen: list[dict], index_version: typing.Optional[list] = None
+) -> web.Application:
+    """
+    A solr stand-in for the async client at /solr/isb_core_records/: looks records up by id, pages with start/rows,
+    filters on location (docs with x and y), facets on a field or a heatmap, and answers /stream and /admin/luke (with
+    the index version in index_version[0])
+    """
+
+    async def select(request: web.Request) -> web.StreamResponse:
+        q = request.query["q"]
+        rows = int(request.query.get("rows", 10))
+        fqs = request.query.getall("fq", [])
+        requests_seen.append({"handler": "select", "q": q, "rows": rows, "fq": fqs})
+        matching = [doc for doc in docs if _located_within(doc, fqs)]
+        if q == "fail":
+            return web.json_response({"error": {"msg": "bad query"}}, status=400)
+        if q.startswith("id:"):
+            matching = [doc for doc in docs if doc["id"] == q[len("id:"):].replace("\\", "")]
+            return web.json_response({"response": {"numFound": len(matching), "docs": matching[:rows]}})
+        if "facet.field" in request.query:
+            field = request.query["facet.field"]
+            counts = collections.Counter(doc[field] for doc in matching if field in doc)
+            return web.json_response({
+                "response": {"numFound": len(matching), "docs": []},
+                "facet_counts": {"facet_fields": {field: dict(counts)}},
+            })
+        if rows == 0:
+            geom = request.query["facet.heatmap.geom"]
+            requests_seen[-1].update(geom=geom, distErr=request.query.get("facet.heatmap.distErr"))
+            return web.json_response({
+                "response": {"numFound": len(docs), "docs": []},
+                "facet_counts": {"facet_heatmaps": {"producedBy_samplingSite_location_rpt": _heatmap_for(geom)}},
+            })
+        start = int(request.query.get("start", 0))
+        return web.json_response({"response": {"numFound": len(matching), "docs": matching[start:start + rows]}})
+
+    async def stream(request: web.Request) -> web.StreamResponse:
+        form = await request.post()
+        requests_seen.append({"handler": "stream", "expr": form["expr"]})
+        body = json.dumps({"result-set": {"docs": [{"id": doc["id"]} for doc in docs] + [{"EOF": True}]}})
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        for i in range(0, len(body), 100):
+            await response.write(body[i:i + 100].encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def luke(request: web.Request) -> web.StreamResponse:
+        if request.query["show"] == "index":
+            return web.json_response({"index": {"version": index_version[0] if index_version else 1}})
+        return web.json_response({"schema": {"uniqueKeyField": "id"}})
+
+    app = web.Application()
+    app.router.add_get(f"{STAND_IN_SOLR_PATH}select", select)
+    app.router.add_post(f"{STAND_IN_SOLR_PATH}stream", stream)
+    app.router.add_get(f"{STAND_IN_SOLR_PATH}admin/luke", luke)
+    return app
+
+
+@pytest.fixture
+def solr_stand_in(monkeypatch):
+    monkeypatch.setattr(isb_solr_query, "BASE_URL", "http://localhost:8983/solr/isb_core_records/")
+    docs = [{"id": f"IGSN:{i:04d}", "source": "SESAR", "label": f"sample ∆ {i}"} for i in range(NUM_DOCS)]
+    app = solr_stand_in_app(docs)
+    return docs, app, TestClient(app)
+
+
+@pytest.mark.parametrize("paging,batch_size", [(PAGING_OFFSET, 10), (PAGING_CURSOR, 10), (PAGING_CURSOR, 25)])
+def test_iterator_paging(solr_stand_in, paging, batch_size):
+    docs, app, client = solr_stand_in
+    records = list(ISBCoreSolrRecordIterator(client, "*:*", batch_size, 0, "id asc", paging))
+    assert docs == records
+    if paging == PAGING_CURSOR:
+        assert [CURSOR_MARK_START] == [seen["cursorMark"] for seen in app.state.requests_seen][:1]
+        assert all(seen["start"] == 0 for seen in app.state.requests_seen)
+    else:
+        assert [0, 10, 20, 25] == [seen["start"] for seen in app.state.requests_seen]
+
+
+def test_iterator_cursor_with_offset_pages_by_offset(solr_stand_in):
+    docs, app, client = solr_stand_in
+    iterator = ISBCoreSolrRecordIterator(client, "*:*", 10, 20, "id asc")
+    assert PAGING_OFFSET == iterator.paging
+    assert docs[20:] == list(iterator)
+
+
+def test_iterator_export(solr_stand_in):
+    docs, app, client = solr_stand_in
+    records = list(ISBCoreSolrRecordIterator(client, "*:*", 10, 0, "source asc", PAGING_EXPORT, "id,label"))
+    assert [{"id": doc["id"], "label": doc["label"]} for doc in docs] == records
+    assert [{"handler": "export", "fl": "id,label", "sort": "source asc, id asc"}] == app.state.requests_seen
+
+
+def test_iterator_export_failure(solr_stand_in):
+    docs, app, client = solr_stand_in
+    with pytest.raises(ValueError):
+        list(ISBCoreSolrRecordIterator(client, "*:*", 10, 0, None, PAGING_EXPORT, "id,fail"))
+
+
+def test_iterator_export_requires_fields():
+    with pytest.raises(ValueError):
+        ISBCoreSolrRecordIterator(None, "*:*", 10, 0, None, PAGING_EXPORT)
+
+
+@pytest.fixture
+def async_solr(monkeypatch):
+    """Runs a coroutine function against a solr stand-in, passing it the stand-in's docs and requests seen"""
+    docs = [{"id": f"IGSN:{i:04d}", "source": "SESAR"} for i in range(NUM_DOCS)]
+    monkeypatch.setattr(isb_solr_query, "_heatmap_cache", None)
+
+    def run(coroutine_function):
+        async def _run():
+            requests_seen: list[dict] = []
+            async with TestServer(aiohttp_solr_stand_in_app(docs, requests_seen)) as server:
+                monkeypatch.setattr(isb_solr_query, "BASE_URL", str(server.make_url(STAND_IN_SOLR_PATH)))
+                try:
+                    return await coroutine_function(docs, requests_seen)
+                finally:
+                    await solr_client.close_async_solr_client()
+
+        return asyncio.run(_run())
+
+    return run
+
+
+async def _body(response) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def test_async_solr_get_record(async_solr):
+    async def _get_records(docs, requests_seen):
+        assert (200, docs[3]) == await isb_solr_query.async_solr_get_record(docs[3]["id"])
+        assert (404, None) == await isb_solr_query.async_solr_get_record("IGSN:missing")
+        # The connection is kept alive and shared
+        assert solr_client.get_async_solr_client() is solr_client.get_async_solr_client()
+
+    async_solr(_get_records)
+
+
+def test_async_solr_query(async_solr):
+    async def _query(docs, requests_seen):
+        response = await isb_solr_query.async_solr_query([["q", "*:*"], ["rows", 5], ["wt", "csv"]])
+        assert "text/plain" == response.media_type
+        assert docs[:5] == json.loads(await _body(response))["response"]["docs"]
+        # Solr's errors are passed through along with their status
+        response = await isb_solr_query.async_solr_query([["q", "fail"], ["rows", 5]])
+        assert 400 == response.status_code
+        assert "bad query" == json.loads(await _body(response))["error"]["msg"]
+
+    async_solr(_query)
+
+
+def test_async_solr_searchStream(async_solr):
+    async def _stream(docs, requests_seen):
+        response = await isb_solr_query.async_solr_searchStream([["q", "source:SESAR"], ["xycount", "true"]])
+        body = json.loads(await _body(response))
+        assert len(docs) + 1 == len(body["result-set"]["docs"])
+        assert requests_seen[-1]["expr"].startswith('select(rollup(search(isb_core_records,q="source:SESAR"')
+
+    async_solr(_stream)
+
+
+def test_async_solr_stream_released_unread(async_solr):
+    async def _stream(docs, requests_seen):
+        client = solr_client.AsyncSolrClient(max_connections=1)
+        try:
+            url = isb_solr_query.get_solr_url("select")
+            response = await client.stream("GET", url, "application/json", params={"q": "*:*"})
+            # The body is never iterated, e.g. the client went away first, but the connection still goes back
+            await response.background()
+            status, res = await asyncio.wait_for(client.get_json(url, params={"q": "*:*"}), 5)
+            assert 200 == status
+        finally:
+            await client.close()
+
+    async_solr(_stream)
+
+
+def test_async_solr_heatmaps(async_solr):
+    async def _heatmaps(docs, requests_seen):
+        geojson_heatmap = await isb_solr_query.async_solr_geojson_heatmap("*:*", None)
+        assert 1 == len(geojson_heatmap["features"])
+        assert 3 == geojson_heatmap["total"]
+        assert len(docs) == geojson_heatmap["num_docs"]
+        leaflet_heatmap = await isb_solr_query.async_solr_leaflet_heatmap("*:*", None)
+        assert [[45.0, 90.0, 3]] == leaflet_heatmap["data"]
+
+    async_solr(_heatmaps)
+
+
+def test_async_solr_heatmaps_cached(async_solr):
+    async def _heatmaps(docs, requests_seen):
+        bounds = {
+            isb_solr_query.MIN_LAT: -10.0,
+            isb_solr_query.MAX_LAT: 10.0,
+            isb_solr_query.MIN_LON: -20.0,
+            isb_solr_query.MAX_LON: 20.0000000001,
+        }
+        # Identical concurrent requests share a single solr request
+        heatmaps = await asyncio.gather(
+            *[isb_solr_query.async_solr_geojson_heatmap("*:*", dict(bounds)) for _ in range(5)]
+        )
+        assert all(heatmap == heatmaps[0] for heatmap in heatmaps)
+        # So do later ones, for practically the same bounds
+        bounds[isb_solr_query.MAX_LON] = 20.0
+        await isb_solr_query.async_solr_geojson_heatmap(" *:* ", dict(bounds), fq="")
+        assert 1 == len([seen for seen in requests_seen if seen["rows"] == 0])
+        # But not ones for other queries
+        await isb_solr_query.async_solr_geojson_heatmap("source:SESAR", dict(bounds))
+        assert 2 == len([seen for seen in requests_seen if seen["rows"] == 0])
+        stats = isb_solr_query.get_heatmap_cache().stats()
+        assert 2 == stats["misses"]
+        assert 1 == stats["hits"]
+        assert 4 == stats["coalesced"]
+
+    async_solr(_heatmaps)
+
+
+def test_async_solr_heatmaps_across_antimeridian(async_solr):
+    async def _heatmaps(docs, requests_seen):
+        bounds = {
+            isb_solr_query.MIN_LAT: -10.0,
+            isb_solr_query.MAX_LAT: 10.0,
+            isb_solr_query.MIN_LON: 170.0,
+            isb_solr_query.MAX_LON: -170.0,
+        }
+        leaflet_heatmap = await isb_solr_query.async_solr_leaflet_heatmap("*:*", bounds)
+        heatmap_requests = [seen for seen in requests_seen if seen["rows"] == 0]
+        assert ["[170.0 -10.0 TO 180.0 10.0]", "[-180.0 -10.0 TO -170.0 10.0]"] == [
+            seen["geom"] for seen in heatmap_requests
+        ]
+        # Both halves at the grid level solr would have picked for the whole
+        assert heatmap_requests[0]["distErr"] is not None
+        assert heatmap_requests[0]["distErr"] == heatmap_requests[1]["distErr"]
+        assert [[45.0, 90.0, 3]] == leaflet_heatmap["data"]
+        # The same bounds, west of -180, share the cached heatmaps and come back in those longitudes
+        bounds[isb_solr_query.MIN_LON] = -190.0
+        bounds[isb_solr_query.MAX_LON] = -170.0
+        leaflet_heatmap = await isb_solr_query.async_solr_leaflet_heatmap("*:*", bounds)
+        assert 2 == len([seen for seen in requests_seen if seen["rows"] == 0])
+        assert [[45.0, -270.0, 3]] == leaflet_heatmap["data"]
+
+    async_solr(_heatmaps)
+
+
+def test_heatmap_longitude_ranges():
+    assert ([(-180.0, 180.0)], 0.0) == isb_solr_query.heatmap_longitude_ranges(-180.0, 180.0)
+    assert ([(-10.0, 10.0)], 0.0) == isb_solr_query.heatmap_longitude_ranges(-10.0, 10.0)
+    assert ([(170.0, 180.0), (-180.0, -170.0)], 0.0) == isb_solr_query.heatmap_longitude_ranges(170.0, -170.0)
+    assert ([(170.0, 180.0), (-180.0, -170.0)], 0.0) == isb_solr_query.heatmap_longitude_ranges(170.0, 190.0)
+    assert ([(170.0, 180.0), (-180.0, -170.0)], -360.0) == isb_solr_query.heatmap_longitude_ranges(-190.0, -170.0)
+    assert ([(160.0, 170.0)], -360.0) == isb_solr_query.heatmap_longitude_ranges(-200.0, -190.0)
+
+
+def test_get_async_solr_client_per_loop():
+    async def _client():
+        client = solr_client.get_async_solr_client()
+        assert client is solr_client.get_async_solr_client()
+        return client
+
+    first = asyncio.run(_client())
+    # Connections can't be shared with another event loop, so it gets its own client
+    second = asyncio.run(_client())
+    assert second is not first
+    asyncio.run(solr_client.close_async_solr_client())
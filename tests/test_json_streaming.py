@@ -0,0 +1,83 @@
+import datetime
+import json
+
+import pytest
+
+from isb_lib.utilities import json_streaming
+from isb_lib.utilities.json_streaming import json_array_chunks, dumps_bytes
+
+
+@pytest.mark.parametrize("num_records,chunk_size", [(0, 10), (1, 10), (100, 10), (100, 1024 * 1024)])
+def test_json_array_chunks(num_records, chunk_size):
+    records = [{"id": str(i), "label": f"thing {i}", "values": [i, i / 2]} for i in range(num_records)]
+    chunks = list(json_array_chunks(records, chunk_size))
+    assert records == json.loads(b"".join(chunks))
+
+
+def test_json_array_chunks_lazy():
+    def records():
+        yield {"id": "1"}
+        raise ValueError("Shouldn't have been consumed yet")
+
+    chunks = json_array_chunks(records(), 1)
+    assert b'[{"id":"1"}' == next(chunks).replace(b" ", b"")
+
+
+def test_dumps_bytes_without_orjson(monkeypatch):
+    monkeypatch.setattr(json_streaming, "orjson", None)
+    assert {"id": "1", "n": 2} == json.loads(dumps_bytes({"id": "1", "n": 2}))
+
+
+def test_dumps_bytes_falls_back_on_unsupported_values():
+    # orjson refuses non-str keys, json.dumps converts them
+    assert {"1": "one"} == json.loads(dumps_bytes({1: "one"}))
+
+
+def test_ndjson_chunks():
+    records = [{"id": str(i), "values": [i, i / 2]} for i in range(100)]
+    data = b"".join(json_streaming.ndjson_chunks(records, 64))
+    assert records == [json.loads(line) for line in data.splitlines()]
+    assert [] == list(json_streaming.ndjson_chunks([]))
+
+
+@pytest.mark.parametrize("encoding", [json_streaming.ENCODING_GZIP, json_streaming.ENCODING_ZSTD])
+def test_compressed_chunks(encoding):
+    if encoding not in json_streaming.available_encodings():
+        pytest.skip(f"{encoding} support isn't installed")
+    records = [{"id": str(i), "label": f"thing {i}"} for i in range(1000)]
+    chunks = json_streaming.compressed_chunks(json_streaming.ndjson_chunks(records, 128), encoding)
+    data = json_streaming.decompress(b"".join(chunks), encoding)
+    assert records == [json.loads(line) for line in data.splitlines()]
+
+
+def test_best_encoding(monkeypatch):
+    monkeypatch.setattr(json_streaming, "zstandard", None)
+    assert json_streaming.best_encoding(None) is None
+    assert json_streaming.best_encoding("identity") is None
+    assert "gzip" == json_streaming.best_encoding("gzip, deflate")
+    assert "gzip" == json_streaming.best_encoding("zstd, gzip;q=0.5")
+    assert json_streaming.best_encoding("gzip;q=0") is None
+
+
+def test_dumps_bytes_datetimes(monkeypatch):
+    tstamp = datetime.datetime(2022, 1, 1, 9, 40, 28, 123456)
+    expected = {"tstamp": "2022-01-01T09:40:28.123456"}
+    assert expected == json.loads(dumps_bytes({"tstamp": tstamp}))
+    monkeypatch.setattr(json_streaming, "orjson", None)
+    assert expected == json.loads(dumps_bytes({"tstamp": tstamp}))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1024])
+def test_iter_json_array_items(chunk_size):
+    docs = [{"id": str(i), "label": f"sample ∆ {i}", "nested": {"values": [i, "]", "}"]}} for i in range(20)]
+    body = json.dumps({"responseHeader": {"status": 0}, "response": {"numFound": 20, "docs": docs}}, indent=1)
+    body = body.encode("utf-8")
+    chunks = (body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+    assert docs == list(json_streaming.iter_json_array_items(chunks, "docs"))
+
+
+def test_iter_json_array_items_malformed():
+    with pytest.raises(ValueError):
+        list(json_streaming.iter_json_array_items([b'{"response": {"numFound": 0}}'], "docs"))
+    with pytest.raises(ValueError):
+        list(json_streaming.iter_json_array_items([b'{"docs": [{"id": "1"}, {"id": '], "docs"))
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from isb_lib.utilities.pipeline import PipelineStats, PrefetchIterator, ConcurrentBatchSender
+
+
+def test_prefetch_iterator():
+    stats = PipelineStats()
+    prefetched = PrefetchIterator(range(100), 5, "fetch", stats)
+    assert list(range(100)) == list(prefetched)
+    assert 100 == stats.count("fetch")
+    prefetched.close()
+
+
+def _failing_generator():
+    yield 1
+    raise ValueError("boom")
+
+
+def test_prefetch_iterator_reraises():
+    prefetched = PrefetchIterator(_failing_generator(), 5)
+    assert 1 == next(prefetched)
+    with pytest.raises(ValueError):
+        next(prefetched)
+    prefetched.close()
+
+
+def test_prefetch_iterator_close_early():
+    prefetched = PrefetchIterator(range(1000), 2)
+    assert 0 == next(prefetched)
+    # Closing with the producer blocked on a full queue shouldn't hang
+    prefetched.close()
+
+
+def test_concurrent_batch_sender():
+    stats = PipelineStats()
+    sent = []
+    lock = threading.Lock()
+    max_concurrent = 0
+    in_flight = 0
+
+    def send(batch):
+        nonlocal in_flight, max_concurrent
+        with lock:
+            in_flight += 1
+            max_concurrent = max(max_concurrent, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+            sent.extend(batch)
+
+    with ConcurrentBatchSender(send, 3, stage="solr", stats=stats) as sender:
+        for i in range(10):
+            sender.submit([i, i])
+    assert 20 == len(sent)
+    assert 20 == stats.count("solr")
+    assert max_concurrent <= 3
+    assert 0 == stats.queue_depth("solr")
+    assert "solr: 20" in stats.summary()
+
+
+def test_concurrent_batch_sender_reraises():
+    def send(batch):
+        raise ValueError("solr is down")
+
+    sender = ConcurrentBatchSender(send, 2)
+    sender.submit([1])
+    with pytest.raises(ValueError):
+        sender.close()
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from isb_lib.sesar_adapter import SESARAsyncHarvester
+
+
+def _stub_sesar_app(num_requests: dict) -> web.Application:
+    async def _igsn(request):
+        igsn = request.match_info["igsn"]
+        num_requests[igsn] = num_requests.get(igsn, 0) + 1
+        if igsn == "THROTTLED" and num_requests[igsn] == 1:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        if igsn == "UNAVAILABLE":
+            return web.Response(status=503)
+        if igsn == "MISSING":
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response({"description": {"igsn": igsn}})
+
+    app = web.Application()
+    app.router.add_get("/igsn/{igsn}", _igsn)
+    return app
+
+
+def test_sesar_async_harvester():
+    saved = []
+    num_requests: dict = {}
+    igsns = [f"IEXYZ{i:04d}" for i in range(20)] + ["THROTTLED", "UNAVAILABLE", "MISSING"]
+
+    async def _harvest():
+        async with TestServer(_stub_sesar_app(num_requests)) as server:
+            harvester = SESARAsyncHarvester(
+                saved.append,
+                requests_per_second=1000,
+                max_concurrency=4,
+                save_batch_size=5,
+                max_retries=2,
+                retry_backoff=0,
+                url_template=f"http://{server.host}:{server.port}/igsn/{{igsn}}",
+            )
+            await harvester.harvest((igsn, datetime.datetime(2020, 1, 1)) for igsn in igsns)
+            return harvester
+
+    harvester = asyncio.run(_harvest())
+    things = [thing for batch in saved for thing in batch]
+    assert all(len(batch) <= 5 for batch in saved)
+    assert 22 == len(things) == harvester.num_saved
+    things_by_id = {thing.id: thing for thing in things}
+    assert "IGSN:IEXYZ0001" in things_by_id
+    assert 200 == things_by_id["IGSN:THROTTLED"].resolved_status
+    assert 404 == things_by_id["IGSN:MISSING"].resolved_status
+    assert "IGSN:UNAVAILABLE" not in things_by_id
+    assert 1 == harvester.num_failed
+    assert 3 == num_requests["UNAVAILABLE"]
+    assert 3 == harvester.num_retries
+
+
+def test_sesar_async_harvester_save_failure():
+    saved = []
+    save_threads = set()
+    rollbacks = []
+    igsns = [f"IEXYZ{i:04d}" for i in range(10)]
+
+    def save_things(things):
+        save_threads.add(threading.get_ident())
+        if len(saved) == 0 and len(rollbacks) == 0:
+            raise ValueError("database is down")
+        saved.append(things)
+
+    async def _harvest():
+        async with TestServer(_stub_sesar_app({})) as server:
+            harvester = SESARAsyncHarvester(
+                save_things,
+                requests_per_second=1000,
+                max_concurrency=2,
+                save_batch_size=5,
+                retry_backoff=0,
+                url_template=f"http://{server.host}:{server.port}/igsn/{{igsn}}",
+                rollback=lambda: rollbacks.append(True),
+            )
+            await harvester.harvest((igsn, datetime.datetime(2020, 1, 1)) for igsn in igsns)
+            return harvester
+
+    harvester = asyncio.run(_harvest())
+    # The whole first batch failed, and the session was rolled back for the next one
+    assert 5 == harvester.num_failed
+    assert [True] == rollbacks
+    assert 5 == harvester.num_saved == len(saved[0])
+    # Saves happen off the event loop, all on the same thread
+    assert 1 == len(save_threads)
+    assert threading.get_ident() not in save_threads
@@ -1,14 +1,25 @@
+import gzip
+import json
+import shutil
+import typing
+
 import pytest
 import requests
 import os
 import datetime
+import fastapi
+from fastapi.testclient import TestClient
 from sqlalchemy.pool import StaticPool
 from sqlmodel import SQLModel, create_engine, Session
 
 from isb_lib.sitemaps.sitemap_fetcher import (
+    ConcurrentSitemapConsumer,
     SitemapIndexFetcher,
     SitemapFileFetcher,
     ThingFetcher,
+    ThingsFetcher,
+    ChangeFeedFetcher,
+    iter_sitemap_entries,
 )
 from test_utils import LocalFileAdapter
 
@@ -100,3 +111,253 @@ def test_thing_fetcher_thing_identifier():
     )
     thing_identifier = thing_fetcher.thing_identifier()
     assert "ark:/65665/3cb09f2ef-0548-4670-b99c-d4a60bd750c3" == thing_identifier
+
+
+SITEMAP_HEADER = '<?xml version="1.0" encoding="utf-8"?>'
+SITEMAP_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+NUM_SITEMAP_FILES = 3
+NUM_THINGS_PER_FILE = 5
+
+
+def _stand_in_thing_id(file_num: int, thing_num: int) -> str:
+    return f"ark:/99999/{file_num}-{thing_num}"
+
+
+def stand_in_app(
+    things_failures: int = 0,
+    ndjson: bool = False,
+    failing_ids: typing.Collection[str] = (),
+    failing_sitemap_files: typing.Collection[int] = (),
+) -> fastapi.FastAPI:
+    """A minimal stand-in for the sitemap and /things endpoints of another iSB instance"""
+    app = fastapi.FastAPI()
+    app.state.things_requests = 0
+
+    @app.get("/sitemaps/index.xml")
+    def sitemap_index():
+        entries = "".join(
+            f"<sitemap><loc>http://testserver/sitemaps/sitemap-{i}.xml</loc>"
+            f"<lastmod>2022-01-01T09:40:28Z</lastmod></sitemap>"
+            for i in range(NUM_SITEMAP_FILES)
+        )
+        content = f'{SITEMAP_HEADER}<sitemapindex xmlns="{SITEMAP_NAMESPACE}">{entries}</sitemapindex>'
+        return fastapi.Response(content=content, media_type="application/xml")
+
+    @app.get("/sitemaps/sitemap-{file_num}.xml")
+    def sitemap_file(file_num: int):
+        if file_num in failing_sitemap_files:
+            raise fastapi.HTTPException(status_code=404)
+        entries = "".join(
+            f"<url><loc>http://testserver/thing/{_stand_in_thing_id(file_num, j)}?full=false&amp;format=core</loc>"
+            f"<lastmod>2022-01-01T09:40:28Z</lastmod></url>"
+            for j in range(NUM_THINGS_PER_FILE)
+        )
+        content = f'{SITEMAP_HEADER}<urlset xmlns="{SITEMAP_NAMESPACE}">{entries}</urlset>'
+        return fastapi.Response(content=content, media_type="application/xml")
+
+    # A journal of (sequence, id, deleted), the way /things/changes reports it
+    app.state.changes = [
+        (i + 1, _stand_in_thing_id(0, i), i == 2) for i in range(NUM_THINGS_PER_FILE)
+    ]
+
+    @app.get("/things/changes")
+    def thing_changes(since: int = 0, limit: int = 1000):
+        page = [change for change in app.state.changes if change[0] > since][:limit]
+        return {
+            "since": since,
+            "next": page[-1][0] if len(page) > 0 else since,
+            "max_sequence": app.state.changes[-1][0],
+            "changes": [
+                {"sequence": sequence, "id": thing_id, "authority_id": None, "tstamp": "2022-01-01T09:40:28",
+                 "deleted": deleted}
+                for sequence, thing_id, deleted in page
+            ],
+        }
+
+    @app.post("/things")
+    async def things(request: fastapi.Request):
+        app.state.things_requests += 1
+        if app.state.things_requests <= things_failures:
+            raise fastapi.HTTPException(status_code=503)
+        params = await request.json()
+        if any(identifier in failing_ids for identifier in params["identifiers"]):
+            raise fastapi.HTTPException(status_code=503)
+        json_things = [
+            {"primary_key": i, "id": identifier, "resolved_content": {}}
+            for i, identifier in enumerate(params["identifiers"])
+        ]
+        if ndjson and "application/x-ndjson" in request.headers.get("accept", ""):
+            content = "".join(json.dumps(json_thing) + "\n" for json_thing in json_things)
+            return fastapi.Response(content=content, media_type="application/x-ndjson")
+        return json_things
+
+    return app
+
+
+@pytest.mark.parametrize(
+    "ordered,streaming,ndjson", [(True, False, False), (False, False, False), (True, True, False), (True, False, True)]
+)
+def test_concurrent_sitemap_consumer(ordered: bool, streaming: bool, ndjson: bool):
+    app = stand_in_app(things_failures=1, ndjson=ndjson)
+    client = TestClient(app)
+    index_fetcher = SitemapIndexFetcher(
+        "http://testserver/sitemaps/index.xml", "OPENCONTEXT", None, client, streaming
+    )
+    index_fetcher.fetch_index_file()
+    saved_ids: list[str] = []
+    consumer = ConcurrentSitemapConsumer(
+        index_fetcher,
+        lambda things_fetcher: saved_ids.extend(json_thing["id"] for json_thing in things_fetcher.json_things),
+        batch_size=2,
+        max_sitemap_workers=2,
+        max_things_workers=3,
+        ordered=ordered,
+        retry_backoff=0,
+    )
+    stats = consumer.run()
+    expected_ids = [
+        _stand_in_thing_id(i, j) for i in range(NUM_SITEMAP_FILES) for j in range(NUM_THINGS_PER_FILE)
+    ]
+    if ordered:
+        assert expected_ids == saved_ids
+    else:
+        assert sorted(expected_ids) == sorted(saved_ids)
+    assert NUM_SITEMAP_FILES == stats.count("sitemap files")
+    # 5 things per file in batches of 2 is 3 batches per file
+    assert 3 * NUM_SITEMAP_FILES == stats.count("batches saved")
+    assert len(expected_ids) == stats.count("things saved")
+    assert 0 == stats.count("failed batches")
+    # the 503 was retried
+    assert 3 * NUM_SITEMAP_FILES + 1 == app.state.things_requests
+
+
+@pytest.mark.parametrize(
+    "failing_ids,failing_sitemap_files,num_saved",
+    [([_stand_in_thing_id(1, 2)], [], NUM_THINGS_PER_FILE + 2), ([], [1], NUM_THINGS_PER_FILE)],
+)
+def test_concurrent_sitemap_consumer_stops_at_failure(failing_ids, failing_sitemap_files, num_saved: int):
+    app = stand_in_app(failing_ids=failing_ids, failing_sitemap_files=failing_sitemap_files)
+    client = TestClient(app)
+    index_fetcher = SitemapIndexFetcher("http://testserver/sitemaps/index.xml", "OPENCONTEXT", None, client)
+    index_fetcher.fetch_index_file()
+    saved_ids: list[str] = []
+    consumer = ConcurrentSitemapConsumer(
+        index_fetcher,
+        lambda things_fetcher: saved_ids.extend(json_thing["id"] for json_thing in things_fetcher.json_things),
+        batch_size=2,
+        max_sitemap_workers=2,
+        max_things_workers=3,
+        max_retries=1,
+        retry_backoff=0,
+    )
+    with pytest.raises(RuntimeError):
+        consumer.run()
+    # Nothing past the failure is saved, so resuming from the last saved thing doesn't skip it
+    all_ids = [_stand_in_thing_id(i, j) for i in range(NUM_SITEMAP_FILES) for j in range(NUM_THINGS_PER_FILE)]
+    assert all_ids[:num_saved] == saved_ids
+
+
+def test_things_fetcher_gives_up():
+    app = stand_in_app(things_failures=100)
+    things_fetcher = ThingsFetcher(
+        "http://testserver/things", "sitemap-0.xml", ["ark:/99999/0-0"], TestClient(app), max_retries=3,
+        retry_backoff=0
+    )
+    things_fetcher.fetch_things()
+    assert things_fetcher.primary_keys_fetched is None
+    assert 3 == app.state.things_requests
+
+
+def test_things_fetcher_no_attempts():
+    app = stand_in_app()
+    things_fetcher = ThingsFetcher(
+        "http://testserver/things", "sitemap-0.xml", ["ark:/99999/0-0"], TestClient(app), max_retries=0
+    )
+    things_fetcher.fetch_things()
+    assert things_fetcher.primary_keys_fetched is None
+
+
+def test_gzipped_sitemap_file(local_file_requests_session, tmp_path):
+    gzipped_path = tmp_path / "sitemap-0.xml.gz"
+    with open("test_data/sitemaps/sitemap-0.xml", "rb") as sitemap_file:
+        with gzip.open(gzipped_path, "wb") as gzipped_file:
+            shutil.copyfileobj(sitemap_file, gzipped_file)
+    for streaming in [False, True]:
+        file_fetcher = SitemapFileFetcher(
+            f"file://{gzipped_path}", "OPENCONTEXT", None, local_file_requests_session, streaming
+        )
+        file_fetcher.fetch_sitemap_file()
+        assert [
+            "test_data/sitemaps/thing1.json",
+            "test_data/sitemaps/thing2.json",
+        ] == list(file_fetcher.url_iterator())
+
+
+def test_iter_sitemap_entries():
+    entries = "".join(
+        f"<url><loc>http://testserver/thing/{i}</loc><lastmod>2022-01-01T09:40:28Z</lastmod></url>"
+        for i in range(1000)
+    )
+    sitemap = f'{SITEMAP_HEADER}<urlset xmlns="{SITEMAP_NAMESPACE}">{entries}<url><loc>nolastmod</loc></url></urlset>'
+    sitemap_bytes = sitemap.encode("utf-8")
+    # feed it in small chunks so entries straddle chunk boundaries
+    chunks = [sitemap_bytes[i:i + 100] for i in range(0, len(sitemap_bytes), 100)]
+    parsed_entries = list(iter_sitemap_entries(chunks))
+    assert 1001 == len(parsed_entries)
+    assert ("http://testserver/thing/0", "2022-01-01T09:40:28Z") == parsed_entries[0]
+    assert ("nolastmod", None) == parsed_entries[-1]
+
+
+def test_change_feed_fetcher():
+    app = stand_in_app()
+    change_feed_fetcher = ChangeFeedFetcher(
+        "http://testserver/things/changes", None, 1, TestClient(app), page_size=2, retry_backoff=0
+    )
+    assert "http://testserver/things" == change_feed_fetcher.things_url
+    pages = []
+    fetched_ids = []
+    for changes, next_sequence in change_feed_fetcher.pages():
+        pages.append(([change["id"] for change in changes], next_sequence))
+        for things_fetcher in change_feed_fetcher.things_fetchers(changes, 1):
+            things_fetcher.fetch_things()
+            fetched_ids.extend(json_thing["id"] for json_thing in things_fetcher.json_things)
+    assert [
+        ([_stand_in_thing_id(0, 1), _stand_in_thing_id(0, 2)], 3),
+        ([_stand_in_thing_id(0, 3), _stand_in_thing_id(0, 4)], 5),
+    ] == pages
+    # the deleted thing isn't fetched
+    assert [_stand_in_thing_id(0, 1), _stand_in_thing_id(0, 3), _stand_in_thing_id(0, 4)] == fetched_ids
+    assert 5 == change_feed_fetcher.since
+    assert 5 == change_feed_fetcher.max_sequence
+
+
+def test_change_feed_fetcher_held_back_pages():
+    app = fastapi.FastAPI()
+    # Changes 2 and 3 were to another authority, and 5 hasn't been committed so the feed stops before it
+    pages = {
+        1: ([], 3),
+        3: ([(4, "IGSN:4")], 4),
+        4: ([], 4),
+    }
+
+    @app.get("/things/changes")
+    def thing_changes(since: int = 0, limit: int = 1000):
+        changes, next_sequence = pages[since]
+        return {
+            "since": since,
+            "next": next_sequence,
+            "max_sequence": 6,
+            "changes": [
+                {"sequence": sequence, "id": thing_id, "authority_id": "SESAR", "tstamp": "2022-01-01T09:40:28",
+                 "deleted": False}
+                for sequence, thing_id in changes
+            ],
+        }
+
+    change_feed_fetcher = ChangeFeedFetcher(
+        "http://testserver/things/changes", "SESAR", 1, TestClient(app), retry_backoff=0
+    )
+    assert [([], 3), (["IGSN:4"], 4)] == [
+        ([change["id"] for change in changes], next_sequence) for changes, next_sequence in change_feed_fetcher.pages()
+    ]
+    assert 4 == change_feed_fetcher.since
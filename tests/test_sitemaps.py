@@ -9,8 +9,10 @@ import pytest
 import requests
 
 from isb_lib.sitemaps import SitemapIndexEntry, ThingSitemapIndexEntry, UrlSetEntry, ThingUrlSetEntry, \
-    write_urlset_file, write_sitemap_index_file, INDEX_XML, build_sitemap, SiteMap
+    write_urlset_file, write_sitemap_index_file, INDEX_XML, MANIFEST_JSON, build_sitemap, read_manifest, SiteMap
 from isb_lib.sitemaps.gh_pages_sitemap import GHPagesSitemapIndexIterator
+from isb_lib.sitemaps.thing_sitemap import ThingUrlSetIterator, ThingSitemapIndexIterator
+from isb_web import isb_solr_query
 from test_utils import LocalFileAdapter
 
 
@@ -93,3 +95,71 @@ def test_sitemap_scan_items(local_file_requests_session):
                       local_file_requests_session, local_url_path)
     for item in sitemap.scanItems():
         assert item is not None
+
+
+def _thing_url_set_iterators(things_per_file: list[list[str]]) -> list[ThingUrlSetIterator]:
+    return [
+        ThingUrlSetIterator(
+            i,
+            len(thing_ids),
+            [{"id": thing_id, "sourceUpdatedTime": f"2022-01-0{i + 1}T00:00:00Z"} for thing_id in thing_ids],
+        )
+        for i, thing_ids in enumerate(things_per_file)
+    ]
+
+
+def _mtime_ns(path: str, filename: str) -> int:
+    return os.stat(os.path.join(path, filename)).st_mtime_ns
+
+
+def test_build_sitemap_incremental():
+    path = tempfile.mkdtemp()
+    host = "https://hyde.cyverse.org"
+    build_sitemap(path, host, iter(_thing_url_set_iterators([["a", "b"], ["c", "d"], ["e"]])), True)
+    manifest = read_manifest(path)
+    assert ["sitemap-0.xml", "sitemap-1.xml", "sitemap-2.xml"] == sorted(manifest.keys())
+    assert 2 == manifest["sitemap-1.xml"]["num_urls"]
+    assert "c" == manifest["sitemap-1.xml"]["first_identifier"]
+    assert "d" == manifest["sitemap-1.xml"]["last_identifier"]
+    # Backdate the files so a rewrite is visible in the modification time
+    for filename in manifest.keys():
+        os.utime(os.path.join(path, filename), ns=(0, 0))
+
+    # "c" was updated, so it moved to the end, and the last file was removed
+    build_sitemap(path, host, iter(_thing_url_set_iterators([["a", "b"], ["d", "c"]])), True)
+    assert 0 == _mtime_ns(path, "sitemap-0.xml")
+    assert 0 != _mtime_ns(path, "sitemap-1.xml")
+    assert not os.path.exists(os.path.join(path, "sitemap-2.xml"))
+    assert ["sitemap-0.xml", "sitemap-1.xml"] == sorted(read_manifest(path).keys())
+    assert [name for name in os.listdir(path) if name.endswith(".tmp")] == []
+    with open(os.path.join(path, INDEX_XML)) as index_file:
+        index_xml = index_file.read()
+    assert "sitemap-1.xml" in index_xml
+    assert "sitemap-2.xml" not in index_xml
+    _assert_file_exists_and_is_xml(os.path.join(path, "sitemap-1.xml"))
+    assert os.path.exists(os.path.join(path, MANIFEST_JSON))
+
+
+def test_thing_sitemap_index_iterator_cursor(monkeypatch):
+    docs = [{"id": f"IGSN:{i}", "sourceUpdatedTime": "2022-01-01T00:00:00Z"} for i in range(5)]
+    cursor_marks = []
+
+    def solr_records_for_sitemap_with_cursor(rsession, authority_id, cursor_mark, batch_size):
+        cursor_marks.append(cursor_mark)
+        start = 0 if cursor_mark == isb_solr_query.CURSOR_MARK_START else int(cursor_mark)
+        page = docs[start:start + batch_size]
+        # Like solr, hand back the same cursorMark once the results are exhausted
+        return page, str(start + len(page)) if len(page) > 0 else cursor_mark
+
+    monkeypatch.setattr(isb_solr_query, "solr_records_for_sitemap_with_cursor", solr_records_for_sitemap_with_cursor)
+    url_set_iterators = list(ThingSitemapIndexIterator(num_things_per_file=2))
+    assert [["IGSN:0", "IGSN:1"], ["IGSN:2", "IGSN:3"], ["IGSN:4"]] == [
+        [entry.identifier for entry in url_set_iterator] for url_set_iterator in url_set_iterators
+    ]
+    assert [isb_solr_query.CURSOR_MARK_START, "2", "4", "5"] == cursor_marks
+
+
+def test_sort_with_unique_key():
+    assert "id asc" == isb_solr_query.sort_with_unique_key(None)
+    assert "sourceUpdatedTime asc, id asc" == isb_solr_query.sort_with_unique_key("sourceUpdatedTime asc")
+    assert "source asc, id desc" == isb_solr_query.sort_with_unique_key("source asc, id desc")
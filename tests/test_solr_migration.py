@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import typing
+import urllib.parse
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+
+from isb_lib.core import solr_atomic_update_doc
+from isb_lib.solr_migration import SolrMigrationRunner, read_checkpoint
+from isb_web import isb_solr_query
+from isb_web.isb_solr_query import CURSOR_MARK_START
+
+SOLR_URL = "http://localhost:8983/solr/isb_core_records/"
+NUM_DOCS = 45
+
+
+def solr_stand_in_app(docs: list[dict], fail_on_update: int = -1) -> fastapi.FastAPI:
+    """Just enough of solr's cursorMark /select and JSON /update to run migrations against"""
+    app = fastapi.FastAPI()
+    app.state.updates = []
+    app.state.commits = 0
+
+    def path(handler: str) -> str:
+        return urllib.parse.urlparse(urllib.parse.urljoin(SOLR_URL, handler)).path
+
+    @app.get(path("select"))
+    def select(q: str, rows: int, sort: str, cursorMark: str):
+        matching = docs
+        resume_after = re.search(r'id:\{"(.*)" TO \*\]', q)
+        if resume_after is not None:
+            matching = [doc for doc in docs if doc["id"] > resume_after.group(1)]
+        if cursorMark != CURSOR_MARK_START:
+            matching = [doc for doc in matching if doc["id"] > cursorMark]
+        page = [dict(doc) for doc in matching[:rows]]
+        next_cursor_mark = page[-1]["id"] if len(page) > 0 else cursorMark
+        return {"response": {"numFound": len(matching), "docs": page}, "nextCursorMark": next_cursor_mark}
+
+    @app.post(path("update"))
+    async def update(request: fastapi.Request):
+        records = json.loads(await request.body())
+        if len(app.state.updates) == fail_on_update:
+            return fastapi.responses.JSONResponse({"error": "bad update"}, status_code=400)
+        app.state.updates.append({"params": dict(request.query_params), "records": records})
+        return {"responseHeader": {"status": 0}}
+
+    @app.get(path("update"))
+    def commit(commit: str):
+        app.state.commits += 1
+        return {"responseHeader": {"status": 0}}
+
+    return app
+
+
+def mutate_record(record: typing.Dict) -> typing.Optional[typing.Dict]:
+    # Leave every third record alone
+    if int(record["id"].split(":")[1]) % 3 == 0:
+        return None
+    record_copy = record.copy()
+    record_copy["migrated"] = True
+    return record_copy
+
+
+def atomic_update_for_record(record: typing.Dict) -> typing.Optional[typing.Dict]:
+    if int(record["id"].split(":")[1]) % 3 == 0:
+        return None
+    return solr_atomic_update_doc(record["id"], {"migrated": True})
+
+
+@pytest.fixture
+def docs(monkeypatch):
+    monkeypatch.setattr(isb_solr_query, "BASE_URL", SOLR_URL)
+    return [{"id": f"IGSN:{i:04d}", "_version_": i, "searchText": "copied"} for i in range(NUM_DOCS)]
+
+
+def _saved_ids(app: fastapi.FastAPI) -> list[str]:
+    return [record["id"] for update in app.state.updates for record in update["records"]]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_solr_migration_runner(docs, num_workers, tmp_path):
+    app = solr_stand_in_app(docs)
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    runner = SolrMigrationRunner(
+        SOLR_URL,
+        mutate_record,
+        "*:*",
+        10,
+        num_workers=num_workers,
+        mutate_chunk_size=4,
+        commit_within_ms=5000,
+        checkpoint_path=checkpoint_path,
+        rsession=TestClient(app),
+    )
+    stats = runner.run()
+    expected_ids = [doc["id"] for doc in docs if mutate_record(doc) is not None]
+    assert expected_ids == _saved_ids(app)
+    assert all(record["migrated"] for update in app.state.updates for record in update["records"])
+    # Copy fields are stripped before sending
+    assert all("searchText" not in record for update in app.state.updates for record in update["records"])
+    assert all(update["params"]["commitWithin"] == "5000" for update in app.state.updates)
+    assert 1 == app.state.commits
+    assert NUM_DOCS == stats.count("mutate")
+    assert len(expected_ids) == stats.count("solr")
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_solr_migration_runner_resumes(docs, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    failing_app = solr_stand_in_app(docs, fail_on_update=1)
+    runner = SolrMigrationRunner(
+        SOLR_URL, mutate_record, None, 10, checkpoint_path=checkpoint_path, rsession=TestClient(failing_app)
+    )
+    with pytest.raises(ValueError):
+        runner.run()
+    saved_before_failure = _saved_ids(failing_app)
+    assert 10 == len(saved_before_failure)
+    assert {"last_id": saved_before_failure[-1], "num_saved": 10} == read_checkpoint(checkpoint_path)
+    assert 0 == failing_app.state.commits
+
+    app = solr_stand_in_app(docs)
+    runner = SolrMigrationRunner(
+        SOLR_URL, mutate_record, None, 10, checkpoint_path=checkpoint_path, rsession=TestClient(app)
+    )
+    runner.run()
+    expected_ids = [doc["id"] for doc in docs if mutate_record(doc) is not None]
+    assert expected_ids == saved_before_failure + _saved_ids(app)
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_solr_migration_runner_atomic_updates(docs):
+    app = solr_stand_in_app(docs)
+    runner = SolrMigrationRunner(
+        SOLR_URL, atomic_update_for_record, None, 10, rsession=TestClient(app), atomic_updates=True
+    )
+    runner.run()
+    expected_ids = [doc["id"] for doc in docs if mutate_record(doc) is not None]
+    assert expected_ids == _saved_ids(app)
+    for update in app.state.updates:
+        assert "false" == update["params"]["failOnVersionConflicts"]
+        assert all({"set": True} == record["migrated"] for record in update["records"])
+        assert all({"set": None} == record["searchText"] for record in update["records"])
+
+
+def mutate_records(records: typing.List[typing.Dict]) -> typing.List[typing.Dict]:
+    return [mutated_record for mutated_record in map(mutate_record, records) if mutated_record is not None]
+
+
+def test_solr_migration_runner_batch_mutate(docs):
+    app = solr_stand_in_app(docs)
+    runner = SolrMigrationRunner(
+        SOLR_URL, mutate_records, None, 10, mutate_chunk_size=7, rsession=TestClient(app), batch_mutate=True
+    )
+    runner.run()
+    assert [doc["id"] for doc in docs if mutate_record(doc) is not None] == _saved_ids(app)
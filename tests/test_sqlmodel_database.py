@@ -1,15 +1,22 @@
 import datetime
+import json
 import random
 
 import pytest
 from isb_lib.models.namespace import Namespace
+import sqlalchemy
 from sqlalchemy.orm.attributes import flag_modified
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
 from isb_lib.core import ThingRecordIterator
-from isb_lib.models.thing import Thing, Point
+from isb_lib.models.thing import Thing, Point, ThingIdentifier
+from isb_lib.models.thing_change import ThingChange
 from isb_web.sqlmodel_database import (
+    SQLModelDAO,
+    CHANGE_JOURNAL_SETTLE_TIME,
+    settled_change_sequence,
+    settled_thing_changes_since,
     get_thing_with_id,
     read_things_summary,
     last_time_thing_created,
@@ -20,8 +27,15 @@ from isb_web.sqlmodel_database import (
     save_or_update_thing,
     get_things_with_ids, insert_identifiers, all_thing_identifiers, get_thing_identifiers_for_thing,
     h3_values_without_points, h3_to_height, all_thing_primary_keys, save_draft_thing_with_id, save_person_with_orcid_id,
-    all_orcid_ids, mint_identifiers_in_namespace, save_or_update_namespace,
+    all_orcid_ids, mint_identifiers_in_namespace, save_or_update_namespace, stream_thing_columns,
+    thing_changes_since, max_thing_change_sequence, get_change_watermark, save_change_watermark,
+    primary_keys_for_thing_ids, save_or_update_things, save_or_update_thing_mappings, get_things_by_ids,
+    primary_keys_for_identifiers, stream_thing_identifiers, thing_identifier_map, stream_things_with_ids,
+    thing_change_feed, thing_change_sequence_before, save_h3_count_cube, get_h3_count_cube, h3_counts,
+    save_thing_identifiers, backfill_thing_identifiers, thing_identifiers_backfilled,
+    THING_IDENTIFIERS_BACKFILL_WATERMARK, thing_ids_for_primary_keys, max_thing_primary_key,
 )
+from isb_lib.models.h3_count import ALL_VALUES
 from test_utils import _add_some_things
 
 
@@ -168,6 +182,37 @@ def test_thing_iterator(session: Session):
     assert num_things == count_iterated_things
 
 
+def test_thing_iterator_projected(session: Session):
+    authority_id = "test"
+    num_things = 10
+    _add_some_things(session, num_things, authority_id, None)
+    session.expunge_all()
+    iterator = ThingRecordIterator(session, authority_id, 200, 3, 0, None)
+    ids = []
+    for row in iterator.yieldProjectedRecords():
+        assert type(row) is not Thing
+        assert {"foo": "bar"} == row.resolved_content
+        assert authority_id == row.authority_id
+        ids.append(row.id)
+    assert [str(i) for i in range(num_things)] == ids
+    # Nothing should have been loaded into the session
+    assert 0 == len(session.identity_map)
+
+
+def test_thing_iterator_projected_limit(session: Session):
+    _add_some_things(session, 10, "test", None)
+    iterator = ThingRecordIterator(session, "test", 200, 3, 0, 4)
+    assert 4 == len(list(iterator.yieldProjectedRecords()))
+
+
+def test_stream_thing_columns(session: Session):
+    _add_some_things(session, 10, "test", None)
+    _add_some_things(session, 5, "other", None)
+    rows = list(stream_thing_columns(session, ["primary_key", "id"], "test", min_id=5))
+    assert 5 == len(rows)
+    assert [6, 7, 8, 9, 10] == [row.primary_key for row in rows]
+
+
 def test_thing_with_identifier(session: Session):
     thing_id = "123456"
     new_thing = Thing(
@@ -303,6 +348,88 @@ def test_save_or_update_thing_existing_thing(session: Session):
     assert updated_tstamp == refetched_thing.tstamp
 
 
+def test_primary_keys_for_thing_ids(session: Session):
+    _add_some_things(session, 3, "test")
+    primary_keys = primary_keys_for_thing_ids(session, ["0", "2", "nope"])
+    assert {"0", "2"} == set(primary_keys.keys())
+    assert get_thing_with_id(session, "2").primary_key == primary_keys["2"]
+
+
+def test_save_or_update_things(session: Session):
+    existing_thing = test_save_thing(session)
+    existing_thing.h3 = "8a2a1072b59ffff"
+    session.commit()
+    updated_thing = Thing()
+    updated_thing.take_values_from_other_thing(existing_thing)
+    updated_thing.h3 = None
+    updated_thing.resolved_status = 404
+    num_inserted, num_updated = save_or_update_things(
+        session, [_test_sesar_thing("IGSN:1"), updated_thing, _test_sesar_thing("IGSN:2")]
+    )
+    assert 2 == num_inserted
+    assert 1 == num_updated
+    session.expire_all()
+    refetched_thing = get_thing_with_id(session, existing_thing.id)
+    assert 404 == refetched_thing.resolved_status
+    # h3 isn't part of the update, so it should be left alone
+    assert "8a2a1072b59ffff" == refetched_thing.h3
+    assert ["IGSN:1"] == get_thing_with_id(session, "IGSN:1").identifiers
+    changed_ids = [change.thing_id for change in thing_changes_since(session, 0)]
+    assert [existing_thing.id, "IGSN:1", existing_thing.id, "IGSN:2"] == changed_ids
+
+
+def test_save_or_update_thing_mappings_last_wins(session: Session):
+    mappings = [
+        {"id": "dup", "authority_id": "test", "resolved_status": 200, "resolved_url": "http://foo.bar/1"},
+        {"id": "dup", "authority_id": "test", "resolved_status": 200, "resolved_url": "http://foo.bar/2"},
+    ]
+    assert (1, 0) == save_or_update_thing_mappings(session, mappings)
+    assert (0, 1) == save_or_update_thing_mappings(session, mappings[:1])
+    assert "http://foo.bar/1" == get_thing_with_id(session, "dup").resolved_url
+    assert 1 == len(all_thing_primary_keys(session, "test"))
+
+
+def test_save_or_update_thing_mappings_stale_primary_keys(session: Session):
+    mapping = {"id": "stale", "authority_id": "test", "resolved_status": 200, "resolved_url": "http://foo.bar/1"}
+    assert (1, 0) == save_or_update_thing_mappings(session, [mapping])
+    # As if from an identifier map loaded before the Thing was saved
+    assert (0, 1) == save_or_update_thing_mappings(session, [dict(mapping, resolved_status=404)], {})
+    assert 1 == len(all_thing_primary_keys(session, "test"))
+    session.expire_all()
+    assert 404 == get_thing_with_id(session, "stale").resolved_status
+
+
+def test_thing_ids_for_primary_keys(session: Session):
+    assert 0 == max_thing_primary_key(session)
+    _add_some_things(session, 3, "test")
+    primary_keys = all_thing_primary_keys(session, "test")
+    assert {primary_keys["0"]: "0", primary_keys["2"]: "2"} == thing_ids_for_primary_keys(
+        session, [primary_keys["0"], primary_keys["2"], -1]
+    )
+    assert max(primary_keys.values()) == max_thing_primary_key(session, "test")
+    assert 0 == max_thing_primary_key(session, "other")
+
+
+@pytest.mark.parametrize("on_conflict", [True, False])
+def test_save_thing_identifiers_upserts(session: Session, monkeypatch, on_conflict: bool):
+    if not on_conflict:
+        # As if on a database without INSERT ... ON CONFLICT
+        monkeypatch.setattr(session.get_bind().dialect, "name", "other")
+    _add_some_things(session, 2, "test")
+    first_key = get_thing_with_id(session, "0").primary_key
+    second_key = get_thing_with_id(session, "1").primary_key
+    # As if another writer recorded the identifier in the meantime
+    session.add(ThingIdentifier(guid="ark:/1", thing_id=first_key, tstamp=datetime.datetime(2000, 1, 1)))
+    session.commit()
+    save_thing_identifiers(session, {first_key: ["ark:/1", "ark:/2"]})
+    session.commit()
+    # Unchanged identifiers are left alone
+    assert datetime.datetime(2000, 1, 1) == session.get(ThingIdentifier, "ark:/1").tstamp
+    save_thing_identifiers(session, {second_key: ["ark:/1"]})
+    session.commit()
+    assert {"ark:/1": second_key, "ark:/2": first_key} == primary_keys_for_identifiers(session, ["ark:/1", "ark:/2"])
+
+
 def test_mark_existing_thing_not_found(session: Session):
     existing_thing = test_save_thing(session)
     # make sure status is 200
@@ -381,6 +508,48 @@ def test_get_things_with_ids(session: Session):
     assert len(things) == 3
 
 
+def test_get_things_by_ids(session: Session):
+    _add_some_things(session, 10, "authority", datetime.datetime.now())
+    alternate_thing = get_thing_with_id(session, "5")
+    session.add(ThingIdentifier(guid="ark:/12345/5", thing_id=alternate_thing.primary_key))
+    session.commit()
+    things_by_id = get_things_by_ids(session, ["0", "1", "1", "ark:/12345/5", "nope"])
+    assert {"0", "1", "ark:/12345/5"} == set(things_by_id.keys())
+    assert "1" == things_by_id["1"].id
+    assert "5" == things_by_id["ark:/12345/5"].id
+    assert {} == get_things_by_ids(session, [])
+
+
+def test_stream_things_with_ids(session: Session):
+    _add_some_things(session, 10, "authority", datetime.datetime.now())
+    things = get_things_with_ids(session, ["0", "5", "nope"])
+    streamed_things = list(stream_things_with_ids(session, ["0", "5", "nope"], yield_per=1))
+    assert [thing.dict() for thing in things] == streamed_things
+
+
+def test_save_thing_records_identifiers(session: Session):
+    thing = _test_sesar_thing("IGSN:123")
+    thing.identifiers = ["ark:/123"]
+    save_thing(session, thing)
+    primary_keys = primary_keys_for_identifiers(session, ["IGSN:123", "ark:/123", "nope"])
+    assert {"IGSN:123": thing.primary_key, "ark:/123": thing.primary_key} == primary_keys
+    assert thing.id == get_thing_with_id(session, "ark:/123").id
+
+
+def test_save_or_update_thing_mappings_alternate_identifiers(session: Session):
+    mappings = [
+        {"id": "ark:/1", "authority_id": "test", "resolved_url": "http://foo.bar", "resolved_status": 200, "identifiers": json.dumps(["ark:/1", "alias:1"])},
+    ]
+    assert (1, 0) == save_or_update_thing_mappings(session, mappings)
+    # A Thing arriving under its alternate identifier updates the existing row
+    assert (0, 1) == save_or_update_thing_mappings(
+        session, [{"id": "alias:1", "authority_id": "test", "resolved_url": "http://foo.bar", "resolved_status": 404, "identifiers": ["alias:1", "alias:2"]}]
+    )
+    primary_keys = primary_keys_for_identifiers(session, ["ark:/1", "alias:1", "alias:2"])
+    assert 1 == len(set(primary_keys.values()))
+    assert 3 == len(primary_keys)
+
+
 def test_get_thing_with_id_with_identifier(session: Session):
     _add_some_things(session, 10, "authority", datetime.datetime.now())
     guid = "12345"
@@ -395,12 +564,74 @@ def test_get_thing_with_id_with_identifier(session: Session):
     assert thing_with_identifier is not None
 
 
+def _add_thing_with_column_identifiers(session: Session, thing_id: str, identifiers: list[str]) -> Thing:
+    # As saved before the ThingIdentifier table was maintained, with the identifiers only in the column
+    thing = _test_sesar_thing(thing_id)
+    thing.identifiers = identifiers
+    session.add(thing)
+    session.commit()
+    return thing
+
+
+def test_identifiers_only_in_column(session: Session):
+    thing = _add_thing_with_column_identifiers(session, "IGSN:1", ["IGSN:1", "ark:/1"])
+    _add_thing_with_column_identifiers(session, "IGSN:12", ["IGSN:12", "ark:/12"])
+    assert thing.primary_key == get_thing_with_id(session, "ark:/1").primary_key
+    # Exact matches only, ark:/1 is a prefix of ark:/12
+    assert {"ark:/1": thing.primary_key} == primary_keys_for_identifiers(session, ["ark:/1", "ark:/123"])
+    assert {"ark:/1"} == set(get_things_by_ids(session, ["ark:/1", "ark:/123"]).keys())
+    # So existing Things matched by an alias are updated rather than duplicated
+    assert (0, 1) == save_or_update_thing_mappings(
+        session, [{"id": "ark:/1", "authority_id": "SESAR", "resolved_url": "http://foo.bar", "resolved_status": 404}]
+    )
+    assert 2 == len(all_thing_primary_keys(session))
+
+
+def test_backfill_thing_identifiers(session: Session):
+    first = _add_thing_with_column_identifiers(session, "IGSN:1", ["IGSN:1", "ark:/1"])
+    second = _add_thing_with_column_identifiers(session, "IGSN:2", ["IGSN:2", "ark:/2", "ark:/3"])
+    _add_thing_with_column_identifiers(session, "IGSN:3", None)
+    # Already copied by an earlier, interrupted run
+    save_change_watermark(session, THING_IDENTIFIERS_BACKFILL_WATERMARK, first.primary_key)
+    assert not thing_identifiers_backfilled(session)
+    # IGSN:3 has no identifiers, so only its id
+    assert 4 == backfill_thing_identifiers(session, session, chunk_size=1)
+    assert thing_identifiers_backfilled(session)
+    assert 3 == get_change_watermark(session, THING_IDENTIFIERS_BACKFILL_WATERMARK)
+    assert {"ark:/2": second.primary_key, "ark:/3": second.primary_key} == {
+        guid: thing_id for guid, thing_id in session.execute(sqlalchemy.select(ThingIdentifier.guid, ThingIdentifier.thing_id))
+        if guid.startswith("ark:")
+    }
+    # The column isn't searched anymore
+    assert get_thing_with_id(session, "ark:/1") is None
+
+
+def test_empty_database_backfilled(tmp_path):
+    dao = SQLModelDAO(f"sqlite:///{tmp_path}/things.db")
+    with dao.get_session() as session:
+        assert thing_identifiers_backfilled(session)
+
+
 def test_all_thing_identifiers(session: Session):
     _add_some_things(session, 10, "authority", datetime.datetime.now())
     all_identifiers = all_thing_identifiers(session)
     assert 10 == len(all_identifiers)
 
 
+def test_thing_identifier_map(session: Session):
+    _add_some_things(session, 10, "authority")
+    thing = _test_sesar_thing("IGSN:123")
+    thing.identifiers = ["ark:/123"]
+    save_thing(session, thing)
+    # things without identifiers fall back to their id
+    assert [("0", 1), ("1", 2)] == list(stream_thing_identifiers(session, "authority", 3))[:2]
+    identifier_map = thing_identifier_map(session)
+    assert thing.primary_key == identifier_map["ark:/123"]
+    assert thing.primary_key == identifier_map["IGSN:123"]
+    assert get_thing_with_id(session, "7").primary_key == identifier_map["7"]
+    assert 10 == len(thing_identifier_map(session, "authority"))
+
+
 def test_all_thing_primary_keys(session: Session):
     _add_some_things(session, 10, "authority", datetime.datetime.now())
     all_primary_keys = all_thing_primary_keys(session)
@@ -504,3 +735,183 @@ def test_add_orcid_id_to_namespace(session: Session):
     namespace.remove_allowed_person(orcid_id)
     namespace = save_or_update_namespace(session, namespace)
     assert namespace.allowed_people == [orcid_id_2]
+
+
+def test_save_thing_journals_change(session: Session):
+    assert 0 == max_thing_change_sequence(session)
+    _add_journaled_things(session, 3, "test")
+    _add_journaled_things(session, 2, "other")
+    changes = thing_changes_since(session, 0)
+    assert 5 == len(changes)
+    assert ["test_0", "test_1", "test_2", "other_0", "other_1"] == [change.thing_id for change in changes]
+    assert 5 == max_thing_change_sequence(session)
+    assert 3 == max_thing_change_sequence(session, "test")
+    other_changes = thing_changes_since(session, 2, "other", 1)
+    assert 1 == len(other_changes)
+    assert "other_0" == other_changes[0].thing_id
+
+
+def test_save_or_update_thing_journals_change(session: Session):
+    thing = _test_sesar_thing("IGSN:123456")
+    save_or_update_thing(session, thing)
+    save_or_update_thing(session, _test_sesar_thing("IGSN:123456"))
+    changes = thing_changes_since(session, 0)
+    assert ["IGSN:123456", "IGSN:123456"] == [change.thing_id for change in changes]
+
+
+def test_thing_change_feed(session: Session):
+    assert ([], 0) == thing_change_feed(session, 0)
+    _add_journaled_things(session, 3, "test")
+    save_thing(session, get_thing_with_id(session, "test_0"))
+    mark_thing_not_found(session, "test_1", "http://foo.bar")
+    session.commit()
+    changes, next_sequence = thing_change_feed(session, 0)
+    assert 5 == next_sequence
+    # Repeated changes collapse into the latest, ordered by it
+    assert ["test_2", "test_0", "test_1"] == [change["id"] for change in changes]
+    assert [3, 4, 5] == [change["sequence"] for change in changes]
+    assert [False, False, True] == [change["deleted"] for change in changes]
+    changes, next_sequence = thing_change_feed(session, 0, limit=2)
+    assert ["test_0", "test_1"] == [change["id"] for change in changes]
+    assert 2 == next_sequence
+    assert ([], 5) == thing_change_feed(session, 5)
+    assert [] == thing_change_feed(session, 0, "other")[0]
+
+
+def test_thing_change_feed_out_of_order_commits(session: Session):
+    _add_journaled_things(session, 4, "test")
+    uncommitted = _hold_back_thing_change(session, 2)
+    changes, next_sequence = thing_change_feed(session, 0)
+    # Stops short of the change that's yet to commit, rather than moving past it
+    assert ["test_0"] == [change["id"] for change in changes]
+    assert 1 == next_sequence
+    assert ([], 1) == thing_change_feed(session, next_sequence)
+    session.add(uncommitted)
+    session.commit()
+    changes, next_sequence = thing_change_feed(session, next_sequence)
+    assert ["test_1", "test_2", "test_3"] == [change["id"] for change in changes]
+    assert 4 == next_sequence
+
+
+def test_thing_change_sequence_before(session: Session):
+    assert 0 == thing_change_sequence_before(session, datetime.datetime.now())
+    _add_journaled_things(session, 3, "test")
+    changes = thing_changes_since(session, 0)
+    assert 0 == thing_change_sequence_before(session, changes[0].tstamp)
+    assert 3 == thing_change_sequence_before(session, changes[-1].tstamp + datetime.timedelta(seconds=1))
+    assert 0 == thing_change_sequence_before(session, datetime.datetime.now(), "other")
+
+
+def test_change_watermark(session: Session):
+    assert 0 == get_change_watermark(session, "solr_test")
+    save_change_watermark(session, "solr_test", 10)
+    assert 10 == get_change_watermark(session, "solr_test")
+    save_change_watermark(session, "solr_test", 20)
+    assert 20 == get_change_watermark(session, "solr_test")
+    assert 0 == get_change_watermark(session, "solr_other")
+
+
+def test_h3_count_cube(session: Session):
+    assert get_h3_count_cube(session) is None
+    counts = {
+        (0, ALL_VALUES, ALL_VALUES): {"8001fffffffffff": 3, "8003fffffffffff": 2},
+        (0, "SESAR", ALL_VALUES): {"8001fffffffffff": 3},
+        (0, "SESAR", "Rock"): {"8001fffffffffff": 1},
+        (1, ALL_VALUES, ALL_VALUES): {"81003ffffffffff": 5},
+    }
+    save_h3_count_cube(session, counts, 1, "hasMaterialCategory")
+    cube = get_h3_count_cube(session)
+    assert 1 == cube.max_resolution
+    assert "hasMaterialCategory" == cube.category_field
+    assert counts[(0, ALL_VALUES, ALL_VALUES)] == h3_counts(session, 0)
+    assert counts[(0, "SESAR", "Rock")] == h3_counts(session, 0, "SESAR", "Rock")
+    assert {} == h3_counts(session, 0, "GEOME")
+    # Saving again replaces the previous counts entirely
+    save_h3_count_cube(session, {(0, ALL_VALUES, ALL_VALUES): {"8001fffffffffff": 4}}, 0, "hasMaterialCategory")
+    assert {"8001fffffffffff": 4} == h3_counts(session, 0)
+    assert {} == h3_counts(session, 1)
+    assert 0 == get_h3_count_cube(session).max_resolution
+
+
+def test_thing_iterator_journaled(session: Session):
+    _add_journaled_things(session, 5, "test")
+    iterator = ThingRecordIterator(session, "test", 200, 2, 0, None)
+    assert 5 == len(list(iterator.yieldJournaledRecords(0)))
+    assert 5 == iterator.max_sequence
+    # Re-save one of them, and only that one should come back
+    thing = get_thing_with_id(session, "test_3")
+    save_thing(session, thing)
+    journaled_things = list(iterator.yieldJournaledRecords(iterator.max_sequence))
+    assert ["test_3"] == [thing.id for thing in journaled_things]
+    assert 6 == iterator.max_sequence
+    assert 0 == len(list(iterator.yieldJournaledRecords(iterator.max_sequence)))
+
+
+def _hold_back_thing_change(session: Session, sequence: int) -> ThingChange:
+    """Removes a journal entry, as if the transaction writing it hadn't committed yet, returning it for committing"""
+    change = session.get(ThingChange, sequence)
+    session.delete(change)
+    session.commit()
+    return ThingChange(sequence=change.sequence, thing_id=change.thing_id, authority_id=change.authority_id)
+
+
+def test_thing_iterator_journaled_out_of_order_commits(session: Session):
+    _add_journaled_things(session, 3, "test")
+    _add_journaled_things(session, 2, "other")
+    # The transaction that was given sequence 2 commits after the ones given 3, 4 and 5
+    uncommitted = _hold_back_thing_change(session, 2)
+    iterator = ThingRecordIterator(session, "test", 200, 2, 0, None)
+    assert ["test_0"] == [thing.id for thing in iterator.yieldJournaledRecords(0)]
+    assert 1 == iterator.max_sequence
+    assert ([], 1) == settled_thing_changes_since(session, 1)
+    session.add(uncommitted)
+    session.commit()
+    journaled_things = list(iterator.yieldJournaledRecords(iterator.max_sequence))
+    assert ["test_1", "test_2"] == [thing.id for thing in journaled_things]
+    # The changes after it were to other authorities
+    assert 3 == iterator.max_sequence
+
+
+def test_settled_change_sequence(session: Session):
+    _add_journaled_things(session, 6, "test")
+    _hold_back_thing_change(session, 2)
+    _hold_back_thing_change(session, 3)
+    assert 1 == settled_change_sequence(session, 0, 6)
+    assert 6 == settled_change_sequence(session, 3, 6)
+    # Long enough ago that the transaction is taken to have rolled back
+    change = session.get(ThingChange, 4)
+    change.tstamp = change.tstamp - CHANGE_JOURNAL_SETTLE_TIME - datetime.timedelta(minutes=1)
+    session.add(change)
+    session.commit()
+    assert 6 == settled_change_sequence(session, 0, 6)
+    _hold_back_thing_change(session, 5)
+    assert 4 == settled_change_sequence(session, 0, 6)
+    assert 4 == settled_change_sequence(session, 0, 4)
+
+
+def _add_journaled_things(session: Session, num_things: int, authority_id: str):
+    for i in range(num_things):
+        save_thing(
+            session,
+            Thing(
+                id=f"{authority_id}_{i}",
+                authority_id=authority_id,
+                resolved_url="http://foo.bar",
+                resolved_status=200,
+                resolved_content={"foo": "bar"},
+            ),
+        )
+
+
+def test_sqlmodel_dao_create_index(tmp_path):
+    db_url = f"sqlite:///{tmp_path}/things.db"
+    # Connecting again finds the indexes already there
+    SQLModelDAO(db_url)
+    dao = SQLModelDAO(db_url)
+    index_names = [index["name"] for index in sqlalchemy.inspect(dao.engine).get_indexes("thing")]
+    assert 1 == index_names.count("authority_id_tcreated_idx")
+    assert 0 == len([index for index in Thing.__table__.indexes if index.name == "authority_id_tcreated_idx"])
+    # Other failures aren't swallowed
+    missing_table = sqlalchemy.Table("missing", sqlalchemy.MetaData(), sqlalchemy.Column("id", sqlalchemy.Integer))
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        dao._create_index(sqlalchemy.Index("missing_id_idx", missing_table.c.id))
@@ -1,7 +1,16 @@
+import sqlalchemy.exc
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+import scripts.consume_sitemaps
 import scripts.geome_things
 import scripts.opencontext_things
 import scripts.sesar_things
 import scripts.smithsonian_things
+from isb_lib.models.thing import Thing
+from isb_lib.utilities.identifier_map import CompactIdentifierMap
+from isb_web.sqlmodel_database import all_thing_primary_keys, primary_keys_for_identifiers
+from test_utils import _add_some_things
 
 
 def test_geome_things():
@@ -19,6 +28,76 @@ def test_sesar_things():
     print(module)
 
 
+def test_sesar_save_things_batch_conflict(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    def conflict(session, things):
+        raise sqlalchemy.exc.IntegrityError("INSERT", {}, Exception("conflict"))
+
+    monkeypatch.setattr(scripts.sesar_things, "save_or_update_things", conflict)
+    things = [
+        Thing(id=f"IGSN:{i}", authority_id="SESAR", resolved_url="http://foo.bar", resolved_status=200, resolved_content={})
+        for i in range(3)
+    ]
+    with Session(engine) as session:
+        scripts.sesar_things._saveThings(session, things)
+        # The batch failing doesn't lose its Things, they're saved one at a time instead
+        assert 0 == len(things)
+        assert {"IGSN:0", "IGSN:1", "IGSN:2"} == set(all_thing_primary_keys(session, "SESAR").keys())
+
+
+def _sqlite_session() -> Session:
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    return Session(engine)
+
+
+def test_consume_sitemaps_primary_keys_for_things():
+    with _sqlite_session() as session:
+        _add_some_things(session, 3, "test")
+        primary_keys = all_thing_primary_keys(session, "test")
+        # As if "1" collided with the hash of "0" and overwrote its entry
+        identifier_map = CompactIdentifierMap.from_pairs([("0", primary_keys["1"]), ("2", primary_keys["2"])])
+        json_things = [{"id": thing_id} for thing_id in ["0", "1", "2", "new"]]
+        assert {"0": primary_keys["0"], "1": primary_keys["1"], "2": primary_keys["2"]} == (
+            scripts.consume_sitemaps.primary_keys_for_things(session, json_things, identifier_map)
+        )
+
+
+def test_consume_sitemaps_load_identifier_map(tmp_path):
+    identifier_map_file = str(tmp_path / "identifiers.npy")
+    with _sqlite_session() as session:
+        _add_some_things(session, 2, "test")
+        assert 2 == len(scripts.consume_sitemaps.load_identifier_map(session, "test", identifier_map_file))
+        session.add(
+            Thing(id="new", authority_id="test", resolved_url="http://foo.bar", resolved_status=200, resolved_content={})
+        )
+        session.commit()
+        # Things were saved since the file was written, so it's rebuilt rather than trusted
+        assert 3 == len(scripts.consume_sitemaps.load_identifier_map(session, "test", identifier_map_file))
+        assert 3 == len(CompactIdentifierMap.load(identifier_map_file))
+
+
+def test_consume_sitemaps_save_fetched_things_without_authority():
+    things_fetcher = scripts.consume_sitemaps.ThingsFetcher("http://foo.bar/things", "changes", ["ark:/1"])
+    things_fetcher.json_things = [
+        {
+            "id": "ark:/1",
+            "primary_key": 123,
+            "authority_id": "GEOME",
+            "resolved_url": "http://foo.bar",
+            "resolved_status": 200,
+            "resolved_content": {"children": [{"bcid": "ark:/1/child"}]},
+        }
+    ]
+    with _sqlite_session() as session:
+        # As from a change feed of every authority, the thing's own authority says how to find its identifiers
+        scripts.consume_sitemaps.save_fetched_things(session, None, None, things_fetcher)
+        primary_keys = all_thing_primary_keys(session, "GEOME")
+        assert {"ark:/1/child": primary_keys["ark:/1"]} == primary_keys_for_identifiers(session, ["ark:/1/child"])
+
+
 def test_smithsonian_things():
     module = scripts.smithsonian_things
     print(module)
@@ -0,0 +1,257 @@
+import asyncio
+import struct
+
+import h3
+import pytest
+from aiohttp.test_utils import TestServer
+
+from isamples_metadata.Transformer import H3_FIELD_PREFIX, H3_RESOLUTIONS
+from isb_web import isb_solr_query, solr_client, vector_tiles
+from isb_web.vector_tiles import Layer, encode_tile
+from test_isb_solr_query import STAND_IN_SOLR_PATH, aiohttp_solr_stand_in_app
+
+
+def _fields(data: bytes) -> list:
+    """(field number, value) of the protocol buffer message in data, values being ints or bytes"""
+    fields = []
+    position = 0
+
+    def _varint():
+        nonlocal position
+        value = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value
+
+    while position < len(data):
+        key = _varint()
+        wire_type = key & 0x7
+        if wire_type == 0:
+            value = _varint()
+        elif wire_type == 1:
+            value = data[position:position + 8]
+            position += 8
+        else:
+            length = _varint()
+            value = data[position:position + length]
+            position += length
+        fields.append((key >> 3, value))
+    return fields
+
+
+def _packed(data: bytes) -> list[int]:
+    values = []
+    position = 0
+    while position < len(data):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        values.append(value)
+    return values
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _geometry(commands: list[int]) -> list[list[tuple[int, int]]]:
+    """The points of each MoveTo, along with those of the LineTos after it"""
+    parts: list = []
+    x, y = 0, 0
+    i = 0
+    while i < len(commands):
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            continue
+        for _ in range(count):
+            x += _unzigzag(commands[i])
+            y += _unzigzag(commands[i + 1])
+            i += 2
+            if command == 1:
+                parts.append([])
+            parts[-1].append((x, y))
+    return parts
+
+
+def _value(data: bytes):
+    field, value = _fields(data)[0]
+    if field == 1:
+        return value.decode("utf-8")
+    if field == 3:
+        return struct.unpack("<d", value)[0]
+    if field == 6:
+        return _unzigzag(value)
+    if field == 7:
+        return bool(value)
+    return value
+
+
+def decode_tile(data: bytes) -> dict:
+    """Just enough of a Mapbox Vector Tile decoder to check the tiles: layer name to its extent and features"""
+    layers = {}
+    for _, layer_data in _fields(data):
+        layer_fields = _fields(layer_data)
+        keys = [value.decode("utf-8") for field, value in layer_fields if field == 3]
+        values = [_value(value) for field, value in layer_fields if field == 4]
+        features = []
+        for field, feature_data in layer_fields:
+            if field != 2:
+                continue
+            feature = dict(_fields(feature_data))
+            tags = _packed(feature.get(2, b""))
+            features.append({
+                "type": feature[3],
+                "geometry": _geometry(_packed(feature[4])),
+                "properties": {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)},
+            })
+        layer = dict(layer_fields)
+        assert vector_tiles.MVT_VERSION == layer[15]
+        layers[layer[1].decode("utf-8")] = {"extent": layer[5], "features": features}
+    return layers
+
+
+def _area(ring: list[tuple[int, int]]) -> int:
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def test_encode_tile():
+    layer = Layer("test")
+    # Anticlockwise, with y pointing down
+    assert layer.add_polygon([(0, 0), (0, 10.2), (10, 10), (10, 0), (0, 0)], {"count": 3, "h3": "abc"})
+    layer.add_point(-5, 4096, {"id": "IGSN:1", "count": -1, "weight": 0.5, "point": True, "h3": None})
+    # Vanishes once rounded to the tile's resolution
+    assert not layer.add_polygon([(0, 0), (0.1, 0.1), (0.2, 0.3)], {"count": 1})
+    assert 2 == len(layer)
+    tile = decode_tile(encode_tile([layer, Layer("empty")]))
+    assert ["test"] == list(tile.keys())
+    assert vector_tiles.DEFAULT_EXTENT == tile["test"]["extent"]
+    polygon, point = tile["test"]["features"]
+    assert vector_tiles.GEOM_POLYGON == polygon["type"]
+    assert {"count": 3, "h3": "abc"} == polygon["properties"]
+    [ring] = polygon["geometry"]
+    assert {(0, 0), (0, 10), (10, 10), (10, 0)} == set(ring)
+    # Exterior rings are clockwise
+    assert _area(ring) > 0
+    assert vector_tiles.GEOM_POINT == point["type"]
+    assert [[(-5, 4096)]] == point["geometry"]
+    assert {"id": "IGSN:1", "count": -1, "weight": 0.5, "point": True} == point["properties"]
+    assert b"" == encode_tile([Layer("empty")])
+
+
+def test_tile_coordinates():
+    west, south, east, north = vector_tiles.tile_bounds(0, 0, 0)
+    assert (-180.0, 180.0) == (west, east)
+    assert vector_tiles.MAX_MERCATOR_LATITUDE == pytest.approx(north)
+    assert -vector_tiles.MAX_MERCATOR_LATITUDE == pytest.approx(south)
+    west, south, east, north = vector_tiles.tile_bounds(3, 5, 2)
+    assert [0.0, 4096.0] == pytest.approx(vector_tiles.tile_x([west, east], 3, 5).tolist(), abs=1e-6)
+    assert [0.0, 4096.0] == pytest.approx(vector_tiles.tile_y([north, south], 3, 2).tolist(), abs=1e-6)
+    assert not vector_tiles.valid_tile(1, 2, 0)
+    resolutions = [vector_tiles.tile_h3_resolution(z, 2 ** z // 2) for z in range(0, vector_tiles.MAX_ZOOM + 1)]
+    assert 0 == resolutions[0]
+    assert resolutions == sorted(resolutions)
+    assert H3_RESOLUTIONS[-1] == resolutions[-1]
+
+
+@pytest.fixture
+def tile_solr(monkeypatch):
+    """Runs a coroutine function against a solr stand-in with located docs, passing it the docs and requests seen"""
+    locations = [(37.87, -122.26), (37.8701, -122.2601), (-33.86, 151.21), (64.14, -21.94)]
+    docs = []
+    for i, (latitude, longitude) in enumerate(locations):
+        doc = {"id": f"IGSN:{i:04d}", "source": "SESAR", "x": longitude, "y": latitude}
+        for resolution in H3_RESOLUTIONS:
+            doc[f"{H3_FIELD_PREFIX}{resolution}"] = h3.latlng_to_cell(latitude, longitude, resolution)
+        docs.append(doc)
+    monkeypatch.setattr(isb_solr_query, "_heatmap_cache", None)
+    monkeypatch.setattr(vector_tiles, "_tile_cache", None)
+
+    def run(coroutine_function):
+        async def _run():
+            requests_seen: list[dict] = []
+            async with TestServer(aiohttp_solr_stand_in_app(docs, requests_seen)) as server:
+                monkeypatch.setattr(isb_solr_query, "BASE_URL", str(server.make_url(STAND_IN_SOLR_PATH)))
+                try:
+                    return await coroutine_function(docs, requests_seen)
+                finally:
+                    await solr_client.close_async_solr_client()
+
+        return asyncio.run(_run())
+
+    return run
+
+
+def test_h3_tile(tile_solr):
+    async def _tile(docs, requests_seen):
+        tile = decode_tile(await vector_tiles.things_tile(0, 0, 0))
+        features = tile[vector_tiles.H3_LAYER]["features"]
+        assert len(docs) == sum(feature["properties"]["count"] for feature in features)
+        assert all(0 == h3.get_resolution(feature["properties"]["h3"]) for feature in features)
+        # Only the Berkeley cell in the tile over it
+        tile = decode_tile(await vector_tiles.things_tile(4, 2, 6))
+        [feature] = tile[vector_tiles.H3_LAYER]["features"]
+        resolution = vector_tiles.tile_h3_resolution(4, 6)
+        assert docs[0][f"{H3_FIELD_PREFIX}{resolution}"] == feature["properties"]["h3"]
+        assert 2 == feature["properties"]["count"]
+        assert _area(feature["geometry"][0]) > 0
+
+    tile_solr(_tile)
+
+
+def test_things_tile(tile_solr):
+    async def _tile(docs, requests_seen):
+        z = 14
+        # The tile over Berkeley
+        x, y = 2627, 6327
+        tile = decode_tile(await vector_tiles.things_tile(z, x, y, point_min_zoom=z))
+        features = tile[vector_tiles.THINGS_LAYER]["features"]
+        assert [docs[0]["id"], docs[1]["id"]] == [feature["properties"]["id"] for feature in features]
+        for feature in features:
+            [[(point_x, point_y)]] = feature["geometry"]
+            assert 0 <= point_x <= vector_tiles.DEFAULT_EXTENT
+            assert 0 <= point_y <= vector_tiles.DEFAULT_EXTENT
+        # Too many to show individually, so they're counted instead
+        tile = decode_tile(await vector_tiles.things_tile(z, x, y, point_min_zoom=z, max_points=1))
+        assert [vector_tiles.H3_LAYER] == list(tile.keys())
+        # Below the zoom for points
+        tile = decode_tile(await vector_tiles.things_tile(z, x, y, point_min_zoom=z + 1))
+        assert [vector_tiles.H3_LAYER] == list(tile.keys())
+
+    tile_solr(_tile)
+
+
+def test_heatmap_tile(tile_solr):
+    async def _tile(docs, requests_seen):
+        tile = decode_tile(await vector_tiles.things_tile(1, 1, 0, aggregation=vector_tiles.HEATMAP_LAYER))
+        # The stand-in's heatmap has a count of 3 in the cell covering the north east quarter of the world
+        [feature] = tile[vector_tiles.HEATMAP_LAYER]["features"]
+        assert 3 == feature["properties"]["count"]
+        [ring] = feature["geometry"]
+        assert (0, vector_tiles.DEFAULT_EXTENT) == (min(x for x, _ in ring), max(x for x, _ in ring))
+        # From the equator up to where web mercator stops
+        assert (0, vector_tiles.DEFAULT_EXTENT) == (min(y for _, y in ring), max(y for _, y in ring))
+
+    tile_solr(_tile)
+
+
+def test_cached_things_tile(tile_solr):
+    async def _tiles(docs, requests_seen):
+        tiles = await asyncio.gather(*[vector_tiles.cached_things_tile(2, 1, 1) for _ in range(3)])
+        assert 1 == len([seen for seen in requests_seen if seen["handler"] == "select"])
+        assert all(tile == tiles[0] for tile in tiles)
+        await vector_tiles.cached_things_tile(2, 1, 1, aggregation=vector_tiles.HEATMAP_LAYER)
+        assert 2 == len([seen for seen in requests_seen if seen["handler"] == "select"])
+
+    tile_solr(_tiles)